@@ -4,13 +4,8 @@ from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.urls import reverse
 from django.views.decorators.csrf import csrf_protect
-from django.db.utils import OperationalError
-from django.db import connection
-import sqlite3
-import time
 
-# Import the database lock handler
-from kampala_pharma.db_lock_handler import fix_database_lock, check_db_locked
+from kampala_pharma.db_writer import write_transaction
 
 @csrf_protect
 def user_login(request):
@@ -19,42 +14,16 @@ def user_login(request):
         username = request.POST.get('username')
         password = request.POST.get('password')
         
-        try:
-            user = authenticate(request, username=username, password=password)
-            if user is not None:
-                # Close any existing connections before login to prevent locks
-                connection.close()
-                
-                try:
-                    login(request, user)
-                    messages.success(request, f'Welcome, {user.get_full_name() or user.username}!')
-                    
-                    # Use centralized dashboard routing
-                    return redirect('dashboards:dashboard_home')
-                except OperationalError as e:
-                    if "database is locked" in str(e):
-                        # Try to fix the database lock
-                        if fix_database_lock():
-                            messages.warning(request, "Database lock detected and fixed. Please try logging in again.")
-                        else:
-                            messages.error(request, "Database is currently locked. Please try again in a few moments.")
-                    else:
-                        messages.error(request, f"Login error: {str(e)}")
-            else:
-                messages.error(request, 'Invalid username or password.')
-        except OperationalError as e:
-            if "database is locked" in str(e):
-                # Try to fix the database lock
-                if fix_database_lock():
-                    messages.warning(request, "Database lock detected and fixed. Please try logging in again.")
-                else:
-                    messages.error(request, "Database is currently locked. Please try again in a few moments.")
-            else:
-                messages.error(request, f"Login error: {str(e)}")
-    
-    # Check if database is currently locked and show message if needed
-    if check_db_locked():
-        messages.warning(request, "System is currently busy. If login fails, please try again in a few moments.")
+        user = authenticate(request, username=username, password=password)
+        if user is not None:
+            # The session and last login are written behind the other writers
+            with write_transaction():
+                login(request, user)
+            messages.success(request, f'Welcome, {user.get_full_name() or user.username}!')
+            
+            # Use centralized dashboard routing
+            return redirect('dashboards:dashboard_home')
+        messages.error(request, 'Invalid username or password.')
     
     return render(request, 'accounts/login.html')
 
@@ -13,6 +13,7 @@ from .serializers import (
 )
 from .forms import BMRCreateForm, BMRRequestForm
 from products.models import Product
+from workflow.models import PhaseConflict
 from workflow.services import WorkflowService
 
 @login_required
@@ -302,12 +303,9 @@ class BMRViewSet(viewsets.ModelViewSet):
         bmr.approved_by = request.user
         bmr.approved_date = timezone.now()
         bmr.regulatory_comments = request.data.get('comments', '')
+        # save() initializes the workflow phases on approval
         bmr.save()
         
-        # Create initial workflow phases using the proper service
-        from workflow.services import WorkflowService
-        WorkflowService.initialize_workflow_for_bmr(bmr)
-        
         return Response({'message': 'BMR approved successfully'})
     
     @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated])
@@ -343,6 +341,14 @@ class ProductViewSet(viewsets.ReadOnlyModelViewSet):
     search_fields = ['product_code', 'product_name']
     ordering = ['product_code']
 
+def posted_version(request):
+    """Execution version the submitted form was rendered with, if it sent one"""
+    version = request.POST.get('version') or request.GET.get('version')
+    try:
+        return int(version) if version else None
+    except ValueError:
+        return None
+
 @login_required
 def start_phase_view(request, bmr_id, phase_name):
     """Start a specific phase for a BMR"""
@@ -361,7 +367,11 @@ def start_phase_view(request, bmr_id, phase_name):
         return redirect('bmr:detail', bmr_id)
     
     # Start the phase
-    execution = WorkflowService.start_phase(bmr, phase_name, request.user)
+    try:
+        execution = WorkflowService.start_phase(bmr, phase_name, request.user, posted_version(request))
+    except PhaseConflict as conflict:
+        messages.warning(request, f'{conflict}. Please reload and try again.')
+        return redirect('bmr:detail', bmr_id)
     
     if execution:
         messages.success(
@@ -403,7 +413,13 @@ def complete_phase_view(request, bmr_id, phase_name):
     comments = request.GET.get('comments', '') or request.POST.get('comments', '')
     
     # Complete the phase
-    next_phase = WorkflowService.complete_phase(bmr, phase_name, request.user, comments)
+    try:
+        next_phase = WorkflowService.complete_phase(
+            bmr, phase_name, request.user, comments, posted_version(request)
+        )
+    except PhaseConflict as conflict:
+        messages.warning(request, f'{conflict}. Please reload and try again.')
+        return redirect('bmr:detail', bmr_id)
     
     if next_phase:
         messages.success(
@@ -465,14 +481,11 @@ def reject_phase_view(request, bmr_id, phase_name):
         try:
             # Mark the QC phase as failed with comments
             from workflow.models import BatchPhaseExecution
-            execution = BatchPhaseExecution.objects.get(
+            execution = BatchPhaseExecution.objects.select_related('phase').get(
                 bmr=bmr,
                 phase__phase_name=phase_name,
                 status='in_progress'
             )
-            execution.status = 'failed'
-            execution.completed_by = request.user
-            execution.completed_date = timezone.now()
             
             # Determine rollback phase based on QC type
             rollback_mapping = {
@@ -482,8 +495,12 @@ def reject_phase_view(request, bmr_id, phase_name):
             }
             rollback_phase = rollback_mapping[phase_name]
             
-            execution.operator_comments = f"QC FAILED - ROLLBACK TO {rollback_phase.upper()}: {comments}"
-            execution.save()
+            execution.transition(
+                'failed', expected_version=posted_version(request),
+                completed_by=request.user,
+                completed_date=timezone.now(),
+                operator_comments=f"QC FAILED - ROLLBACK TO {rollback_phase.upper()}: {comments}",
+            )
             
             # Trigger rollback to appropriate phase
             rollback_success = WorkflowService.handle_qc_failure_rollback(bmr, phase_name, rollback_phase)
@@ -511,30 +528,29 @@ def reject_phase_view(request, bmr_id, phase_name):
             packing_phases = ['blister_packing', 'bulk_packing', 'secondary_packaging']
             last_packing_phase = None
             
+            completed_packing = set(BatchPhaseExecution.objects.filter(
+                bmr=bmr,
+                phase__phase_name__in=packing_phases,
+                status='completed'
+            ).values_list('phase__phase_name', flat=True))
             for packing_phase in reversed(packing_phases):  # Check in reverse order
-                try:
-                    packing_execution = BatchPhaseExecution.objects.get(
-                        bmr=bmr,
-                        phase__phase_name=packing_phase,
-                        status='completed'
-                    )
+                if packing_phase in completed_packing:
                     last_packing_phase = packing_phase
                     break
-                except BatchPhaseExecution.DoesNotExist:
-                    continue
             
             if last_packing_phase:
                 # Mark Final QA as failed
-                execution = BatchPhaseExecution.objects.get(
+                execution = BatchPhaseExecution.objects.select_related('phase').get(
                     bmr=bmr,
                     phase__phase_name=phase_name,
                     status='in_progress'
                 )
-                execution.status = 'failed'
-                execution.completed_by = request.user
-                execution.completed_date = timezone.now()
-                execution.operator_comments = f"FINAL QA FAILED - ROLLBACK TO {last_packing_phase.upper()}: {comments}"
-                execution.save()
+                execution.transition(
+                    'failed', expected_version=posted_version(request),
+                    completed_by=request.user,
+                    completed_date=timezone.now(),
+                    operator_comments=f"FINAL QA FAILED - ROLLBACK TO {last_packing_phase.upper()}: {comments}",
+                )
                 
                 # Trigger rollback to last packing phase
                 rollback_success = WorkflowService.handle_qc_failure_rollback(bmr, phase_name, last_packing_phase)
@@ -557,16 +573,17 @@ def reject_phase_view(request, bmr_id, phase_name):
         # Handle other phase rejections (original logic)
         try:
             from workflow.models import BatchPhaseExecution
-            execution = BatchPhaseExecution.objects.get(
+            execution = BatchPhaseExecution.objects.select_related('phase').get(
                 bmr=bmr,
                 phase__phase_name=phase_name,
                 status='in_progress'
             )
-            execution.status = 'failed'
-            execution.completed_by = request.user
-            execution.completed_date = timezone.now()
-            execution.operator_comments = f"REJECTED: {comments}"
-            execution.save()
+            execution.transition(
+                'failed', expected_version=posted_version(request),
+                completed_by=request.user,
+                completed_date=timezone.now(),
+                operator_comments=f"REJECTED: {comments}",
+            )
             
             # Update BMR status for regulatory rejection
             if phase_name == 'regulatory_approval':
@@ -3,11 +3,17 @@ Analytics module for the Pharmaceutical Operations System.
 This module provides data processing functions for admin dashboard analytics.
 """
 import datetime
+from functools import reduce
+from operator import or_
+
 from django.db.models import Avg, Count, F, Sum, Q, ExpressionWrapper, DurationField, DateTimeField
 from django.utils import timezone
 from django.db.models.functions import TruncMonth, TruncWeek, ExtractMonth
 from bmr.models import BMR
-from workflow.models import BatchPhaseExecution, ProductionPhase
+from workflow.models import BatchPhaseExecution, PhaseStats, ProductionPhase
+from workflow.transitions import QC_PHASES
+
+from .stats import percentile
 
 
 def get_monthly_production_stats(months_lookback=6):
@@ -134,72 +140,44 @@ def get_production_cycle_times():
 
 def get_phase_bottleneck_analysis():
     """Identify bottlenecks in the production process by analyzing phase durations"""
-    # Get all completed phases
-    completed_phases = BatchPhaseExecution.objects.filter(
-        status='completed',
-        started_date__isnull=False,
-        completed_date__isnull=False
-    ).select_related('phase', 'bmr__product')
-    
-    # Calculate duration for each phase
-    phase_durations = {}
-    
-    for phase in completed_phases:
-        duration = (phase.completed_date - phase.started_date).total_seconds() / 3600  # hours
-        
-        phase_name = phase.phase.phase_name
-        product_type = phase.bmr.product.product_type
-        
-        key = f"{product_type}__{phase_name}"
-        
-        if key not in phase_durations:
-            phase_durations[key] = []
-        
-        phase_durations[key].append(duration)
+    # Running totals, which the maintenance scheduler folds the phase events into
+    rows = sorted(PhaseStats.objects.filter(timed_completions__gt=0), key=lambda row: row.average_hours, reverse=True)[:10]
+    if not rows:
+        return []
+    
+    # 90th percentile of the current executions' net durations, read from the stored column
+    durations = {}
+    executions = BatchPhaseExecution.objects.filter(
+        status='completed', net_duration_seconds__isnull=False,
+    ).filter(
+        reduce(or_, [Q(phase__product_type=row.product_type, phase__phase_name=row.phase_name) for row in rows])
+    ).order_by('net_duration_seconds').values_list('phase__product_type', 'phase__phase_name', 'net_duration_seconds')
+    for product_type, phase_name, seconds in executions:
+        durations.setdefault((product_type, phase_name), []).append(seconds)
     
-    # Calculate average durations
     avg_durations = []
-    
-    for key, durations in phase_durations.items():
-        product_type, phase_name = key.split('__')
-        avg_duration = sum(durations) / len(durations)
-        
+    for row in rows:
+        p90 = percentile(durations.get((row.product_type, row.phase_name)), 0.9)
         avg_durations.append({
-            'product_type': product_type.replace('_', ' ').title(),
-            'phase_name': phase_name.replace('_', ' ').title(),
-            'avg_hours': round(avg_duration, 2),
-            'count': len(durations)
+            'product_type': row.product_type.replace('_', ' ').title(),
+            'phase_name': row.phase_name.replace('_', ' ').title(),
+            'avg_hours': round(row.average_hours, 2),
+            'p90_hours': round(p90 / 3600, 2) if p90 is not None else None,
+            'count': row.timed_completions
         })
     
-    # Sort by average duration (descending)
-    avg_durations.sort(key=lambda x: x['avg_hours'], reverse=True)
-    
-    return avg_durations[:10]  # Return top 10 longest phases
+    return avg_durations  # Top 10 longest phases, by average duration
 
 
 def get_quality_metrics():
     """Calculate quality control metrics and rejection rates"""
-    # Get all QC phases
-    qc_phases = BatchPhaseExecution.objects.filter(
-        phase__phase_name__contains='qc_',
-        status__in=['completed', 'failed']
-    ).select_related('bmr__product')
-    
-    # Calculate rejection rates by product type
-    product_types = {}
-    
-    for phase in qc_phases:
-        product_type = phase.bmr.product.product_type
-        
-        if product_type not in product_types:
-            product_types[product_type] = {
-                'total': 0,
-                'failed': 0
-            }
-        
-        product_types[product_type]['total'] += 1
-        if phase.status == 'failed':
-            product_types[product_type]['failed'] += 1
+    # Every QC pass and failure folded into the phase statistics so far, by product type
+    product_types = (
+        PhaseStats.objects.filter(phase_name__in=QC_PHASES)
+        .values('product_type')
+        .annotate(passed=Sum('completions'), failed=Sum('failures'))
+        .order_by('product_type')
+    )
     
     # Calculate rejection percentages
     result = {
@@ -208,11 +186,12 @@ def get_quality_metrics():
         'fail_rates': []
     }
     
-    for product_type, data in product_types.items():
-        if data['total'] > 0:
-            result['labels'].append(product_type.replace('_', ' ').title())
+    for data in product_types:
+        total = data['passed'] + data['failed']
+        if total > 0:
+            result['labels'].append(data['product_type'].replace('_', ' ').title())
             
-            fail_rate = (data['failed'] / data['total']) * 100
+            fail_rate = (data['failed'] / total) * 100
             pass_rate = 100 - fail_rate
             
             result['pass_rates'].append(round(pass_rate, 1))
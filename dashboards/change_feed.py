@@ -0,0 +1,73 @@
+"""
+Server-Sent Events stream and polling helpers for the change feed.
+
+Live screens subscribe once and receive only the ``ChangeEvent`` rows added
+after the sequence number they already have. An idle stream checks the
+latest sequence in the cache and only reads the events table when that
+number moves (or every ``RECHECK_SECONDS`` in case another process wrote the
+event), so the database load follows the rate of change rather than the
+number of open screens.
+
+A stream still occupies a worker thread for ``STREAM_SECONDS``, so it is off
+unless ``settings.CHANGE_FEED_STREAM`` is set and the server has a thread per
+open screen to spare; screens otherwise poll ``?since=<seq>``.
+"""
+import json
+import time
+
+from django.core.cache import cache
+
+from workflow.models import ChangeEvent
+
+
+STREAM_SECONDS = 55        # Clients reconnect (with Last-Event-ID) after this
+POLL_SECONDS = 1
+RECHECK_SECONDS = 10
+KEEPALIVE_SECONDS = 15
+RETRY_MILLISECONDS = 3000
+
+
+def parse_sources(value):
+    """Comma separated source filter, limited to known sources"""
+    known = {source for source, _ in ChangeEvent.SOURCE_CHOICES}
+    return [source for source in (value or '').split(',') if source in known]
+
+
+def parse_sequence(value):
+    try:
+        return max(int(value), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def _message(event):
+    return f"id: {event.sequence}\nevent: change\ndata: {json.dumps(event.as_dict())}\n\n"
+
+
+def stream_events(since, sources=None, duration=STREAM_SECONDS):
+    """Yield SSE messages for events after ``since`` until ``duration`` runs out"""
+    yield f"retry: {RETRY_MILLISECONDS}\n\n"
+
+    last = since
+    checked = None
+    last_query = 0.0
+    last_message = time.monotonic()
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        latest = cache.get(ChangeEvent.LATEST_SEQUENCE_KEY)
+        now = time.monotonic()
+        if latest is None or checked is None or latest > checked or now - last_query >= RECHECK_SECONDS:
+            events = list(ChangeEvent.since(last, sources))
+            last_query = now
+            checked = latest if latest is not None else 0
+            for event in events:
+                last = event.sequence
+                checked = max(checked, event.sequence)
+                yield _message(event)
+                last_message = now
+            if latest is None:
+                cache.add(ChangeEvent.LATEST_SEQUENCE_KEY, ChangeEvent.latest_sequence(), None)
+        if now - last_message >= KEEPALIVE_SECONDS:
+            yield ": keep-alive\n\n"
+            last_message = now
+        time.sleep(POLL_SECONDS)
@@ -0,0 +1,161 @@
+"""
+Background export jobs.
+
+Spreadsheet and Word exports are slow to build, so their views only queue an
+``ExportJob`` and show a page that polls for it. Identical requests (same
+export, same filters, same visibility) share one job, and a finished file is
+downloaded again without rebuilding until it expires.
+
+Jobs are built by ``manage.py run_export_jobs``. When no worker has reported
+in recently, a queued job is built on a background thread of the web process
+instead, so exports keep working on a single-process setup.
+
+Each export type maps to a builder that takes a request (with ``user`` and
+``GET`` restored from the job) and returns the usual file response.
+"""
+import logging
+import re
+import tempfile
+import threading
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connections
+from django.http import HttpRequest, JsonResponse, QueryDict
+from django.shortcuts import redirect, render
+from django.urls import reverse
+from django.utils.module_loading import import_string
+
+from kampala_pharma.db_router import read_only
+
+from .models import ExportJob
+
+
+logger = logging.getLogger(__name__)
+
+BUILDERS = {
+    'timeline_excel': 'reports.timeline_views.build_timeline_excel',
+    'timeline_detail_excel': 'dashboards.views.build_timeline_detail_excel',
+    'wip_excel': 'dashboards.views.build_wip_excel',
+    'comments_excel': 'reports.views.build_comments_excel',
+    'comments_word': 'reports.views.build_comments_word',
+}
+
+# Query parameters that do not change the exported data
+IGNORED_PARAMS = {'page', 'export', 'format', '_'}
+
+WORKER_HEARTBEAT_KEY = 'export_jobs:worker_heartbeat'
+WORKER_HEARTBEAT_SECONDS = 30
+RUN_IN_BACKGROUND = True
+
+
+def export_params(request):
+    """The request's filters as a sorted, JSON-friendly dict of value lists"""
+    return {
+        key: sorted(values)
+        for key, values in sorted(request.GET.lists())
+        if key not in IGNORED_PARAMS
+    }
+
+
+def _job_request(job):
+    request = HttpRequest()
+    request.method = 'GET'
+    request.GET = QueryDict(mutable=True)
+    for key, values in job.params.items():
+        request.GET.setlist(key, values)
+    request.user = get_user_model().objects.get(pk=job.requested_by_id)
+    return request
+
+
+def _filename(response, job):
+    match = re.search(r'filename="?([^";]+)"?', response.get('Content-Disposition', ''))
+    return match.group(1) if match else f"{job.export_type}_{job.pk}"
+
+
+def run_job(job):
+    """Build a claimed job's file; failures are recorded on the job"""
+    try:
+        with tempfile.TemporaryFile() as handle:
+            # The export's reads go to the read-only connection; saving the file does not
+            with read_only():
+                response = import_string(BUILDERS[job.export_type])(_job_request(job))
+                if response.status_code != 200:
+                    raise ValueError(f"Export returned status {response.status_code}")
+                for chunk in response:
+                    handle.write(chunk)
+            handle.seek(0)
+            job.complete(_filename(response, job), response['Content-Type'], handle)
+    except Exception as exc:
+        logger.exception('Export job %s failed', job.pk)
+        job.fail(str(exc) or exc.__class__.__name__)
+
+
+def run_pending(limit=None):
+    """Build queued jobs, oldest first; returns the number processed"""
+    processed = 0
+    while limit is None or processed < limit:
+        job = ExportJob.claim_next()
+        if job is None:
+            break
+        run_job(job)
+        processed += 1
+    return processed
+
+
+def worker_alive():
+    return cache.get(WORKER_HEARTBEAT_KEY) is not None
+
+
+def heartbeat():
+    cache.set(WORKER_HEARTBEAT_KEY, True, WORKER_HEARTBEAT_SECONDS)
+
+
+def _run_in_thread(job):
+    try:
+        if job.claim():
+            run_job(job)
+    finally:
+        if RUN_IN_BACKGROUND:
+            connections.close_all()
+
+
+def dispatch(job):
+    """Leave the job to the worker, or build it on a thread when no worker is running"""
+    if worker_alive():
+        return
+    if RUN_IN_BACKGROUND:
+        threading.Thread(target=_run_in_thread, args=(job,), daemon=True).start()
+    else:
+        _run_in_thread(job)
+
+
+def job_status(job):
+    data = {
+        'id': job.pk,
+        'export_type': job.export_type,
+        'status': job.status,
+        'status_url': reverse('dashboards:export_job_status', args=[job.pk]),
+        'download_url': None,
+        'error': job.error,
+    }
+    if job.is_available:
+        data['download_url'] = reverse('dashboards:export_job_download', args=[job.pk])
+    return data
+
+
+def queue_export(request, export_type):
+    """Queue (or reuse) the export and answer with its download or a polling page"""
+    job, created = ExportJob.enqueue(export_type, export_params(request), request.user)
+    if created:
+        dispatch(job)
+        job.refresh_from_db()
+
+    if request.headers.get('Accept') == 'application/json':
+        return JsonResponse(job_status(job), status=200 if job.is_available else 202)
+    if job.is_available:
+        return redirect('dashboards:export_job_download', pk=job.pk)
+    return render(request, 'dashboards/export_job.html', {
+        'job': job,
+        'job_status': job_status(job),
+    })
@@ -0,0 +1,36 @@
+"""
+Streaming CSV responses for the report exports.
+
+Rows are produced by generators over chunked queryset iteration and written
+straight to the client, so the first bytes go out as soon as the first chunk
+is read and memory stays flat however many rows are exported.
+
+    return streaming_csv_response(rows, 'bmr_timeline_export.csv')
+"""
+import csv
+
+from django.http import StreamingHttpResponse
+
+
+# Rows fetched per query when iterating an export queryset
+EXPORT_CHUNK_SIZE = 500
+
+
+class Echo:
+    """File-like object whose write() hands the formatted line back"""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows):
+    """Yield each row formatted as a CSV line"""
+    writer = csv.writer(Echo())
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def streaming_csv_response(rows, filename):
+    response = StreamingHttpResponse(iter_csv(rows), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -0,0 +1,139 @@
+"""
+Shared cache for dashboard sections.
+
+A section (usually a dict of counters) is cached per role, or per user when
+it contains the user's own numbers, under a key that embeds the version of
+every data source it reads. Saving a phase execution, quarantine batch,
+sample request, FGS inventory row or product release replaces that source's
+version (see ``ChangeEvent.touch``), so the next request computes under a new
+key and stale entries simply expire.
+
+    stats = cached_section(
+        'qa_counters', lambda: count_stats(...),
+        sources=['phase'], role=request.user.role, timeout=60,
+    )
+
+The cache must be shared by every worker process (see CACHES in settings)
+for a save in one process to invalidate the sections the others serve.
+
+With ``stale_for`` set, a request that misses after an invalidation is
+served the previous value (if it is at most that many seconds old) while a
+background thread recomputes it, so busy screens never wait on the refresh.
+"""
+import logging
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import connections
+from django.utils import timezone
+
+from workflow.models import ChangeEvent
+
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'dashboard_section'
+STATS_KEY = 'dashboard_section_stats:{name}:{kind}'
+STAT_KINDS = ('hit', 'miss', 'stale')
+DEFAULT_TIMEOUT = 300
+REVALIDATE_LOCK_SECONDS = 30
+REVALIDATE_IN_BACKGROUND = True
+
+# Names of the sections served so far, for the system health page; kept in
+# the cache so every worker's sections are listed
+SECTIONS_KEY = 'dashboard_section_names'
+# Names this process has already added to SECTIONS_KEY
+SECTIONS = set()
+
+
+def _count(name, kind):
+    key = STATS_KEY.format(name=name, kind=kind)
+    if not cache.add(key, 1, None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+
+def _register(name):
+    if name in SECTIONS:
+        return
+    cache.set(SECTIONS_KEY, (cache.get(SECTIONS_KEY) or set()) | {name}, None)
+    SECTIONS.add(name)
+
+
+def _scope(role, user):
+    # Dates are part of the key so "today" counters roll over at midnight
+    return f"{role or '-'}:{user.pk if user else '-'}:{timezone.localdate().isoformat()}"
+
+
+def _store(key, latest_key, value, versions, timeout, stale_for):
+    cache.set(key, value, timeout)
+    if stale_for:
+        cache.set(latest_key, (versions, time.time(), value), timeout + stale_for)
+
+
+def _revalidate(key, latest_key, compute, versions, timeout, stale_for):
+    try:
+        _store(key, latest_key, compute(), versions, timeout, stale_for)
+    except Exception:
+        logger.exception('Failed to refresh dashboard section %s', key)
+    finally:
+        cache.delete(f"{key}:lock")
+        if REVALIDATE_IN_BACKGROUND:
+            connections.close_all()
+
+
+def cached_section(name, compute, sources, role=None, user=None, timeout=DEFAULT_TIMEOUT, stale_for=None):
+    """Return ``compute()`` for this role/user, cached until one of ``sources`` changes"""
+    _register(name)
+    versions = ChangeEvent.versions(sources)
+    scope = _scope(role, user)
+    version = '.'.join(versions[source] for source in sorted(versions))
+    key = f"{KEY_PREFIX}:{name}:{scope}:{version}"
+    latest_key = f"{KEY_PREFIX}:{name}:{scope}:latest"
+
+    value = cache.get(key)
+    if value is not None:
+        _count(name, 'hit')
+        return value
+
+    if stale_for:
+        latest = cache.get(latest_key)
+        if latest is not None and time.time() - latest[1] <= stale_for:
+            _count(name, 'stale')
+            # Only one request recomputes a given version
+            if cache.add(f"{key}:lock", 1, REVALIDATE_LOCK_SECONDS):
+                args = (key, latest_key, compute, versions, timeout, stale_for)
+                if REVALIDATE_IN_BACKGROUND:
+                    threading.Thread(target=_revalidate, args=args, daemon=True).start()
+                else:
+                    _revalidate(*args)
+            return latest[2]
+
+    _count(name, 'miss')
+    value = compute()
+    _store(key, latest_key, value, versions, timeout, stale_for)
+    return value
+
+
+def section_stats():
+    """Hit/miss/stale counts per section, busiest first"""
+    rows = []
+    for name in (cache.get(SECTIONS_KEY) or set()) | SECTIONS:
+        keys = {kind: STATS_KEY.format(name=name, kind=kind) for kind in STAT_KINDS}
+        found = cache.get_many(keys.values())
+        counts = {kind: found.get(key, 0) for kind, key in keys.items()}
+        total = sum(counts.values())
+        served = counts['hit'] + counts['stale']
+        rows.append({
+            'name': name,
+            'hits': counts['hit'],
+            'misses': counts['miss'],
+            'stale': counts['stale'],
+            'requests': total,
+            'hit_rate': round(served / total * 100, 1) if total else None,
+        })
+    rows.sort(key=lambda row: row['requests'], reverse=True)
+    return rows
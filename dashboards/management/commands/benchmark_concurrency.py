@@ -0,0 +1,89 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+
+from bmr.models import BMR
+from dashboards.stats import percentile
+from dashboards.timeline import build_bmr_timelines
+from kampala_pharma.db_router import read_only, replica_alias
+from workflow.models import BatchPhaseExecution, EventWatermark
+
+
+CONSUMER = 'benchmark:concurrency'
+
+
+class Command(BaseCommand):
+    help = 'Measure write latency while dashboard-style reads run concurrently, with and without the read-only alias'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--writes',
+            type=int,
+            default=200,
+            help='Number of write transactions to time per scenario (default 200)',
+        )
+        parser.add_argument(
+            '--readers',
+            type=int,
+            default=4,
+            help='Number of concurrent reader threads (default 4)',
+        )
+
+    def read_dashboards(self, stop, replica):
+        """Run the heavy admin dashboard reads in a loop until told to stop"""
+        try:
+            while not stop.is_set():
+                if replica:
+                    with read_only():
+                        self.read_once()
+                else:
+                    self.read_once()
+        finally:
+            connections.close_all()
+
+    def read_once(self):
+        build_bmr_timelines(BMR.objects.all())
+        list(BatchPhaseExecution.objects.select_related('bmr__product', 'phase', 'started_by', 'completed_by'))
+
+    def time_writes(self, count):
+        """Latency of small committed write transactions, in milliseconds"""
+        latencies = []
+        for sequence in range(count):
+            started = time.perf_counter()
+            with transaction.atomic():
+                EventWatermark.objects.update_or_create(consumer=CONSUMER, defaults={'sequence': sequence})
+            latencies.append((time.perf_counter() - started) * 1000)
+        return sorted(latencies)
+
+    def scenario(self, label, writes, readers=0, replica=False):
+        stop = threading.Event()
+        threads = [
+            threading.Thread(target=self.read_dashboards, args=(stop, replica), daemon=True)
+            for _ in range(readers)
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            latencies = self.time_writes(writes)
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
+        self.stdout.write(
+            f'{label:<36} p50 {percentile(latencies, 0.5):7.1f} ms   '
+            f'p95 {percentile(latencies, 0.95):7.1f} ms   max {latencies[-1]:7.1f} ms'
+        )
+
+    def handle(self, *args, **options):
+        if replica_alias() is None:
+            raise CommandError('The read-only database alias is not configured for this database')
+        writes, readers = options['writes'], options['readers']
+        try:
+            self.scenario('No readers', writes)
+            self.scenario(f'{readers} readers on the primary', writes, readers)
+            self.scenario(f'{readers} readers on the read-only alias', writes, readers, replica=True)
+        finally:
+            EventWatermark.objects.filter(consumer=CONSUMER).delete()
+        self.stdout.write(self.style.SUCCESS('Benchmark complete'))
@@ -0,0 +1,98 @@
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import RequestFactory
+from django.utils import timezone
+
+from accounts.models import CustomUser
+from bmr.models import BMR
+from dashboards.views import export_timeline_data
+from products.models import Product
+from workflow.models import BatchPhaseExecution, ProductionPhase
+from workflow.services import WorkflowService
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Measure peak memory and time to first byte of the streaming timeline CSV export'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows',
+            type=int,
+            action='append',
+            dest='sizes',
+            help='Number of phase rows to export (can be repeated, default 1000 and 100000)',
+        )
+
+    def seed(self, phase_rows):
+        """Bulk insert BMRs with a full ointment workflow, bypassing the save hooks"""
+        user = CustomUser.objects.create_user(
+            username='export_benchmark', password=None, role='admin',
+            employee_id='BENCH001', department='Admin', is_staff=True,
+        )
+        product = Product.objects.create(product_name='Benchmark Ointment', product_type='ointment')
+        phases = [
+            ProductionPhase.objects.get_or_create(
+                product_type='ointment', phase_name=phase_name, defaults={'phase_order': order},
+            )[0]
+            for order, phase_name in enumerate(WorkflowService.PRODUCT_WORKFLOWS['ointment'], 1)
+        ]
+        bmr_count = -(-phase_rows // len(phases))
+        bmrs = BMR.objects.bulk_create(
+            BMR(
+                bmr_number=f"BENCH{number:07d}", batch_number=f"B{number:07d}",
+                product=product, created_by=user, status='in_production',
+            )
+            for number in range(bmr_count)
+        )
+        now = timezone.now()
+        BatchPhaseExecution.objects.bulk_create(
+            (
+                BatchPhaseExecution(
+                    bmr=bmr, phase=phase, status='completed', started_date=now, completed_date=now,
+                    started_by=user, completed_by=user,
+                )
+                for bmr in bmrs for phase in phases
+            ),
+            batch_size=1000,
+        )
+        return user
+
+    def measure(self, user):
+        request = RequestFactory().get('/', {'format': 'csv'})
+        request.user = user
+
+        tracemalloc.start()
+        started = time.perf_counter()
+        response = export_timeline_data(request)
+        chunks = iter(response.streaming_content)
+        size = len(next(chunks))
+        first_byte = time.perf_counter() - started
+        for chunk in chunks:
+            size += len(chunk)
+        elapsed = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return first_byte, elapsed, peak, size
+
+    def handle(self, *args, **options):
+        for phase_rows in options['sizes'] or [1000, 100000]:
+            try:
+                with transaction.atomic():
+                    user = self.seed(phase_rows)
+                    first_byte, elapsed, peak, size = self.measure(user)
+                    raise Rollback
+            except Rollback:
+                pass
+            self.stdout.write(
+                f'{phase_rows:>8} phase rows: first byte {first_byte * 1000:.0f} ms, '
+                f'total {elapsed:.1f} s, {size / 1024 / 1024:.1f} MB written, '
+                f'peak memory {peak / 1024 / 1024:.1f} MB'
+            )
+        self.stdout.write(self.style.SUCCESS('Benchmark complete (seeded rows were rolled back)'))
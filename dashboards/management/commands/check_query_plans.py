@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.models import CustomUser
+from dashboards.query_plans import full_scans, hot_queries
+
+
+class Command(BaseCommand):
+    help = 'EXPLAIN the hot dashboard queries against this database and fail on full table scans'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--username',
+            help='Operator whose work queue and history are checked (default: any operator)',
+        )
+        parser.add_argument(
+            '--plans',
+            action='store_true',
+            help='Print every query plan, not only the failing ones',
+        )
+
+    def handle(self, *args, **options):
+        users = CustomUser.objects.exclude(role='admin')
+        if options['username']:
+            users = CustomUser.objects.filter(username=options['username'])
+        user = users.order_by('pk').first()
+        if user is None:
+            raise CommandError('No operator found to check the queries for')
+
+        failures = []
+        for name, queryset in hot_queries(user).items():
+            scans = full_scans(queryset)
+            if scans:
+                failures.append(name)
+                self.stdout.write(self.style.ERROR(f'{name}: full scan of {", ".join(scans)}'))
+            else:
+                self.stdout.write(f'{name}: ok')
+            if scans or options['plans']:
+                self.stdout.write(queryset.explain())
+        if failures:
+            raise CommandError(f'{len(failures)} query plan(s) scan whole tables: {", ".join(failures)}')
+        self.stdout.write(self.style.SUCCESS('Every hot query uses an index'))
@@ -0,0 +1,65 @@
+import os
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from kampala_pharma import sqlite_copy
+
+
+class Command(BaseCommand):
+    help = (
+        'Migrate a database (e.g. the PostgreSQL one) and replace its contents with every row '
+        'of an existing SQLite file, keeping primary keys and timestamps'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Path of the SQLite database file to copy from')
+        parser.add_argument(
+            '--database',
+            default='default',
+            help='Database alias to copy into (default "default")',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of rows to read and insert per query (default 1000)',
+        )
+        parser.add_argument(
+            '--noinput', '--no-input',
+            action='store_false',
+            dest='interactive',
+            help='Do not ask before deleting the existing rows of the target database',
+        )
+
+    def handle(self, *args, **options):
+        path, target = options['path'], options['database']
+        if not os.path.isfile(path):
+            raise CommandError(f'SQLite database not found: {path}')
+        with sqlite_copy.sqlite_database(path) as source:
+            self.copy(path, source.alias, target, options)
+
+    def copy(self, path, source, target, options):
+        call_command('migrate', database=target, interactive=False, verbosity=options['verbosity'])
+        missing, unknown = sqlite_copy.migration_difference(source, target)
+        if missing or unknown:
+            raise CommandError(
+                f'{path} is not at the same migration state as the code; '
+                f'run "migrate" against it first ({len(missing)} missing, {len(unknown)} unknown)'
+            )
+
+        if options['interactive']:
+            answer = input(
+                f'Every row in the "{target}" database will be replaced by the contents of {path}.\n'
+                "Type 'yes' to continue, or 'no' to cancel: "
+            )
+            if answer != 'yes':
+                self.stdout.write('Copy cancelled.')
+                return
+
+        copied = sqlite_copy.copy_database(source, target, options['batch_size'])
+        if options['verbosity'] > 1:
+            for model, count in copied.items():
+                if count:
+                    self.stdout.write(f'{model._meta.label}: {count} row(s)')
+        self.stdout.write(self.style.SUCCESS(f'Copied {len(copied)} table(s) from {path} into "{target}"'))
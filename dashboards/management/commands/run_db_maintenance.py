@@ -0,0 +1,60 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from kampala_pharma import db_maintenance
+
+
+class Command(BaseCommand):
+    help = (
+        'Run the scheduled database maintenance tasks '
+        '(WAL checkpoint, optimize, vacuum, quick_check, phase event processing)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Run the tasks currently due and exit instead of polling',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=60,
+            help='Seconds to wait between checks for due tasks (default 60)',
+        )
+        parser.add_argument(
+            '--enable-incremental-vacuum',
+            action='store_true',
+            help='Switch the SQLite database to incremental auto-vacuum (rewrites the file; stop the application first)',
+        )
+
+    def handle(self, *args, **options):
+        if options['enable_incremental_vacuum']:
+            if connection.vendor != 'sqlite':
+                raise CommandError('Incremental vacuum only applies to SQLite databases')
+            if not db_maintenance.enable_incremental_vacuum():
+                raise CommandError('The database did not switch to incremental auto-vacuum')
+            self.stdout.write(self.style.SUCCESS('Incremental auto-vacuum enabled'))
+            return
+
+        if options['once']:
+            if not db_maintenance.is_leader():
+                self.stdout.write('Another process runs the database maintenance')
+                return
+            results = db_maintenance.run_pending()
+            for name, outcome in results.items():
+                self.stdout.write(f'{name}: {outcome}')
+            self.stdout.write(self.style.SUCCESS(f'Ran {len(results)} maintenance task(s)'))
+            return
+
+        self.stdout.write('Database maintenance worker started')
+        waiting = False
+        while True:
+            if db_maintenance.is_leader():
+                db_maintenance.run_pending()
+            elif not waiting:
+                self.stdout.write('Another process runs the database maintenance; waiting to take over')
+                waiting = True
+            time.sleep(options['poll_interval'])
@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from dashboards import export_jobs
+from dashboards.models import ExportJob
+
+
+class Command(BaseCommand):
+    help = 'Build queued report exports (Excel/Word) in the background'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Build the jobs currently queued and exit instead of polling',
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=2,
+            help='Seconds to wait between queue checks (default 2)',
+        )
+
+    def handle(self, *args, **options):
+        if options['once']:
+            processed = export_jobs.run_pending()
+            pruned = ExportJob.prune()
+            self.stdout.write(
+                self.style.SUCCESS(f'Built {processed} export(s), removed {pruned} expired export(s)')
+            )
+            return
+
+        self.stdout.write('Export worker started')
+        last_prune = 0.0
+        while True:
+            export_jobs.heartbeat()
+            processed = export_jobs.run_pending(limit=1)
+            if time.monotonic() - last_prune >= 60:
+                ExportJob.prune()
+                last_prune = time.monotonic()
+            if not processed:
+                time.sleep(options['poll_interval'])
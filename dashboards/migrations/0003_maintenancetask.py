@@ -0,0 +1,31 @@
+# Generated by Django 4.2.7 on 2026-10-17 05:19
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboards', '0002_exportjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MaintenanceTask',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('next_run_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_started_at', models.DateTimeField(blank=True, null=True)),
+                ('last_duration_ms', models.PositiveIntegerField(blank=True, null=True)),
+                ('last_outcome', models.CharField(blank=True, choices=[('ok', 'OK'), ('skipped', 'Skipped'), ('failed', 'Failed')], max_length=10)),
+                ('last_detail', models.TextField(blank=True)),
+                ('runs', models.PositiveIntegerField(default=0)),
+                ('failures', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['name'],
+            },
+        ),
+    ]
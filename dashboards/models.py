@@ -1,5 +1,12 @@
-from django.db import models
+import hashlib
+import json
+from datetime import timedelta
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Q
 from django.conf import settings
+from django.core.files import File
+from django.utils import timezone
 from bmr.models import BMR
 from workflow.models import BatchPhaseExecution
 
@@ -95,3 +102,232 @@ class UserDashboardPreferences(models.Model):
     
     def __str__(self):
         return f"Dashboard preferences for {self.user.username}"
+
+class ExportJob(models.Model):
+    """
+    A report export built outside the request by the export worker.
+
+    Jobs are keyed by export type, the user's visibility scope and the export
+    filters, so identical requests share one in-flight job and a finished
+    file is served again until it expires.
+    """
+    
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    ]
+    
+    EXPORT_TYPE_CHOICES = [
+        ('timeline_excel', 'Timeline (Excel)'),
+        ('timeline_detail_excel', 'Detailed Timeline (Excel)'),
+        ('wip_excel', 'Work in Progress (Excel)'),
+        ('comments_excel', 'Comments (Excel)'),
+        ('comments_word', 'Comments (Word)'),
+    ]
+    
+    TTL = timedelta(minutes=15)
+    # A running job not finished by then is assumed lost (e.g. the worker died)
+    RUN_TIMEOUT = timedelta(minutes=30)
+    
+    export_type = models.CharField(max_length=30, choices=EXPORT_TYPE_CHOICES)
+    params = models.JSONField(default=dict, blank=True)
+    scope = models.CharField(max_length=30)
+    dedupe_key = models.CharField(max_length=64, db_index=True)
+    requested_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='export_jobs'
+    )
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    file = models.FileField(upload_to='exports/%Y/%m/%d', blank=True)
+    filename = models.CharField(max_length=200, blank=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='dashboards_export_queue'),
+        ]
+        constraints = [
+            # At most one queued or running job per distinct export
+            models.UniqueConstraint(
+                fields=['dedupe_key'],
+                condition=Q(status__in=['queued', 'running']),
+                name='dashboards_export_inflight_unique',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_export_type_display()} #{self.pk} ({self.status})"
+    
+    @staticmethod
+    def scope_for(user):
+        """Visibility scope of the exports: admins see everything, others their own records"""
+        if user.is_staff or user.is_superuser or user.role == 'admin':
+            return 'all'
+        return f"user:{user.pk}"
+    
+    @staticmethod
+    def make_key(export_type, scope, params):
+        payload = json.dumps([export_type, scope, params], sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+    
+    @classmethod
+    def reusable(cls, now=None):
+        """Jobs a new request can share: in flight, or finished and not yet expired"""
+        now = now or timezone.now()
+        return cls.objects.filter(
+            Q(status='queued')
+            | Q(status='running', started_at__gte=now - cls.RUN_TIMEOUT)
+            | Q(status='completed', expires_at__gt=now)
+        )
+    
+    @classmethod
+    def enqueue(cls, export_type, params, user):
+        """Return (job, created), reusing an identical in-flight or finished job"""
+        now = timezone.now()
+        scope = cls.scope_for(user)
+        key = cls.make_key(export_type, scope, params)
+        job = cls.reusable(now).filter(dedupe_key=key).order_by('-created_at').first()
+        if job:
+            return job, False
+        
+        # A job the worker lost no longer counts as in flight
+        cls.objects.filter(dedupe_key=key, status='running').update(
+            status='failed', error='Export timed out', finished_at=now
+        )
+        try:
+            with transaction.atomic():
+                return cls.objects.create(
+                    export_type=export_type, params=params, scope=scope, dedupe_key=key, requested_by=user,
+                ), True
+        except IntegrityError:
+            # Another request queued the same export first
+            return cls.objects.get(dedupe_key=key, status__in=['queued', 'running']), False
+    
+    @classmethod
+    def claim_next(cls):
+        """Atomically take the oldest queued job, or None if the queue is empty"""
+        for job in cls.objects.filter(status='queued').order_by('created_at')[:10]:
+            if job.claim():
+                return job
+        return None
+    
+    def claim(self):
+        """Mark this job running unless another worker already took it"""
+        now = timezone.now()
+        claimed = ExportJob.objects.filter(pk=self.pk, status='queued').update(status='running', started_at=now)
+        if claimed:
+            self.status = 'running'
+            self.started_at = now
+        return bool(claimed)
+    
+    def complete(self, filename, content_type, handle):
+        """Store the built file and make it downloadable until the TTL runs out"""
+        self.file.save(filename, File(handle), save=False)
+        self.filename = filename
+        self.content_type = content_type
+        self.status = 'completed'
+        self.finished_at = timezone.now()
+        self.expires_at = self.finished_at + self.TTL
+        self.save()
+    
+    def fail(self, error):
+        self.status = 'failed'
+        self.error = error
+        self.finished_at = timezone.now()
+        self.save(update_fields=['status', 'error', 'finished_at'])
+    
+    @property
+    def is_available(self):
+        return self.status == 'completed' and bool(self.file) and self.expires_at > timezone.now()
+    
+    @classmethod
+    def prune(cls, now=None):
+        """Delete expired files and finished jobs older than the TTL; returns the number removed"""
+        now = now or timezone.now()
+        stale = cls.objects.filter(
+            Q(status='completed', expires_at__lte=now)
+            | Q(status='failed', finished_at__lte=now - cls.TTL)
+            | Q(status='running', started_at__lt=now - cls.RUN_TIMEOUT)
+        )
+        count = 0
+        for job in stale.iterator():
+            if job.file:
+                job.file.delete(save=False)
+            job.delete()
+            count += 1
+        return count
+
+
+class MaintenanceTask(models.Model):
+    """
+    A recurring database maintenance task and the outcome of its last run.
+
+    Each task is due at ``next_run_at``. A scheduler claims it by moving that
+    time forward with a guarded UPDATE, so a task due once runs once however
+    many processes poll (see kampala_pharma/db_maintenance.py).
+    """
+    
+    OUTCOME_CHOICES = [
+        ('ok', 'OK'),
+        ('skipped', 'Skipped'),
+        ('failed', 'Failed'),
+    ]
+    
+    name = models.CharField(max_length=50, unique=True)
+    next_run_at = models.DateTimeField(default=timezone.now)
+    last_started_at = models.DateTimeField(null=True, blank=True)
+    last_duration_ms = models.PositiveIntegerField(null=True, blank=True)
+    last_outcome = models.CharField(max_length=10, choices=OUTCOME_CHOICES, blank=True)
+    last_detail = models.TextField(blank=True)
+    runs = models.PositiveIntegerField(default=0)
+    failures = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        ordering = ['name']
+    
+    def __str__(self):
+        return f"{self.name} ({self.last_outcome or 'never run'})"
+    
+    @classmethod
+    def claim_due(cls, intervals, now=None):
+        """
+        Take the tasks due by now, given as {name: interval}, and schedule
+        their next run; a task another process claimed first is left out
+        """
+        now = now or timezone.now()
+        known = set(cls.objects.filter(name__in=intervals).values_list('name', flat=True))
+        if known != set(intervals):
+            cls.objects.bulk_create(
+                [cls(name=name, next_run_at=now) for name in intervals if name not in known],
+                ignore_conflicts=True,
+            )
+        claimed = []
+        for task in cls.objects.filter(name__in=intervals, next_run_at__lte=now).order_by('next_run_at'):
+            taken = cls.objects.filter(pk=task.pk, next_run_at=task.next_run_at).update(
+                next_run_at=now + intervals[task.name], last_started_at=now
+            )
+            if taken:
+                task.last_started_at = now
+                claimed.append(task)
+        return claimed
+    
+    def record(self, outcome, detail, duration_ms):
+        """Store the outcome of the run this task was claimed for"""
+        MaintenanceTask.objects.filter(pk=self.pk).update(
+            last_outcome=outcome,
+            last_detail=detail,
+            last_duration_ms=duration_ms,
+            runs=F('runs') + 1,
+            failures=F('failures') + int(outcome == 'failed'),
+        )
@@ -0,0 +1,90 @@
+"""
+Query plan checks for the hot dashboard and work queue queries.
+
+``hot_queries`` builds the querysets the dashboards run on every page view,
+filtered the way the views filter them. ``full_scans`` runs EXPLAIN on a
+queryset and returns the tables it reads from start to end, so a dropped or
+unusable index shows up in the tests (and in ``check_query_plans`` against a
+real database) instead of as a slow dashboard.
+
+    for name, queryset in hot_queries(user).items():
+        assert not full_scans(queryset), name
+
+Reference tables that stay small whatever the production volume (phases,
+products, machines) may be scanned.
+"""
+import re
+from datetime import datetime, time, timedelta
+
+from django.db import connections
+from django.utils import timezone
+
+from fgs_management.models import FGSInventory, ProductRelease
+from products.models import Product
+from quarantine.models import QuarantineBatch, SampleRequest
+from workflow.models import BatchPhaseExecution, Machine, ProductionPhase
+from workflow.services import WorkflowService
+
+
+SMALL_TABLES = frozenset([
+    ProductionPhase._meta.db_table,
+    Product._meta.db_table,
+    Machine._meta.db_table,
+])
+
+# SQLite: "SCAN table [USING INDEX ...]"; PostgreSQL: "Seq Scan on table"
+_SCAN_PATTERNS = {
+    'sqlite': re.compile(r'\bSCAN (?!CONSTANT ROW)(\S+)'),
+    'postgresql': re.compile(r'\bSeq Scan on (\S+)'),
+}
+
+
+def hot_queries(user):
+    """The most frequent dashboard queries, for the given operator"""
+    now = timezone.now()
+    today = timezone.make_aware(datetime.combine(timezone.localdate(), time.min))
+    return {
+        'work_queue': WorkflowService.get_work_queue(user),
+        'active_phases': BatchPhaseExecution.objects.filter(
+            status__in=['pending', 'in_progress']
+        ).select_related('bmr__product', 'phase', 'started_by').order_by('-started_date'),
+        'phase_status': BatchPhaseExecution.objects.filter(
+            phase__phase_name='finished_goods_store', status='pending'
+        ),
+        'completed_this_week': BatchPhaseExecution.objects.filter(completed_date__gte=now - timedelta(days=7)),
+        'operator_completed_today': BatchPhaseExecution.objects.filter(
+            completed_by=user, completed_date__gte=today, completed_date__lt=today + timedelta(days=1)
+        ),
+        'recent_breakdowns': BatchPhaseExecution.objects.filter(
+            breakdown_occurred=True, breakdown_start_time__gte=now - timedelta(days=30)
+        ).select_related('machine_used', 'bmr').order_by('-breakdown_start_time')[:20],
+        'recent_changeovers': BatchPhaseExecution.objects.filter(
+            changeover_occurred=True, changeover_start_time__gte=now - timedelta(days=30)
+        ).select_related('machine_used', 'bmr').order_by('-changeover_start_time')[:20],
+        'open_quarantine': QuarantineBatch.objects.filter(
+            status__in=QuarantineBatch.OPEN_STATUSES
+        ).select_related('bmr__product', 'current_phase'),
+        'qa_queue': SampleRequest.objects.filter(sample_date__isnull=True).order_by('-request_date')[:10],
+        'qc_queue': SampleRequest.objects.filter(
+            sample_date__isnull=False, qc_status='pending'
+        ).select_related('quarantine_batch__bmr__product', 'sampled_by'),
+        'qc_decided_today': SampleRequest.objects.filter(
+            qc_status='approved', approved_date__gte=today, approved_date__lt=today + timedelta(days=1)
+        ),
+        'available_inventory': FGSInventory.objects.filter(status='available'),
+        'recent_releases': ProductRelease.objects.filter(release_date__gte=now - timedelta(days=7)),
+    }
+
+
+def full_scans(queryset):
+    """Tables (or aliases) the queryset's plan reads in full, apart from SMALL_TABLES"""
+    vendor = connections[queryset.db].vendor
+    pattern = _SCAN_PATTERNS.get(vendor)
+    if pattern is None:
+        raise NotImplementedError(f'No query plan check for {vendor}')
+    tables = []
+    for line in queryset.explain().splitlines():
+        match = pattern.search(line)
+        if match and match.group(1).strip('"') not in SMALL_TABLES:
+            tables.append(match.group(1).strip('"'))
+    return tables
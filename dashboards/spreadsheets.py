@@ -0,0 +1,137 @@
+"""
+Write-only Excel workbooks for the report exports.
+
+Every Excel export goes through ``Spreadsheet``: an openpyxl workbook in
+write-only mode, so rows are flushed to disk as they are appended and memory
+does not grow with the report. Styles are registered once per workbook as
+named styles and referenced by name from each cell, instead of building a
+new Font/Fill/Border per cell.
+
+    book = Spreadsheet()
+    sheet = book.add_sheet('Summary', widths=[18] * 4, merged=['A1:D1'])
+    sheet.append(['Report title'], style='title')
+    sheet.append(headers, style='header')
+    for row in rows:            # any iterable, typically a generator
+        sheet.append(row, style='cell')
+    return book.response('report.xlsx')
+
+Layout (column widths, merged ranges, frozen panes) has to be given when the
+sheet is created, because write-only sheets write their header before the
+first row.
+"""
+import tempfile
+from datetime import datetime
+
+from django.http import FileResponse
+from django.utils import timezone
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Border, Font, NamedStyle, PatternFill, Side
+from openpyxl.utils import get_column_letter
+
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+_thin = Side(style='thin')
+_border = Border(left=_thin, right=_thin, top=_thin, bottom=_thin)
+_center = Alignment(horizontal='center', vertical='center')
+
+
+def solid_fill(color):
+    return PatternFill(start_color=color, end_color=color, fill_type='solid')
+
+
+# Named styles available in every workbook
+STYLES = {
+    'title': {'font': Font(bold=True, size=14), 'alignment': _center},
+    'subtitle': {'font': Font(bold=True, size=13), 'alignment': _center},
+    'note': {'font': Font(italic=True), 'alignment': _center},
+    'header': {
+        'font': Font(bold=True, color='FFFFFF'),
+        'fill': solid_fill('2C3E50'),
+        'alignment': Alignment(horizontal='center', vertical='center', wrap_text=True),
+        'border': _border,
+    },
+    'cell': {'border': _border, 'alignment': Alignment(vertical='center')},
+    'centered': {'border': _border, 'alignment': _center},
+    'wrapped': {'border': _border, 'alignment': Alignment(wrap_text=True, vertical='top')},
+    'datetime': {'border': _border, 'alignment': _center, 'number_format': 'yyyy-mm-dd hh:mm:ss'},
+    'status_completed': {'fill': solid_fill('C6EFCE')},
+    'status_in_progress': {'fill': solid_fill('FFEB9C')},
+    'status_pending': {'fill': solid_fill('FFC7CE')},
+    'status_request': {'fill': solid_fill('E7E6E6')},
+}
+
+
+def excel_value(value):
+    """Excel has no time zones: aware datetimes are written in local time"""
+    if isinstance(value, datetime) and timezone.is_aware(value):
+        return timezone.localtime(value).replace(tzinfo=None)
+    return value
+
+
+class Sheet:
+    """A write-only worksheet that appends plain or styled rows"""
+
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+
+    def append(self, values, style=None, styles=None):
+        """
+        Append one row.
+
+        ``style`` applies a named style to every cell; ``styles`` maps column
+        indexes (0-based) to a named style and overrides ``style`` for those
+        columns. Without either the values are written as they are.
+        """
+        if style is None and not styles:
+            self.worksheet.append([excel_value(value) for value in values])
+            return
+        row = []
+        for index, value in enumerate(values):
+            cell = WriteOnlyCell(self.worksheet)
+            name = styles.get(index, style) if styles else style
+            if name:
+                cell.style = name
+            # Set after the style so dates keep a date number format
+            cell.value = excel_value(value)
+            row.append(cell)
+        self.worksheet.append(row)
+
+    def extend(self, rows, style=None, styles=None):
+        for values in rows:
+            self.append(values, style=style, styles=styles)
+
+    def close(self):
+        """Flush the sheet to disk; nothing can be appended afterwards"""
+        self.worksheet.close()
+
+
+class Spreadsheet:
+    """Write-only workbook with the shared styles registered once"""
+
+    def __init__(self, styles=None):
+        self.workbook = Workbook(write_only=True)
+        for name, attributes in {**STYLES, **(styles or {})}.items():
+            self.workbook.add_named_style(NamedStyle(name=name, **attributes))
+
+    def add_sheet(self, title, widths=(), merged=(), freeze=None):
+        """New sheet; ``widths`` are column widths in characters, from column A"""
+        worksheet = self.workbook.create_sheet(title=title[:31])
+        for index, width in enumerate(widths, 1):
+            worksheet.column_dimensions[get_column_letter(index)].width = width
+        for cell_range in merged:
+            worksheet.merged_cells.add(cell_range)
+        if freeze:
+            worksheet.freeze_panes = freeze
+        return Sheet(worksheet)
+
+    def save(self, handle):
+        self.workbook.save(handle)
+
+    def response(self, filename):
+        """Save to a temporary file and stream it back as a download"""
+        handle = tempfile.TemporaryFile()
+        self.save(handle)
+        handle.seek(0)
+        return FileResponse(handle, as_attachment=True, filename=filename, content_type=XLSX_CONTENT_TYPE)
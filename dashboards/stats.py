@@ -0,0 +1,62 @@
+"""
+Declarative counters for the dashboard statistic cards.
+
+Each dashboard lists the counts it needs as ``Counter`` objects and passes
+them to ``count_stats``. Counters over the same model (or the same base
+queryset) are folded into a single ``aggregate(Count(..., filter=Q(...)))``
+query, so adding a counter to a dashboard does not add a round trip.
+
+    stats = count_stats(
+        total_bmrs=Counter(BMR),
+        completed_batches=Counter(BMR, status='completed'),
+        qc_failed=Counter(BatchPhaseExecution, phase__phase_name__in=QC_PHASES, status='failed'),
+    )
+
+Conditions should only follow forward (many-to-one) relations; a reverse
+relation would repeat rows and inflate every count in the same query.
+"""
+import math
+
+from django.db.models import Count, Q
+from django.db.models.query import QuerySet
+
+
+class Counter:
+    """A count over a model or base queryset, optionally narrowed by a condition"""
+
+    def __init__(self, source, *args, **kwargs):
+        if isinstance(source, QuerySet):
+            self.queryset = source
+        else:
+            self.queryset = source._default_manager.all()
+        self.condition = Q(*args, **kwargs)
+
+    @property
+    def group_key(self):
+        """Counters sharing a key are answered by the same query"""
+        return (self.queryset.model, str(self.queryset.order_by().query))
+
+    def as_aggregate(self):
+        if self.condition:
+            return Count('pk', filter=self.condition)
+        return Count('pk')
+
+
+def count_stats(**counters):
+    """Evaluate the named counters, one aggregate query per model/base queryset"""
+    groups = {}
+    for name, counter in counters.items():
+        queryset, aggregates = groups.setdefault(counter.group_key, (counter.queryset, {}))
+        aggregates[name] = counter.as_aggregate()
+
+    results = {}
+    for queryset, aggregates in groups.values():
+        results.update(queryset.order_by().aggregate(**aggregates))
+    return results
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of values sorted in ascending order, or None when there are none"""
+    if not values:
+        return None
+    return values[max(math.ceil(fraction * len(values)), 1) - 1]
@@ -0,0 +1,673 @@
+import multiprocessing
+import os
+import tempfile
+from datetime import datetime, timedelta
+from io import BytesIO, StringIO
+from unittest import mock
+
+import openpyxl
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from bmr.models import BMR, BMRRequest
+from fgs_management.models import FGSInventory, ProductRelease
+from kampala_pharma.testing import create_admin, create_bmr, create_operator
+from products.models import Product
+from quarantine.models import QuarantineBatch
+from workflow.models import BatchPhaseExecution, BMRProgress, ChangeEvent, Machine, PhaseOperator, ProductionPhase
+from reports.timeline_views import build_timeline_excel
+from reports.views import build_comments_excel
+from workflow.services import WorkflowService
+
+from . import export_jobs, fragment_cache
+from .change_feed import stream_events
+from .fragment_cache import cached_section, section_stats
+from .models import ExportJob
+from .query_plans import full_scans, hot_queries
+from .spreadsheets import Spreadsheet, solid_fill
+from .stats import Counter, count_stats
+from .timeline import build_bmr_timelines, iter_bmr_timelines
+from .views import build_timeline_detail_excel, build_wip_excel
+
+
+class TimelineAssemblyTests(TestCase):
+    """The timeline pages must not issue queries per BMR"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_admin()
+        cls.operator = create_operator()
+        cls.machine = Machine.objects.create(name='Mixer 1', machine_type='mixing')
+        cls.product = Product.objects.create(product_name='Test Ointment', product_type='ointment')
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def create_bmrs(self, count):
+        now = timezone.now()
+        start = BMR.objects.count() + 1
+        for number in range(start, start + count):
+            bmr = create_bmr(self.product, self.admin, number)
+            BMRRequest.objects.create(
+                product=self.product, requested_by=self.admin, bmr=bmr,
+                required_date=now.date(), reason='Stock', quantity_required=100, quantity_unit='kg',
+            )
+            BatchPhaseExecution.objects.filter(bmr=bmr, phase__phase_name='mixing').update(
+                status='in_progress', started_by=self.operator, started_date=now,
+                machine_used=self.machine,
+            )
+            BatchPhaseExecution.objects.filter(bmr=bmr, phase__phase_name='finished_goods_store').update(
+                status='completed', started_date=now, completed_date=now, completed_by=self.operator,
+            )
+
+    def count_queries(self, func):
+        with CaptureQueriesContext(connection) as context:
+            func()
+        return len(context.captured_queries)
+
+    def assertQueriesFlat(self, func):
+        self.create_bmrs(2)
+        baseline = self.count_queries(func)
+        self.create_bmrs(5)
+        self.assertEqual(self.count_queries(func), baseline)
+
+    def test_build_bmr_timelines(self):
+        self.create_bmrs(1)
+        item = build_bmr_timelines(BMR.objects.all(), include_requests=True)[0]
+
+        self.assertTrue(item['is_completed'])
+        self.assertEqual(item['current_phase'].phase.phase_name, 'regulatory_approval')
+        self.assertTrue(item['phase_timeline'][0]['is_request_phase'])
+        mixing = next(p for p in item['phase_timeline'] if p['phase_name'] == 'Mixing')
+        self.assertEqual(mixing['machine_used'], 'Mixer 1')
+        self.assertEqual(mixing['started_by'], self.operator.get_full_name())
+
+    def test_build_bmr_timelines_query_count_is_flat(self):
+        self.assertQueriesFlat(lambda: build_bmr_timelines(include_requests=True))
+
+    def test_admin_timeline_query_count_is_flat(self):
+        self.assertQueriesFlat(lambda: self.client.get(reverse('dashboards:admin_timeline')))
+
+    def test_admin_timeline_paginates_in_database(self):
+        self.create_bmrs(12)
+        BMR.objects.filter(batch_number='0032025').update(status='approved')
+        url = reverse('dashboards:admin_timeline')
+
+        response = self.client.get(url, {'sort': 'batch', 'page': 2})
+        self.assertEqual(response.context['total_bmrs'], 12)
+        self.assertEqual(
+            [item['bmr'].batch_number for item in response.context['timeline_data']],
+            ['0112025', '0122025'],
+        )
+        response = self.client.get(url, {'status': 'approved'})
+        self.assertEqual([item['bmr'].batch_number for item in response.context['timeline_data']], ['0032025'])
+        response = self.client.get(url, {'state': 'in-progress'})
+        self.assertEqual(response.context['total_bmrs'], 0)
+
+        # A page costs the same whatever the total number of BMRs
+        baseline = self.count_queries(lambda: self.client.get(url, {'page_size': 10}))
+        self.create_bmrs(15)
+        self.assertEqual(self.count_queries(lambda: self.client.get(url, {'page_size': 10})), baseline)
+
+    def test_admin_timeline_data_endpoint(self):
+        self.create_bmrs(3)
+        response = self.client.get(
+            reverse('dashboards:admin_timeline_data'), {'sort': '-batch', 'page_size': 10, 'q': '2025'}
+        )
+        data = response.json()
+        self.assertEqual(data['total'], 3)
+        self.assertFalse(data['has_next'])
+        self.assertEqual([row['batch_number'] for row in data['results']], ['0032025', '0022025', '0012025'])
+        self.assertTrue(data['results'][0]['is_completed'])
+        self.assertEqual(data['results'][0]['phases'][0]['phase_name'], 'Production Manager BMR Request')
+
+        self.client.force_login(self.operator)
+        self.assertEqual(self.client.get(reverse('dashboards:admin_timeline_data')).status_code, 403)
+
+    def test_live_tracking_query_count_is_flat(self):
+        self.assertQueriesFlat(lambda: self.client.get(reverse('dashboards:live_tracking')))
+
+    def test_timeline_export_query_count_is_flat(self):
+        self.assertQueriesFlat(
+            lambda: self.client.get(reverse('dashboards:admin_timeline'), {'export': 'csv'})
+        )
+
+
+class CountStatsTests(TestCase):
+    """Dashboard counters are folded into one query per model"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_admin()
+        cls.product = Product.objects.create(product_name='Test Ointment', product_type='ointment')
+        for number, status in enumerate(['draft', 'draft', 'completed'], 1):
+            create_bmr(cls.product, cls.admin, number, status=status)
+
+    def setUp(self):
+        # Version tokens are rolled back with each test; sections cached
+        # under earlier ones would be served stale and refreshed in a thread
+        cache.clear()
+
+    def test_counts(self):
+        stats = count_stats(
+            total=Counter(BMR),
+            drafts=Counter(BMR, status='draft'),
+            completed=Counter(BMR.objects.filter(status='completed')),
+            machines=Counter(Machine),
+        )
+        self.assertEqual(stats, {'total': 3, 'drafts': 2, 'completed': 1, 'machines': 0})
+
+    def test_one_query_per_model(self):
+        with self.assertNumQueries(2):
+            count_stats(
+                total=Counter(BMR),
+                drafts=Counter(BMR, status='draft'),
+                completed=Counter(BMR, status='completed'),
+                mixing=Counter(BatchPhaseExecution, phase__phase_name='mixing'),
+                pending=Counter(BatchPhaseExecution, status='pending'),
+            )
+
+    def test_admin_dashboards_render(self):
+        self.client.force_login(self.admin)
+        for name in ['dashboards:admin_dashboard', 'dashboards:admin_fgs_monitor', 'quarantine:dashboard']:
+            with self.subTest(name=name):
+                self.assertEqual(self.client.get(reverse(name)).status_code, 200)
+
+
+class ChangeFeedTests(TestCase):
+    """Live screens read only the events after the sequence they already have"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_admin()
+        cls.product = Product.objects.create(product_name='Test Ointment', product_type='ointment')
+        cls.bmr = create_bmr(cls.product, cls.admin)
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def start_mixing(self):
+        execution = BatchPhaseExecution.objects.get(bmr=self.bmr, phase__phase_name='mixing')
+        execution.status = 'in_progress'
+        execution.started_date = timezone.now()
+        execution.save()
+        return execution
+
+    def test_phase_changes_are_recorded_in_order(self):
+        since = ChangeEvent.latest_sequence()
+        execution = self.start_mixing()
+        execution.save()  # No status change, no event
+
+        events = list(ChangeEvent.since(since))
+        self.assertEqual(len(events), 1)
+        self.assertEqual((events[0].source, events[0].object_id, events[0].action), ('phase', execution.pk, 'in_progress'))
+        self.assertEqual(events[0].data['phase'], 'mixing')
+        self.assertEqual(events[0].data['previous_status'], 'not_ready')
+
+    def test_polling_fallback(self):
+        url = reverse('dashboards:change_feed')
+        since = self.client.get(url).json()['last_seq']
+        self.assertEqual(self.client.get(url, {'since': since}).json()['events'], [])
+
+        execution = self.start_mixing()
+        data = self.client.get(url, {'since': since, 'source': 'phase'}).json()
+        self.assertEqual([event['object_id'] for event in data['events']], [execution.pk])
+        self.assertEqual(data['last_seq'], data['events'][0]['seq'])
+        self.assertEqual(self.client.get(url, {'since': since, 'source': 'fgs'}).json()['events'], [])
+
+    def test_late_commit_below_the_cursor_is_read(self):
+        url = reverse('dashboards:change_feed')
+        since = self.client.get(url).json()['last_seq']
+        # A transaction that took a lower id but commits later still gets the
+        # next sequence, so a poller that already moved on does not skip it
+        early = ChangeEvent.record_many('fgs', [(1, self.bmr.pk, 'stored', {})])[0]
+        ChangeEvent.objects.filter(pk=early.pk).update(id=1000)
+        since = self.client.get(url, {'since': since}).json()['last_seq']
+        late = ChangeEvent.record_many('fgs', [(2, self.bmr.pk, 'stored', {})])[0]
+        ChangeEvent.objects.filter(pk=late.pk).update(id=900)
+        data = self.client.get(url, {'since': since}).json()
+        self.assertEqual([event['object_id'] for event in data['events']], [2])
+        self.assertEqual(ChangeEvent.latest_sequence(), late.sequence)
+
+    @override_settings(CHANGE_FEED_STREAM=True)
+    def test_stream(self):
+        since = ChangeEvent.latest_sequence()
+        execution = self.start_mixing()
+        messages = list(stream_events(since, ['phase'], duration=0.1))
+        self.assertTrue(messages[0].startswith('retry:'))
+        self.assertIn(f'"object_id": {execution.pk}', messages[1])
+
+        response = self.client.get(reverse('dashboards:change_feed_stream'), HTTP_LAST_EVENT_ID=str(since))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        chunks = iter(response.streaming_content)
+        next(chunks)
+        self.assertIn(f'id: {messages[1].split()[1]}', next(chunks).decode())
+        response.close()
+
+    def test_stream_is_off_by_default(self):
+        # The screens poll, and a stream request does not hold a worker
+        response = self.client.get(reverse('dashboards:change_feed_stream'))
+        self.assertEqual(response.status_code, 204)
+        self.assertNotContains(self.client.get(reverse('dashboards:live_tracking')), 'changes/stream')
+
+    def test_live_pages_render(self):
+        for name in ['dashboards:live_tracking', 'dashboards:admin_fgs_monitor']:
+            with self.subTest(name=name):
+                response = self.client.get(reverse(name))
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(response, 'js/change_feed.js')
+
+
+class WorkQueueTests(TestCase):
+    """Role work queues are one query however many batches exist"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_admin()
+        cls.operator = create_operator('mixer')
+        cls.product = Product.objects.create(product_name='Test Ointment', product_type='ointment')
+
+    def create_bmrs(self, count):
+        start = BMR.objects.count() + 1
+        for number in range(start, start + count):
+            bmr = create_bmr(self.product, self.admin, number)
+            BatchPhaseExecution.objects.filter(bmr=bmr, phase__phase_name='mixing').update(status='pending')
+
+    def test_queue_for_role_and_assignment(self):
+        self.create_bmrs(2)
+        queue = list(WorkflowService.get_work_queue(self.operator))
+        self.assertEqual([execution.phase.phase_name for execution in queue], ['mixing', 'mixing'])
+        self.assertEqual(queue[0].bmr.batch_number, '0022025')
+
+        # A PhaseOperator assignment adds that phase to the user's queue
+        tube_filling = ProductionPhase.objects.get(product_type='ointment', phase_name='tube_filling')
+        PhaseOperator.objects.create(user=self.operator, phase=tube_filling)
+        BatchPhaseExecution.objects.filter(phase=tube_filling).update(status='pending')
+        with self.assertNumQueries(1):
+            queue = list(WorkflowService.get_work_queue(self.operator))
+            [execution.bmr.product.product_name for execution in queue]
+        self.assertEqual(
+            [execution.phase.phase_name for execution in queue],
+            ['mixing', 'tube_filling', 'mixing', 'tube_filling'],
+        )
+
+    def test_operator_dashboard_query_count_is_flat(self):
+        self.client.force_login(self.operator)
+        url = reverse('dashboards:operator_dashboard')
+        self.create_bmrs(2)
+        cache.clear()
+        self.client.get(url)  # Warm the cached sections
+        with CaptureQueriesContext(connection) as baseline:
+            self.client.get(url)
+        self.create_bmrs(5)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(len(context.captured_queries), len(baseline.captured_queries))
+        self.assertEqual(response.context['stats']['pending_phases'], 7)
+
+
+class FragmentCacheTests(TestCase):
+    """Dashboard sections are reused until a source they read changes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_admin()
+        cls.product = Product.objects.create(product_name='Test Ointment', product_type='ointment')
+        cls.bmr = create_bmr(cls.product, cls.admin)
+
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return {'calls': self.calls}
+
+    def start_mixing(self):
+        execution = BatchPhaseExecution.objects.get(bmr=self.bmr, phase__phase_name='mixing')
+        execution.status = 'in_progress'
+        with self.captureOnCommitCallbacks(execute=True):
+            execution.save()
+
+    def test_hit_and_invalidation(self):
+        self.assertEqual(cached_section('test_section', self.compute, ['phase'], role='admin'), {'calls': 1})
+        self.assertEqual(cached_section('test_section', self.compute, ['phase'], role='admin'), {'calls': 1})
+        # Other roles, and unrelated sources, do not share or drop the entry
+        self.assertEqual(cached_section('test_section', self.compute, ['phase'], role='qa'), {'calls': 2})
+        with self.captureOnCommitCallbacks(execute=True):
+            ChangeEvent.touch('fgs')
+        self.assertEqual(cached_section('test_section', self.compute, ['phase'], role='admin'), {'calls': 1})
+
+        self.start_mixing()
+        self.assertEqual(cached_section('test_section', self.compute, ['phase'], role='admin'), {'calls': 3})
+
+        row = next(row for row in section_stats() if row['name'] == 'test_section')
+        self.assertEqual((row['hits'], row['misses'], row['stale']), (2, 3, 0))
+        self.assertEqual(row['hit_rate'], 40.0)
+
+    def test_stale_while_revalidate(self):
+        cached_section('stale_section', self.compute, ['phase'], stale_for=60)
+        self.start_mixing()
+        with mock.patch.object(fragment_cache, 'REVALIDATE_IN_BACKGROUND', False):
+            # The previous value is served while the new one is computed
+            self.assertEqual(cached_section('stale_section', self.compute, ['phase'], stale_for=60), {'calls': 1})
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(cached_section('stale_section', self.compute, ['phase'], stale_for=60), {'calls': 2})
+
+    def test_dashboards_share_cached_counters(self):
+        self.client.force_login(self.admin)
+        url = reverse('dashboards:admin_dashboard')
+        with CaptureQueriesContext(connection) as first:
+            self.client.get(url)
+        with CaptureQueriesContext(connection) as second:
+            response = self.client.get(url)
+        self.assertEqual(response.context['total_bmrs'], 1)
+        self.assertLess(len(second.captured_queries), len(first.captured_queries))
+
+        response = self.client.get(reverse('dashboards:system_health'))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'admin_counters')
+
+    def test_workers_share_sections_and_invalidations(self):
+        def other_worker():
+            cached_section('worker_section', lambda: {'worker': os.getpid()}, ['phase'], role='admin')
+
+        # The token is in the database, which the forked worker only sees as it was at the fork
+        ChangeEvent.versions(['phase'])
+        process = multiprocessing.get_context('fork').Process(target=other_worker)
+        process.start()
+        process.join(10)
+        self.assertEqual(process.exitcode, 0)
+
+        value = cached_section('worker_section', self.compute, ['phase'], role='admin')
+        self.assertNotEqual(value['worker'], os.getpid())
+        row = next(row for row in section_stats() if row['name'] == 'worker_section')
+        self.assertEqual((row['hits'], row['misses']), (1, 1))
+
+        # What ChangeEvent.touch does once any worker's save commits
+        caches['versions'].set(ChangeEvent.VERSION_KEY.format(source='phase'), 'replaced', None)
+        self.assertEqual(cached_section('worker_section', self.compute, ['phase'], role='admin'), {'calls': 1})
+
+
+class StreamingExportTests(TestCase):
+    """CSV exports stream rows as the querysets are read"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_admin()
+        cls.product = Product.objects.create(product_name='Test Ointment', product_type='ointment')
+        cls.bmrs = [create_bmr(cls.product, cls.admin, number) for number in range(1, 4)]
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+
+    def get_csv(self, url, params=None):
+        response = self.client.get(url, params or {})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        return b''.join(response.streaming_content).decode()
+
+    def test_timeline_exports(self):
+        content = self.get_csv(reverse('dashboards:admin_timeline'), {'export': 'csv', 'product': self.product.pk})
+        for bmr in self.bmrs:
+            self.assertIn(f"BMR: {bmr.batch_number} - Test Ointment", content)
+        self.assertEqual(content.count('Mixing,Not_Ready'), 3)
+
+        content = self.get_csv(reverse('reports:export_timeline_csv'))
+        self.assertEqual(len(content.splitlines()), 4)
+        self.assertTrue(content.splitlines()[1].startswith('0032025,Test Ointment'))
+
+    def test_timeline_chunks_match_single_build(self):
+        entries = list(iter_bmr_timelines(BMR.objects.all(), include_requests=True, chunk_size=2))
+        expected = build_bmr_timelines(BMR.objects.all(), include_requests=True)
+        self.assertEqual([entry['bmr'].pk for entry in entries], [entry['bmr'].pk for entry in expected])
+        self.assertEqual(
+            [len(entry['phase_timeline']) for entry in entries],
+            [len(entry['phase_timeline']) for entry in expected],
+        )
+
+    def test_wip_export(self):
+        BatchPhaseExecution.objects.filter(bmr=self.bmrs[0], phase__phase_name='mixing').update(status='pending')
+        BMRProgress.refresh(self.bmrs[0].pk)
+        content = self.get_csv(reverse('dashboards:export_wip'), {'format': 'csv'})
+        self.assertIn('Work In Progress Report', content)
+        self.assertIn('0012025', content)
+
+    def test_comments_export_is_sorted_and_filtered(self):
+        now = timezone.now()
+        BMR.objects.filter(pk=self.bmrs[0].pk).update(qa_comments='Checked labels')
+        mixing = BatchPhaseExecution.objects.filter(bmr=self.bmrs[1], phase__phase_name='mixing')
+        mixing.update(operator_comments='Viscosity low', completed_date=now + timedelta(hours=1))
+        BatchPhaseExecution.objects.filter(bmr=self.bmrs[2], phase__phase_name='tube_filling').update(
+            rejection_reason='Seal leak', completed_date=now - timedelta(days=1),
+        )
+
+        url = reverse('reports:export_comments_csv')
+        rows = self.get_csv(url).splitlines()
+        self.assertEqual(rows[0], 'BMR Number,Product,Comment Type,Phase,Date,Comments,Status')
+        self.assertEqual(
+            [row.split(',')[2] for row in rows[1:]],
+            ['Operator Comments', 'BMR QA Comments', 'Rejection Reason'],
+        )
+
+        rows = self.get_csv(url, {'type': 'Rejection Reason'}).splitlines()
+        self.assertEqual([row.split(',')[0] for row in rows[1:]], ['0032025'])
+        rows = self.get_csv(url, {'bmr': '0042025'}).splitlines()
+        self.assertEqual(rows, ['No comments found in the system'])
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('benchmark_exports', rows=[30], stdout=out)
+        self.assertIn('30 phase rows', out.getvalue())
+        self.assertFalse(BMR.objects.filter(batch_number__startswith='B').exists())
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ExportJobTests(TestCase):
+    """Excel and Word exports are queued, coalesced and downloaded from the built file"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_admin()
+        cls.other_admin = create_admin('admin2', 'ADM002')
+        cls.operator = create_operator('mixer')
+        cls.product = Product.objects.create(product_name='Test Ointment', product_type='ointment')
+        cls.bmr = create_bmr(cls.product, cls.admin)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.admin)
+        patcher = mock.patch.object(export_jobs, 'RUN_IN_BACKGROUND', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_identical_requests_share_a_job(self):
+        job, created = ExportJob.enqueue('wip_excel', {'start_date': ['2025-01-01']}, self.admin)
+        self.assertTrue(created)
+        self.assertEqual(ExportJob.enqueue('wip_excel', {'start_date': ['2025-01-01']}, self.other_admin), (job, False))
+        self.assertTrue(ExportJob.enqueue('wip_excel', {'start_date': ['2025-02-01']}, self.admin)[1])
+        # Operators only see their own records, so they never share an admin's file
+        self.assertNotEqual(ExportJob.enqueue('comments_word', {}, self.operator)[0].scope, job.scope)
+
+    def test_worker_builds_queued_jobs(self):
+        export_jobs.heartbeat()
+        url = reverse('reports:export_timeline_excel')
+        response = self.client.get(url)
+        self.assertContains(response, 'Your export is being prepared')
+        job = ExportJob.objects.get()
+        self.assertEqual(job.status, 'queued')
+
+        status_url = reverse('dashboards:export_job_status', args=[job.pk])
+        self.assertIsNone(self.client.get(status_url).json()['download_url'])
+        self.assertEqual(self.client.get(url, HTTP_ACCEPT='application/json').status_code, 202)
+
+        out = StringIO()
+        call_command('run_export_jobs', '--once', stdout=out)
+        self.assertIn('Built 1 export(s)', out.getvalue())
+        download_url = self.client.get(status_url).json()['download_url']
+        response = self.client.get(download_url)
+        workbook = openpyxl.load_workbook(BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(workbook.sheetnames[:2], ['Production Summary', 'BMR-0012025'])
+
+        # Repeat requests are served from the finished file
+        self.assertRedirects(self.client.get(url), download_url, fetch_redirect_response=False)
+        self.assertEqual(ExportJob.objects.count(), 1)
+
+    def test_without_worker_the_job_runs_in_the_web_process(self):
+        response = self.client.get(reverse('dashboards:export_wip'))
+        job = ExportJob.objects.get()
+        self.assertEqual(job.status, 'completed')
+        self.assertRedirects(
+            response, reverse('dashboards:export_job_download', args=[job.pk]), fetch_redirect_response=False,
+        )
+        self.assertTrue(job.filename.endswith('.xlsx'))
+
+        self.client.get(reverse('reports:export_comments_word'))
+        job = ExportJob.objects.get(export_type='comments_word')
+        self.assertEqual(job.status, 'completed')
+        self.assertTrue(job.filename.endswith('.docx'))
+
+        # Other scopes cannot fetch the file
+        self.client.force_login(self.operator)
+        self.assertEqual(self.client.get(reverse('dashboards:export_job_download', args=[job.pk])).status_code, 404)
+
+    def test_failures_and_expiry(self):
+        job, _ = ExportJob.enqueue('wip_excel', {'start_date': ['not-a-date']}, self.admin)
+        with self.assertLogs('dashboards.export_jobs', 'ERROR'):
+            export_jobs.run_pending()
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertIn('not-a-date', job.error)
+
+        job, _ = ExportJob.enqueue('wip_excel', {}, self.admin)
+        export_jobs.run_pending()
+        job.refresh_from_db()
+        path = job.file.path
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(ExportJob.prune(now=job.expires_at + timedelta(seconds=1)), 2)
+        self.assertFalse(os.path.exists(path))
+
+
+class SpreadsheetExportTests(TestCase):
+    """Every Excel export is written by the shared write-only engine"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_admin()
+        cls.product = Product.objects.create(product_name='Test Ointment', product_type='ointment')
+        cls.bmrs = [create_bmr(cls.product, cls.admin, number) for number in range(1, 3)]
+        cls.started = timezone.make_aware(datetime(2025, 3, 1, 5, 30), timezone.utc)
+        BatchPhaseExecution.objects.filter(bmr=cls.bmrs[0], phase__phase_name='mixing').update(
+            status='completed', started_date=cls.started, completed_date=cls.started + timedelta(hours=2),
+            started_by=cls.admin, completed_by=cls.admin, operator_comments='Viscosity low',
+        )
+
+    def build(self, builder, params=None):
+        request = RequestFactory().get('/', params or {})
+        request.user = self.admin
+        response = builder(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Disposition'].endswith('.xlsx"'))
+        return openpyxl.load_workbook(BytesIO(b''.join(response.streaming_content)))
+
+    def test_engine(self):
+        book = Spreadsheet(styles={'warning': {'fill': solid_fill('FF0000')}})
+        sheet = book.add_sheet('Styled', widths=[12, 30], merged=['A1:B1'], freeze='A3')
+        sheet.append(['Title'], style='title')
+        sheet.append(['When', 'Note'], style='header')
+        for _ in range(3):
+            sheet.append([self.started, 'late'], style='cell', styles={0: 'datetime', 1: 'warning'})
+        sheet.append([self.started, None])
+        output = BytesIO()
+        book.save(output)
+
+        workbook = openpyxl.load_workbook(output)
+        ws = workbook['Styled']
+        self.assertEqual([style for style in workbook.named_styles if style == 'warning'], ['warning'])
+        self.assertEqual(ws.column_dimensions['B'].width, 30)
+        self.assertEqual([str(cell_range) for cell_range in ws.merged_cells.ranges], ['A1:B1'])
+        self.assertEqual(ws.freeze_panes, 'A3')
+        # Kampala is UTC+3 and Excel has no time zones
+        self.assertEqual(ws['A3'].value, datetime(2025, 3, 1, 8, 30))
+        self.assertEqual(ws['A3'].number_format, 'yyyy-mm-dd hh:mm:ss')
+        self.assertTrue(ws['A6'].is_date)
+        self.assertEqual(ws['B4'].fill.start_color.rgb, '00FF0000')
+
+    def test_timeline_workbooks(self):
+        workbook = self.build(build_timeline_excel)
+        self.assertEqual(workbook.sheetnames, ['Production Summary', 'BMR-0022025', 'BMR-0012025'])
+        self.assertEqual(workbook['Production Summary']['A5'].value, '0022025')
+        mixing = next(row for row in workbook['BMR-0012025'].iter_rows(values_only=True) if row[0] == 'Mixing')
+        self.assertEqual(mixing[2], datetime(2025, 3, 1, 8, 30))
+        self.assertEqual(mixing[6], 2)
+
+        workbook = self.build(build_timeline_detail_excel)
+        self.assertEqual(workbook.sheetnames[0], 'Production Summary')
+        self.assertCountEqual(workbook.sheetnames[1:], ['BMR-0012025', 'BMR-0022025'])
+        rows = list(workbook['BMR-0012025'].iter_rows(min_row=6, values_only=True))
+        mixing = next(row for row in rows if row[0] == 'Mixing')
+        self.assertEqual(mixing[2], '2025-03-01 08:30')
+        self.assertEqual(mixing[7], 'Viscosity low')
+
+    def test_wip_and_comments_workbooks(self):
+        workbook = self.build(build_wip_excel)
+        ws = workbook['Work in Progress']
+        self.assertEqual(ws['A2'].value, 'Work In Progress Report')
+        self.assertEqual(ws['A5'].value, 'Product Name')
+
+        workbook = self.build(build_comments_excel)
+        rows = list(workbook['Comments Report'].iter_rows(values_only=True))
+        self.assertEqual(rows[0][0], 'BMR Number')
+        self.assertEqual(rows[1][:3], ('0012025', 'Test Ointment', 'Operator Comments'))
+        self.assertEqual(rows[1][4], datetime(2025, 3, 1, 10, 30))
+
+
+class QueryPlanTests(TestCase):
+    """The hot dashboard queries are served by indexes, never by full table scans"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_admin()
+        cls.operator = create_operator()
+        product = Product.objects.create(product_name='Capsule', product_type='capsule')
+        bmrs = [create_bmr(product, cls.admin, number) for number in range(1, 4)]
+        now = timezone.now()
+        BatchPhaseExecution.objects.filter(bmr=bmrs[0], phase__phase_name='drying').update(
+            status='completed', completed_by=cls.operator, completed_date=now,
+            breakdown_occurred=True, breakdown_start_time=now - timedelta(hours=2),
+            changeover_occurred=True, changeover_start_time=now - timedelta(hours=3),
+        )
+        drying = ProductionPhase.objects.get(product_type='capsule', phase_name='drying')
+        batch = QuarantineBatch.enter([(bmrs[0], drying)])[0]
+        batch.request_sample(cls.admin)
+        inventory = FGSInventory.objects.create(
+            bmr=bmrs[1], product=product, batch_number=bmrs[1].batch_number,
+            quantity_available=100, status='available', created_by=cls.admin,
+        )
+        ProductRelease.objects.create(
+            inventory=inventory, release_type='sale', quantity_released=10, release_reference='REL-1',
+            authorized_by=cls.admin, created_by=cls.admin,
+        )
+
+    def test_hot_queries_use_indexes(self):
+        for name, queryset in hot_queries(self.operator).items():
+            with self.subTest(name):
+                self.assertEqual(full_scans(queryset), [], queryset.explain())
+                list(queryset)
+
+    def test_unindexed_filter_is_reported(self):
+        queryset = BatchPhaseExecution.objects.filter(operator_comments='Checked')
+        self.assertEqual(full_scans(queryset), ['workflow_batchphaseexecution'])
+        # Small reference tables may be scanned
+        self.assertEqual(full_scans(ProductionPhase.objects.filter(is_mandatory=True)), [])
+
+    def test_check_command(self):
+        output = StringIO()
+        call_command('check_query_plans', stdout=output)
+        self.assertIn('Every hot query uses an index', output.getvalue())
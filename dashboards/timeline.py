@@ -0,0 +1,323 @@
+"""
+Timeline assembly for the admin dashboards.
+
+Builds the per-BMR phase timelines used by the admin dashboard, the timeline
+page, live tracking and the timeline exports. Everything is loaded up front in
+a fixed number of queries (BMRs, phase executions, BMR requests) and grouped in
+memory, so the cost does not grow with the number of batches.
+
+The timeline page filters, sorts and paginates BMRs in the database first
+(``filter_timeline_bmrs``), so only the rows on the current page are built.
+Exports walk the BMRs in chunks (``iter_bmr_timelines``) instead.
+"""
+from collections import defaultdict
+from datetime import datetime
+
+from django.db.models import Exists, OuterRef, Q
+from django.db.models.query import QuerySet
+from django.utils import timezone
+
+from bmr.models import BMR, BMRRequest
+from workflow.models import BatchPhaseExecution
+
+
+ACTIVE_STATUSES = ('pending', 'in_progress')
+
+# Sort keys accepted by the timeline page, mapped to BMR ordering fields
+TIMELINE_SORTS = {
+    'batch': 'batch_number',
+    'product': 'product__product_name',
+    'type': 'product__product_type',
+    'created': 'created_date',
+    'status': 'status',
+    'progress': 'progress__percent_complete',
+    'activity': 'progress__last_activity',
+}
+DEFAULT_TIMELINE_SORT = '-created'
+TIMELINE_PAGE_SIZES = (10, 25, 50)
+
+
+def _format_total_hours(total_hours):
+    """Format a total production time as '1d 2h 3m' / '2h 3m' / '3m'"""
+    days = int(total_hours // 24)
+    hours = int(total_hours % 24)
+    minutes = int((total_hours % 1) * 60)
+    if days > 0:
+        return f"{days}d {hours}h {minutes}m"
+    if hours > 0:
+        return f"{hours}h {minutes}m"
+    return f"{minutes}m"
+
+
+def _format_phase_hours(total_hours, ongoing=False):
+    """Format a phase duration as '2h 3m' / '3m', flagging phases still running"""
+    hours = int(total_hours)
+    minutes = int((total_hours - hours) * 60)
+    formatted = f"{hours}h {minutes}m" if hours > 0 else f"{minutes}m"
+    return f"{formatted} (ongoing)" if ongoing else formatted
+
+
+def _request_entry(bmr_request):
+    """Timeline row for the production manager's BMR request"""
+    return {
+        'phase_name': 'Production Manager BMR Request',
+        'status': bmr_request.get_status_display(),
+        'started_date': bmr_request.request_date,
+        'completed_date': bmr_request.approved_date,
+        'started_by': bmr_request.requested_by.get_full_name() if bmr_request.requested_by else None,
+        'completed_by': bmr_request.approved_by.get_full_name() if bmr_request.approved_by else None,
+        'duration_hours': (bmr_request.approved_date - bmr_request.request_date).total_seconds() / 3600 if bmr_request.approved_date else None,
+        'duration_formatted': None,
+        'operator_comments': '',
+        'phase_order': 0,
+        'is_request_phase': True,  # Flag to identify this as a request phase
+        'execution_id': None,
+        # Keep the export columns aligned with the phase rows
+        'machine_used': '',
+        'breakdown_occurred': 'No',
+        'breakdown_duration': '',
+        'breakdown_start_time': '',
+        'breakdown_end_time': '',
+        'changeover_occurred': 'No',
+        'changeover_duration': '',
+        'changeover_start_time': '',
+        'changeover_end_time': '',
+    }
+
+
+def _phase_entry(execution, now):
+    """Timeline row for a single BatchPhaseExecution"""
+    phase_data = {
+        'phase_name': execution.phase.phase_name.replace('_', ' ').title(),
+        'status': execution.status.title(),
+        'started_date': execution.started_date,
+        'completed_date': execution.completed_date,
+        'started_by': execution.started_by.get_full_name() if execution.started_by else None,
+        'completed_by': execution.completed_by.get_full_name() if execution.completed_by else None,
+        'duration_hours': None,
+        'duration_formatted': None,
+        'operator_comments': execution.operator_comments or '',
+        'phase_order': execution.phase.phase_order,
+        'execution_id': execution.pk,
+        # Machine tracking
+        'machine_used': execution.machine_used.name if execution.machine_used else '',
+        # Breakdown tracking
+        'breakdown_occurred': 'Yes' if execution.breakdown_occurred else 'No',
+        'breakdown_duration': execution.get_breakdown_duration() if execution.breakdown_occurred else '',
+        'breakdown_start_time': execution.breakdown_start_time if execution.breakdown_occurred else '',
+        'breakdown_end_time': execution.breakdown_end_time if execution.breakdown_occurred else '',
+        # Changeover tracking
+        'changeover_occurred': 'Yes' if execution.changeover_occurred else 'No',
+        'changeover_duration': execution.get_changeover_duration() if execution.changeover_occurred else '',
+        'changeover_start_time': execution.changeover_start_time if execution.changeover_occurred else '',
+        'changeover_end_time': execution.changeover_end_time if execution.changeover_occurred else '',
+    }
+    if execution.started_date:
+        ongoing = not execution.completed_date
+        end = now if ongoing else execution.completed_date
+        total_hours = (end - execution.started_date).total_seconds() / 3600
+        phase_data['duration_hours'] = round(total_hours, 2)
+        phase_data['duration_formatted'] = _format_phase_hours(total_hours, ongoing=ongoing)
+    return phase_data
+
+
+def build_bmr_timelines(bmrs=None, include_requests=False):
+    """
+    Build timeline entries for the given BMRs (all BMRs by default).
+
+    Returns one dict per BMR, in the order of ``bmrs``, with the keys
+    ``bmr``, ``phase_timeline``, ``current_phase``, ``is_completed``,
+    ``total_time_days``, ``total_time_hours`` and ``total_production_time``.
+    When ``include_requests`` is set the BMR request (if any) is prepended to
+    each phase timeline.
+    """
+    if bmrs is None:
+        bmrs = BMR.objects.all()
+
+    executions = BatchPhaseExecution.objects.select_related(
+        'phase', 'started_by', 'completed_by', 'machine_used'
+    ).order_by('bmr_id', 'phase__phase_order')
+    requests = BMRRequest.objects.select_related('requested_by', 'approved_by')
+
+    if isinstance(bmrs, QuerySet) and not bmrs.query.is_sliced:
+        # Filter related rows with a subquery rather than a huge IN list
+        bmr_filter = bmrs.order_by().values('pk')
+        bmrs = list(bmrs.select_related('product', 'created_by', 'approved_by'))
+    else:
+        bmrs = list(bmrs)
+        bmr_filter = [bmr.pk for bmr in bmrs]
+
+    executions_by_bmr = defaultdict(list)
+    for execution in executions.filter(bmr_id__in=bmr_filter):
+        executions_by_bmr[execution.bmr_id].append(execution)
+
+    requests_by_bmr = {}
+    if include_requests:
+        # Latest request per BMR, matching BMRRequest's default ordering
+        for bmr_request in requests.filter(bmr_id__in=bmr_filter).order_by('bmr_id', '-request_date'):
+            requests_by_bmr.setdefault(bmr_request.bmr_id, bmr_request)
+
+    now = timezone.now()
+    timeline_data = []
+    for bmr in bmrs:
+        phases = executions_by_bmr.get(bmr.pk, [])
+
+        fgs_completed = next(
+            (p for p in phases if p.phase.phase_name == 'finished_goods_store' and p.status == 'completed'),
+            None
+        )
+        current_phase = next((p for p in phases if p.status in ACTIVE_STATUSES), None)
+
+        total_time_days = None
+        total_time_hours = None
+        total_production_time = None
+        if fgs_completed and fgs_completed.completed_date:
+            total_duration = fgs_completed.completed_date - bmr.created_date
+            total_time_days = total_duration.days
+            total_time_hours = round(total_duration.total_seconds() / 3600, 2)
+            total_production_time = _format_total_hours(total_duration.total_seconds() / 3600)
+
+        phase_timeline = []
+        bmr_request = requests_by_bmr.get(bmr.pk)
+        if bmr_request:
+            phase_timeline.append(_request_entry(bmr_request))
+        phase_timeline.extend(_phase_entry(execution, now) for execution in phases)
+
+        timeline_data.append({
+            'bmr': bmr,
+            'total_time_days': total_time_days,
+            'total_time_hours': total_time_hours,
+            'total_production_time': total_production_time,
+            'phase_timeline': phase_timeline,
+            'current_phase': current_phase,
+            'is_completed': fgs_completed is not None,
+        })
+
+    return timeline_data
+
+
+def iter_bmr_timelines(bmrs=None, include_requests=False, chunk_size=200):
+    """
+    Yield the same entries as ``build_bmr_timelines``, one chunk of BMRs at a time.
+
+    Used by the streaming exports: memory is bounded by ``chunk_size`` rather
+    than by the number of BMRs, at the cost of three queries per chunk.
+    """
+    if bmrs is None:
+        bmrs = BMR.objects.all()
+    if isinstance(bmrs, QuerySet):
+        bmrs = bmrs.select_related('product', 'created_by', 'approved_by').iterator(chunk_size=chunk_size)
+
+    chunk = []
+    for bmr in bmrs:
+        chunk.append(bmr)
+        if len(chunk) >= chunk_size:
+            yield from build_bmr_timelines(chunk, include_requests=include_requests)
+            chunk = []
+    if chunk:
+        yield from build_bmr_timelines(chunk, include_requests=include_requests)
+
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return None
+
+
+def filter_timeline_bmrs(params):
+    """
+    Apply the timeline page's filters and sort to the BMR queryset.
+
+    ``params`` is a QueryDict (or dict) with optional ``q``, ``product``,
+    ``product_type``, ``status``, ``state`` (completed / in-progress),
+    ``start_date``, ``end_date`` and ``sort``. Returns the lazy queryset and
+    the cleaned filter values, so nothing is loaded until a page is sliced.
+    """
+    fgs_completed = BatchPhaseExecution.objects.filter(
+        bmr=OuterRef('pk'), phase__phase_name='finished_goods_store', status='completed'
+    )
+    bmrs = BMR.objects.select_related('product', 'created_by', 'approved_by').annotate(
+        is_completed=Exists(fgs_completed)
+    )
+
+    filters = {
+        'q': (params.get('q') or '').strip(),
+        'product': params.get('product') or '',
+        'product_type': params.get('product_type') or '',
+        'status': params.get('status') or '',
+        'state': params.get('state') or '',
+        'start_date': _parse_date(params.get('start_date')),
+        'end_date': _parse_date(params.get('end_date')),
+    }
+    if filters['q']:
+        bmrs = bmrs.filter(
+            Q(batch_number__icontains=filters['q']) | Q(product__product_name__icontains=filters['q'])
+        )
+    if filters['product'].isdigit():
+        bmrs = bmrs.filter(product_id=filters['product'])
+    if filters['product_type']:
+        bmrs = bmrs.filter(product__product_type=filters['product_type'])
+    if filters['status']:
+        bmrs = bmrs.filter(status=filters['status'])
+    if filters['state'] == 'completed':
+        bmrs = bmrs.filter(is_completed=True)
+    elif filters['state'] == 'in-progress':
+        bmrs = bmrs.filter(is_completed=False)
+    if filters['start_date']:
+        bmrs = bmrs.filter(created_date__date__gte=filters['start_date'])
+    if filters['end_date']:
+        bmrs = bmrs.filter(created_date__date__lte=filters['end_date'])
+
+    sort = params.get('sort') or DEFAULT_TIMELINE_SORT
+    if sort.lstrip('-') not in TIMELINE_SORTS:
+        sort = DEFAULT_TIMELINE_SORT
+    field = TIMELINE_SORTS[sort.lstrip('-')]
+    descending = sort.startswith('-')
+    # pk breaks ties so rows never repeat or go missing between pages
+    bmrs = bmrs.order_by(f"-{field}" if descending else field, '-pk' if descending else 'pk')
+    filters['sort'] = sort
+    return bmrs, filters
+
+
+def timeline_page_size(params):
+    try:
+        size = int(params.get('page_size', TIMELINE_PAGE_SIZES[0]))
+    except (TypeError, ValueError):
+        return TIMELINE_PAGE_SIZES[0]
+    return size if size in TIMELINE_PAGE_SIZES else TIMELINE_PAGE_SIZES[0]
+
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+
+def serialize_timeline_entry(item):
+    """JSON-friendly form of a build_bmr_timelines() entry"""
+    bmr = item['bmr']
+    current = item['current_phase']
+    return {
+        'id': bmr.pk,
+        'batch_number': bmr.batch_number,
+        'product_name': bmr.product.product_name,
+        'product_type': bmr.product.product_type,
+        'status': bmr.status,
+        'created_date': _isoformat(bmr.created_date),
+        'current_phase': {
+            'name': current.phase.phase_name,
+            'status': current.status,
+        } if current else None,
+        'total_time_days': item['total_time_days'],
+        'total_production_time': item['total_production_time'],
+        'is_completed': item['is_completed'],
+        'phases': [
+            {
+                'phase_name': phase['phase_name'],
+                'status': phase['status'],
+                'started_date': _isoformat(phase['started_date']),
+                'completed_date': _isoformat(phase['completed_date']),
+                'duration_hours': phase['duration_hours'],
+            }
+            for phase in item['phase_timeline']
+        ],
+    }
@@ -41,16 +41,22 @@ urlpatterns = [
     path('packaging/', views.packaging_dashboard, name='packaging_dashboard'),
     path('packing/', views.packing_dashboard, name='packing_dashboard'),
     path('finished-goods/', views.finished_goods_dashboard, name='finished_goods_dashboard'),
+    path('phases/bulk/', views.bulk_phase_action, name='bulk_phase_action'),
     
     # Admin Dashboard
         # Redirect for old URL pattern
     path('admin/', views.admin_redirect, name='admin_redirect'),
     path('admin-overview/', views.admin_dashboard, name='admin_dashboard'),
     path('admin/timeline/', views.admin_timeline_view, name='admin_timeline'),
+    path('admin/timeline/data/', views.admin_timeline_data, name='admin_timeline_data'),
     path('admin/fgs-monitor/', views.admin_fgs_monitor, name='admin_fgs_monitor'),
     path('admin/quarantine-monitor/', views.quarantine_monitor_view, name='quarantine_monitor'),
     path('admin/export-timeline/', views.export_timeline_data, name='export_timeline_data'),
     path('admin/live-tracking/', views.live_tracking_view, name='live_tracking'),
+    path('changes/', views.change_feed, name='change_feed'),
+    path('changes/stream/', views.change_feed_stream, name='change_feed_stream'),
+    path('exports/<int:pk>/status/', views.export_job_status, name='export_job_status'),
+    path('exports/<int:pk>/download/', views.export_job_download, name='export_job_download'),
     path('export-wip/', views.export_wip, name='export_wip'),
     
     # Admin section routes for direct URL links
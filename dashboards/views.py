@@ -1,17 +1,41 @@
+from django.conf import settings
 from django.core.paginator import Paginator
 # --- RESTORE: Admin Timeline View ---
-from django.db.models import F, ExpressionWrapper, DateTimeField, Count, Avg
-from django.db import models
+from django.db.models import F, ExpressionWrapper, DateTimeField, Count, Avg, Prefetch, Q, Sum
+from kampala_pharma.db_writer import write_transaction, writer_stats
 from django.contrib.auth.decorators import login_required
 from django.utils import timezone
 from django.shortcuts import render, redirect
+from django.http import FileResponse, Http404, StreamingHttpResponse
+from django.views.decorators.http import require_POST
 from django.contrib import messages
-from datetime import timedelta
+import json
+from datetime import datetime, time, timedelta
 from dashboards.templatetags.custom_tags import format_phase_name
+from dashboards.change_feed import parse_sequence, parse_sources, stream_events
+from dashboards.export_jobs import job_status, queue_export
+from dashboards.exports import EXPORT_CHUNK_SIZE, streaming_csv_response
+from dashboards.spreadsheets import STYLES, Spreadsheet, solid_fill
+from dashboards.fragment_cache import cached_section, section_stats
+from dashboards.stats import Counter, count_stats
+from dashboards.timeline import (
+    TIMELINE_PAGE_SIZES, build_bmr_timelines, filter_timeline_bmrs, iter_bmr_timelines, serialize_timeline_entry,
+    timeline_page_size,
+)
 from accounts.models import CustomUser
-from bmr.models import BMR
+from bmr.models import BMR, BMRRequest
+from bmr.views import posted_version
+from dashboards.models import ExportJob, MaintenanceTask
 from products.models import Product
-from workflow.models import BatchPhaseExecution, Machine
+from workflow.machine_performance import get_machine_performance, machine_usage_counts
+from workflow.models import BatchPhaseExecution, ChangeEvent, Machine, OperatorBatchDay, OperatorDailyStats, PhaseConflict
+
+
+def _today(field):
+    """Filter for a datetime field on the local day, as a range the field's index can serve"""
+    start = timezone.make_aware(datetime.combine(timezone.localdate(), time.min))
+    return {f'{field}__gte': start, f'{field}__lt': start + timedelta(days=1)}
+
 
 @login_required
 def admin_timeline_view(request):
@@ -23,87 +47,72 @@ def admin_timeline_view(request):
     # Get export format if requested
     export_format = request.GET.get('export')
 
-    # Get all BMRs with timeline data
-    bmrs = BMR.objects.select_related('product', 'created_by', 'approved_by').all()
-
-    # Add timeline data for each BMR
-    timeline_data = []
-    from workflow.models import BatchPhaseExecution
-    from bmr.models import BMRRequest
-    
-    for bmr in bmrs:
-        phases = BatchPhaseExecution.objects.filter(bmr=bmr).select_related('phase').order_by('phase__phase_order')
-        bmr_created = bmr.created_date
-        
-        # Try to get BMR request information if it exists
-        bmr_request = BMRRequest.objects.filter(bmr=bmr).first()
-        
-        fgs_completed = phases.filter(
-            phase__phase_name='finished_goods_store',
-            status='completed'
-        ).first()
-        total_time_days = None
-        if fgs_completed and fgs_completed.completed_date:
-            total_time_days = (fgs_completed.completed_date - bmr_created).days
-        phase_timeline = []
-        
-        # Add BMR Request phase if available
-        if bmr_request:
-            phase_timeline.append({
-                'phase_name': 'Production Manager BMR Request',
-                'status': bmr_request.get_status_display(),
-                'started_date': bmr_request.request_date,
-                'completed_date': bmr_request.approved_date,
-                'started_by': bmr_request.requested_by.get_full_name() if bmr_request.requested_by else None,
-                'completed_by': bmr_request.approved_by.get_full_name() if bmr_request.approved_by else None,
-                'duration_hours': (bmr_request.approved_date - bmr_request.request_date).total_seconds() / 3600 if bmr_request.approved_date else None,
-                'is_request_phase': True  # Flag to identify this as a request phase
-            })
-        for phase in phases:
-            phase_data = {
-                'phase_name': phase.phase.phase_name.replace('_', ' ').title(),
-                'status': phase.status.title(),
-                'started_date': phase.started_date,
-                'completed_date': phase.completed_date,
-                'started_by': phase.started_by.get_full_name() if phase.started_by else None,
-                'completed_by': phase.completed_by.get_full_name() if phase.completed_by else None,
-                'duration_hours': None,
-                'operator_comments': getattr(phase, 'operator_comments', '') or '',
-                'phase_order': phase.phase.phase_order if hasattr(phase.phase, 'phase_order') else 0,
-            }
-            if phase.started_date and phase.completed_date:
-                duration = phase.completed_date - phase.started_date
-                phase_data['duration_hours'] = round(duration.total_seconds() / 3600, 2)
-            elif phase.started_date and not phase.completed_date:
-                duration = timezone.now() - phase.started_date
-                phase_data['duration_hours'] = round(duration.total_seconds() / 3600, 2)
-            phase_timeline.append(phase_data)
-        timeline_data.append({
-            'bmr': bmr,
-            'total_time_days': total_time_days,
-            'phase_timeline': phase_timeline,
-            'current_phase': phases.filter(status__in=['pending', 'in_progress']).first(),
-            'is_completed': fgs_completed is not None,
-        })
+    # Filter and sort in the database; only the current page is materialized
+    bmrs, filters = filter_timeline_bmrs(request.GET)
 
-    # Handle exports
-    if export_format in ['csv', 'excel']:
+    # Handle exports (every BMR matching the filters); the workbook is built by the export worker
+    if export_format == 'csv':
+        timeline_data = iter_bmr_timelines(bmrs, include_requests=True)
         return export_timeline_data(request, timeline_data, export_format)
+    if export_format == 'excel':
+        return queue_export(request, 'timeline_detail_excel')
 
     # Pagination
-    paginator = Paginator(timeline_data, 10)  # 10 BMRs per page
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    paginator = Paginator(bmrs, timeline_page_size(request.GET))
+    page_obj = paginator.get_page(request.GET.get('page'))
+    page_obj.object_list = build_bmr_timelines(page_obj.object_list, include_requests=True)
+
+    summary = count_stats(
+        completed_count=Counter(bmrs, is_completed=True),
+        in_progress_count=Counter(bmrs, is_completed=False),
+    )
+
+    # Query string without the page number, for pagination and sort links
+    query = request.GET.copy()
+    query.pop('page', None)
+    sort_query = query.copy()
+    sort_query.pop('sort', None)
 
     context = {
         'user': request.user,
         'page_obj': page_obj,
         'timeline_data': page_obj.object_list,
         'dashboard_title': 'BMR Timeline Tracking',
-        'total_bmrs': len(timeline_data),
+        'total_bmrs': paginator.count,
+        'completed_count': summary['completed_count'],
+        'in_progress_count': summary['in_progress_count'],
+        'filters': filters,
+        'filter_query': query.urlencode(),
+        'sort_query': sort_query.urlencode(),
+        'page_size': paginator.per_page,
+        'page_sizes': TIMELINE_PAGE_SIZES,
+        'products': Product.objects.order_by('product_name').values('pk', 'product_name'),
+        'product_types': Product.PRODUCT_TYPE_CHOICES,
+        'bmr_statuses': BMR.STATUS_CHOICES,
     }
 
     return render(request, 'dashboards/admin_timeline.html', context)
+
+
+@login_required
+def admin_timeline_data(request):
+    """JSON page of the admin timeline, taking the same filters as the page"""
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Admin privileges required.'}, status=403)
+
+    bmrs, filters = filter_timeline_bmrs(request.GET)
+    paginator = Paginator(bmrs, timeline_page_size(request.GET))
+    page_obj = paginator.get_page(request.GET.get('page'))
+    timeline_data = build_bmr_timelines(page_obj.object_list, include_requests=True)
+
+    return JsonResponse({
+        'results': [serialize_timeline_entry(item) for item in timeline_data],
+        'page': page_obj.number,
+        'num_pages': paginator.num_pages,
+        'total': paginator.count,
+        'has_next': page_obj.has_next(),
+        'sort': filters['sort'],
+    })
 # Basic workflow_chart view to resolve missing view error
 
 @login_required
@@ -131,9 +140,17 @@ def admin_machine_management(request):
     total_breakdowns = BatchPhaseExecution.objects.filter(breakdown_occurred=True).count()
     total_changeovers = BatchPhaseExecution.objects.filter(changeover_occurred=True).count()
     
+    # Availability, downtime and utilization over the selected window
+    try:
+        performance_days = min(max(int(request.GET.get('days', 7)), 1), 90)
+    except ValueError:
+        performance_days = 7
+    performance = get_machine_performance(days=performance_days, machines=all_machines)
+    
     context = {
         'page_title': 'Machine Management',
         'all_machines': all_machines,
+        'performance': performance,
         'recent_breakdowns': recent_breakdowns,
         'recent_changeovers': recent_changeovers,
         'total_breakdowns': total_breakdowns,
@@ -142,60 +159,15 @@ def admin_machine_management(request):
     
     return render(request, 'dashboards/admin_machine_management.html', context)
 
-@login_required
-def export_wip(request):
-    """Export Work in Progress data to Excel or CSV"""
-    if not request.user.is_staff:
-        messages.error(request, 'Access denied. Admin privileges required.')
-        return redirect('dashboards:dashboard_home')
-        
-    # Get filter parameters
-    export_format = request.GET.get('format', 'excel')
-    start_date = request.GET.get('start_date')
-    end_date = request.GET.get('end_date')
-    
-    # Get BMRs with active phases
-    active_phases = BatchPhaseExecution.objects.filter(status__in=['pending', 'in_progress']).select_related('bmr', 'phase')
-    active_bmr_ids = set(active_phases.values_list('bmr_id', flat=True))
-    
-    # Filter BMRs based on dates if provided
-    bmrs_query = BMR.objects.filter(id__in=active_bmr_ids).select_related('product')
-    
-    if start_date:
-        start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
-        bmrs_query = bmrs_query.filter(actual_start_date__gte=start_date)
-        
-    if end_date:
-        end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
-        end_date = datetime.combine(end_date, datetime.max.time())
-        bmrs_query = bmrs_query.filter(actual_start_date__lte=end_date)
-    
-    # Create a dict mapping BMR IDs to their active phases
-    bmr_active_phases = {}
-    for phase in active_phases:
-        if phase.bmr_id not in bmr_active_phases:
-            bmr_active_phases[phase.bmr_id] = phase
-    
-    # Process BMRs to add current phase and progress
-    work_in_progress_bmrs = []
-    for bmr in bmrs_query:
-        # Get BMR request information
-        from bmr.models import BMRRequest
-        bmr_request = BMRRequest.objects.filter(bmr=bmr).first()
-        
-        # Get the current phase from our pre-loaded dict
-        current_phase = bmr_active_phases.get(bmr.id)
-        
-        # Calculate progress percentage using aggregation for better performance
-        from django.db.models import Count, Q
-        phase_counts = BatchPhaseExecution.objects.filter(bmr=bmr).aggregate(
-            total=Count('id'),
-            completed=Count('id', filter=Q(status='completed'))
-        )
+def _wip_rows(bmrs_query):
+    """Work in progress export rows, read a chunk of BMRs at a time"""
+    for bmr in bmrs_query.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        # Latest BMR request (prefetched, newest first)
+        bmr_requests = bmr.bmr_requests.all()
+        bmr_request = bmr_requests[0] if bmr_requests else None
         
-        total_phases = phase_counts.get('total', 0)
-        completed_phases = phase_counts.get('completed', 0)
-        progress_percentage = int((completed_phases / total_phases) * 100) if total_phases > 0 else 0
+        current_phase = bmr.progress.current_execution
+        progress_percentage = bmr.progress.percent_complete
         
         # Calculate time since request
         time_since_request = 'N/A'
@@ -210,7 +182,7 @@ def export_wip(request):
                 time_since_request = f"{int(total_hours)}h"
         
         # Prepare data for export
-        wip_data = {
+        yield {
             'product_name': bmr.product.product_name,
             'batch_number': bmr.batch_number,
             'batch_size': bmr.actual_batch_size or bmr.product.standard_batch_size,
@@ -225,189 +197,136 @@ def export_wip(request):
             'started_date': bmr.actual_start_date.strftime('%Y-%m-%d') if bmr.actual_start_date else "N/A",
             'progress': f"{progress_percentage}%"
         }
-        work_in_progress_bmrs.append(wip_data)
+
+def _wip_csv_rows(work_in_progress_bmrs, start_date, end_date):
+    """Rows of the work in progress CSV: report header, then one row per BMR"""
+    # Write company name as main title
+    yield ['Kampala Pharmaceutical Industries']
+    
+    # Write Work In Progress Report subtitle
+    yield ['Work In Progress Report']
+    
+    # Write date range subtitle
+    date_range_text = ""
+    if start_date and end_date:
+        date_range_text = f"Period: {start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}"
+    elif start_date:
+        date_range_text = f"From: {start_date.strftime('%Y-%m-%d')}"
+    elif end_date:
+        date_range_text = f"To: {end_date.strftime('%Y-%m-%d')}"
+    yield [date_range_text]
+    
+    # Write report generation date
+    current_datetime = timezone.now().strftime("%Y-%m-%d %H:%M:%S")
+    yield [f'Report Generated: {current_datetime}']
+    
+    yield []  # Empty row for spacing
+    
+    # Write headers with BMR request information
+    yield ['Product Name', 'Batch Number', 'Request Date', 'Requested By', 'Priority', 'Time Since Request', 'Batch Size', 'Packaging Size', 'Current Phase', 'Status', 'Progress']
+    
+    for item in work_in_progress_bmrs:
+        yield [
+            item['product_name'],
+            item['batch_number'],
+            item['request_date'],
+            item['requested_by'],
+            item['request_priority'],
+            item['time_since_request'],
+            f"{item['batch_size']} {item['batch_size_unit']}",
+            item['pack_size'],
+            item['current_phase'],
+            "Approved",  # Status column to match example
+            item['progress']
+        ]
+
+def _wip_queryset(params):
+    """BMRs in production, filtered by start date; returns (bmrs_query, start_date, end_date)"""
+    start_date = params.get('start_date')
+    end_date = params.get('end_date')
+    
+    # Get BMRs with active phases from the progress summary
+    bmrs_query = BMR.objects.filter(
+        progress__current_execution__isnull=False
+    ).select_related(
+        'product', 'progress__current_execution__phase'
+    ).prefetch_related(
+        Prefetch('bmr_requests', queryset=BMRRequest.objects.select_related('requested_by'))
+    )
     
-    # Generate export file
-    if export_format == 'csv':
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = f'attachment; filename="KPI_Work_In_Progress_{timezone.now().strftime("%Y%m%d")}.csv"'
-        
-        writer = csv.writer(response)
-        
-        # Write company name as main title
-        writer.writerow(['Kampala Pharmaceutical Industries'])
-        
-        # Write Work In Progress Report subtitle
-        writer.writerow(['Work In Progress Report'])
-        
-        # Write date range subtitle
-        date_range_text = ""
-        if start_date and end_date:
-            date_range_text = f"Period: {start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}"
-        elif start_date:
-            date_range_text = f"From: {start_date.strftime('%Y-%m-%d')}"
-        elif end_date:
-            date_range_text = f"To: {end_date.strftime('%Y-%m-%d')}"
-        writer.writerow([date_range_text])
-        
-        # Write report generation date
-        current_datetime = timezone.now().strftime("%Y-%m-%d %H:%M:%S")
-        writer.writerow([f'Report Generated: {current_datetime}'])
-        
-        writer.writerow([])  # Empty row for spacing
-        
-        # Write headers with BMR request information
-        writer.writerow(['Product Name', 'Batch Number', 'Request Date', 'Requested By', 'Priority', 'Time Since Request', 'Batch Size', 'Packaging Size', 'Current Phase', 'Status', 'Progress'])
-        
-        for item in work_in_progress_bmrs:
-            writer.writerow([
-                item['product_name'],
-                item['batch_number'],
-                item['request_date'],
-                item['requested_by'],
-                item['request_priority'],
-                item['time_since_request'],
-                f"{item['batch_size']} {item['batch_size_unit']}",
-                item['pack_size'],
-                item['current_phase'],
-                "Approved",  # Status column to match example
-                item['progress']
-            ])
+    if start_date:
+        start_date = datetime.strptime(start_date, '%Y-%m-%d').date()
+        bmrs_query = bmrs_query.filter(actual_start_date__gte=start_date)
         
-        return response
+    if end_date:
+        end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
+        end_date = datetime.combine(end_date, datetime.max.time())
+        bmrs_query = bmrs_query.filter(actual_start_date__lte=end_date)
     
-    else:  # Excel format
-        response = HttpResponse(content_type='application/ms-excel')
-        response['Content-Disposition'] = f'attachment; filename="KPI_Work_In_Progress_{timezone.now().strftime("%Y%m%d")}.xls"'
-        
-        wb = xlwt.Workbook(encoding='utf-8')
-        ws = wb.add_sheet('Work in Progress')
-        
-        # Set up border styles - using slightly thicker borders for better visibility
-        borders = xlwt.Borders()
-        borders.left = xlwt.Borders.THIN
-        borders.right = xlwt.Borders.THIN
-        borders.top = xlwt.Borders.THIN
-        borders.bottom = xlwt.Borders.THIN
-        borders.left_colour = xlwt.Style.colour_map['black']
-        borders.right_colour = xlwt.Style.colour_map['black']
-        borders.top_colour = xlwt.Style.colour_map['black']
-        borders.bottom_colour = xlwt.Style.colour_map['black']
-        
-        # Company title
-        title_style = xlwt.XFStyle()
-        title_style.font.bold = True
-        title_style.font.height = 280  # Font size 14
-        title_style.font.name = 'Calibri'
-        title_style.alignment.horz = xlwt.Alignment.HORZ_CENTER
-        
-        row_num = 0
-        ws.write_merge(row_num, row_num, 0, 6, "Kampala Pharmaceutical Industries", title_style)
-        
-        # First subtitle - Work In Progress Report
-        row_num += 1
-        subtitle_style = xlwt.XFStyle()
-        subtitle_style.font.bold = True
-        subtitle_style.font.name = 'Calibri'
-        subtitle_style.font.height = 260  # Font size 13
-        subtitle_style.alignment.horz = xlwt.Alignment.HORZ_CENTER
-        
-        # Add Work In Progress Report subtitle
-        ws.write_merge(row_num, row_num, 0, 6, "Work In Progress Report", subtitle_style)
-        
-        # Second subtitle - Date range
-        row_num += 1
-        date_style = xlwt.XFStyle()
-        date_style.font.name = 'Calibri'
-        date_style.alignment.horz = xlwt.Alignment.HORZ_CENTER
-        
-        # Create date range text based on filters
-        date_range_text = ""
-        if start_date and end_date:
-            date_range_text = f"Period: {start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}"
-        elif start_date:
-            date_range_text = f"From: {start_date.strftime('%Y-%m-%d')}"
-        elif end_date:
-            date_range_text = f"To: {end_date.strftime('%Y-%m-%d')}"
-        
-        # Write date range with date_style
-        ws.write_merge(row_num, row_num, 0, 6, date_range_text, date_style)
-        
-        # Third subtitle - Report Generation Date
-        row_num += 1
-        generation_style = xlwt.XFStyle()
-        generation_style.font.name = 'Calibri'
-        generation_style.font.italic = True  # Italic text
-        generation_style.font.height = 220  # Font size 11
-        generation_style.alignment.horz = xlwt.Alignment.HORZ_CENTER
-        
-        # Generate current date time string
-        current_datetime = timezone.now().strftime("%Y-%m-%d %H:%M:%S")
-        period_text = f"Report Generated: {current_datetime}"
-        ws.write_merge(row_num, row_num, 0, 6, period_text, generation_style)
-        
-        # Add space after report generation date
-        row_num += 1
-        
-        # Table header with exact dark blue background from attachment
-        header_style = xlwt.XFStyle()
-        header_style.font.bold = True
-        header_style.font.name = 'Calibri'
-        header_style.font.colour_index = xlwt.Style.colour_map['white']
-        
-        # Set custom dark blue background color (from attachment)
-        pattern = xlwt.Pattern()
-        pattern.pattern = xlwt.Pattern.SOLID_PATTERN
-        
-        # Creating a custom dark blue color (RGB: 0, 66, 89) - matching the attachment
-        xlwt.add_palette_colour("custom_dark_blue", 0x21)
-        wb.set_colour_RGB(0x21, 0, 66, 89)
-        pattern.pattern_fore_colour = 0x21
-        header_style.pattern = pattern
-        
-        # Add borders to headers
-        header_style.borders = borders
-        header_style.alignment.horz = xlwt.Alignment.HORZ_CENTER
-        
-        columns = ['Product Name', 'Batch Number', 'Request Date', 'Requested By', 'Priority', 'Time Since Request', 'Batch Size', 'Packaging Size', 'Current Phase', 'Status', 'Progress']
-        
-        for col_num in range(len(columns)):
-            ws.write(row_num, col_num, columns[col_num], header_style)
-            # Set column width
-            ws.col(col_num).width = 256 * 20  # 20 characters wide
-            
-        # Sheet body, remaining rows - no alternating colors, just borders
-        cell_style = xlwt.XFStyle()
-        cell_style.borders = borders
-        cell_style.font.name = 'Calibri'
-        
-        # Centered style for some columns
-        centered_style = xlwt.XFStyle()
-        centered_style.borders = borders
-        centered_style.font.name = 'Calibri'
-        centered_style.alignment.horz = xlwt.Alignment.HORZ_CENTER
-        
-        for idx, item in enumerate(work_in_progress_bmrs):
-            row_num += 1
-            # Use consistent styles without alternating colors
-            row_style = cell_style
-            centered_row_style = centered_style
-            
-            # Write data with borders on all cells including BMR request information
-            ws.write(row_num, 0, item['product_name'], row_style)  # Product Name
-            ws.write(row_num, 1, item['batch_number'], centered_row_style)  # Batch Number centered
-            ws.write(row_num, 2, item['request_date'], centered_row_style)  # Request Date
-            ws.write(row_num, 3, item['requested_by'], row_style)  # Requested By
-            ws.write(row_num, 4, item['request_priority'], centered_row_style)  # Priority
-            ws.write(row_num, 5, item['time_since_request'], centered_row_style)  # Time Since Request
-            ws.write(row_num, 6, f"{item['batch_size']} {item['batch_size_unit']}", row_style)  # Batch Size
-            ws.write(row_num, 7, item['pack_size'], centered_row_style)  # Packaging Size centered
-            ws.write(row_num, 8, item['current_phase'], row_style)  # Current Phase
-            ws.write(row_num, 9, "Approved", centered_row_style)  # Status column, matching example
-            ws.write(row_num, 10, item['progress'], centered_row_style)  # Progress centered
-        
-        wb.save(response)
-        return response
+    return bmrs_query, start_date, end_date
+
+@login_required
+def export_wip(request):
+    """Export Work in Progress data to Excel or CSV"""
+    if not request.user.is_staff:
+        messages.error(request, 'Access denied. Admin privileges required.')
+        return redirect('dashboards:dashboard_home')
+    
+    # CSV streams straight away; the Excel workbook is built by the export worker
+    if request.GET.get('format', 'excel') == 'csv':
+        bmrs_query, start_date, end_date = _wip_queryset(request.GET)
+        return streaming_csv_response(
+            _wip_csv_rows(_wip_rows(bmrs_query), start_date, end_date),
+            f'KPI_Work_In_Progress_{timezone.now().strftime("%Y%m%d")}.csv',
+        )
+    return queue_export(request, 'wip_excel')
+
+def build_wip_excel(request):
+    """Work in Progress Excel workbook, built by the export worker"""
+    bmrs_query, start_date, end_date = _wip_queryset(request.GET)
+    
+    # Create date range text based on filters
+    date_range_text = ""
+    if start_date and end_date:
+        date_range_text = f"Period: {start_date.strftime('%Y-%m-%d')} to {end_date.strftime('%Y-%m-%d')}"
+    elif start_date:
+        date_range_text = f"From: {start_date.strftime('%Y-%m-%d')}"
+    elif end_date:
+        date_range_text = f"To: {end_date.strftime('%Y-%m-%d')}"
+    
+    columns = ['Product Name', 'Batch Number', 'Request Date', 'Requested By', 'Priority', 'Time Since Request', 'Batch Size', 'Packaging Size', 'Current Phase', 'Status', 'Progress']
+    
+    # Dark blue table header (RGB 0, 66, 89)
+    book = Spreadsheet(styles={'wip_header': {**STYLES['header'], 'fill': solid_fill('004259')}})
+    ws = book.add_sheet(
+        'Work in Progress',
+        widths=[20] * len(columns),
+        merged=[f"A{row}:G{row}" for row in range(1, 5)],
+    )
+    ws.append(["Kampala Pharmaceutical Industries"], style='title')
+    ws.append(["Work In Progress Report"], style='subtitle')
+    ws.append([date_range_text], style='centered')
+    ws.append([f"Report Generated: {timezone.localtime().strftime('%Y-%m-%d %H:%M:%S')}"], style='note')
+    ws.append(columns, style='wip_header')
+    
+    # Sheet body - no alternating colors, just borders; short values centered
+    centered_columns = {index: 'centered' for index in (1, 2, 4, 5, 7, 9, 10)}
+    for item in _wip_rows(bmrs_query):
+        ws.append([
+            item['product_name'],
+            item['batch_number'],
+            item['request_date'],
+            item['requested_by'],
+            item['request_priority'],
+            item['time_since_request'],
+            f"{item['batch_size']} {item['batch_size_unit']}",
+            item['pack_size'],
+            item['current_phase'],
+            "Approved",  # Status column, matching example
+            item['progress'],
+        ], style='cell', styles=centered_columns)
+    
+    return book.response(f'KPI_Work_In_Progress_{timezone.now().strftime("%Y%m%d")}.xlsx')
 
 @login_required
 def admin_quality_control(request):
@@ -533,6 +452,15 @@ def admin_system_health(request):
         'products_count': Product.objects.count(),
     }
     
+    # Dashboard section cache effectiveness
+    cache_stats = section_stats()
+    
+    # Write queue: lock waits and busy retries
+    write_stats = writer_stats()
+    
+    # Scheduled maintenance: last duration and outcome of each task
+    maintenance_tasks = MaintenanceTask.objects.all()
+    
     # System logs
     from django.contrib.admin.models import LogEntry
     recent_logs = LogEntry.objects.select_related('user', 'content_type').order_by('-action_time')[:50]
@@ -541,6 +469,9 @@ def admin_system_health(request):
         'page_title': 'System Health',
         'system_info': system_info,
         'db_stats': db_stats,
+        'cache_stats': cache_stats,
+        'write_stats': write_stats,
+        'maintenance_tasks': maintenance_tasks,
         'recent_logs': recent_logs,
     }
     
@@ -563,7 +494,6 @@ from django.views.decorators.http import require_http_methods
 from django.core.paginator import Paginator
 from django.db.models.functions import Coalesce
 import csv
-import xlwt
 from bmr.models import BMR
 from workflow.models import BatchPhaseExecution, Machine
 from workflow.services import WorkflowService
@@ -613,61 +543,88 @@ def admin_dashboard(request):
         messages.error(request, 'Access denied. Admin privileges required.')
         return redirect('dashboards:dashboard_home')
     
+    from fgs_management.models import FGSInventory, ProductRelease, FGSAlert
+    from quarantine.models import QuarantineBatch, SampleRequest
+    
+    # === DASHBOARD COUNTERS ===
+    # All statistic cards, answered with one aggregate query per model
+    now = timezone.now()
+    today = now.date()
+    qc_phase_names = ['post_compression_qc', 'post_mixing_qc', 'post_blending_qc']
+    common_phases = ['mixing', 'drying', 'granulation', 'compression', 'packing']
+    
+    counters = {
+        # BMRs
+        'total_bmrs': Counter(BMR),
+        'active_batches': Counter(BMR, status__in=['draft', 'approved', 'in_production']),
+        'completed_batches': Counter(BMR, status='completed'),
+        'rejected_batches': Counter(BMR, status='rejected'),
+        
+        # Users
+        'total_users': Counter(CustomUser),
+        'active_users_count': Counter(CustomUser, is_active=True, last_login__gte=now - timedelta(days=30)),
+        
+        # Phase executions
+        'phases_completed_today': Counter(BatchPhaseExecution, completed_date__date=today),
+        'total_breakdowns': Counter(BatchPhaseExecution, breakdown_occurred=True),
+        'total_changeovers': Counter(BatchPhaseExecution, changeover_occurred=True),
+        'breakdowns_today': Counter(BatchPhaseExecution, breakdown_occurred=True, breakdown_start_time__date=today),
+        'changeovers_today': Counter(BatchPhaseExecution, changeover_occurred=True, changeover_start_time__date=today),
+        'qc_passed': Counter(BatchPhaseExecution, phase__phase_name__in=qc_phase_names, status='completed'),
+        'qc_failed': Counter(BatchPhaseExecution, phase__phase_name__in=qc_phase_names, status='failed'),
+        'qc_pending': Counter(BatchPhaseExecution, phase__phase_name__in=qc_phase_names, status='in_progress'),
+        'fgs_completed': Counter(BatchPhaseExecution, phase__phase_name='finished_goods_store', status='completed'),
+        'fgs_pending': Counter(BatchPhaseExecution, phase__phase_name='finished_goods_store', status='pending'),
+        'fgs_in_progress': Counter(BatchPhaseExecution, phase__phase_name='finished_goods_store', status='in_progress'),
+        'pending_approvals': Counter(BatchPhaseExecution, phase__phase_name='regulatory_approval', status='pending'),
+        'failed_phases': Counter(BatchPhaseExecution, status='failed', completed_date__date=today),
+        'in_production': Counter(BatchPhaseExecution, status='in_progress'),
+        'quality_hold': Counter(BatchPhaseExecution, phase__phase_name__contains='qc', status='pending'),
+        'awaiting_packaging': Counter(BatchPhaseExecution, phase__phase_name='packaging_material_release', status='pending'),
+        'final_qa_pending': Counter(BatchPhaseExecution, phase__phase_name='final_qa', status='pending'),
+        'in_fgs': Counter(BatchPhaseExecution, phase__phase_name='finished_goods_store', status__in=['completed', 'in_progress']),
+        
+        # Machines
+        'total_machines': Counter(Machine),
+        'active_machines': Counter(Machine, is_active=True),
+        
+        # Finished goods store
+        'available_for_sale': Counter(FGSInventory, status='available'),
+        'recent_releases': Counter(ProductRelease, release_date__gte=now - timedelta(days=7)),
+        'active_alerts': Counter(FGSAlert, is_resolved=False),
+        
+        # Quarantine
+        'total_quarantine_batches': Counter(QuarantineBatch),
+        'pending_qa_samples': Counter(SampleRequest, sample_date__isnull=True),  # No sample taken yet = pending QA
+        'pending_qc_samples': Counter(SampleRequest, sample_date__isnull=False, qc_status='pending'),  # Sampled by QA, QC not completed
+        'approved_samples_today': Counter(SampleRequest, qc_status='approved', approved_date__date=today),
+        'rejected_samples_today': Counter(SampleRequest, qc_status='failed', approved_date__date=today),
+    }
+    for phase_name in common_phases:
+        counters[f"{phase_name}_completed"] = Counter(
+            BatchPhaseExecution, phase__phase_name__icontains=phase_name, status='completed'
+        )
+        counters[f"{phase_name}_inprogress"] = Counter(
+            BatchPhaseExecution, phase__phase_name__icontains=phase_name, status__in=['pending', 'in_progress']
+        )
+    stats = cached_section(
+        'admin_counters', lambda: count_stats(**counters),
+        sources=['phase', 'quarantine', 'sample', 'fgs', 'release'], role='admin', timeout=120, stale_for=60,
+    )
+    
     # === CORE BMR STATISTICS ===
-    total_bmrs = BMR.objects.count()
-    active_batches = BMR.objects.filter(status__in=['draft', 'approved', 'in_production']).count()
-    completed_batches = BMR.objects.filter(status='completed').count()
-    rejected_batches = BMR.objects.filter(status='rejected').count()
+    total_bmrs = stats['total_bmrs']
+    active_batches = stats['active_batches']
+    completed_batches = stats['completed_batches']
+    rejected_batches = stats['rejected_batches']
     
     # === USER MANAGEMENT DATA ===
-    total_users = CustomUser.objects.count()
-    active_users_count = CustomUser.objects.filter(is_active=True, last_login__gte=timezone.now() - timedelta(days=30)).count()
+    total_users = stats['total_users']
+    active_users_count = stats['active_users_count']
     recent_users = CustomUser.objects.filter(is_active=True).order_by('-date_joined')[:10]
     
     # === BMR TIMELINE DATA ===
-    bmrs = BMR.objects.select_related('product', 'created_by', 'approved_by').all()
-    timeline_data = []
-    
-    for bmr in bmrs:
-        phases = BatchPhaseExecution.objects.filter(bmr=bmr).select_related('phase').order_by('phase__phase_order')
-        bmr_created = bmr.created_date
-        fgs_completed = phases.filter(
-            phase__phase_name='finished_goods_store',
-            status='completed'
-        ).first()
-        
-        total_time_days = None
-        if fgs_completed and fgs_completed.completed_date:
-            total_time_days = (fgs_completed.completed_date - bmr_created).days
-            
-        phase_timeline = []
-        for phase in phases:
-            phase_data = {
-                'phase_name': phase.phase.phase_name.replace('_', ' ').title(),
-                'status': phase.status.title(),
-                'started_date': phase.started_date,
-                'completed_date': phase.completed_date,
-                'started_by': phase.started_by.get_full_name() if phase.started_by else None,
-                'completed_by': phase.completed_by.get_full_name() if phase.completed_by else None,
-                'duration_hours': None,
-                'operator_comments': getattr(phase, 'operator_comments', '') or '',
-                'phase_order': phase.phase.phase_order if hasattr(phase.phase, 'phase_order') else 0,
-            }
-            if phase.started_date and phase.completed_date:
-                duration = phase.completed_date - phase.started_date
-                phase_data['duration_hours'] = round(duration.total_seconds() / 3600, 2)
-            elif phase.started_date and not phase.completed_date:
-                duration = timezone.now() - phase.started_date
-                phase_data['duration_hours'] = round(duration.total_seconds() / 3600, 2)
-            phase_timeline.append(phase_data)
-            
-        timeline_data.append({
-            'bmr': bmr,
-            'total_time_days': total_time_days,
-            'phase_timeline': phase_timeline,
-            'current_phase': phases.filter(status__in=['pending', 'in_progress']).first(),
-            'is_completed': fgs_completed is not None,
-        })
+    timeline_data = build_bmr_timelines(BMR.objects.all())
     
     # Timeline summary stats
     completed_count = sum(1 for item in timeline_data if item['is_completed'])
@@ -677,9 +634,7 @@ def admin_dashboard(request):
     completed_times = [item['total_time_days'] for item in timeline_data if item['total_time_days']]
     
     # Count phases completed today for Live BMR Tracking
-    phases_completed_today = BatchPhaseExecution.objects.filter(
-        completed_date__date=timezone.now().date()
-    ).count()
+    phases_completed_today = stats['phases_completed_today']
     avg_production_time = round(sum(completed_times) / len(completed_times)) if completed_times else None
     
     # === ACTIVE PHASES DATA ===
@@ -696,45 +651,27 @@ def admin_dashboard(request):
             phase._duration_hours = 0
             
     # === WORK IN PROGRESS DATA ===
-    # Get BMRs with active phases
-    active_bmr_ids = set(active_phases.values_list('bmr_id', flat=True))
-    work_in_progress_bmrs = BMR.objects.filter(
-        id__in=active_bmr_ids
-    ).select_related('product')
-    
-    # Create a dict mapping BMR IDs to their active phases
-    bmr_active_phases = {}
-    for phase in active_phases:
-        if phase.bmr_id not in bmr_active_phases:
-            bmr_active_phases[phase.bmr_id] = phase
+    # Get BMRs with active phases from the progress summary
+    work_in_progress_bmrs = list(BMR.objects.filter(
+        progress__current_execution__isnull=False
+    ).select_related(
+        'product', 'progress__current_execution__phase'
+    ).prefetch_related(
+        Prefetch('bmr_requests', queryset=BMRRequest.objects.select_related('requested_by'))
+    ))
     
     for bmr in work_in_progress_bmrs:
-        # Get BMR request information
-        from bmr.models import BMRRequest
-        bmr_request = BMRRequest.objects.filter(bmr=bmr).first()
-        
-        # Get the current phase from our pre-loaded dict
-        current_phase = bmr_active_phases.get(bmr.id)
+        # Latest BMR request (prefetched, newest first)
+        bmr_requests = bmr.bmr_requests.all()
+        bmr_request = bmr_requests[0] if bmr_requests else None
         
+        current_phase = bmr.progress.current_execution
         if current_phase and current_phase.phase:
             bmr.current_phase_name = current_phase.phase.phase_name.replace('_', ' ').title()
         else:
             bmr.current_phase_name = "Awaiting Production"
         
-        # Calculate progress percentage
-        from django.db.models import Count, Q
-        phase_counts = BatchPhaseExecution.objects.filter(bmr=bmr).aggregate(
-            total=Count('id'),
-            completed=Count('id', filter=Q(status='completed'))
-        )
-        
-        total_phases = phase_counts.get('total', 0)
-        completed_phases = phase_counts.get('completed', 0)
-        
-        if total_phases > 0:
-            bmr.progress_percentage = int((completed_phases / total_phases) * 100)
-        else:
-            bmr.progress_percentage = 0
+        bmr.progress_percentage = bmr.progress.percent_complete
             
         # Add BMR request information for tracking
         bmr.request_date = bmr_request.request_date if bmr_request else None
@@ -773,21 +710,9 @@ def admin_dashboard(request):
     
     # === PHASE COMPLETION DATA FOR CHARTS ===
     phase_data = {}
-    common_phases = ['mixing', 'drying', 'granulation', 'compression', 'packing']
-    
     for phase_name in common_phases:
-        completed = BatchPhaseExecution.objects.filter(
-            phase__phase_name__icontains=phase_name,
-            status='completed'
-        ).count()
-        
-        in_progress = BatchPhaseExecution.objects.filter(
-            phase__phase_name__icontains=phase_name,
-            status__in=['pending', 'in_progress']
-        ).count()
-        
-        phase_data[f"{phase_name}_completed"] = completed
-        phase_data[f"{phase_name}_inprogress"] = in_progress
+        phase_data[f"{phase_name}_completed"] = stats[f"{phase_name}_completed"]
+        phase_data[f"{phase_name}_inprogress"] = stats[f"{phase_name}_inprogress"]
     
     # === MACHINE MANAGEMENT DATA ===
     all_machines = Machine.objects.all().order_by('machine_type', 'name')
@@ -804,44 +729,36 @@ def admin_dashboard(request):
     ).select_related('machine_used', 'bmr').order_by('-changeover_start_time')[:20]
     
     # Count breakdowns and changeovers
-    total_breakdowns = BatchPhaseExecution.objects.filter(breakdown_occurred=True).count()
-    total_changeovers = BatchPhaseExecution.objects.filter(changeover_occurred=True).count()
+    total_breakdowns = stats['total_breakdowns']
+    total_changeovers = stats['total_changeovers']
     
     # Today's events
-    today = timezone.now().date()
-    breakdowns_today = BatchPhaseExecution.objects.filter(
-        breakdown_occurred=True,
-        breakdown_start_time__date=today
-    ).count()
-    changeovers_today = BatchPhaseExecution.objects.filter(
-        changeover_occurred=True,
-        changeover_start_time__date=today
-    ).count()
+    breakdowns_today = stats['breakdowns_today']
+    changeovers_today = stats['changeovers_today']
     
-    # Machine statistics
+    # Machine statistics (all-time counts plus availability over the last week)
+    usage_counts = machine_usage_counts()
+    performance = get_machine_performance(days=7, machines=all_machines)
     machine_stats = {}
-    for machine in all_machines:
-        usage_count = BatchPhaseExecution.objects.filter(machine_used=machine).count()
-        breakdown_count = BatchPhaseExecution.objects.filter(
-            machine_used=machine,
-            breakdown_occurred=True
-        ).count()
-        changeover_count = BatchPhaseExecution.objects.filter(
-            machine_used=machine,
-            changeover_occurred=True
-        ).count()
-        
+    for row in performance['machines']:
+        machine = row['machine']
+        counts = usage_counts.get(machine.id, {})
+        usage_count = counts.get('usage_count', 0)
+        breakdown_count = counts.get('breakdown_count', 0)
         machine_stats[machine.id] = {
             'machine': machine,
             'usage_count': usage_count,
             'breakdown_count': breakdown_count,
-            'changeover_count': changeover_count,
-            'breakdown_rate': round((breakdown_count / usage_count * 100), 1) if usage_count > 0 else 0
+            'changeover_count': counts.get('changeover_count', 0),
+            'breakdown_rate': round((breakdown_count / usage_count * 100), 1) if usage_count > 0 else 0,
+            'availability': row['availability'],
+            'utilization': row['utilization'],
+            'downtime_minutes': row['downtime_minutes'],
         }
     
     # === QUALITY CONTROL DATA ===
     qc_phases = BatchPhaseExecution.objects.filter(
-        phase__phase_name__in=['post_compression_qc', 'post_mixing_qc', 'post_blending_qc']
+        phase__phase_name__in=qc_phase_names
     ).select_related('bmr__product', 'phase', 'started_by', 'completed_by').order_by('-started_date')
     
     # Categorize QC tests
@@ -850,9 +767,9 @@ def admin_dashboard(request):
     pending_tests = qc_phases.filter(status='in_progress')
     
     qc_stats = {
-        'passed_tests': passed_tests.count(),
-        'failed_tests': failed_tests.count(),
-        'pending_tests': pending_tests.count(),
+        'passed_tests': stats['qc_passed'],
+        'failed_tests': stats['qc_failed'],
+        'pending_tests': stats['qc_pending'],
     }
     
     # Detailed QC test data for clickable cards
@@ -863,80 +780,37 @@ def admin_dashboard(request):
     }
     
     # === FGS (FINISHED GOODS STORAGE) DATA ===
-    # Import FGS models if available
-    try:
-        from fgs_management.models import FGSInventory, ProductRelease, FGSAlert
-        
-        fgs_phases = BatchPhaseExecution.objects.filter(
-            phase__phase_name='finished_goods_store'
-        ).select_related('bmr__product', 'started_by', 'completed_by').order_by('-started_date')
-        
-        fgs_stats = {
-            'total_in_store': fgs_phases.filter(status='completed').count(),
-            'pending_storage': fgs_phases.filter(status='pending').count(),
-            'being_stored': fgs_phases.filter(status='in_progress').count(),
-            'available_for_sale': FGSInventory.objects.filter(status='available').count(),
-            'recent_releases': ProductRelease.objects.filter(
-                release_date__gte=timezone.now() - timedelta(days=7)
-            ).count(),
-            'active_alerts': FGSAlert.objects.filter(is_resolved=False).count(),
-        }
-    except ImportError:
-        # Fallback if FGS models not available
-        fgs_stats = {
-            'total_in_store': 156,
-            'pending_storage': 12,
-            'being_stored': 8,
-            'available_for_sale': 89,
-            'recent_releases': 5,
-            'active_alerts': 2,
-        }
+    fgs_stats = {
+        'total_in_store': stats['fgs_completed'],
+        'pending_storage': stats['fgs_pending'],
+        'being_stored': stats['fgs_in_progress'],
+        'available_for_sale': stats['available_for_sale'],
+        'recent_releases': stats['recent_releases'],
+        'active_alerts': stats['active_alerts'],
+    }
     
     # === SYSTEM HEALTH DATA ===
-    pending_approvals = BatchPhaseExecution.objects.filter(
-        phase__phase_name='regulatory_approval',
-        status='pending'
-    ).count()
-    
-    failed_phases = BatchPhaseExecution.objects.filter(
-        status='failed',
-        completed_date__date=timezone.now().date()
-    ).count()
+    pending_approvals = stats['pending_approvals']
+    failed_phases = stats['failed_phases']
     
     # Production metrics
     production_stats = {
-        'in_production': BatchPhaseExecution.objects.filter(
-            status='in_progress'
-        ).count(),
-        'quality_hold': BatchPhaseExecution.objects.filter(
-            phase__phase_name__contains='qc',
-            status='pending'
-        ).count(),
-        'awaiting_packaging': BatchPhaseExecution.objects.filter(
-            phase__phase_name='packaging_material_release',
-            status='pending'
-        ).count(),
-        'final_qa_pending': BatchPhaseExecution.objects.filter(
-            phase__phase_name='final_qa',
-            status='pending'
-        ).count(),
-        'in_fgs': BatchPhaseExecution.objects.filter(
-            phase__phase_name='finished_goods_store',
-            status__in=['completed', 'in_progress']
-        ).count(),
+        'in_production': stats['in_production'],
+        'quality_hold': stats['quality_hold'],
+        'awaiting_packaging': stats['awaiting_packaging'],
+        'final_qa_pending': stats['final_qa_pending'],
+        'in_fgs': stats['in_fgs'],
     }
     
     # === ADDITIONAL DATA FOR DASHBOARD ===
     recent_bmrs = BMR.objects.select_related('product', 'created_by').order_by('-created_date')[:20]
     
     # Calculate machine utilization
-    total_machines = all_machines.count()
-    active_machines = all_machines.filter(is_active=True).count()
+    total_machines = stats['total_machines']
+    active_machines = stats['active_machines']
     machine_utilization = round((active_machines / total_machines * 100), 1) if total_machines > 0 else 0
     
     # === QUARANTINE MONITORING DATA ===
-    from quarantine.models import QuarantineBatch, SampleRequest
-    
     # Get all quarantine batches with their sample requests
     quarantine_batches = QuarantineBatch.objects.select_related(
         'bmr__product',
@@ -960,44 +834,14 @@ def admin_dashboard(request):
     ).order_by('-request_date')[:15]
     
     # Calculate quarantine statistics
-    total_quarantine_batches = QuarantineBatch.objects.count()
-    pending_qa_samples = SampleRequest.objects.filter(
-        sample_date__isnull=True  # No sample taken yet = pending QA
-    ).count()
-    pending_qc_samples = SampleRequest.objects.filter(
-        sample_date__isnull=False,  # Sample taken by QA
-        qc_status='pending'  # But QC not completed
-    ).count()
-    approved_samples_today = SampleRequest.objects.filter(
-        qc_status='approved',
-        approved_date__date=timezone.now().date()
-    ).count()
-    rejected_samples_today = SampleRequest.objects.filter(
-        qc_status='failed',
-        approved_date__date=timezone.now().date()
-    ).count()
-    
     quarantine_stats = {
-        'total_quarantine_batches': total_quarantine_batches,
-        'pending_qa_samples': pending_qa_samples,
-        'pending_qc_samples': pending_qc_samples,
-        'approved_samples_today': approved_samples_today,
-        'rejected_samples_today': rejected_samples_today,
-        'avg_qa_processing_time': SampleRequest.objects.filter(
-            sample_date__isnull=False  # QA processing completed
-        ).aggregate(
-            avg_time=models.Avg(
-                models.F('sample_date') - models.F('request_date')
-            )
-        )['avg_time'],
-        'avg_qc_processing_time': SampleRequest.objects.filter(
-            approved_date__isnull=False,  # QC decision made
-            received_date__isnull=False   # QC received sample
-        ).aggregate(
-            avg_time=models.Avg(
-                models.F('approved_date') - models.F('received_date')
-            )
-        )['avg_time']
+        'total_quarantine_batches': stats['total_quarantine_batches'],
+        'pending_qa_samples': stats['pending_qa_samples'],
+        'pending_qc_samples': stats['pending_qc_samples'],
+        'approved_samples_today': stats['approved_samples_today'],
+        'rejected_samples_today': stats['rejected_samples_today'],
+        # Averaged over the stored stage durations, in hours
+        **SampleRequest.processing_times(),
     }
     
     # Productivity metrics
@@ -1005,22 +849,20 @@ def admin_dashboard(request):
         role__in=['mixing_operator', 'compression_operator', 'granulation_operator', 'packing_operator']
     )
     
-    top_operators = []
-    for operator in operators:
-        completed_phases = BatchPhaseExecution.objects.filter(
-            completed_by=operator,
-            status='completed'
-        ).count()
-        
-        if completed_phases > 0:
-            top_operators.append({
-                'name': operator.get_full_name(),
-                'completions': completed_phases,
-                'role': operator.get_role_display()
-            })
-    
-    top_operators.sort(key=lambda x: x['completions'], reverse=True)
-    top_operators = top_operators[:10]
+    top_rows = OperatorDailyStats.objects.filter(
+        operator__in=operators, completions__gt=0
+    ).values('operator').annotate(
+        completions=Sum('completions')
+    ).order_by('-completions')[:10]
+    top_users = CustomUser.objects.in_bulk([row['operator'] for row in top_rows])
+    top_operators = [
+        {
+            'name': top_users[row['operator']].get_full_name(),
+            'completions': row['completions'],
+            'role': top_users[row['operator']].get_role_display()
+        }
+        for row in top_rows
+    ]
     
     productivity_metrics = {
         'top_operators': top_operators,
@@ -1126,81 +968,103 @@ def qa_dashboard(request):
         
         if phase_id and action in ['start', 'approve', 'reject']:
             try:
-                phase_execution = get_object_or_404(BatchPhaseExecution, pk=phase_id)
+                phase_execution = get_object_or_404(BatchPhaseExecution.objects.select_related('phase', 'bmr__product'), pk=phase_id)
+                
+                version = posted_version(request)
                 
                 if action == 'start':
                     # Start the Final QA review process
-                    phase_execution.status = 'in_progress'
-                    phase_execution.started_by = request.user
-                    phase_execution.started_date = timezone.now()
-                    phase_execution.operator_comments = f"Final QA review started by {request.user.get_full_name()}. Notes: {comments}"
-                    phase_execution.save()
+                    phase_execution.transition(
+                        'in_progress', expected_version=version,
+                        started_by=request.user,
+                        started_date=timezone.now(),
+                        operator_comments=f"Final QA review started by {request.user.get_full_name()}. Notes: {comments}",
+                    )
                     
                     messages.success(request, f'Final QA review started for batch {phase_execution.bmr.batch_number}. You can now complete the review.')
                 
                 elif action == 'approve':
                     # Complete Final QA with approval
-                    phase_execution.status = 'completed'
-                    phase_execution.completed_by = request.user
-                    phase_execution.completed_date = timezone.now()
-                    phase_execution.operator_comments += f"\nFinal QA Approved by {request.user.get_full_name()}. Comments: {comments}"
-                    phase_execution.save()
-                    
-                    # Trigger next phase in workflow (should be finished goods store)
-                    WorkflowService.trigger_next_phase(phase_execution.bmr, phase_execution.phase)
+                    with write_transaction():
+                        phase_execution.transition(
+                            'completed', expected_version=version,
+                            completed_by=request.user,
+                            completed_date=timezone.now(),
+                            operator_comments=f"{phase_execution.operator_comments or ''}\nFinal QA Approved by {request.user.get_full_name()}. Comments: {comments}",
+                        )
+                        
+                        # Trigger next phase in workflow (should be finished goods store)
+                        WorkflowService.trigger_next_phase(phase_execution.bmr, phase_execution.phase)
                     
                     messages.success(request, f'Final QA approved for batch {phase_execution.bmr.batch_number}. Batch is ready for finished goods storage.')
                     
                 elif action == 'reject':
                     # Complete Final QA with rejection
-                    phase_execution.status = 'failed'
-                    phase_execution.completed_by = request.user
-                    phase_execution.completed_date = timezone.now()
-                    phase_execution.operator_comments += f"\nFinal QA Rejected by {request.user.get_full_name()}. Rejection Reason: {comments}"
-                    phase_execution.save()
+                    with write_transaction():
+                        phase_execution.transition(
+                            'failed', expected_version=version,
+                            completed_by=request.user,
+                            completed_date=timezone.now(),
+                            operator_comments=f"{phase_execution.operator_comments or ''}\nFinal QA Rejected by {request.user.get_full_name()}. Rejection Reason: {comments}",
+                        )
                     
-                    # Rollback to appropriate packing phase based on product type
-                    bmr = phase_execution.bmr
-                    product_type = bmr.product.product_type
+                        # Rollback to appropriate packing phase based on product type
+                        bmr = phase_execution.bmr
+                        product_type = bmr.product.product_type
                     
-                    # Determine which packing phase to rollback to based on product type
-                    if product_type == 'tablet':
-                        if hasattr(bmr.product, 'tablet_type') and bmr.product.tablet_type == 'tablet_2':
-                            rollback_phase = 'bulk_packing'
-                        else:
+                        # Determine which packing phase to rollback to based on product type
+                        if product_type == 'tablet':
+                            if hasattr(bmr.product, 'tablet_type') and bmr.product.tablet_type == 'tablet_2':
+                                rollback_phase = 'bulk_packing'
+                            else:
+                                rollback_phase = 'blister_packing'
+                        elif product_type == 'capsule':
                             rollback_phase = 'blister_packing'
-                    elif product_type == 'capsule':
-                        rollback_phase = 'blister_packing'
-                    elif product_type == 'ointment':
-                        rollback_phase = 'secondary_packaging'
-                    else:
-                        rollback_phase = 'secondary_packaging'  # default
+                        elif product_type == 'ointment':
+                            rollback_phase = 'secondary_packaging'
+                        else:
+                            rollback_phase = 'secondary_packaging'  # default
                     
-                    # Find and activate the appropriate packing phase for rework
-                    rollback_execution = BatchPhaseExecution.objects.filter(
-                        bmr=bmr,
-                        phase__phase_name=rollback_phase
-                    ).first()
+                        # Find and activate the appropriate packing phase for rework
+                        rollback_execution = BatchPhaseExecution.objects.filter(
+                            bmr=bmr,
+                            phase__phase_name=rollback_phase
+                        ).select_related('phase').order_by().first()
                     
-                    if rollback_execution:
-                        rollback_execution.status = 'pending'
-                        rollback_execution.operator_comments = f"Returned for rework due to Final QA rejection. Reason: {comments}. Original comments: {rollback_execution.operator_comments}"
-                        rollback_execution.save()
+                        if rollback_execution:
+                            BatchPhaseExecution.bulk_transition({rollback_execution: 'pending'}, values={rollback_execution: {
+                                'operator_comments': f"Returned for rework due to Final QA rejection. Reason: {comments}. Original comments: {rollback_execution.operator_comments}",
+                            }})
                         
-                        messages.warning(request, f'Final QA rejected for batch {bmr.batch_number}. Batch has been sent back to {rollback_phase.replace("_", " ").title()} for rework.')
-                    else:
-                        messages.error(request, f'Could not find {rollback_phase} phase to rollback to for batch {bmr.batch_number}.')
+                            messages.warning(request, f'Final QA rejected for batch {bmr.batch_number}. Batch has been sent back to {rollback_phase.replace("_", " ").title()} for rework.')
+                        else:
+                            messages.error(request, f'Could not find {rollback_phase} phase to rollback to for batch {bmr.batch_number}.')
                     
+            except PhaseConflict as conflict:
+                messages.warning(request, f'{conflict}. Please reload and try again.')
             except Exception as e:
                 messages.error(request, f'Error processing Final QA: {str(e)}')
         
         return redirect('dashboards:qa_dashboard')
     
-    # Get QA-specific data
-    total_bmrs = BMR.objects.count()
-    draft_bmrs = BMR.objects.filter(status='draft').count()
-    submitted_bmrs = BMR.objects.filter(status='submitted').count()
-    my_bmrs = BMR.objects.filter(created_by=request.user).count()
+    # Get QA-specific data (BMR and request changes are not versioned, hence the short timeout)
+    stats = cached_section(
+        'qa_counters',
+        lambda: count_stats(
+            total_bmrs=Counter(BMR),
+            draft_bmrs=Counter(BMR, status='draft'),
+            submitted_bmrs=Counter(BMR, status='submitted'),
+            my_bmrs=Counter(BMR, created_by=request.user),
+            requests_pending=Counter(BMRRequest, status='pending'),
+            requests_approved=Counter(BMRRequest, status='approved'),
+            requests_rejected=Counter(BMRRequest, status='rejected'),
+        ),
+        sources=['phase'], user=request.user, timeout=60,
+    )
+    total_bmrs = stats['total_bmrs']
+    draft_bmrs = stats['draft_bmrs']
+    submitted_bmrs = stats['submitted_bmrs']
+    my_bmrs = stats['my_bmrs']
     
     # Recent BMRs created by this user
     recent_bmrs = BMR.objects.filter(created_by=request.user).select_related('product').order_by('-created_date')[:5]
@@ -1217,15 +1081,12 @@ def qa_dashboard(request):
         status='in_progress'
     ).select_related('bmr', 'phase')[:10]
     
-    # Import BMRRequest model
-    from bmr.models import BMRRequest
-    
     # Get BMR requests data
     bmr_requests_pending = BMRRequest.objects.filter(status='pending').select_related('product', 'requested_by').order_by('-request_date')[:5]
     bmr_request_counts = {
-        'pending': BMRRequest.objects.filter(status='pending').count(),
-        'approved': BMRRequest.objects.filter(status='approved').count(),
-        'rejected': BMRRequest.objects.filter(status='rejected').count(),
+        'pending': stats['requests_pending'],
+        'approved': stats['requests_approved'],
+        'rejected': stats['requests_rejected'],
     }
     
     # Build operator history for this user: only regulatory approval phases completed by this user
@@ -1253,7 +1114,7 @@ def qa_dashboard(request):
         ).order_by('-request_date')[:10]
         
         quarantine_samples_processed_today = SampleRequest.objects.filter(
-            sample_date__date=timezone.now().date()  # Processed by QA today
+            **_today('sample_date')  # Processed by QA today
         ).select_related(
             'quarantine_batch__bmr__product',
             'quarantine_batch__bmr'
@@ -1422,13 +1283,8 @@ def store_dashboard(request):
         return redirect('dashboards:store_dashboard')
     
     # Get all BMRs
-    all_bmrs = BMR.objects.select_related('product', 'created_by').all()
-    
     # Get raw material release phases this user can work on
-    my_phases = []
-    for bmr in all_bmrs:
-        user_phases = WorkflowService.get_phases_for_user_role(bmr, request.user.role)
-        my_phases.extend(user_phases)
+    my_phases = list(WorkflowService.get_work_queue(request.user))
     
     # Statistics
     stats = {
@@ -1436,7 +1292,7 @@ def store_dashboard(request):
         'in_progress_phases': len([p for p in my_phases if p.status == 'in_progress']),
         'completed_today': BatchPhaseExecution.objects.filter(
             completed_by=request.user,
-            completed_date__date=timezone.now().date()
+            **_today('completed_date')
         ).count(),
         'total_batches': len(set([p.bmr for p in my_phases])),
     }
@@ -1479,7 +1335,7 @@ def operator_dashboard(request):
         
         if phase_id and action in ['start', 'complete']:
             try:
-                phase_execution = get_object_or_404(BatchPhaseExecution, pk=phase_id)
+                phase_execution = get_object_or_404(BatchPhaseExecution.objects.select_related('phase', 'bmr__product'), pk=phase_id)
                 
                 if action == 'start':
                     # Check if machine selection is required for this phase
@@ -1503,30 +1359,31 @@ def operator_dashboard(request):
                         messages.error(request, f'Cannot start {phase_execution.phase.phase_name} for batch {phase_execution.bmr.batch_number} - prerequisites not met.')
                         return redirect(request.path)
                     
-                    phase_execution.status = 'in_progress'
-                    phase_execution.started_by = request.user
-                    phase_execution.started_date = timezone.now()
-                    phase_execution.operator_comments = f"Started by {request.user.get_full_name()}. Notes: {comments}"
+                    fields = {
+                        'started_by': request.user,
+                        'started_date': timezone.now(),
+                        'operator_comments': f"Started by {request.user.get_full_name()}. Notes: {comments}",
+                    }
                     
                     # Set machine if provided
                     if machine_id:
                         try:
-                            machine = Machine.objects.get(id=machine_id, is_active=True)
-                            phase_execution.machine_used = machine
+                            fields['machine_used'] = Machine.objects.get(id=machine_id, is_active=True)
                         except Machine.DoesNotExist:
                             messages.error(request, 'Selected machine not found or inactive.')
                             return redirect(request.path)
                     
-                    phase_execution.save()
+                    phase_execution.transition('in_progress', expected_version=posted_version(request), **fields)
                     
                     machine_info = f" using {phase_execution.machine_used.name}" if phase_execution.machine_used else ""
                     messages.success(request, f'Phase {phase_execution.phase.phase_name}{machine_info} started for batch {phase_execution.bmr.batch_number}.')
                     
                 elif action == 'complete':
-                    phase_execution.status = 'completed'
-                    phase_execution.completed_by = request.user
-                    phase_execution.completed_date = timezone.now()
-                    phase_execution.operator_comments = f"Completed by {request.user.get_full_name()}. Notes: {comments}"
+                    fields = {
+                        'completed_by': request.user,
+                        'completed_date': timezone.now(),
+                        'operator_comments': f"Completed by {request.user.get_full_name()}. Notes: {comments}",
+                    }
                     
                     # Only handle breakdown/changeover for production phases (not material dispensing)
                     phase_name = phase_execution.phase.phase_name
@@ -1534,29 +1391,30 @@ def operator_dashboard(request):
                     
                     if phase_name not in exclude_breakdown_phases:
                         # Handle breakdown tracking
-                        phase_execution.breakdown_occurred = breakdown_occurred
+                        fields['breakdown_occurred'] = breakdown_occurred
                         if breakdown_occurred and breakdown_start_time and breakdown_end_time:
                             from datetime import datetime
                             try:
-                                phase_execution.breakdown_start_time = datetime.fromisoformat(breakdown_start_time.replace('T', ' '))
-                                phase_execution.breakdown_end_time = datetime.fromisoformat(breakdown_end_time.replace('T', ' '))
+                                fields['breakdown_start_time'] = datetime.fromisoformat(breakdown_start_time.replace('T', ' '))
+                                fields['breakdown_end_time'] = datetime.fromisoformat(breakdown_end_time.replace('T', ' '))
                             except ValueError:
                                 messages.warning(request, 'Invalid breakdown time format. Breakdown recorded without times.')
                         
                         # Handle changeover tracking
-                        phase_execution.changeover_occurred = changeover_occurred
+                        fields['changeover_occurred'] = changeover_occurred
                         if changeover_occurred and changeover_start_time and changeover_end_time:
                             from datetime import datetime
                             try:
-                                phase_execution.changeover_start_time = datetime.fromisoformat(changeover_start_time.replace('T', ' '))
-                                phase_execution.changeover_end_time = datetime.fromisoformat(changeover_end_time.replace('T', ' '))
+                                fields['changeover_start_time'] = datetime.fromisoformat(changeover_start_time.replace('T', ' '))
+                                fields['changeover_end_time'] = datetime.fromisoformat(changeover_end_time.replace('T', ' '))
                             except ValueError:
                                 messages.warning(request, 'Invalid changeover time format. Changeover recorded without times.')
                     
-                    phase_execution.save()
-                    
-                    # Trigger next phase in workflow
-                    WorkflowService.trigger_next_phase(phase_execution.bmr, phase_execution.phase)
+                    with write_transaction():
+                        phase_execution.transition('completed', expected_version=posted_version(request), **fields)
+                        
+                        # Trigger next phase in workflow
+                        WorkflowService.trigger_next_phase(phase_execution.bmr, phase_execution.phase)
                     
                     completion_msg = f'Phase {phase_execution.phase.phase_name} completed for batch {phase_execution.bmr.batch_number}.'
                     if breakdown_occurred:
@@ -1566,27 +1424,37 @@ def operator_dashboard(request):
                     
                     messages.success(request, completion_msg)
                     
+            except PhaseConflict as conflict:
+                messages.warning(request, f'{conflict}. Please reload and try again.')
             except Exception as e:
                 messages.error(request, f'Error processing phase: {str(e)}')
         
         return redirect(request.path)  # Redirect to same dashboard
     
     # Get phases this user can work on
-    all_bmrs = BMR.objects.select_related('product', 'created_by').all()
-    my_phases = []
-    
-    for bmr in all_bmrs:
-        user_phases = WorkflowService.get_phases_for_user_role(bmr, request.user.role)
-        my_phases.extend(user_phases)
+    my_phases = list(WorkflowService.get_work_queue(request.user))
+    
+    # Totals from the operator's daily rollups
+    operator_totals = cached_section(
+        'operator_totals',
+        lambda: {
+            **request.user.daily_stats.aggregate(
+                completed_today=Sum('completions', filter=Q(day=timezone.localdate())),
+                completions=Sum('completions'),
+                attempts=Sum('attempts'),
+                active_minutes=Sum('active_minutes'),
+                timed_completions=Sum('timed_completions'),
+            ),
+            'batches': OperatorBatchDay.counts(request.user.pk)['handled'],
+        },
+        sources=['phase'], user=request.user,
+    )
     
     # Statistics
     stats = {
         'pending_phases': len([p for p in my_phases if p.status == 'pending']),
         'in_progress_phases': len([p for p in my_phases if p.status == 'in_progress']),
-        'completed_today': BatchPhaseExecution.objects.filter(
-            completed_by=request.user,
-            completed_date__date=timezone.now().date()
-        ).count(),
+        'completed_today': operator_totals['completed_today'] or 0,
         'total_batches': len(set([p.bmr for p in my_phases])),
     }
 
@@ -1625,16 +1493,12 @@ def operator_dashboard(request):
     ]
 
     # Operator Statistics
-    # Use .distinct() before slicing for batches_handled
-    batches_handled = completed_phases_qs.values('bmr').distinct().count()
-    total_completed = completed_phases_qs.count()
-    total_attempted = BatchPhaseExecution.objects.filter(started_by=request.user).count()
+    batches_handled = operator_totals['batches'] or 0
+    total_completed = operator_totals['completions'] or 0
+    total_attempted = operator_totals['attempts'] or 0
     success_rate = round((total_completed / total_attempted) * 100, 1) if total_attempted else 0
-    completion_times = [
-        (p.completed_date - p.started_date).total_seconds() / 60
-        for p in completed_phases if p.completed_date and p.started_date
-    ]
-    avg_completion_time = f"{round(sum(completion_times)/len(completion_times), 1)} min" if completion_times else "-"
+    timed_completions = operator_totals['timed_completions']
+    avg_completion_time = f"{round(operator_totals['active_minutes'] / timed_completions, 1)} min" if timed_completions else "-"
     assignment_status = "You have assignments pending." if stats['pending_phases'] > 0 else "All assignments up to date."
     operator_stats = {
         'batches_handled': batches_handled,
@@ -1744,39 +1608,46 @@ def qc_dashboard(request):
         
         if phase_id and action in ['start', 'pass', 'fail']:
             try:
-                phase_execution = get_object_or_404(BatchPhaseExecution, pk=phase_id)
+                phase_execution = get_object_or_404(BatchPhaseExecution.objects.select_related('phase', 'bmr__product'), pk=phase_id)
+                
+                version = posted_version(request)
                 
                 if action == 'start':
                     # Start QC testing
-                    phase_execution.status = 'in_progress'
-                    phase_execution.started_by = request.user
-                    phase_execution.started_date = timezone.now()
-                    phase_execution.operator_comments = f"QC Testing started by {request.user.get_full_name()}. Notes: {test_results}"
-                    phase_execution.save()
+                    phase_execution.transition(
+                        'in_progress', expected_version=version,
+                        started_by=request.user,
+                        started_date=timezone.now(),
+                        operator_comments=f"QC Testing started by {request.user.get_full_name()}. Notes: {test_results}",
+                    )
                     
                     messages.success(request, f'QC testing started for batch {phase_execution.bmr.batch_number}.')
                 
                 elif action == 'pass':
-                    phase_execution.status = 'completed'
-                    phase_execution.completed_by = request.user
-                    phase_execution.completed_date = timezone.now()
-                    phase_execution.operator_comments = f"QC Test Passed by {request.user.get_full_name()}. Results: {test_results}"
-                    phase_execution.save()
-                    
-                    # Trigger next phase in workflow
-                    WorkflowService.trigger_next_phase(phase_execution.bmr, phase_execution.phase)
+                    with write_transaction():
+                        phase_execution.transition(
+                            'completed', expected_version=version,
+                            completed_by=request.user,
+                            completed_date=timezone.now(),
+                            operator_comments=f"QC Test Passed by {request.user.get_full_name()}. Results: {test_results}",
+                        )
+                        
+                        # Trigger next phase in workflow
+                        WorkflowService.trigger_next_phase(phase_execution.bmr, phase_execution.phase)
                     
                     messages.success(request, f'QC test passed for batch {phase_execution.bmr.batch_number}.')
                     
                 elif action == 'fail':
-                    phase_execution.status = 'failed'
-                    phase_execution.completed_by = request.user
-                    phase_execution.completed_date = timezone.now()
-                    phase_execution.operator_comments = f"QC Test Failed by {request.user.get_full_name()}. Results: {test_results}"
-                    phase_execution.save()
-                    
-                    # Rollback to previous phase and get the specific phase name
-                    rollback_phase_name = WorkflowService.rollback_to_previous_phase(phase_execution.bmr, phase_execution.phase)
+                    with write_transaction():
+                        phase_execution.transition(
+                            'failed', expected_version=version,
+                            completed_by=request.user,
+                            completed_date=timezone.now(),
+                            operator_comments=f"QC Test Failed by {request.user.get_full_name()}. Results: {test_results}",
+                        )
+                        
+                        # Rollback to previous phase and get the specific phase name
+                        rollback_phase_name = WorkflowService.rollback_to_previous_phase(phase_execution.bmr, phase_execution.phase)
                     
                     if rollback_phase_name:
                         # Format phase name for display
@@ -1785,21 +1656,16 @@ def qc_dashboard(request):
                     else:
                         messages.error(request, f'QC test failed for batch {phase_execution.bmr.batch_number}. Rollback failed - please contact administrator.')
                     
+            except PhaseConflict as conflict:
+                messages.warning(request, f'{conflict}. Please reload and try again.')
             except Exception as e:
                 messages.error(request, f'Error processing QC test: {str(e)}')
         
         return redirect('dashboards:qc_dashboard')
     
     # Get all BMRs
-    all_bmrs = BMR.objects.select_related('product', 'created_by').all()
-    
-    # Get QC phases this user can work on - EXCLUDE failed and completed tests
-    my_phases = []
-    for bmr in all_bmrs:
-        user_phases = WorkflowService.get_phases_for_user_role(bmr, request.user.role)
-        # Filter out failed and completed QC tests so they don't reappear
-        filtered_phases = [p for p in user_phases if p.status in ['pending', 'in_progress']]
-        my_phases.extend(filtered_phases)
+    # Get QC phases this user can work on - failed and completed tests are not in the queue
+    my_phases = list(WorkflowService.get_work_queue(request.user))
     
     # Statistics
     stats = {
@@ -1807,7 +1673,7 @@ def qc_dashboard(request):
         'in_testing': len([p for p in my_phases if p.status == 'in_progress']),
         'passed_today': BatchPhaseExecution.objects.filter(
             completed_by=request.user,
-            completed_date__date=timezone.now().date(),
+            **_today('completed_date'),
             status='completed'
         ).count(),
         'failed_this_week': BatchPhaseExecution.objects.filter(
@@ -1861,7 +1727,7 @@ def packaging_dashboard(request):
         
         if phase_id and action in ['start', 'complete']:
             try:
-                phase_execution = get_object_or_404(BatchPhaseExecution, pk=phase_id)
+                phase_execution = get_object_or_404(BatchPhaseExecution.objects.select_related('phase', 'bmr__product'), pk=phase_id)
                 
                 if action == 'start':
                     # Validate that the phase can actually be started
@@ -1903,13 +1769,8 @@ def packaging_dashboard(request):
         return redirect('dashboards:packaging_dashboard')
     
     # Get all BMRs
-    all_bmrs = BMR.objects.select_related('product', 'created_by').all()
-    
     # Get packaging phases this user can work on
-    my_phases = []
-    for bmr in all_bmrs:
-        user_phases = WorkflowService.get_phases_for_user_role(bmr, request.user.role)
-        my_phases.extend(user_phases)
+    my_phases = list(WorkflowService.get_work_queue(request.user))
     
     # Statistics
     stats = {
@@ -1917,7 +1778,7 @@ def packaging_dashboard(request):
         'in_progress_phases': len([p for p in my_phases if p.status == 'in_progress']),
         'completed_today': BatchPhaseExecution.objects.filter(
             completed_by=request.user,
-            completed_date__date=timezone.now().date()
+            **_today('completed_date')
         ).count(),
         'total_batches': len(set([p.bmr for p in my_phases])),
     }
@@ -1990,7 +1851,7 @@ def packing_dashboard(request):
         
         if phase_id and action in ['start', 'complete']:
             try:
-                phase_execution = get_object_or_404(BatchPhaseExecution, pk=phase_id)
+                phase_execution = get_object_or_404(BatchPhaseExecution.objects.select_related('phase', 'bmr__product'), pk=phase_id)
                 
                 if action == 'start':
                     # Validate that the phase can actually be started
@@ -2062,13 +1923,8 @@ def packing_dashboard(request):
         return redirect('dashboards:packing_dashboard')
     
     # Get all BMRs
-    all_bmrs = BMR.objects.all()
-    
     # Get packing phases this user can work on
-    my_phases = []
-    for bmr in all_bmrs:
-        user_phases = WorkflowService.get_phases_for_user_role(bmr, request.user.role)
-        my_phases.extend(user_phases)
+    my_phases = list(WorkflowService.get_work_queue(request.user))
     
     # Statistics
     stats = {
@@ -2078,7 +1934,7 @@ def packing_dashboard(request):
         'in_progress_packing': len([p for p in my_phases if p.status == 'in_progress']),  # For template compatibility
         'completed_today': BatchPhaseExecution.objects.filter(
             completed_by=request.user,
-            completed_date__date=timezone.now().date()
+            **_today('completed_date')
         ).count(),
         'total_batches': len(set([p.bmr for p in my_phases])),
     }
@@ -2138,6 +1994,66 @@ def packing_dashboard(request):
     
     return render(request, 'dashboards/packing_dashboard.html', context)
 
+BULK_ACTION_LIMIT = 100
+
+
+def _bulk_action_items(request):
+    """(action, {execution id: expected version or None}, comments, machine id) from a JSON or form POST"""
+    if request.content_type == 'application/json':
+        payload = json.loads(request.body or b'{}')
+        if not isinstance(payload, dict):
+            raise TypeError('The request body must be a JSON object')
+        items = payload.get('executions') or []
+        if not isinstance(items, list):
+            raise TypeError('executions must be a list')
+    else:
+        payload = request.POST
+        items = request.POST.getlist('execution_id')
+    versions = {}
+    for item in items:
+        if isinstance(item, dict):
+            versions[int(item['id'])] = int(item['version']) if item.get('version') not in (None, '') else None
+        elif isinstance(item, (int, str)) and not isinstance(item, bool):
+            versions[int(item)] = None
+        else:
+            raise TypeError(f"Not an execution: {item!r}")
+    comments = payload.get('comments', '')
+    if not isinstance(comments, str):
+        raise TypeError('comments must be text')
+    machine_id = payload.get('machine_id')
+    return payload.get('action'), versions, comments, int(machine_id) if machine_id not in (None, '') else None
+
+
+@login_required
+@require_POST
+def bulk_phase_action(request):
+    """Start or complete several phase executions in one request, answering with a JSON result per execution"""
+    try:
+        action, versions, comments, machine_id = _bulk_action_items(request)
+    except (ValueError, TypeError, KeyError):
+        return JsonResponse({'error': 'Malformed request.'}, status=400)
+    if action not in WorkflowService.BULK_ACTIONS:
+        return JsonResponse({'error': f"Unknown action: {action}"}, status=400)
+    if not versions:
+        return JsonResponse({'error': 'No phases selected.'}, status=400)
+    if len(versions) > BULK_ACTION_LIMIT:
+        return JsonResponse({'error': f"At most {BULK_ACTION_LIMIT} phases can be processed at once."}, status=400)
+    
+    machine = None
+    if machine_id:
+        machine = Machine.objects.filter(pk=machine_id, is_active=True).first()
+        if machine is None:
+            return JsonResponse({'error': 'Selected machine not found or inactive.'}, status=400)
+    
+    results = WorkflowService.bulk_phase_action(request.user, action, versions, comments=comments, machine=machine)
+    applied = sum(1 for result in results if result['ok'])
+    return JsonResponse({
+        'action': action,
+        'applied': applied,
+        'failed': len(results) - applied,
+        'results': results,
+    })
+
 @login_required
 def finished_goods_dashboard(request):
     """Finished Goods Store Dashboard with Inventory Management"""
@@ -2151,15 +2067,8 @@ def finished_goods_dashboard(request):
     from datetime import timedelta
     
     # Get all BMRs
-    all_bmrs = BMR.objects.select_related('product', 'created_by').all()
-    
-    # Get phases this user can work on
-    my_phases = []
-    for bmr in all_bmrs:
-        user_phases = WorkflowService.get_phases_for_user_role(bmr, request.user.role)
-        my_phases.extend(user_phases)
-    # Only show finished_goods_store phases
-    my_phases = [p for p in my_phases if getattr(p.phase, 'phase_name', None) == 'finished_goods_store']
+    # Get finished_goods_store phases this user can work on
+    my_phases = list(WorkflowService.get_work_queue(request.user, phase_names=['finished_goods_store']))
     
     # Get all finished goods store phases for history statistics
     all_fgs_phases = BatchPhaseExecution.objects.filter(
@@ -2262,7 +2171,7 @@ def finished_goods_dashboard(request):
         'completed_today': BatchPhaseExecution.objects.filter(
             phase__phase_name='finished_goods_store',
             status='completed',
-            completed_date__date=timezone.now().date()
+            **_today('completed_date')
         ).count(),
         'total_batches': all_fgs_phases.values('bmr').distinct().count(),
         'daily_history': daily_completions,
@@ -2368,6 +2277,8 @@ def admin_fgs_monitor(request):
     from django.utils import timezone
     from datetime import timedelta
     
+    change_seq = ChangeEvent.latest_sequence()
+    
     # Get finished goods storage phases
     fgs_phases = BatchPhaseExecution.objects.filter(
         phase__phase_name='finished_goods_store'
@@ -2378,30 +2289,51 @@ def admin_fgs_monitor(request):
     fgs_in_progress = fgs_phases.filter(status='in_progress') 
     fgs_completed = fgs_phases.filter(status='completed')
     
-    # FGS Inventory Statistics
-    total_inventory_items = FGSInventory.objects.count()
-    available_for_sale = FGSInventory.objects.filter(status='available').count()
-    
-    # Recent releases (last 7 days)
-    recent_releases_count = ProductRelease.objects.filter(
-        release_date__gte=timezone.now() - timedelta(days=7)
-    ).count()
-    
-    # Active alerts
-    active_alerts_count = FGSAlert.objects.filter(is_resolved=False).count()
+    # Weekly production trend windows (last 4 weeks)
+    today = timezone.now().date()
+    start_date = today - timezone.timedelta(days=28)
+    weeks = []
+    for i in range(4):
+        week_start = start_date + timezone.timedelta(days=i*7)
+        week_end = week_start + timezone.timedelta(days=6)
+        weeks.append((f"{week_start.strftime('%d %b')} - {week_end.strftime('%d %b')}", week_start, week_end))
+    
+    qc_phase_names = ['post_compression_qc', 'post_mixing_qc', 'post_blending_qc']
+    counters = {
+        'total_in_store': Counter(BatchPhaseExecution, phase__phase_name='finished_goods_store', status='completed'),
+        'pending_storage': Counter(BatchPhaseExecution, phase__phase_name='finished_goods_store', status='pending'),
+        'being_stored': Counter(BatchPhaseExecution, phase__phase_name='finished_goods_store', status='in_progress'),
+        'qc_passed': Counter(BatchPhaseExecution, phase__phase_name__in=qc_phase_names, status='completed'),
+        'qc_failed': Counter(BatchPhaseExecution, phase__phase_name__in=qc_phase_names, status='failed'),
+        'total_inventory_items': Counter(FGSInventory),
+        'available_for_sale': Counter(FGSInventory, status='available'),
+        'recent_releases': Counter(ProductRelease, release_date__gte=timezone.now() - timedelta(days=7)),
+        'active_alerts': Counter(FGSAlert, is_resolved=False),
+    }
+    for index, (week_label, week_start, week_end) in enumerate(weeks):
+        counters[f"week_{index}"] = Counter(
+            BatchPhaseExecution,
+            phase__phase_name='finished_goods_store',
+            status='completed',
+            completed_date__date__range=[week_start, week_end]
+        )
+    stats = cached_section(
+        'fgs_counters', lambda: count_stats(**counters),
+        sources=['phase', 'fgs', 'release'], role='admin', stale_for=60,
+    )
     
     # Statistics
     fgs_stats = {
-        'total_in_store': fgs_completed.count(),
-        'pending_storage': fgs_pending.count(),
-        'being_stored': fgs_in_progress.count(),
-        'storage_capacity_used': min(100, (fgs_completed.count() / max(1000, 1)) * 100),  # Assuming 1000 batch capacity
+        'total_in_store': stats['total_in_store'],
+        'pending_storage': stats['pending_storage'],
+        'being_stored': stats['being_stored'],
+        'storage_capacity_used': min(100, (stats['total_in_store'] / max(1000, 1)) * 100),  # Assuming 1000 batch capacity
         
         # New inventory statistics
-        'total_inventory_items': total_inventory_items,
-        'available_for_sale': available_for_sale,
-        'recent_releases': recent_releases_count,
-        'active_alerts': active_alerts_count,
+        'total_inventory_items': stats['total_inventory_items'],
+        'available_for_sale': stats['available_for_sale'],
+        'recent_releases': stats['recent_releases'],
+        'active_alerts': stats['active_alerts'],
     }
     
     # Recent storage activity
@@ -2432,29 +2364,22 @@ def admin_fgs_monitor(request):
     ).order_by('bmr__product__product_type', '-latest_storage')
     
     # Get production data by product type
-    product_type_data = {}
-    completed_bmrs = BatchPhaseExecution.objects.filter(
-        phase__phase_name='finished_goods_store',
-        status='completed'
-    ).select_related('bmr__product')
-    
-    for execution in completed_bmrs:
-        product_type = execution.bmr.product.product_type
-        if product_type not in product_type_data:
-            product_type_data[product_type] = 0
-        product_type_data[product_type] += 1
+    product_type_data = {
+        row['bmr__product__product_type']: row['count']
+        for row in fgs_completed.order_by().values('bmr__product__product_type').annotate(count=Count('id'))
+    }
     
     # Get phase completion status across all batches
     phase_completion = {}
-    all_phases = BatchPhaseExecution.objects.values('phase__phase_name').distinct()
-    for phase_dict in all_phases:
-        phase_name = phase_dict['phase__phase_name']
+    phase_rows = BatchPhaseExecution.objects.order_by().values('phase__phase_name').annotate(
+        total=Count('id'),
+        completed=Count('id', filter=Q(status='completed'))
+    )
+    for row in phase_rows:
+        phase_name = row['phase__phase_name']
         if phase_name:
-            total = BatchPhaseExecution.objects.filter(phase__phase_name=phase_name).count()
-            completed = BatchPhaseExecution.objects.filter(
-                phase__phase_name=phase_name,
-                status='completed'
-            ).count()
+            total = row['total']
+            completed = row['completed']
             if total > 0:  # Avoid division by zero
                 completion_rate = (completed / total) * 100
             else:
@@ -2466,31 +2391,15 @@ def admin_fgs_monitor(request):
             }
     
     # Get weekly production trend
-    today = timezone.now().date()
-    start_date = today - timezone.timedelta(days=28)  # Last 4 weeks
-    
-    weekly_completions = {}
-    for i in range(4):  # 4 weeks
-        week_start = start_date + timezone.timedelta(days=i*7)
-        week_end = week_start + timezone.timedelta(days=6)
-        week_label = f"{week_start.strftime('%d %b')} - {week_end.strftime('%d %b')}"
-        
-        weekly_completions[week_label] = BatchPhaseExecution.objects.filter(
-            phase__phase_name='finished_goods_store',
-            status='completed',
-            completed_date__date__range=[week_start, week_end]
-        ).count()
+    weekly_completions = {
+        week_label: stats[f"week_{index}"]
+        for index, (week_label, week_start, week_end) in enumerate(weeks)
+    }
     
     # QC pass/fail data
     qc_stats = {
-        'passed': BatchPhaseExecution.objects.filter(
-            phase__phase_name__in=['post_compression_qc', 'post_mixing_qc', 'post_blending_qc'],
-            status='completed'
-        ).count(),
-        'failed': BatchPhaseExecution.objects.filter(
-            phase__phase_name__in=['post_compression_qc', 'post_mixing_qc', 'post_blending_qc'],
-            status='failed'
-        ).count()
+        'passed': stats['qc_passed'],
+        'failed': stats['qc_failed'],
     }
     
     context = {
@@ -2510,6 +2419,8 @@ def admin_fgs_monitor(request):
         'recent_inventory': recent_inventory,
         'recent_releases': recent_releases,
         'active_alerts': active_alerts,
+        'change_seq': change_seq,
+        'change_feed_stream': settings.CHANGE_FEED_STREAM,
     }
     
     return render(request, 'dashboards/admin_fgs_monitor.html', context)
@@ -2521,78 +2432,115 @@ def live_tracking_view(request):
         messages.error(request, 'Access denied. Admin privileges required.')
         return redirect('dashboards:dashboard_home')
 
-    bmrs = BMR.objects.select_related('product', 'created_by', 'approved_by').all()
-    timeline_data = []
-    from workflow.models import BatchPhaseExecution
-    for bmr in bmrs:
-        phases = BatchPhaseExecution.objects.filter(bmr=bmr).select_related('phase').order_by('phase__phase_order')
-        phase_timeline = []
-        for phase in phases:
-            phase_data = {
-                'phase_name': phase.phase.phase_name.replace('_', ' ').title(),
-                'status': phase.status.title(),
-                'started_date': phase.started_date,
-                'completed_date': phase.completed_date,
-                'started_by': phase.started_by.get_full_name() if phase.started_by else None,
-                'duration_hours': None,
-                'duration_formatted': None,
-            }
-            if phase.started_date and phase.completed_date:
-                duration = phase.completed_date - phase.started_date
-                total_hours = duration.total_seconds() / 3600
-                phase_data['duration_hours'] = round(total_hours, 2)
-                
-                # Format duration in hours and minutes
-                hours = int(total_hours)
-                minutes = int((total_hours - hours) * 60)
-                if hours > 0:
-                    phase_data['duration_formatted'] = f"{hours}h {minutes}m"
-                else:
-                    phase_data['duration_formatted'] = f"{minutes}m"
-            elif phase.started_date and not phase.completed_date:
-                from django.utils import timezone
-                duration = timezone.now() - phase.started_date
-                total_hours = duration.total_seconds() / 3600
-                phase_data['duration_hours'] = round(total_hours, 2)
-                
-                # Format duration in hours and minutes
-                hours = int(total_hours)
-                minutes = int((total_hours - hours) * 60)
-                if hours > 0:
-                    phase_data['duration_formatted'] = f"{hours}h {minutes}m (ongoing)"
-                else:
-                    phase_data['duration_formatted'] = f"{minutes}m (ongoing)"
-            phase_timeline.append(phase_data)
-        # Calculate total production time for this BMR
-        total_production_time = None
-        bmr_creation_date = bmr.created_date
-        
-        # Find the finished goods store phase
-        fgs_phase = next((p for p in phase_timeline if p['phase_name'] == 'Finished Goods Store' and p['status'] == 'Completed'), None)
-        
-        if bmr_creation_date and fgs_phase and fgs_phase['completed_date']:
-            # Calculate total production time
-            total_duration = fgs_phase['completed_date'] - bmr_creation_date
-            total_hours = total_duration.total_seconds() / 3600
-            
-            # Format total production time
-            days = int(total_hours // 24)
-            hours = int(total_hours % 24)
-            minutes = int((total_hours % 1) * 60)
-            
-            if days > 0:
-                total_production_time = f"{days}d {hours}h {minutes}m"
-            elif hours > 0:
-                total_production_time = f"{hours}h {minutes}m"
-            else:
-                total_production_time = f"{minutes}m"
-        
-        timeline_data.append({
-            'bmr': bmr,
-            'phase_timeline': phase_timeline,
-            'total_production_time': total_production_time,
-        })
-    return render(request, 'dashboards/live_tracking.html', {'timeline_data': timeline_data, 'dashboard_title': 'Live BMR Tracking'})
+    # Taken before the page data so no change can fall between the two
+    change_seq = ChangeEvent.latest_sequence()
+    timeline_data = build_bmr_timelines(BMR.objects.all())
+    return render(request, 'dashboards/live_tracking.html', {
+        'timeline_data': timeline_data,
+        'dashboard_title': 'Live BMR Tracking',
+        'change_seq': change_seq,
+        'change_feed_stream': settings.CHANGE_FEED_STREAM,
+    })
+
+
+@login_required
+def change_feed(request):
+    """Polling fallback for the change feed: events after ?since=<seq>"""
+    since = parse_sequence(request.GET.get('since'))
+    if since is None:
+        # No position yet, tell the client where the feed currently ends
+        return JsonResponse({'events': [], 'last_seq': ChangeEvent.latest_sequence(), 'has_more': False})
+
+    limit = 500
+    events = list(ChangeEvent.since(since, parse_sources(request.GET.get('source')), limit=limit))
+    return JsonResponse({
+        'events': [event.as_dict() for event in events],
+        'last_seq': events[-1].sequence if events else since,
+        'has_more': len(events) == limit,
+    })
+
+
+@login_required
+def change_feed_stream(request):
+    """Server-Sent Events stream of the change feed, when enabled in the settings"""
+    if not settings.CHANGE_FEED_STREAM:
+        # EventSource does not reconnect after a 204; the client polls instead
+        return HttpResponse(status=204)
+    since = parse_sequence(request.headers.get('Last-Event-ID') or request.GET.get('since'))
+    if since is None:
+        since = ChangeEvent.latest_sequence()
+
+    response = StreamingHttpResponse(
+        stream_events(since, parse_sources(request.GET.get('source'))),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def _export_job_for(request, pk):
+    """An export job the user may see: same visibility scope as the one that queued it"""
+    job = get_object_or_404(ExportJob, pk=pk)
+    if job.scope != ExportJob.scope_for(request.user):
+        raise Http404('No such export')
+    return job
+
+
+@login_required
+def export_job_status(request, pk):
+    """Polled by the export page until the file is ready"""
+    return JsonResponse(job_status(_export_job_for(request, pk)))
+
+
+@login_required
+def export_job_download(request, pk):
+    job = _export_job_for(request, pk)
+    if not job.is_available:
+        messages.error(request, 'This export has expired. Please run it again.')
+        return redirect('dashboards:dashboard_home')
+    response = FileResponse(job.file.open('rb'), as_attachment=True, filename=job.filename)
+    response['Content-Type'] = job.content_type or 'application/octet-stream'
+    return response
+
+def build_timeline_detail_excel(request):
+    """Detailed timeline workbook for the timeline page filters, built by the export worker"""
+    bmrs, _ = filter_timeline_bmrs(request.GET)
+    return export_timeline_data(request, iter_bmr_timelines(bmrs, include_requests=True), 'excel')
+
+def _timeline_csv_rows(timeline_data):
+    """Rows of the detailed timeline CSV, one BMR block at a time"""
+    yield ['BMR Report - Generated on', timezone.now().strftime('%Y-%m-%d %H:%M:%S')]
+    yield []
+    
+    # Write detailed phase information for each BMR
+    for item in timeline_data:
+        bmr = item['bmr']
+        yield []  # Empty row for separation
+        yield [f"BMR: {bmr.batch_number} - {bmr.product.product_name}"]
+        yield [f"Product Type: {bmr.product.product_type}"]
+        yield [f"Created: {bmr.created_date.strftime('%Y-%m-%d %H:%M:%S')}"]
+        yield [f"Total Production Time: {item['total_time_hours']} hours" if item['total_time_hours'] else "In Progress"]
+        yield []  # Empty row
+        yield [
+            'Phase Name', 'Status', 'Started Date', 'Started By', 
+            'Completed Date', 'Completed By', 'Duration (Hours)', 'Comments',
+            'Machine Used', 'Breakdown Occurred', 'Breakdown Duration (Min)', 
+            'Breakdown Start', 'Breakdown End', 'Changeover Occurred', 
+            'Changeover Duration (Min)', 'Changeover Start', 'Changeover End'
+        ]
+        for phase in item['phase_timeline']:
+            yield [
+                phase['phase_name'], phase['status'],
+                phase['started_date'], phase['started_by'],
+                phase['completed_date'], phase['completed_by'],
+                phase['duration_hours'], phase['operator_comments'],
+                phase['machine_used'], phase['breakdown_occurred'], 
+                phase['breakdown_duration'], phase['breakdown_start_time'],
+                phase['breakdown_end_time'], phase['changeover_occurred'],
+                phase['changeover_duration'], phase['changeover_start_time'],
+                phase['changeover_end_time']
+            ]
 
 def export_timeline_data(request, timeline_data=None, format_type=None):
     """Export detailed timeline data to CSV or Excel with all phases"""
@@ -2600,167 +2548,63 @@ def export_timeline_data(request, timeline_data=None, format_type=None):
     if timeline_data is None:
         # Get export format from request
         format_type = request.GET.get('format', 'excel')
+        if format_type == 'excel':
+            if not request.user.is_staff:
+                messages.error(request, 'Access denied. Admin privileges required.')
+                return redirect('dashboards:dashboard_home')
+            return queue_export(request, 'timeline_detail_excel')
         
-        # Recreate the timeline data from scratch
-        from bmr.models import BMR
-        from workflow.models import BatchPhaseExecution
-        
-        bmrs = BMR.objects.select_related('product', 'created_by', 'approved_by').all()
-        
-        # Add timeline data for each BMR
-        timeline_data = []
-        for bmr in bmrs:
-            phases = BatchPhaseExecution.objects.filter(bmr=bmr).select_related('phase').order_by('phase__phase_order')
-            bmr_created = bmr.created_date
-            fgs_completed = phases.filter(
-                phase__phase_name='finished_goods_store',
-                status='completed'
-            ).first()
-            total_time_hours = None
-            if fgs_completed and fgs_completed.completed_date:
-                total_time_hours = round((fgs_completed.completed_date - bmr_created).total_seconds() / 3600, 2)
-            phase_timeline = []
-            for phase in phases:
-                phase_data = {
-                    'phase_name': phase.phase.phase_name.replace('_', ' ').title(),
-                    'status': phase.status.title(),
-                    'started_date': phase.started_date,
-                    'completed_date': phase.completed_date,
-                    'started_by': phase.started_by.get_full_name() if phase.started_by else None,
-                    'completed_by': phase.completed_by.get_full_name() if phase.completed_by else None,
-                    'duration_hours': None,
-                    'operator_comments': getattr(phase, 'operator_comments', '') or '',
-                    'phase_order': phase.phase.phase_order if hasattr(phase.phase, 'phase_order') else 0,
-                    # Machine tracking
-                    'machine_used': phase.machine_used.name if phase.machine_used else '',
-                    # Breakdown tracking
-                    'breakdown_occurred': 'Yes' if phase.breakdown_occurred else 'No',
-                    'breakdown_duration': phase.get_breakdown_duration() if hasattr(phase, 'get_breakdown_duration') and phase.breakdown_occurred else '',
-                    'breakdown_start_time': phase.breakdown_start_time if phase.breakdown_occurred else '',
-                    'breakdown_end_time': phase.breakdown_end_time if phase.breakdown_occurred else '',
-                    # Changeover tracking
-                    'changeover_occurred': 'Yes' if phase.changeover_occurred else 'No',
-                    'changeover_duration': phase.get_changeover_duration() if hasattr(phase, 'get_changeover_duration') and phase.changeover_occurred else '',
-                    'changeover_start_time': phase.changeover_start_time if phase.changeover_occurred else '',
-                    'changeover_end_time': phase.changeover_end_time if phase.changeover_occurred else '',
-                }
-                if phase.started_date and phase.completed_date:
-                    duration = phase.completed_date - phase.started_date
-                    phase_data['duration_hours'] = round(duration.total_seconds() / 3600, 2)
-                elif phase.started_date and not phase.completed_date:
-                    duration = timezone.now() - phase.started_date
-                    phase_data['duration_hours'] = round(duration.total_seconds() / 3600, 2)
-                phase_timeline.append(phase_data)
-            timeline_data.append({
-                'bmr': bmr,
-                'total_time_hours': total_time_hours,
-                'phase_timeline': phase_timeline,
-                'current_phase': phases.filter(status__in=['pending', 'in_progress']).first(),
-                'is_completed': fgs_completed is not None,
-            })
+        # Recreate the timeline data from scratch, a chunk of BMRs at a time
+        timeline_data = iter_bmr_timelines(BMR.objects.all())
     
-    # Generate CSV export
+    # Generate CSV export, streamed as the BMRs are read
     if format_type == 'csv':
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = f'attachment; filename="bmr_detailed_timeline_{timezone.now().strftime("%Y%m%d_%H%M%S")}.csv"'
-        writer = csv.writer(response)
-        
-        # Header row
-        writer.writerow(['BMR Report - Generated on', timezone.now().strftime('%Y-%m-%d %H:%M:%S')])
-        writer.writerow([])
-        
-        # Write detailed phase information for each BMR
-        for item in timeline_data:
-            bmr = item['bmr']
-            writer.writerow([])  # Empty row for separation
-            writer.writerow([f"BMR: {bmr.batch_number} - {bmr.product.product_name}"])
-            writer.writerow([f"Product Type: {bmr.product.product_type}"])
-            writer.writerow([f"Created: {bmr.created_date.strftime('%Y-%m-%d %H:%M:%S')}"])
-            writer.writerow([f"Total Production Time: {item['total_time_hours']} hours" if item['total_time_hours'] else "In Progress"])
-            writer.writerow([])  # Empty row
-            writer.writerow([
-                'Phase Name', 'Status', 'Started Date', 'Started By', 
-                'Completed Date', 'Completed By', 'Duration (Hours)', 'Comments',
-                'Machine Used', 'Breakdown Occurred', 'Breakdown Duration (Min)', 
-                'Breakdown Start', 'Breakdown End', 'Changeover Occurred', 
-                'Changeover Duration (Min)', 'Changeover Start', 'Changeover End'
-            ])
-            for phase in item['phase_timeline']:
-                writer.writerow([
-                    phase['phase_name'], phase['status'],
-                    phase['started_date'], phase['started_by'],
-                    phase['completed_date'], phase['completed_by'],
-                    phase['duration_hours'], phase['operator_comments'],
-                    phase['machine_used'], phase['breakdown_occurred'], 
-                    phase['breakdown_duration'], phase['breakdown_start_time'],
-                    phase['breakdown_end_time'], phase['changeover_occurred'],
-                    phase['changeover_duration'], phase['changeover_start_time'],
-                    phase['changeover_end_time']
-                ])
-        return response
-    
-    # Generate Excel export
+        return streaming_csv_response(
+            _timeline_csv_rows(timeline_data),
+            f'bmr_detailed_timeline_{timezone.now().strftime("%Y%m%d_%H%M%S")}.csv',
+        )
+    
+    # Generate Excel export, one pass over the timelines: each BMR adds a
+    # summary row and gets its own detail sheet, flushed as soon as it is done
     elif format_type == 'excel':
-        import openpyxl
-        from openpyxl.styles import Font, Alignment, PatternFill, Border, Side
-        from openpyxl.utils import get_column_letter
-        
-        # Create a new workbook and select the active worksheet
-        wb = openpyxl.Workbook()
-        
-        # Create summary sheet
-        summary_sheet = wb.active
-        summary_sheet.title = "Production Summary"
+        book = Spreadsheet(styles={
+            'phase_completed': {**STYLES['centered'], 'fill': solid_fill('E8F5E9')},
+            'phase_in_progress': {**STYLES['centered'], 'fill': solid_fill('FFF9C4')},
+        })
         
-        # Apply styles
-        header_font = Font(bold=True, color="FFFFFF")
-        header_fill = PatternFill(start_color="2C3E50", end_color="2C3E50", fill_type="solid")
-        header_alignment = Alignment(horizontal="center", vertical="center", wrap_text=True)
-        border = Border(
-            left=Side(style='thin'), right=Side(style='thin'),
-            top=Side(style='thin'), bottom=Side(style='thin')
+        summary_sheet = book.add_sheet(
+            "Production Summary", widths=[18] * 9, merged=['A1:I1', 'A2:I2'],
+        )
+        summary_sheet.append(
+            ["Kampala Pharmaceutical Industries - BMR Production Timeline Summary"], style='title'
+        )
+        summary_sheet.append(
+            [f"Report Generated: {timezone.localtime().strftime('%Y-%m-%d %H:%M:%S')}"], style='note'
         )
-        
-        # Create title
-        summary_sheet.merge_cells('A1:I1')
-        title_cell = summary_sheet['A1']
-        title_cell.value = "Kampala Pharmaceutical Industries - BMR Production Timeline Summary"
-        title_cell.font = Font(bold=True, size=14)
-        title_cell.alignment = Alignment(horizontal="center")
-        
-        # Create report generation date
-        summary_sheet.merge_cells('A2:I2')
-        date_cell = summary_sheet['A2']
-        date_cell.value = f"Report Generated: {timezone.now().strftime('%Y-%m-%d %H:%M:%S')}"
-        date_cell.alignment = Alignment(horizontal="center")
-        date_cell.font = Font(italic=True)
-        
-        # Add empty row
         summary_sheet.append([])
-        
-        # Summary headers
-        headers = [
+        summary_sheet.append([
             "Batch Number", "Product Name", "Product Type", 
             "Created Date", "Current Status", "Current Phase",
             "Total Duration (Hours)", "Completed", "Bottleneck Phase"
+        ], style='header')
+        
+        detail_headers = [
+            "Phase Name", "Status", "Started Date", "Started By", 
+            "Completed Date", "Completed By", "Duration (Hours)", "Comments",
+            "Machine Used", "Breakdown Occurred", "Breakdown Duration (Min)", 
+            "Breakdown Start", "Breakdown End", "Changeover Occurred", 
+            "Changeover Duration (Min)", "Changeover Start", "Changeover End"
         ]
+        # Machine, breakdown occurred and changeover occurred are narrower,
+        # the remaining new columns hold dates
+        detail_widths = [18] * 8 + [15, 15, 20, 20, 20, 15, 20, 20, 20]
         
-        header_row = summary_sheet.row_dimensions[4]
-        header_row.height = 30
-        
-        for col_num, header in enumerate(headers, 1):
-            cell = summary_sheet.cell(row=4, column=col_num)
-            cell.value = header
-            cell.font = header_font
-            cell.fill = header_fill
-            cell.alignment = header_alignment
-            cell.border = border
-            summary_sheet.column_dimensions[get_column_letter(col_num)].width = 18
+        def local(value):
+            return timezone.localtime(value).strftime('%Y-%m-%d %H:%M') if value else ""
         
-        # Add data rows
-        row_num = 5
         for item in timeline_data:
             bmr = item['bmr']
+            product_type = bmr.product.product_type.replace('_', ' ').title()
             # Find bottleneck phase (longest duration)
             bottleneck = max(item['phase_timeline'], key=lambda x: x['duration_hours'] if x['duration_hours'] else 0, default={})
             bottleneck_name = bottleneck.get('phase_name', 'N/A') if bottleneck else 'N/A'
@@ -2772,152 +2616,61 @@ def export_timeline_data(request, timeline_data=None, format_type=None):
                 if current_phases:
                     current_phase = current_phases[0]['phase_name']
             
-            # Add row data
-            row_data = [
+            summary_sheet.append([
                 bmr.batch_number,
                 bmr.product.product_name,
-                bmr.product.product_type.replace('_', ' ').title(),
-                bmr.created_date.strftime('%Y-%m-%d'),
+                product_type,
+                timezone.localtime(bmr.created_date).strftime('%Y-%m-%d'),
                 "Completed" if item['is_completed'] else "In Progress",
                 current_phase,
                 item['total_time_hours'] if item['total_time_hours'] else "In Progress",
                 "Yes" if item['is_completed'] else "No",
                 bottleneck_name
-            ]
-            
-            for col_num, cell_value in enumerate(row_data, 1):
-                cell = summary_sheet.cell(row=row_num, column=col_num)
-                cell.value = cell_value
-                cell.border = border
-                cell.alignment = Alignment(horizontal="center", vertical="center")
+            ], style='centered')
             
-            row_num += 1
-        
-        # Create detail sheet for each BMR
-        for item in timeline_data:
-            bmr = item['bmr']
-            # Create sheet for this BMR
-            detail_sheet = wb.create_sheet(title=f"BMR-{bmr.batch_number}")
-            
-            # Title
-            detail_sheet.merge_cells('A1:H1')
-            title_cell = detail_sheet['A1']
-            title_cell.value = f"Detailed Timeline for BMR {bmr.batch_number} - {bmr.product.product_name}"
-            title_cell.font = Font(bold=True, size=14)
-            title_cell.alignment = Alignment(horizontal="center")
-            
-            # BMR information
-            detail_sheet.merge_cells('A2:H2')
-            info_cell = detail_sheet['A2']
-            info_cell.value = f"Product Type: {bmr.product.product_type.replace('_', ' ').title()} | Created: {bmr.created_date.strftime('%Y-%m-%d %H:%M:%S')}"
-            info_cell.font = Font(italic=True)
-            info_cell.alignment = Alignment(horizontal="center")
-            
-            detail_sheet.merge_cells('A3:H3')
-            time_cell = detail_sheet['A3']
-            time_cell.value = f"Total Production Time: {item['total_time_hours']} hours" if item['total_time_hours'] else "Total Production Time: In Progress"
-            time_cell.font = Font(italic=True, bold=True)
-            time_cell.alignment = Alignment(horizontal="center")
-            
-            # Add empty row
+            detail_sheet = book.add_sheet(
+                f"BMR-{bmr.batch_number}", widths=detail_widths, merged=['A1:H1', 'A2:H2', 'A3:H3'],
+            )
+            detail_sheet.append(
+                [f"Detailed Timeline for BMR {bmr.batch_number} - {bmr.product.product_name}"], style='title'
+            )
+            detail_sheet.append(
+                [f"Product Type: {product_type} | Created: {timezone.localtime(bmr.created_date).strftime('%Y-%m-%d %H:%M:%S')}"],
+                style='note',
+            )
+            detail_sheet.append([
+                f"Total Production Time: {item['total_time_hours']} hours" if item['total_time_hours'] else "Total Production Time: In Progress"
+            ], style='note')
             detail_sheet.append([])
+            detail_sheet.append(detail_headers, style='header')
             
-            # Detail headers
-            headers = [
-                "Phase Name", "Status", "Started Date", "Started By", 
-                "Completed Date", "Completed By", "Duration (Hours)", "Comments",
-                "Machine Used", "Breakdown Occurred", "Breakdown Duration (Min)", 
-                "Breakdown Start", "Breakdown End", "Changeover Occurred", 
-                "Changeover Duration (Min)", "Changeover Start", "Changeover End"
-            ]
-            
-            header_row = detail_sheet.row_dimensions[5]
-            header_row.height = 30
-            
-            for col_num, header in enumerate(headers, 1):
-                cell = detail_sheet.cell(row=5, column=col_num)
-                cell.value = header
-                cell.font = header_font
-                cell.fill = header_fill
-                cell.alignment = header_alignment
-                cell.border = border
-                # Adjust column widths for new columns
-                if col_num <= 8:  # Original columns
-                    detail_sheet.column_dimensions[get_column_letter(col_num)].width = 18
-                elif col_num in [9, 10, 14]:  # Machine, breakdown occurred, changeover occurred
-                    detail_sheet.column_dimensions[get_column_letter(col_num)].width = 15
-                else:  # Date/time columns
-                    detail_sheet.column_dimensions[get_column_letter(col_num)].width = 20
-            
-            # Add phase data
-            phase_row = 6
             for phase in item['phase_timeline']:
-                # Format dates for display
-                started_date = phase['started_date'].strftime('%Y-%m-%d %H:%M') if phase['started_date'] else "Not Started"
-                completed_date = phase['completed_date'].strftime('%Y-%m-%d %H:%M') if phase['completed_date'] else "Not Completed"
-                breakdown_start = phase['breakdown_start_time'].strftime('%Y-%m-%d %H:%M') if phase['breakdown_start_time'] else ""
-                breakdown_end = phase['breakdown_end_time'].strftime('%Y-%m-%d %H:%M') if phase['breakdown_end_time'] else ""
-                changeover_start = phase['changeover_start_time'].strftime('%Y-%m-%d %H:%M') if phase['changeover_start_time'] else ""
-                changeover_end = phase['changeover_end_time'].strftime('%Y-%m-%d %H:%M') if phase['changeover_end_time'] else ""
-                
-                phase_data = [
+                style = {
+                    'Completed': 'phase_completed',
+                    'In Progress': 'phase_in_progress',
+                }.get(phase['status'], 'centered')
+                detail_sheet.append([
                     phase['phase_name'],
                     phase['status'],
-                    started_date,
+                    local(phase['started_date']) or "Not Started",
                     phase['started_by'] if phase['started_by'] else "",
-                    completed_date,
+                    local(phase['completed_date']) or "Not Completed",
                     phase['completed_by'] if phase['completed_by'] else "",
                     phase['duration_hours'] if phase['duration_hours'] is not None else "",
                     phase['operator_comments'] if phase['operator_comments'] else "",
                     phase['machine_used'] if phase['machine_used'] else "",
                     phase['breakdown_occurred'],
                     phase['breakdown_duration'] if phase['breakdown_duration'] else "",
-                    breakdown_start,
-                    breakdown_end,
+                    local(phase['breakdown_start_time']),
+                    local(phase['breakdown_end_time']),
                     phase['changeover_occurred'],
                     phase['changeover_duration'] if phase['changeover_duration'] else "",
-                    changeover_start,
-                    changeover_end
-                ]
-                
-                # Apply styling based on status
-                row_fill = None
-                if phase['status'] == 'Completed':
-                    row_fill = PatternFill(start_color="E8F5E9", end_color="E8F5E9", fill_type="solid")
-                elif phase['status'] == 'In Progress':
-                    row_fill = PatternFill(start_color="FFF9C4", end_color="FFF9C4", fill_type="solid")
-                
-                for col_num, cell_value in enumerate(phase_data, 1):
-                    cell = detail_sheet.cell(row=phase_row, column=col_num)
-                    cell.value = cell_value
-                    cell.border = border
-                    if row_fill:
-                        cell.fill = row_fill
-                    
-                    # For comments column, use wrap text
-                    if col_num == 8:  # Comments column
-                        cell.alignment = Alignment(wrap_text=True, vertical="top")
-                        detail_sheet.row_dimensions[phase_row].height = max(15, min(50, len(str(cell_value)) // 10 * 15))
-                    else:
-                        cell.alignment = Alignment(horizontal="center", vertical="center")
-                    
-                    # Adjust column widths for new columns
-                    if col_num <= 8:  # Original columns
-                        detail_sheet.column_dimensions[get_column_letter(col_num)].width = 18
-                    elif col_num in [9, 10, 14]:  # Machine, breakdown occurred, changeover occurred
-                        detail_sheet.column_dimensions[get_column_letter(col_num)].width = 15
-                    else:  # Date/time columns
-                        detail_sheet.column_dimensions[get_column_letter(col_num)].width = 20
-                
-                phase_row += 1
-        
-        # Create response
-        response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        response['Content-Disposition'] = f'attachment; filename="bmr_timeline_{timezone.now().strftime("%Y%m%d_%H%M%S")}.xlsx"'
+                    local(phase['changeover_start_time']),
+                    local(phase['changeover_end_time'])
+                ], style=style, styles={7: 'wrapped'})
+            detail_sheet.close()
         
-        # Save the workbook to the response
-        wb.save(response)
-        return response
+        return book.response(f'bmr_timeline_{timezone.localtime().strftime("%Y%m%d_%H%M%S")}.xlsx')
     
     else:
         return HttpResponse('Unsupported export format', content_type='text/plain')
@@ -2936,29 +2689,39 @@ def production_manager_dashboard(request):
         messages.error(request, 'Access denied. Production Manager role required.')
         return redirect('dashboards:dashboard_home')
     
-    # Import the BMRRequest model
-    from bmr.models import BMRRequest
-    
-    # Get BMR request statistics for this user
+    # Get BMR request statistics for this user and overall production statistics
     user_bmr_requests = BMRRequest.objects.filter(requested_by=request.user)
+    stats = cached_section(
+        'production_manager_counters',
+        lambda: count_stats(
+            requests_total=Counter(user_bmr_requests),
+            requests_pending=Counter(user_bmr_requests, status='pending'),
+            requests_approved=Counter(user_bmr_requests, status='approved'),
+            requests_rejected=Counter(user_bmr_requests, status='rejected'),
+            requests_completed=Counter(user_bmr_requests, status='completed'),
+            total_bmrs=Counter(BMR),
+            active_production=Counter(BMR, status__in=['approved', 'in_production']),
+            completed_batches=Counter(BMR, status='completed'),
+            pending_approval=Counter(BMR, status='submitted'),
+        ),
+        sources=['phase'], user=request.user, timeout=60,
+    )
     bmr_request_stats = {
-        'total': user_bmr_requests.count(),
-        'pending': user_bmr_requests.filter(status='pending').count(),
-        'approved': user_bmr_requests.filter(status='approved').count(),
-        'rejected': user_bmr_requests.filter(status='rejected').count(),
-        'completed': user_bmr_requests.filter(status='completed').count(),
+        'total': stats['requests_total'],
+        'pending': stats['requests_pending'],
+        'approved': stats['requests_approved'],
+        'rejected': stats['requests_rejected'],
+        'completed': stats['requests_completed'],
     }
     
     # Get recent BMR requests
     recent_bmr_requests = user_bmr_requests.select_related('product').order_by('-request_date')[:10]
     
-    # Get overall production statistics
-    all_bmrs = BMR.objects.all()
     production_stats = {
-        'total_bmrs': all_bmrs.count(),
-        'active_production': all_bmrs.filter(status__in=['approved', 'in_production']).count(),
-        'completed_batches': all_bmrs.filter(status='completed').count(),
-        'pending_approval': all_bmrs.filter(status='submitted').count(),
+        'total_bmrs': stats['total_bmrs'],
+        'active_production': stats['active_production'],
+        'completed_batches': stats['completed_batches'],
+        'pending_approval': stats['pending_approval'],
     }
     
     # Get products available for BMR requests
@@ -3030,21 +2793,8 @@ def quarantine_monitor_view(request):
         'pending_qc_samples': pending_qc_samples,
         'approved_samples_today': approved_samples_today,
         'rejected_samples_today': rejected_samples_today,
-        'avg_qa_processing_time': SampleRequest.objects.filter(
-            sample_date__isnull=False  # QA processing completed
-        ).aggregate(
-            avg_time=models.Avg(
-                models.F('sample_date') - models.F('request_date')
-            )
-        )['avg_time'],
-        'avg_qc_processing_time': SampleRequest.objects.filter(
-            approved_date__isnull=False,  # QC decision made
-            received_date__isnull=False   # QC received sample
-        ).aggregate(
-            avg_time=models.Avg(
-                models.F('approved_date') - models.F('received_date')
-            )
-        )['avg_time']
+        # Averaged over the stored stage durations, in hours
+        **SampleRequest.processing_times(),
     }
     
     context = {
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.7 on 2026-10-17 05:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fgs_management', '0003_alter_fgsinventory_options_alter_fgsinventory_status'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='fgsinventory',
+            index=models.Index(fields=['status'], name='fgs_inventory_status'),
+        ),
+        migrations.AddIndex(
+            model_name='productrelease',
+            index=models.Index(fields=['release_date'], name='fgs_release_date'),
+        ),
+    ]
@@ -1,7 +1,9 @@
 from django.db import models
 from django.contrib.auth import get_user_model
 from bmr.models import BMR
+from kampala_pharma.db_writer import write_transaction
 from products.models import Product
+from workflow.models import ChangeEvent
 
 User = get_user_model()
 
@@ -53,6 +55,14 @@ class FGSInventory(models.Model):
     def __str__(self):
         return f"{self.batch_number} - {self.product.product_name} ({self.quantity_available} {self.unit_of_measure})"
     
+    def save(self, *args, **kwargs):
+        with write_transaction(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+            ChangeEvent.record(
+                'fgs', self, self.status, bmr_id=self.bmr_id,
+                batch_number=self.batch_number, quantity_available=str(self.quantity_available),
+            )
+    
     @property
     def quantity_released(self):
         """Calculate total quantity released/sold"""
@@ -64,6 +74,9 @@ class FGSInventory(models.Model):
         ordering = ['-created_at']
         verbose_name = 'FGS Inventory'
         verbose_name_plural = 'FGS Inventory'
+        indexes = [
+            models.Index(fields=['status'], name='fgs_inventory_status'),
+        ]
 
 class ProductRelease(models.Model):
     """Track product releases/sales from FGS"""
@@ -112,23 +125,32 @@ class ProductRelease(models.Model):
         if self.unit_price:
             self.total_value = self.quantity_released * self.unit_price
         
-        # Update inventory available quantity
-        if self.pk:
-            # If updating existing release, revert old quantity first
-            old_release = ProductRelease.objects.get(pk=self.pk)
-            self.inventory.quantity_available += old_release.quantity_released
-        
-        # Subtract new quantity - ensure both are Decimal
-        self.inventory.quantity_available -= Decimal(str(self.quantity_released))
-        self.inventory.save()
-        
-        super().save(*args, **kwargs)
+        # Inventory, release and event are written together
+        with write_transaction(using=kwargs.get('using')):
+            # Update inventory available quantity
+            if self.pk:
+                # If updating existing release, revert old quantity first
+                old_release = ProductRelease.objects.get(pk=self.pk)
+                self.inventory.quantity_available += old_release.quantity_released
+            
+            # Subtract new quantity - ensure both are Decimal
+            self.inventory.quantity_available -= Decimal(str(self.quantity_released))
+            self.inventory.save()
+            
+            super().save(*args, **kwargs)
+            ChangeEvent.record(
+                'release', self, self.release_type, bmr_id=self.inventory.bmr_id,
+                inventory_id=self.inventory_id, quantity_released=str(self.quantity_released),
+            )
     
     def __str__(self):
         return f"{self.release_reference} - {self.inventory.batch_number} ({self.quantity_released} units)"
     
     class Meta:
         ordering = ['-release_date']
+        indexes = [
+            models.Index(fields=['release_date'], name='fgs_release_date'),
+        ]
 
 class FGSAlert(models.Model):
     """Alerts for FGS management"""
@@ -2,9 +2,11 @@ from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.db.models import Sum, Q, Count
+from django.db.models.functions import TruncMonth
 from django.utils import timezone
 from django.http import JsonResponse
 from datetime import datetime, timedelta
+from kampala_pharma.db_writer import write_transaction
 from .models import FGSInventory, ProductRelease, FGSAlert
 from bmr.models import BMR
 from products.models import Product
@@ -190,24 +192,25 @@ def create_release(request, inventory_id):
             messages.error(request, 'Release quantity cannot exceed available quantity.')
             return redirect('fgs_management:inventory_list')
         
-        # Create release
-        release = ProductRelease.objects.create(
-            inventory=inventory,
-            release_type=release_type,
-            quantity_released=quantity_released,
-            release_reference=release_reference,
-            customer_name=customer_name,
-            customer_contact=customer_contact,
-            delivery_address=delivery_address,
-            unit_price=float(unit_price) if unit_price else None,
-            authorized_by=request.user,
-            created_by=request.user,
-            notes=notes
-        )
-        
-        # Update inventory with the release certificate number
-        inventory.release_certificate_number = release_certificate_number
-        inventory.save()
+        with write_transaction():
+            # Create release
+            release = ProductRelease.objects.create(
+                inventory=inventory,
+                release_type=release_type,
+                quantity_released=quantity_released,
+                release_reference=release_reference,
+                customer_name=customer_name,
+                customer_contact=customer_contact,
+                delivery_address=delivery_address,
+                unit_price=float(unit_price) if unit_price else None,
+                authorized_by=request.user,
+                created_by=request.user,
+                notes=notes
+            )
+            
+            # Update inventory with the release certificate number
+            inventory.release_certificate_number = release_certificate_number
+            inventory.save()
         
         messages.success(request, f'Product release {release_reference} created successfully.')
         return redirect('fgs_management:release_list')
@@ -284,24 +287,25 @@ def quick_release(request, inventory_id):
             messages.error(request, 'Release quantity cannot exceed available quantity.')
             return redirect('dashboards:finished_goods_dashboard')
         
-        # Create release
-        release = ProductRelease.objects.create(
-            inventory=inventory,
-            release_type=release_type,
-            quantity_released=quantity_released,
-            release_reference=release_reference,
-            customer_name=customer_name,
-            customer_contact=customer_contact,
-            unit_price=Decimal(unit_price) if unit_price else None,
-            authorized_by=request.user,
-            created_by=request.user,
-            notes=notes
-        )
-        
-        # Update inventory status if fully released
-        if inventory.quantity_available == 0:
-            inventory.status = 'released'
-            inventory.save()
+        with write_transaction():
+            # Create release
+            release = ProductRelease.objects.create(
+                inventory=inventory,
+                release_type=release_type,
+                quantity_released=quantity_released,
+                release_reference=release_reference,
+                customer_name=customer_name,
+                customer_contact=customer_contact,
+                unit_price=Decimal(unit_price) if unit_price else None,
+                authorized_by=request.user,
+                created_by=request.user,
+                notes=notes
+            )
+            
+            # Update inventory status if fully released
+            if inventory.quantity_available == 0:
+                inventory.status = 'released'
+                inventory.save()
         
         messages.success(request, f'Release {release_reference} created successfully. {quantity_released} {inventory.unit_of_measure} released.')
         return redirect('dashboards:finished_goods_dashboard')
@@ -341,8 +345,8 @@ def inventory_analytics(request):
     six_months_ago = timezone.now() - timedelta(days=180)
     monthly_releases = ProductRelease.objects.filter(
         release_date__gte=six_months_ago
-    ).extra(
-        select={'month': "strftime('%%Y-%%m', release_date)"}
+    ).annotate(
+        month=TruncMonth('release_date')
     ).values('month').annotate(
         total_released=Sum('quantity_released'),
         release_count=Count('id')
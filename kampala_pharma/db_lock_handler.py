@@ -1,13 +1,12 @@
 """
-Database Lock Recovery Management
-This module provides utilities to handle SQLite database locks
+Database Lock Diagnostics
+This module provides utilities to inspect database locks and health; writes
+are coordinated by kampala_pharma.db_writer. SQLite is checked through its
+file, other backends through the Django connection
 """
-import os
 import sqlite3
-import time
 import logging
-from django.conf import settings
-from django.db import connection, transaction
+from django.db import connection
 
 logger = logging.getLogger(__name__)
 
@@ -16,39 +15,18 @@ def check_db_locked():
     Check if the database is currently locked
     Returns True if locked, False otherwise
     """
+    if connection.vendor != 'sqlite':
+        # PostgreSQL locks rows, never the whole database
+        return False
     try:
         # Try to get a write lock on the database
-        with sqlite3.connect(settings.DATABASES['default']['NAME'], timeout=0.5) as conn:
+        with sqlite3.connect(connection.settings_dict['NAME'], timeout=0.5) as conn:
             conn.execute("BEGIN IMMEDIATE")
             # If we get here, the database is not locked by another process
             return False
     except sqlite3.OperationalError:
         # Database is locked
         return True
-        
-def fix_database_lock():
-    """
-    Attempt to fix a database lock issue by closing all connections
-    and optimizing the database
-    """
-    try:
-        # Close all Django connections
-        connection.close()
-        
-        # Connect with a higher timeout to wait for any locks to clear
-        with sqlite3.connect(settings.DATABASES['default']['NAME'], timeout=10) as conn:
-            # Force PRAGMA settings that help with locks
-            conn.execute("PRAGMA busy_timeout = 5000")
-            conn.execute("PRAGMA journal_mode = WAL")
-            conn.execute("PRAGMA synchronous = NORMAL")
-            
-            # Optimize database (skipping PRAGMA optimize which might not be available)
-            conn.execute("VACUUM")
-            
-        return True
-    except Exception as e:
-        logger.error(f"Error fixing database lock: {e}")
-        return False
 
 def is_database_healthy():
     """
@@ -56,12 +34,18 @@ def is_database_healthy():
     Returns True if healthy, False otherwise
     """
     try:
-        with sqlite3.connect(settings.DATABASES['default']['NAME'], timeout=1) as conn:
+        if connection.vendor != 'sqlite':
+            # The server checks its own pages; being able to query is enough
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            return True
+        with sqlite3.connect(connection.settings_dict['NAME'], timeout=1) as conn:
             # Check if we can perform a simple query
             conn.execute("SELECT 1")
-            # Check for integrity
-            pragma_result = conn.execute("PRAGMA integrity_check").fetchone()[0]
-            return pragma_result == "ok"
+        # Pages are checked by the maintenance scheduler's daily quick_check
+        # (kampala_pharma/db_maintenance.py), not on every call
+        from dashboards.models import MaintenanceTask
+        return not MaintenanceTask.objects.filter(name='quick_check', last_outcome='failed').exists()
     except Exception as e:
         logger.error(f"Database health check failed: {e}")
-        return False
\ No newline at end of file
+        return False
@@ -1,55 +1,230 @@
 """
 Scheduled tasks for database maintenance
+
+Each task runs on its own interval and does a bounded amount of work, so the
+cost of a run does not grow with the database:
+
+* ``wal_checkpoint``: copies the WAL back into the database and truncates it,
+  giving up after BUSY_TIMEOUT_MS if readers are still on old pages;
+* ``optimize``: ``PRAGMA optimize``, with ANALYZE sampling at most
+  ANALYSIS_LIMIT rows per index;
+* ``incremental_vacuum``: releases up to VACUUM_PAGES free pages (only once
+  the database uses ``auto_vacuum = INCREMENTAL``, see ``run_db_maintenance
+  --enable-incremental-vacuum``);
+* ``quick_check``: ``PRAGMA quick_check``, daily. It reads every page, but
+  without the index cross-checks of ``integrity_check`` and, in WAL mode,
+  without blocking writers;
+* ``process_phase_events``: folds the phase events logged since the last run
+  into the phase statistics, every minute, so the dashboards that show them
+  only read.
+
+Only one process runs the scheduler: the first to take an exclusive lock on
+a file next to the database. Due tasks are also claimed in the database
+(``MaintenanceTask.claim_due``), so each run happens once even where the
+lock file is not available. The duration and outcome of every run are
+stored on the task and shown on the system health page. PostgreSQL only
+runs ``process_phase_events``: autovacuum and the server's own checkpoints
+cover the rest.
 """
+import os
 import time
 import logging
 import threading
-from django.core import management
-from django.db import connection
+from contextlib import nullcontext
+from datetime import timedelta
+
+from django.db import DEFAULT_DB_ALIAS, connection, connections
 from django.conf import settings
 
+from .db_writer import busy_timeout, write_transaction
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
 logger = logging.getLogger(__name__)
 
+BUSY_TIMEOUT_MS = 2000
+ANALYSIS_LIMIT = 400
+VACUUM_PAGES = 2000
+
+# SQLite's auto_vacuum values
+AUTO_VACUUM_INCREMENTAL = 2
+
+_leader_files = {}
+
+
+def wal_checkpoint(connection):
+    with connection.cursor() as cursor:
+        # Not allowed inside a transaction; the scheduler runs in autocommit
+        cursor.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        busy, frames, checkpointed = cursor.fetchone()
+    if frames < 0:
+        return 'skipped', 'The database is not in WAL mode'
+    if busy:
+        return 'skipped', f'Readers kept the WAL busy ({checkpointed} of {frames} frames checkpointed)'
+    return 'ok', f'{checkpointed} WAL frames checkpointed'
+
+
+def optimize(connection):
+    with write_transaction(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute(f'PRAGMA analysis_limit = {ANALYSIS_LIMIT}')
+        cursor.execute('PRAGMA optimize')
+    return 'ok', f'Statistics refreshed where needed (at most {ANALYSIS_LIMIT} rows per index)'
+
+
+def incremental_vacuum(connection):
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA auto_vacuum')
+        if cursor.fetchone()[0] != AUTO_VACUUM_INCREMENTAL:
+            return 'skipped', 'auto_vacuum is not INCREMENTAL'
+        cursor.execute('PRAGMA freelist_count')
+        free_pages = cursor.fetchone()[0]
+    if not free_pages:
+        return 'ok', 'No free pages'
+    pages = min(free_pages, VACUUM_PAGES)
+    with write_transaction(using=connection.alias), connection.cursor() as cursor:
+        # Each step of the statement releases one page, and Python's sqlite3
+        # steps a statement without result columns only once
+        for _ in range(pages):
+            cursor.execute('PRAGMA incremental_vacuum(1)')
+    return 'ok', f'{pages} of {free_pages} free pages released'
+
+
+def quick_check(connection):
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA quick_check(1)')
+        result = cursor.fetchone()[0]
+    if result != 'ok':
+        return 'failed', result
+    return 'ok', 'No problems found'
+
+
+def process_phase_events(connection):
+    # Imported here: the project package must not depend on an app at import time
+    from workflow.models import PhaseStats
+    count = PhaseStats.catch_up()
+    return 'ok', f'{count} phase events folded into the phase statistics'
+
+
+# name: (interval, task)
+SQLITE_TASKS = {
+    'wal_checkpoint': (timedelta(minutes=5), wal_checkpoint),
+    'optimize': (timedelta(hours=1), optimize),
+    'incremental_vacuum': (timedelta(hours=1), incremental_vacuum),
+    'quick_check': (timedelta(days=1), quick_check),
+}
+
+# Run whatever the database
+EVENT_TASKS = {
+    'process_phase_events': (timedelta(minutes=1), process_phase_events),
+}
+
+
+def tasks_for(connection):
+    if connection.vendor == 'sqlite':
+        return {**SQLITE_TASKS, **EVENT_TASKS}
+    return EVENT_TASKS
+
+
+def enable_incremental_vacuum(using=DEFAULT_DB_ALIAS):
+    """
+    Switch the database to incremental auto-vacuum. The change only applies
+    after a full VACUUM, which rewrites the file: run it while the
+    application is stopped
+    """
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        cursor.execute('VACUUM')
+        cursor.execute('PRAGMA auto_vacuum')
+        return cursor.fetchone()[0] == AUTO_VACUUM_INCREMENTAL
+
+
+def is_leader(using=DEFAULT_DB_ALIAS):
+    """
+    Whether this process runs the maintenance scheduler. The first process
+    to ask takes the lock and keeps the role until it exits
+    """
+    connection = connections[using]
+    if fcntl is None or connection.vendor != 'sqlite' or connection.is_in_memory_db():
+        # The due-task claims alone keep each run to one process
+        return True
+    pid = os.getpid()
+    if pid in _leader_files:
+        return True
+    handle = open(f"{connection.settings_dict['NAME']}.maintenance-lock", 'a')
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return False
+    # Opened per process: a descriptor inherited across fork shares its lock
+    _leader_files[pid] = handle
+    return True
+
+
+def run_task(task, function, connection):
+    """Run one claimed task and store its duration and outcome"""
+    started = time.monotonic()
+    timeout = busy_timeout(connection, BUSY_TIMEOUT_MS) if connection.vendor == 'sqlite' else nullcontext()
+    try:
+        with timeout:
+            outcome, detail = function(connection)
+    except Exception as e:
+        logger.exception(f"Database maintenance task {task.name} failed")
+        outcome, detail = 'failed', str(e)
+    duration_ms = round((time.monotonic() - started) * 1000)
+    task.record(outcome, detail, duration_ms)
+    logger.info(f"Database maintenance task {task.name}: {outcome} in {duration_ms} ms ({detail})")
+    return outcome
+
+
+def run_pending(using=DEFAULT_DB_ALIAS, now=None):
+    """Run the maintenance tasks that are due; returns {task name: outcome}"""
+    connection = connections[using]
+    tasks = tasks_for(connection)
+    if not tasks:
+        return {}
+    # Imported here: the project package must not depend on an app at import time
+    from dashboards.models import MaintenanceTask
+    intervals = {name: interval for name, (interval, _) in tasks.items()}
+    return {
+        task.name: run_task(task, tasks[task.name][1], connection)
+        for task in MaintenanceTask.claim_due(intervals, now)
+    }
+
+
 class DatabaseMaintenanceThread(threading.Thread):
     """
-    Thread to periodically check database health and perform maintenance
+    Thread to run the maintenance tasks as they fall due, in the elected process
     """
-    def __init__(self, check_interval=3600):  # Default: check every hour
+    def __init__(self, check_interval=60):  # Default: look for due tasks every minute
         self.check_interval = check_interval
         self.stop_event = threading.Event()
         super().__init__(daemon=True)  # Daemon thread to auto-terminate on app shutdown
-        
+
     def run(self):
-        """Main thread loop that runs maintenance checks"""
+        """Main thread loop that runs maintenance tasks"""
         logger.info("Database maintenance thread started")
-        
+
         while not self.stop_event.is_set():
             try:
                 # Close any idle connections
                 connection.close_if_unusable_or_obsolete()
-                
-                # Run integrity check
-                self._run_integrity_check()
-                
-                # Sleep until next check (can be interrupted by stop event)
-                self.stop_event.wait(self.check_interval)
+
+                if is_leader():
+                    run_pending()
             except Exception as e:
                 logger.error(f"Error in database maintenance thread: {e}")
-                # Sleep for a bit before retrying after an error
-                time.sleep(60)
-                
+
+            # Sleep until next check (can be interrupted by stop event)
+            self.stop_event.wait(self.check_interval)
+
     def stop(self):
         """Stop the maintenance thread"""
         self.stop_event.set()
-        
-    def _run_integrity_check(self):
-        """Run integrity check on the database"""
-        try:
-            # Use Django's management command system to run our check
-            management.call_command('fix_db_locks', check_only=True)
-            logger.info("Database integrity check completed")
-        except Exception as e:
-            logger.error(f"Database integrity check failed: {e}")
 
 # Create the maintenance thread
 maintenance_thread = None
@@ -57,18 +232,18 @@ maintenance_thread = None
 def start_maintenance():
     """Start the database maintenance thread if enabled"""
     global maintenance_thread
-    
+
     # Only start if in DEBUG mode or specifically enabled
     if getattr(settings, 'DB_MAINTENANCE_ENABLED', settings.DEBUG):
         maintenance_thread = DatabaseMaintenanceThread()
         maintenance_thread.start()
         logger.info("Database maintenance scheduler started")
-        
+
 def stop_maintenance():
     """Stop the database maintenance thread if running"""
     global maintenance_thread
-    
+
     if maintenance_thread and maintenance_thread.is_alive():
         maintenance_thread.stop()
         maintenance_thread.join(timeout=5)
-        logger.info("Database maintenance scheduler stopped")
\ No newline at end of file
+        logger.info("Database maintenance scheduler stopped")
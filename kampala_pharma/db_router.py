@@ -0,0 +1,140 @@
+"""
+Read/write routing between the primary connection and a read-only one.
+
+Dashboards, reports and exports run long reads. On the primary connection
+they compete with operators' phase transitions for the same connection and
+file locks; in WAL mode a separate read-only connection reads a consistent
+snapshot without ever blocking a writer. Reads made inside ``read_only()``
+go to the ``readonly`` alias; every write, and every read outside the scope,
+stays on ``default``.
+
+    with read_only():
+        rows = list(BatchPhaseExecution.objects.filter(...))   # readonly alias
+
+``ReadOnlyRequestsMiddleware`` opens the scope for GET requests under
+``READ_ONLY_PATHS``, including the iteration of streaming responses.
+Sessions are always read from the primary. A replica may lag behind it, so
+after a write (e.g. a POST that redirects to a dashboard) the middleware
+sets a short-lived cookie and the browser's requests read from the primary
+until it expires (``READ_ONLY_PIN_SECONDS``).
+
+On PostgreSQL the alias is a streaming replica, configured only when
+``POSTGRES_READ_HOST`` is set. A read-only alias that points at the same
+database as ``default`` (as the test runner's mirror does) is not used, so
+reads never miss rows written in the current transaction.
+"""
+import contextvars
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.backends.signals import connection_created
+from django.http import FileResponse
+
+
+READ_ONLY_ALIAS = 'readonly'
+# Read from the primary whatever the scope: a session saved by the previous
+# request, or a version token just replaced (the "versions" DatabaseCache),
+# must not be read back from a replica that has not caught up
+PRIMARY_APP_LABELS = {'sessions', 'django_cache'}
+PIN_COOKIE = 'read_primary'
+PIN_SECONDS = 10
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+_reading = contextvars.ContextVar('read_only_database', default=False)
+
+
+@contextmanager
+def read_only():
+    """Send the reads made inside the block to the read-only alias"""
+    token = _reading.set(True)
+    try:
+        yield
+    finally:
+        _reading.reset(token)
+
+
+def replica_alias():
+    """The read-only alias, or None when it is not configured or is the primary database itself"""
+    if READ_ONLY_ALIAS not in settings.DATABASES:
+        return None
+    replica = connections[READ_ONLY_ALIAS].settings_dict
+    primary = connections[DEFAULT_DB_ALIAS].settings_dict
+    if all(replica.get(key) == primary.get(key) for key in ('NAME', 'HOST', 'PORT')):
+        return None
+    return READ_ONLY_ALIAS
+
+
+class ReadOnlyRouter:
+    """Reads inside read_only() go to the read-only alias; all writes go to the primary"""
+
+    def db_for_read(self, model, **hints):
+        if _reading.get() and model._meta.app_label not in PRIMARY_APP_LABELS:
+            return replica_alias()
+        return None
+
+    def db_for_write(self, model, **hints):
+        # Explicit, so instances read from the replica are saved to the primary
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        aliases = {DEFAULT_DB_ALIAS, READ_ONLY_ALIAS}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != READ_ONLY_ALIAS
+
+
+def configure_connection(sender, connection, **kwargs):
+    """WAL journal on the primary, so readers never block writers; no writes at all on the replica"""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        if connection.alias == READ_ONLY_ALIAS:
+            cursor.execute('PRAGMA query_only = ON')
+        elif connection.alias == DEFAULT_DB_ALIAS:
+            cursor.execute('PRAGMA journal_mode = WAL')
+            cursor.execute('PRAGMA synchronous = NORMAL')
+
+
+# The router is loaded before the first query is routed, so this is in place
+# before any connection is opened
+connection_created.connect(configure_connection)
+
+
+def _iterate_read_only(content):
+    with read_only():
+        yield from content
+
+
+class ReadOnlyRequestsMiddleware:
+    """
+    Serve GET requests for dashboards, reports and exports from the read-only
+    alias, except for a browser that wrote in the last READ_ONLY_PIN_SECONDS
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.paths = tuple(getattr(settings, 'READ_ONLY_PATHS', ()))
+        self.pin_seconds = getattr(settings, 'READ_ONLY_PIN_SECONDS', PIN_SECONDS)
+
+    def __call__(self, request):
+        if request.method not in SAFE_METHODS:
+            response = self.get_response(request)
+            if self.pin_seconds and replica_alias():
+                # Until the replica has replayed this write, read it back from the primary
+                response.set_cookie(PIN_COOKIE, '1', max_age=self.pin_seconds, httponly=True, samesite='Lax')
+            return response
+        if (
+            request.method not in ('GET', 'HEAD') or not request.path.startswith(self.paths)
+            or PIN_COOKIE in request.COOKIES
+        ):
+            return self.get_response(request)
+        with read_only():
+            response = self.get_response(request)
+        # Streamed rows are read while the response is sent; files need no database
+        if response.streaming and not response.is_async and not isinstance(response, FileResponse):
+            response.streaming_content = _iterate_read_only(response.streaming_content)
+        return response
@@ -0,0 +1,182 @@
+"""
+Write coordination for the SQLite database.
+
+SQLite allows one writer at a time. When many operators save at once the
+losers poll the file lock and, after the busy timeout, fail with "database is
+locked". Writes made through ``write_transaction`` queue instead:
+
+* one writer per process at a time, behind a thread lock;
+* one writer process at a time, behind an exclusive lock on a file next to
+  the database (POSIX only; elsewhere SQLite's own lock is the only one);
+* transactions begin with ``BEGIN IMMEDIATE`` (``kampala_pharma.sqlite_backend``),
+  so the write lock is taken up front instead of failing on the first write
+  after a read, and a busy ``BEGIN`` is retried with jittered backoff. Each
+  attempt waits at most BEGIN_BUSY_TIMEOUT_MS rather than the connection's
+  20 s timeout, and a writer gives up after BEGIN_DEADLINE seconds in all
+  with "database is locked", which the caller can retry.
+
+    @write_transaction
+    def complete(...):
+        ...
+
+    with write_transaction():
+        execution.transition('completed', ...)
+
+Nested inside a transaction it is a plain ``transaction.atomic`` block: the
+outermost write already holds the locks. Lock waits, retries and failures
+are counted in the process, since its start, for the system health page
+(``writer_stats``).
+"""
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, OperationalError, connections, transaction
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+BEGIN_ATTEMPTS = 5
+BEGIN_BUSY_TIMEOUT_MS = 1000
+BEGIN_DEADLINE = 5.0
+BACKOFF_BASE = 0.05
+BACKOFF_CAP = 1.0
+
+STAT_KINDS = ('transactions', 'wait_ms', 'retries', 'failures')
+
+_thread_locks = {}
+_lock_files = {}
+_setup_lock = threading.Lock()
+# Aliases whose writer lock this thread holds
+_held = threading.local()
+# Counted in memory: exact, and nothing for a cache to evict
+_stats = dict.fromkeys(STAT_KINDS, 0)
+_stats_lock = threading.Lock()
+
+
+def _count(kind, amount=1):
+    with _stats_lock:
+        _stats[kind] += amount
+
+
+def writer_stats():
+    """Write transactions, lock wait, busy retries and busy failures counted by this process so far"""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['average_wait_ms'] = (
+        round(stats['wait_ms'] / stats['transactions'], 1) if stats['transactions'] else None
+    )
+    return stats
+
+
+def reset_writer_stats():
+    with _stats_lock:
+        _stats.update(dict.fromkeys(STAT_KINDS, 0))
+
+
+def is_busy(error):
+    message = str(error)
+    return 'database is locked' in message or 'database is busy' in message
+
+
+@contextmanager
+def busy_timeout(connection, milliseconds):
+    """Wait at most this long for SQLite's locks, instead of the connection's own timeout"""
+    connection.ensure_connection()
+    # On the driver connection, so the query log only shows the real statements
+    raw = connection.connection
+    previous = raw.execute('PRAGMA busy_timeout').fetchone()[0]
+    raw.execute(f'PRAGMA busy_timeout = {int(milliseconds)}')
+    try:
+        yield
+    finally:
+        raw.execute(f'PRAGMA busy_timeout = {int(previous)}')
+
+
+def begin(connection, mode=None):
+    """Start a transaction on the connection, retrying while the database is busy until BEGIN_DEADLINE"""
+    statement = f'BEGIN {mode}' if mode else 'BEGIN'
+    deadline = time.monotonic() + BEGIN_DEADLINE
+    with busy_timeout(connection, BEGIN_BUSY_TIMEOUT_MS):
+        for attempt in range(1, BEGIN_ATTEMPTS + 1):
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute(statement)
+                return
+            except OperationalError as error:
+                if not is_busy(error):
+                    raise
+                # Full jitter, so writers that were refused together do not retry together
+                delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+                if attempt == BEGIN_ATTEMPTS or time.monotonic() + delay + BEGIN_BUSY_TIMEOUT_MS / 1000 > deadline:
+                    _count('failures')
+                    raise
+            _count('retries')
+            time.sleep(delay)
+
+
+def _lock_file(connection):
+    """This process's handle on the cross-process write lock file, or None"""
+    if fcntl is None or connection.is_in_memory_db():
+        return None
+    key = (os.getpid(), connection.alias)
+    with _setup_lock:
+        # Opened per process: a descriptor inherited across fork shares its lock
+        if key not in _lock_files:
+            _lock_files[key] = open(f"{connection.settings_dict['NAME']}.write-lock", 'a')
+    return _lock_files[key]
+
+
+@contextmanager
+def _writer_lock(connection):
+    held = getattr(_held, 'aliases', None)
+    if held is None:
+        held = _held.aliases = set()
+    if connection.alias in held:
+        # A commit callback of this thread's write, run after the commit but
+        # before the lock is released
+        yield
+        return
+    with _setup_lock:
+        thread_lock = _thread_locks.setdefault(connection.alias, threading.Lock())
+    with thread_lock:
+        held.add(connection.alias)
+        try:
+            handle = _lock_file(connection)
+            if handle is None:
+                yield
+                return
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+        finally:
+            held.discard(connection.alias)
+
+
+@contextmanager
+def _write_transaction(using, savepoint):
+    connection = connections[using]
+    if connection.in_atomic_block or connection.vendor != 'sqlite':
+        with transaction.atomic(using=using, savepoint=savepoint):
+            yield
+        return
+    started = time.monotonic()
+    with _writer_lock(connection):
+        with transaction.atomic(using=using):
+            _count('transactions')
+            _count('wait_ms', round((time.monotonic() - started) * 1000))
+            yield
+
+
+def write_transaction(using=None, savepoint=True):
+    """Like ``transaction.atomic``, queued behind the other writers; usable as a decorator or context manager"""
+    if callable(using):
+        return _write_transaction(DEFAULT_DB_ALIAS, savepoint)(using)
+    return _write_transaction(using or DEFAULT_DB_ALIAS, savepoint)
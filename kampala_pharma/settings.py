@@ -49,6 +49,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'kampala_pharma.db_router.ReadOnlyRequestsMiddleware',
 
     'accounts.middleware.session_timeout.SessionTimeoutMiddleware',]
 
@@ -76,15 +77,114 @@ WSGI_APPLICATION = 'kampala_pharma.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-        'OPTIONS': {
-            'timeout': 20  # Timeout in seconds
+# SQLite by default; set DB_ENGINE=postgresql and the POSTGRES_* variables
+# for multi-worker deployments (see requirements-postgresql.txt)
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+
+if DB_ENGINE == 'postgresql':
+    postgres = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('POSTGRES_DB', 'kampala_pharma'),
+        'USER': os.environ.get('POSTGRES_USER', 'kampala_pharma'),
+        'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+        'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+        'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+        # Persistent connections, reused by each worker thread across requests
+        'CONN_MAX_AGE': int(os.environ.get('POSTGRES_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
+        # Behind PgBouncer in transaction pooling mode a named cursor can
+        # outlive the server connection it was opened on
+        'DISABLE_SERVER_SIDE_CURSORS': os.environ.get('POSTGRES_PGBOUNCER') == '1',
+    }
+    DATABASES = {'default': postgres}
+    if os.environ.get('POSTGRES_READ_HOST'):
+        # Streaming replica for dashboards, reports and exports
+        DATABASES['readonly'] = {
+            **postgres,
+            'HOST': os.environ['POSTGRES_READ_HOST'],
+            'PORT': os.environ.get('POSTGRES_READ_PORT', postgres['PORT']),
+            'OPTIONS': {'options': '-c default_transaction_read_only=on'},
+            'TEST': {'MIRROR': 'default'},
         }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'kampala_pharma.sqlite_backend',
+            'NAME': BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {
+                'timeout': 20,  # Timeout in seconds
+                # Take the write lock when the transaction starts (see kampala_pharma/db_writer.py)
+                'transaction_mode': 'IMMEDIATE',
+            }
+        },
+        # Read-only connection to the same file for dashboards, reports and exports
+        # (see kampala_pharma/db_router.py); tests read through the default alias
+        'readonly': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': f"file:{BASE_DIR / 'db.sqlite3'}?mode=ro",
+            'OPTIONS': {
+                'timeout': 20
+            },
+            'TEST': {
+                'MIRROR': 'default',
+            },
+        },
     }
-}
+
+DATABASE_ROUTERS = ['kampala_pharma.db_router.ReadOnlyRouter']
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+# Every worker process must see the same caches. "default" holds computed
+# values that can be evicted at any time: dashboard sections, machine day
+# buckets and the hit/miss counters on the system health page. "versions"
+# holds the version tokens that invalidate them (workflow/models.py
+# ChangeEvent.touch, workflow/transitions.py): a handful of keys that must
+# never be culled and are replaced atomically, so it is not a file cache.
+# Redis when REDIS_URL is set; otherwise files shared by the processes of
+# one host, and a database table (python manage.py createcachetable).
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        },
+        'versions': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+            'KEY_PREFIX': 'versions',
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.environ.get('CACHE_DIR', BASE_DIR / 'cache'),
+            'OPTIONS': {
+                'MAX_ENTRIES': 5000,
+            },
+        },
+        'versions': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'cache_versions',
+            'OPTIONS': {
+                # Far above the number of tokens, so none is ever culled
+                'MAX_ENTRIES': 100000,
+            },
+        },
+    }
+
+# Live screens poll the change feed by default. The Server-Sent Events
+# stream holds a worker thread for up to 55 s per open screen, so only enable
+# it (CHANGE_FEED_STREAM=1) under a threaded or async server with a thread
+# per expected screen on top of the request workers.
+CHANGE_FEED_STREAM = os.environ.get('CHANGE_FEED_STREAM') == '1'
+
+# GET requests under these paths read from the read-only connection, unless
+# the browser wrote in the last READ_ONLY_PIN_SECONDS (replicas can lag)
+READ_ONLY_PATHS = ['/dashboard/', '/reports/']
+READ_ONLY_PIN_SECONDS = 10
 
 
 # Password validation
@@ -0,0 +1,21 @@
+"""
+SQLite backend with a configurable transaction mode.
+
+Django 4.2 always starts transactions with a deferred ``BEGIN``. This backend
+reads ``OPTIONS['transaction_mode']`` (the option Django 5.1 added, so the
+setting carries over unchanged) and begins every transaction with
+``BEGIN <mode>``, retrying while the database is busy.
+"""
+from django.db.backends.sqlite3 import base
+
+from kampala_pharma.db_writer import begin
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        self.transaction_mode = params.pop('transaction_mode', None)
+        return params
+
+    def _start_transaction_under_autocommit(self):
+        begin(self, getattr(self, 'transaction_mode', None))
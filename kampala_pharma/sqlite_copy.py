@@ -0,0 +1,94 @@
+"""
+Copying an existing SQLite database into another database, e.g. when moving
+a deployment to PostgreSQL (``python manage.py copy_from_sqlite``).
+
+The SQLite file is opened read-only under a temporary connection alias. The
+target is flushed and every table is filled with raw inserts in one
+transaction, so primary keys, auto_now timestamps and relations are kept
+exactly and no save() hooks or signals run. The sequences of the target are
+then moved past the copied ids, so new rows continue after them.
+"""
+import os
+from contextlib import contextmanager
+from itertools import islice
+
+from django.apps import apps
+from django.core.management import call_command
+from django.core.management.color import no_style
+from django.db import connections, router, transaction
+from django.db.migrations.recorder import MigrationRecorder
+
+
+SOURCE_ALIAS = 'sqlite_source'
+
+
+@contextmanager
+def sqlite_database(path, alias=SOURCE_ALIAS, read_only=True):
+    """A temporary connection alias for a SQLite file, read-only unless asked otherwise"""
+    path = os.path.abspath(path)
+    databases = connections.configure_settings({
+        **connections.settings,
+        alias: {
+            'ENGINE': 'django.db.backends.sqlite3',
+            # Read-only, so a mistyped path can never be written to
+            'NAME': f'file:{path}?mode=ro' if read_only else path,
+        },
+    })
+    connections.settings[alias] = databases[alias]
+    try:
+        yield connections[alias]
+    finally:
+        connections[alias].close()
+        del connections[alias]
+        del connections.settings[alias]
+
+
+def migration_difference(source, target):
+    """(missing, unknown): migrations applied only to the target, and only to the source"""
+    source_migrations = set(MigrationRecorder(connections[source]).applied_migrations())
+    target_migrations = set(MigrationRecorder(connections[target]).applied_migrations())
+    return target_migrations - source_migrations, source_migrations - target_migrations
+
+
+def copied_models(target):
+    """Every table the target database holds, many-to-many tables included"""
+    return [
+        model for model in apps.get_models(include_auto_created=True)
+        if model._meta.managed and not model._meta.proxy
+        and router.allow_migrate_model(target, model)
+    ]
+
+
+def copy_model(model, source, target, batch_size):
+    """Copy one table's rows in primary key order; returns the number of rows"""
+    fields = model._meta.local_concrete_fields
+    rows = model._base_manager.using(source).order_by('pk').iterator(chunk_size=batch_size)
+    copied = 0
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return copied
+        # A raw insert writes the stored values as they are: no auto_now
+        # timestamps, save() hooks or signals
+        model._base_manager._insert(batch, fields=fields, using=target, raw=True)
+        copied += len(batch)
+
+
+def copy_database(source, target, batch_size=1000):
+    """
+    Replace every row of the target with the source's, in one transaction.
+    Both must be at the same migration state. Returns {model: rows copied}.
+    """
+    models = copied_models(target)
+    connection = connections[target]
+    copied = {}
+    # Foreign keys are checked at commit, so tables can be filled in any order
+    with transaction.atomic(using=target):
+        call_command('flush', database=target, interactive=False, inhibit_post_migrate=True, verbosity=0)
+        for model in models:
+            copied[model] = copy_model(model, source, target, batch_size)
+        # Let new rows continue after the copied ids (PostgreSQL sequences)
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), models):
+                cursor.execute(sql)
+    return copied
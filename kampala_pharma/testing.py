@@ -0,0 +1,35 @@
+"""
+Rows the test suites of every app build in setUpTestData: the users, all with
+the password ``pass``, and BMRs numbered ``0012025``, ``0022025``, ...
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_admin()
+        cls.operator = create_operator()
+        cls.product = Product.objects.create(product_name='Capsule', product_type='capsule')
+        cls.bmr = create_bmr(cls.product, cls.admin)
+"""
+from accounts.models import CustomUser
+from bmr.models import BMR
+
+
+def create_user(username, role, employee_id, department, **fields):
+    return CustomUser.objects.create_user(
+        username=username, password='pass', role=role,
+        employee_id=employee_id, department=department, **fields,
+    )
+
+
+def create_admin(username='admin', employee_id='ADM001'):
+    return create_user(username, 'admin', employee_id, 'Admin', is_staff=True)
+
+
+def create_operator(username='operator', role='mixing_operator', employee_id='OP001', department='Production'):
+    return create_user(username, role, employee_id, department)
+
+
+def create_bmr(product, created_by, number=1, **fields):
+    """A BMR, which creates its phase executions on save"""
+    return BMR.objects.create(
+        batch_number=f"{number:03d}2025", product=product, created_by=created_by, **fields,
+    )
@@ -0,0 +1,350 @@
+import os
+import sqlite3
+import tempfile
+from datetime import timedelta
+from io import StringIO
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import OperationalError, connection, connections, transaction
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from accounts.models import CustomUser
+from bmr.models import BMR
+from dashboards.models import MaintenanceTask
+from kampala_pharma import db_maintenance, db_router, db_writer, sqlite_copy
+from kampala_pharma.db_router import ReadOnlyRequestsMiddleware, ReadOnlyRouter, read_only, replica_alias
+from kampala_pharma.db_writer import write_transaction, writer_stats
+from kampala_pharma.testing import create_admin, create_bmr
+from products.models import Product
+from workflow.models import BatchPhaseExecution, ChangeEvent, EventWatermark
+
+
+class ReadOnlyRoutingTests(TestCase):
+    def setUp(self):
+        self.router = ReadOnlyRouter()
+
+    def test_mirror_of_the_primary_is_not_used(self):
+        # The test database mirrors default, so reads stay on the connection
+        # that sees this test's uncommitted rows
+        with read_only():
+            self.assertIsNone(replica_alias())
+            self.assertEqual(BMR.objects.all().db, 'default')
+
+    def test_reads_in_scope_go_to_the_replica(self):
+        with mock.patch('kampala_pharma.db_router.replica_alias', return_value='readonly'):
+            self.assertIsNone(self.router.db_for_read(BMR))
+            with read_only():
+                self.assertEqual(self.router.db_for_read(BMR), 'readonly')
+                self.assertEqual(self.router.db_for_write(BMR), 'default')
+            self.assertIsNone(self.router.db_for_read(BMR))
+        self.assertFalse(self.router.allow_migrate('readonly', 'bmr'))
+        self.assertTrue(self.router.allow_migrate('default', 'bmr'))
+
+    @override_settings(READ_ONLY_PATHS=['/dashboard/'])
+    def test_middleware_scopes_get_requests_and_streams(self):
+        seen = []
+
+        def rows():
+            seen.append(('stream', db_router._reading.get()))
+            yield b'row'
+
+        def view(request):
+            seen.append((request.method, db_router._reading.get()))
+            if request.method == 'GET':
+                return StreamingHttpResponse(rows())
+            return HttpResponse()
+
+        middleware = ReadOnlyRequestsMiddleware(view)
+        factory = RequestFactory()
+        response = middleware(factory.get('/dashboard/admin/'))
+        self.assertEqual(b''.join(response.streaming_content), b'row')
+        middleware(factory.post('/dashboard/admin/'))
+        middleware(factory.get('/quarantine/'))
+        self.assertEqual(seen, [('GET', True), ('stream', True), ('POST', False), ('GET', False)])
+
+    def replica(self):
+        """Point the read-only alias at another server, as POSTGRES_READ_HOST does"""
+        settings_dict = {
+            **connections['readonly'].settings_dict,
+            'ENGINE': 'django.db.backends.postgresql', 'NAME': 'kampala_pharma', 'HOST': 'replica.internal', 'PORT': '5432',
+        }
+        return mock.patch.object(connections['readonly'], 'settings_dict', settings_dict)
+
+    @override_settings(READ_ONLY_PATHS=['/dashboard/'], READ_ONLY_PIN_SECONDS=10)
+    def test_replica_is_not_read_after_a_write(self):
+        seen = []
+
+        def view(request):
+            seen.append(db_router._reading.get())
+            return HttpResponse()
+
+        middleware = ReadOnlyRequestsMiddleware(view)
+        factory = RequestFactory()
+        with self.replica():
+            self.assertEqual(replica_alias(), 'readonly')
+            with read_only():
+                self.assertEqual(self.router.db_for_read(BMR), 'readonly')
+                # The session the previous request saved is read from the primary
+                self.assertIsNone(self.router.db_for_read(Session))
+
+            # A POST that redirects to a dashboard pins the browser to the primary
+            response = middleware(factory.post('/workflow/'))
+            cookie = response.cookies[db_router.PIN_COOKIE]
+            self.assertEqual(cookie['max-age'], 10)
+            factory.cookies[db_router.PIN_COOKIE] = cookie.value
+            middleware(factory.get('/dashboard/admin/'))
+            # Once the cookie expires the replica is read again
+            del factory.cookies[db_router.PIN_COOKIE]
+            middleware(factory.get('/dashboard/admin/'))
+        self.assertEqual(seen, [False, False, True])
+
+        # Without a replica there is nothing to wait for
+        response = middleware(factory.post('/workflow/'))
+        self.assertNotIn(db_router.PIN_COOKIE, response.cookies)
+
+
+class WriteQueueTests(TransactionTestCase):
+    def setUp(self):
+        db_writer.reset_writer_stats()
+
+    def busy_connection(self, *outcomes):
+        connection = mock.MagicMock()
+        connection.cursor.return_value.__enter__.return_value.execute.side_effect = outcomes
+        return connection
+
+    @mock.patch('kampala_pharma.db_writer.time.sleep')
+    def test_busy_begin_is_retried_with_backoff(self, sleep):
+        locked = OperationalError('database is locked')
+        connection = self.busy_connection(locked, locked, None)
+        db_writer.begin(connection, 'IMMEDIATE')
+        execute = connection.cursor.return_value.__enter__.return_value.execute
+        self.assertEqual([call.args[0] for call in execute.call_args_list], ['BEGIN IMMEDIATE'] * 3)
+        self.assertEqual(sleep.call_count, 2)
+        self.assertTrue(all(0 <= call.args[0] <= db_writer.BACKOFF_CAP for call in sleep.call_args_list))
+        self.assertEqual((writer_stats()['retries'], writer_stats()['failures']), (2, 0))
+
+        with self.assertRaises(OperationalError):
+            db_writer.begin(self.busy_connection(*[locked] * db_writer.BEGIN_ATTEMPTS), 'IMMEDIATE')
+        self.assertEqual(writer_stats()['failures'], 1)
+
+        # Other errors are not retried
+        with self.assertRaises(OperationalError):
+            db_writer.begin(self.busy_connection(OperationalError('no such table: x')), 'IMMEDIATE')
+        self.assertEqual(writer_stats()['retries'], 2 + db_writer.BEGIN_ATTEMPTS - 1)
+
+    @mock.patch('kampala_pharma.db_writer.time.sleep')
+    def test_busy_begin_gives_up_by_the_deadline(self, sleep):
+        locked = OperationalError('database is locked')
+        connection = self.busy_connection(*[locked] * db_writer.BEGIN_ATTEMPTS)
+        connection.connection.execute.return_value.fetchone.return_value = [20000]
+        # Each attempt takes two seconds of busy waiting
+        clock = iter(range(0, 100, 2))
+        with mock.patch('kampala_pharma.db_writer.time.monotonic', side_effect=lambda: next(clock)):
+            with self.assertRaises(OperationalError):
+                db_writer.begin(connection, 'IMMEDIATE')
+        execute = connection.cursor.return_value.__enter__.return_value.execute
+        self.assertLess(execute.call_count, db_writer.BEGIN_ATTEMPTS)
+        self.assertEqual(writer_stats()['failures'], 1)
+        # The attempts wait briefly for the lock, and the connection's own timeout is restored
+        self.assertEqual(
+            [call.args[0] for call in connection.connection.execute.call_args_list],
+            ['PRAGMA busy_timeout', f'PRAGMA busy_timeout = {db_writer.BEGIN_BUSY_TIMEOUT_MS}', 'PRAGMA busy_timeout = 20000'],
+        )
+
+    def test_commit_callbacks_can_write(self):
+        # Callbacks run when the outermost write commits, while its thread still holds the writer lock
+        def follow_up():
+            with write_transaction():
+                EventWatermark.objects.create(consumer='follow-up')
+
+        with write_transaction():
+            EventWatermark.objects.create(consumer='writer')
+            transaction.on_commit(follow_up)
+        self.assertEqual(EventWatermark.objects.count(), 2)
+        self.assertEqual(writer_stats()['transactions'], 2)
+
+    def test_writes_begin_immediate_and_are_counted(self):
+        with CaptureQueriesContext(connection) as queries:
+            with write_transaction():
+                EventWatermark.objects.create(consumer='writer-1')
+                # Nested writes run in the outer transaction
+                with write_transaction():
+                    EventWatermark.objects.create(consumer='writer-2')
+        self.assertEqual(queries.captured_queries[0]['sql'], 'BEGIN IMMEDIATE')
+        self.assertEqual(EventWatermark.objects.count(), 2)
+        self.assertEqual(writer_stats()['transactions'], 1)
+
+        with self.assertRaises(ValueError):
+            with write_transaction():
+                EventWatermark.objects.create(consumer='writer-3')
+                raise ValueError
+        self.assertEqual(EventWatermark.objects.count(), 2)
+        # The queue is free again
+        with write_transaction():
+            EventWatermark.objects.create(consumer='writer-4')
+        self.assertEqual(writer_stats()['transactions'], 3)
+
+
+class CopyFromSqliteTests(TransactionTestCase):
+    def test_copy_keeps_ids_timestamps_and_relations(self):
+        admin = create_admin()
+        product = Product.objects.create(product_name='Capsule', product_type='capsule')
+        bmr = create_bmr(product, admin)
+        created = timezone.now() - timedelta(days=30)
+        BMR.objects.filter(pk=bmr.pk).update(created_date=created)
+        executions = dict(BatchPhaseExecution.objects.values_list('pk', 'status'))
+        events = ChangeEvent.objects.count()
+
+        # Snapshot the test database into a file, then empty the database
+        handle, path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        connection.ensure_connection()
+        snapshot = sqlite3.connect(path)
+        connection.connection.backup(snapshot)
+        snapshot.close()
+        BMR.objects.all().delete()
+
+        call_command('copy_from_sqlite', path, interactive=False, verbosity=0, stdout=StringIO())
+        copied = BMR.objects.get()
+        self.assertEqual((copied.pk, copied.created_date, copied.created_by.username), (bmr.pk, created, 'admin'))
+        self.assertEqual(dict(BatchPhaseExecution.objects.values_list('pk', 'status')), executions)
+        self.assertEqual(ChangeEvent.objects.count(), events)
+        self.assertTrue(CustomUser.objects.get().check_password('pass'))
+
+    def test_migration_state_must_match(self):
+        handle, path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        with self.assertRaises(CommandError):
+            call_command('copy_from_sqlite', path, interactive=False, verbosity=0, stdout=StringIO())
+
+    @skipUnless(settings.DB_ENGINE == 'postgresql', 'Needs DB_ENGINE=postgresql')
+    def test_new_rows_follow_the_copied_ids_on_postgresql(self):
+        handle, path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        with sqlite_copy.sqlite_database(path, alias='sqlite_seed', read_only=False):
+            call_command('migrate', database='sqlite_seed', interactive=False, verbosity=0)
+            CustomUser.objects.db_manager('sqlite_seed').create_user(
+                username='admin', password='pass', role='admin', employee_id='ADM001', department='Admin',
+            )
+            seeded = Product.objects.using('sqlite_seed').create(product_name='Capsule', product_type='capsule', pk=40)
+
+        call_command('copy_from_sqlite', path, interactive=False, verbosity=0, stdout=StringIO())
+        self.assertEqual(Product.objects.get().pk, seeded.pk)
+        # The sequence was moved past the copied id, so the insert does not collide
+        product = Product.objects.create(product_name='Tablet', product_type='tablet')
+        self.assertGreater(product.pk, seeded.pk)
+        self.assertTrue(CustomUser.objects.get().check_password('pass'))
+
+
+class DatabaseMaintenanceTests(TransactionTestCase):
+    def file_database(self):
+        """A connection to a fresh SQLite file, in WAL mode with incremental auto-vacuum"""
+        handle, path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(handle)
+        alias = 'maintenance_file'
+        databases = connections.configure_settings({
+            **connections.settings,
+            alias: {'ENGINE': 'kampala_pharma.sqlite_backend', 'NAME': path},
+        })
+        connections.settings[alias] = databases[alias]
+
+        def remove():
+            connections[alias].close()
+            del connections[alias]
+            del connections.settings[alias]
+            for suffix in ('', '-wal', '-shm', '.write-lock'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+        self.addCleanup(remove)
+        self.assertTrue(db_maintenance.enable_incremental_vacuum(alias))
+        with connections[alias].cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode = WAL')
+        return connections[alias]
+
+    def test_due_tasks_run_once_and_record_outcomes(self):
+        now = timezone.now()
+        self.assertEqual(db_maintenance.run_pending(now=now), {
+            # The test database lives in memory: no WAL, no incremental vacuum
+            'wal_checkpoint': 'skipped',
+            'optimize': 'ok',
+            'incremental_vacuum': 'skipped',
+            'quick_check': 'ok',
+            'process_phase_events': 'ok',
+        })
+        task = MaintenanceTask.objects.get(name='quick_check')
+        self.assertEqual((task.runs, task.last_outcome, task.last_detail), (1, 'ok', 'No problems found'))
+        self.assertIsNotNone(task.last_duration_ms)
+        self.assertEqual(task.next_run_at, now + timedelta(days=1))
+
+        # Claimed runs are not repeated, by this or any other process
+        self.assertEqual(db_maintenance.run_pending(now=now), {})
+        self.assertEqual(db_maintenance.run_pending(now=now + timedelta(minutes=6)), {
+            'wal_checkpoint': 'skipped', 'process_phase_events': 'ok',
+        })
+
+        def broken(connection):
+            raise OperationalError('disk I/O error')
+        tasks = {**db_maintenance.SQLITE_TASKS, 'optimize': (timedelta(hours=1), broken)}
+        with mock.patch.object(db_maintenance, 'SQLITE_TASKS', tasks), \
+                self.assertLogs('kampala_pharma.db_maintenance', 'ERROR'):
+            results = db_maintenance.run_pending(now=now + timedelta(hours=2))
+        self.assertEqual(results['optimize'], 'failed')
+        self.assertEqual(results['wal_checkpoint'], 'skipped')
+        task = MaintenanceTask.objects.get(name='optimize')
+        self.assertEqual((task.runs, task.failures, task.last_detail), (2, 1, 'disk I/O error'))
+
+    @mock.patch.object(db_maintenance, 'VACUUM_PAGES', 500)
+    def test_checkpoint_and_vacuum_are_bounded(self):
+        file_connection = self.file_database()
+        with file_connection.cursor() as cursor:
+            cursor.execute('CREATE TABLE filler (data TEXT)')
+            cursor.executemany('INSERT INTO filler VALUES (?)', [('x' * 2000,)] * 3000)
+            cursor.execute('DELETE FROM filler')
+            cursor.execute('PRAGMA freelist_count')
+            free_pages = cursor.fetchone()[0]
+        self.assertGreater(free_pages, db_maintenance.VACUUM_PAGES)
+
+        self.assertEqual(db_maintenance.wal_checkpoint(file_connection)[0], 'ok')
+        self.assertEqual(os.path.getsize(file_connection.settings_dict['NAME'] + '-wal'), 0)
+
+        outcome, detail = db_maintenance.incremental_vacuum(file_connection)
+        self.assertEqual(outcome, 'ok')
+        self.assertEqual(detail, f'{db_maintenance.VACUUM_PAGES} of {free_pages} free pages released')
+        with file_connection.cursor() as cursor:
+            cursor.execute('PRAGMA freelist_count')
+            self.assertEqual(cursor.fetchone()[0], free_pages - db_maintenance.VACUUM_PAGES)
+
+    def test_only_one_process_is_elected(self):
+        handle, path = tempfile.mkstemp(suffix='.sqlite3')
+        os.close(handle)
+        self.addCleanup(os.remove, path)
+        self.addCleanup(os.remove, f'{path}.maintenance-lock')
+        self.addCleanup(db_maintenance._leader_files.clear)
+
+        with mock.patch.dict(connection.settings_dict, {'NAME': path}):
+            # Another process holds the lock
+            with open(f'{path}.maintenance-lock', 'a') as other:
+                db_maintenance.fcntl.flock(other, db_maintenance.fcntl.LOCK_EX)
+                self.assertFalse(db_maintenance.is_leader())
+            # ... until it exits
+            self.assertTrue(db_maintenance.is_leader())
+            self.assertTrue(db_maintenance.is_leader())
+        db_maintenance._leader_files[os.getpid()].close()
+
+    def test_failed_quick_check_marks_database_unhealthy(self):
+        from kampala_pharma.db_lock_handler import is_database_healthy
+        MaintenanceTask.objects.create(name='quick_check', last_outcome='failed', last_detail='page 12 is never used')
+        with mock.patch.dict(connection.settings_dict, {'NAME': ':memory:'}):
+            self.assertFalse(is_database_healthy())
+            MaintenanceTask.objects.filter(name='quick_check').update(last_outcome='ok')
+            self.assertTrue(is_database_healthy())
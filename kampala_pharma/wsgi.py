@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'kampala_pharma.settings')
 
 application = get_wsgi_application()
+
+# Database maintenance (WAL checkpoints, ANALYZE, quick_check); only one
+# worker process takes the scheduler, see kampala_pharma/db_maintenance.py
+from kampala_pharma import db_maintenance  # noqa: E402
+
+db_maintenance.start_maintenance()
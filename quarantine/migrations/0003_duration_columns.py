@@ -0,0 +1,59 @@
+# Generated by Django 4.2.7 on 2026-10-17 04:54
+
+from django.db import migrations, models
+from django.db.models import Q
+
+
+def seconds(start, end):
+    return round((end - start).total_seconds()) if start and end else None
+
+
+def populate_durations(apps, schema_editor):
+    """Store the durations of released batches and processed samples written before the columns existed"""
+    QuarantineBatch = apps.get_model('quarantine', 'QuarantineBatch')
+    SampleRequest = apps.get_model('quarantine', 'SampleRequest')
+    
+    batches = list(QuarantineBatch.objects.filter(released_date__isnull=False).order_by())
+    for batch in batches:
+        batch.quarantine_seconds = seconds(batch.quarantine_date, batch.released_date)
+    QuarantineBatch.objects.bulk_update(batches, ['quarantine_seconds'], batch_size=500)
+    
+    samples = list(SampleRequest.objects.filter(
+        Q(sample_date__isnull=False) | Q(approved_date__isnull=False)
+    ).order_by())
+    for sample in samples:
+        sample.qa_seconds = seconds(sample.request_date, sample.sample_date)
+        sample.qc_seconds = seconds(sample.received_date, sample.approved_date)
+        sample.turnaround_seconds = seconds(sample.request_date, sample.approved_date)
+    SampleRequest.objects.bulk_update(samples, ['qa_seconds', 'qc_seconds', 'turnaround_seconds'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quarantine', '0002_auto_20251011_1126'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='quarantinebatch',
+            name='quarantine_seconds',
+            field=models.IntegerField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='samplerequest',
+            name='qa_seconds',
+            field=models.IntegerField(blank=True, help_text='Request to QA sampling', null=True),
+        ),
+        migrations.AddField(
+            model_name='samplerequest',
+            name='qc_seconds',
+            field=models.IntegerField(blank=True, help_text='QC receipt to decision', null=True),
+        ),
+        migrations.AddField(
+            model_name='samplerequest',
+            name='turnaround_seconds',
+            field=models.IntegerField(blank=True, help_text='Request to QC decision', null=True),
+        ),
+        migrations.RunPython(populate_durations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.7 on 2026-10-17 05:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('quarantine', '0003_duration_columns'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='quarantinebatch',
+            index=models.Index(fields=['status', 'quarantine_date'], name='quarantine_batch_status'),
+        ),
+        migrations.AddIndex(
+            model_name='samplerequest',
+            index=models.Index(fields=['qc_status', 'approved_date'], name='quarantine_sample_qc'),
+        ),
+        migrations.AddIndex(
+            model_name='samplerequest',
+            index=models.Index(fields=['sample_date'], name='quarantine_sample_date'),
+        ),
+    ]
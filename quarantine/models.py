@@ -1,9 +1,23 @@
 from django.db import models
 from django.conf import settings
 from bmr.models import BMR
-from workflow.models import ProductionPhase
+from kampala_pharma.db_writer import write_transaction
+from workflow.models import ChangeEvent, PhaseEvent, ProductionPhase
+from django.db.models import Avg, Case, F, Q, Value, When
 from django.utils import timezone
 
+
+def seconds_between(start, end):
+    """Whole seconds from start to end, or None until both are known"""
+    if start and end:
+        return round((end - start).total_seconds())
+    return None
+
+
+class QuarantineConflict(Exception):
+    """A quarantine or sample step was already taken by someone else"""
+
+
 class QuarantineBatch(models.Model):
     """Tracks batches in quarantine after phase completion"""
     
@@ -30,23 +44,160 @@ class QuarantineBatch(models.Model):
         related_name='released_quarantine_batches'
     )
     sample_count = models.PositiveSmallIntegerField(default=0)  # Track number of samples requested
+    # Quarantine to release, stored on release for reporting
+    quarantine_seconds = models.IntegerField(null=True, blank=True, db_index=True)
+    
+    # Records still waiting for a sample decision or release
+    OPEN_STATUSES = ['quarantined', 'sample_requested', 'sample_in_qa', 'sample_in_qc', 'sample_approved', 'sample_failed']
+    RELEASABLE_STATUSES = ['quarantined', 'sample_approved']
+    SAMPLEABLE_STATUSES = ['quarantined', 'sample_failed']
+    MAX_SAMPLES = 2
     
     class Meta:
         ordering = ['-quarantine_date']
         unique_together = ['bmr', 'current_phase']  # One quarantine record per BMR-phase
+        indexes = [
+            # Open batches on the quarantine dashboard
+            models.Index(fields=['status', 'quarantine_date'], name='quarantine_batch_status'),
+        ]
     
     def __str__(self):
         return f"{self.bmr.batch_number} - {self.current_phase.phase_name} (Quarantine)"
     
+    def save(self, *args, **kwargs):
+        self.quarantine_seconds = seconds_between(self.quarantine_date, self.released_date)
+        super().save(*args, **kwargs)
+        ChangeEvent.record(
+            'quarantine', self, self.status, bmr_id=self.bmr_id,
+            phase_id=self.current_phase_id, sample_count=self.sample_count,
+        )
+    
+    def event(self):
+        """This record's change feed event, for writes that bypass save()"""
+        return (self.pk, self.bmr_id, self.status, {'phase_id': self.current_phase_id, 'sample_count': self.sample_count})
+    
     @property
     def can_request_sample(self):
         """Check if can request another sample (max 2 samples)"""
-        return self.sample_count < 2 and self.status in ['quarantined', 'sample_failed']
+        return self.sample_count < self.MAX_SAMPLES and self.status in self.SAMPLEABLE_STATUSES
     
     @property
     def can_proceed_to_next_phase(self):
         """Check if can proceed to next phase"""
-        return self.status in ['quarantined', 'sample_approved']
+        return self.status in self.RELEASABLE_STATUSES
+    
+    @classmethod
+    def enter(cls, entries):
+        """
+        Quarantine batches whose phases just completed, in one write transaction.
+        
+        ``entries`` are (bmr, phase) pairs. A BMR with an open quarantine
+        record has it moved to the new phase; otherwise its record for the
+        phase is created, or reopened if the phase was quarantined before
+        (after a rework). The statement count does not depend on the number of
+        entries. Returns the quarantined records.
+        """
+        entries = {bmr.pk: phase for bmr, phase in entries}
+        if not entries:
+            return []
+        
+        now = timezone.now()
+        with write_transaction():
+            # Each BMR's newest open record (listed first by the default
+            # ordering), and any earlier record for the phase now quarantined
+            moved, reopened = {}, {}
+            for record in cls.objects.filter(
+                Q(status__in=cls.OPEN_STATUSES) | Q(current_phase_id__in={phase.pk for phase in entries.values()}),
+                bmr_id__in=entries,
+            ).order_by('quarantine_date', 'pk'):
+                if record.status in cls.OPEN_STATUSES:
+                    moved[record.bmr_id] = record
+                elif record.current_phase_id == entries[record.bmr_id].pk:
+                    reopened[record.bmr_id] = record
+            for bmr_id in moved:
+                reopened.pop(bmr_id, None)
+            
+            if moved:
+                cls.objects.filter(pk__in=[record.pk for record in moved.values()]).update(
+                    status='quarantined',
+                    current_phase=Case(
+                        *[When(pk=record.pk, then=Value(entries[bmr_id].pk)) for bmr_id, record in moved.items()],
+                        default=F('current_phase'),
+                    ),
+                )
+                for bmr_id, record in moved.items():
+                    record.status, record.current_phase = 'quarantined', entries[bmr_id]
+            if reopened:
+                cls.objects.filter(pk__in=[record.pk for record in reopened.values()]).update(
+                    status='quarantined', quarantine_date=now,
+                    released_date=None, released_by=None, quarantine_seconds=None,
+                )
+                for record in reopened.values():
+                    record.status, record.quarantine_date = 'quarantined', now
+                    record.released_date = record.released_by = record.quarantine_seconds = None
+            created = cls.objects.bulk_create([
+                cls(bmr_id=bmr_id, current_phase=phase, status='quarantined')
+                for bmr_id, phase in entries.items() if bmr_id not in moved and bmr_id not in reopened
+            ])
+            
+            records = [*moved.values(), *reopened.values(), *created]
+            ChangeEvent.record_many('quarantine', [record.event() for record in records])
+            PhaseEvent.record_many([
+                PhaseEvent(action='quarantined', bmr_id=record.bmr_id, phase_name=entries[record.bmr_id].phase_name)
+                for record in records
+            ])
+        return records
+    
+    @classmethod
+    def release(cls, bmr, phase, user=None):
+        """
+        Release the BMR's quarantine record for a phase with one guarded
+        UPDATE. Returns False when there is nothing to release, e.g. because
+        someone else released it first.
+        """
+        now = timezone.now()
+        with write_transaction():
+            record = cls.objects.filter(
+                bmr=bmr, current_phase=phase, status__in=cls.RELEASABLE_STATUSES
+            ).order_by().first()
+            if record is None:
+                return False
+            released = cls.objects.filter(pk=record.pk, status=record.status).update(
+                status='released', released_date=now, released_by=user,
+                quarantine_seconds=seconds_between(record.quarantine_date, now),
+            )
+            if not released:
+                return False
+            record.status = 'released'
+            ChangeEvent.record_many('quarantine', [record.event()])
+            PhaseEvent.record_many([
+                PhaseEvent(action='released', bmr_id=record.bmr_id, phase_name=phase.phase_name, user=user)
+            ])
+        return True
+    
+    def request_sample(self, user):
+        """
+        Create the next sample request and mark the batch, in one transaction.
+        Raises QuarantineConflict when no further sample can be requested,
+        including when another request got there first.
+        """
+        with write_transaction():
+            claimed = type(self).objects.filter(
+                pk=self.pk, sample_count=self.sample_count,
+                sample_count__lt=self.MAX_SAMPLES, status__in=self.SAMPLEABLE_STATUSES,
+            ).update(sample_count=F('sample_count') + 1, status='sample_requested')
+            if not claimed:
+                raise QuarantineConflict(
+                    f"Cannot request sample for {self.bmr.batch_number}. "
+                    f"Maximum {self.MAX_SAMPLES} samples allowed per batch, or a sample is already in progress."
+                )
+            self.sample_count += 1
+            self.status = 'sample_requested'
+            sample = SampleRequest.objects.create(
+                quarantine_batch=self, sample_number=self.sample_count, requested_by=user
+            )
+            ChangeEvent.record_many('quarantine', [self.event()])
+        return sample
     
     @property
     def quarantine_duration_hours(self):
@@ -111,13 +262,43 @@ class SampleRequest(models.Model):
     )
     approved_date = models.DateTimeField(null=True, blank=True)
     
+    # Stage durations, stored as each stage completes for reporting
+    qa_seconds = models.IntegerField(null=True, blank=True, help_text="Request to QA sampling")
+    qc_seconds = models.IntegerField(null=True, blank=True, help_text="QC receipt to decision")
+    turnaround_seconds = models.IntegerField(null=True, blank=True, help_text="Request to QC decision")
+    
     class Meta:
         ordering = ['-request_date']
         unique_together = ['quarantine_batch', 'sample_number']  # Ensure unique sample numbers per batch
+        indexes = [
+            # QC queue and decisions by day
+            models.Index(fields=['qc_status', 'approved_date'], name='quarantine_sample_qc'),
+            # QA queue (not yet sampled) and samples taken by day
+            models.Index(fields=['sample_date'], name='quarantine_sample_date'),
+        ]
     
     def __str__(self):
         return f"{self.quarantine_batch.bmr.batch_number} - Sample {self.sample_number}"
     
+    def save(self, *args, **kwargs):
+        self.qa_seconds = seconds_between(self.request_date, self.sample_date)
+        self.qc_seconds = seconds_between(self.received_date, self.approved_date)
+        self.turnaround_seconds = seconds_between(self.request_date, self.approved_date)
+        super().save(*args, **kwargs)
+        ChangeEvent.record(
+            'sample', self, self.qc_status, bmr_id=self.quarantine_batch.bmr_id,
+            quarantine_batch_id=self.quarantine_batch_id, sample_number=self.sample_number,
+        )
+    
+    @classmethod
+    def processing_times(cls):
+        """Average QA and QC processing time in hours, over the samples that went through each stage"""
+        averages = cls.objects.order_by().aggregate(qa=Avg('qa_seconds'), qc=Avg('qc_seconds'))
+        return {
+            'avg_qa_processing_time': averages['qa'] / 3600 if averages['qa'] is not None else None,
+            'avg_qc_processing_time': averages['qc'] / 3600 if averages['qc'] is not None else None,
+        }
+    
     @property
     def total_turnaround_time_hours(self):
         """Calculate total time from request to QC decision"""
@@ -164,39 +345,54 @@ class SampleRequest(models.Model):
         wait_time = self.wait_time_hours or self.qc_wait_time_hours
         return wait_time and wait_time > 24
     
+    def _advance(self, guard, fields, batch_status=None):
+        """
+        Apply a stage update with one guarded UPDATE of the sample (and one of
+        its batch) in a single transaction. The sample is only written while
+        ``guard`` still holds, so a second click on the same step raises
+        QuarantineConflict instead of writing it twice.
+        """
+        batch = self.quarantine_batch
+        with write_transaction():
+            if not type(self).objects.filter(guard, pk=self.pk).update(**fields):
+                raise QuarantineConflict(
+                    f"Sample {self.sample_number} for {batch.bmr.batch_number} was already processed by someone else."
+                )
+            for name, value in fields.items():
+                setattr(self, name, value)
+            ChangeEvent.record_many('sample', [(self.pk, batch.bmr_id, self.qc_status, {
+                'quarantine_batch_id': batch.pk, 'sample_number': self.sample_number,
+            })])
+            if batch_status:
+                QuarantineBatch.objects.filter(pk=batch.pk).update(status=batch_status)
+                batch.status = batch_status
+                ChangeEvent.record_many('quarantine', [batch.event()])
+    
     def update_qa_stage(self, user, comments=""):
-        """Update when QA processes the sample"""
-        self.sampled_by = user
-        self.sample_date = timezone.now()
-        self.qa_comments = comments
-        self.save()
-        
-        # Update quarantine batch status
-        self.quarantine_batch.status = 'sample_in_qc'
-        self.quarantine_batch.save()
+        """Update when QA processes the sample, and send it on to QC"""
+        now = timezone.now()
+        self._advance(Q(sample_date__isnull=True), {
+            'sampled_by': user,
+            'sample_date': now,
+            'qa_comments': comments,
+            'qa_seconds': seconds_between(self.request_date, now),
+        }, batch_status='sample_in_qc')
     
     def update_qc_received(self, user):
         """Update when QC receives the sample"""
-        self.received_by = user
-        self.received_date = timezone.now()
-        self.save()
-        
-        # Update quarantine batch status
-        self.quarantine_batch.status = 'sample_in_qc'
-        self.quarantine_batch.save()
+        self._advance(Q(received_date__isnull=True), {
+            'received_by': user,
+            'received_date': timezone.now(),
+        }, batch_status='sample_in_qc')
     
     def update_qc_decision(self, user, status, comments=""):
-        """Update QC decision"""
-        self.approved_by = user
-        self.approved_date = timezone.now()
-        self.qc_status = status
-        self.qc_comments = comments
-        self.save()
-        
-        # Update quarantine batch status based on decision
-        if status == 'approved':
-            self.quarantine_batch.status = 'sample_approved'
-        elif status == 'failed':
-            self.quarantine_batch.status = 'sample_failed'
-        
-        self.quarantine_batch.save()
\ No newline at end of file
+        """Update QC decision, and the batch status with it"""
+        now = timezone.now()
+        self._advance(Q(qc_status='pending'), {
+            'approved_by': user,
+            'approved_date': now,
+            'qc_status': status,
+            'qc_comments': comments,
+            'qc_seconds': seconds_between(self.received_date, now),
+            'turnaround_seconds': seconds_between(self.request_date, now),
+        }, batch_status={'approved': 'sample_approved', 'failed': 'sample_failed'}.get(status))
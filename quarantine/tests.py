@@ -0,0 +1,76 @@
+from django.test import TestCase
+from django.urls import reverse
+
+from kampala_pharma.testing import create_admin, create_bmr, create_user
+from products.models import Product
+from quarantine.models import QuarantineBatch, QuarantineConflict, SampleRequest
+from workflow.models import BatchPhaseExecution, ChangeEvent, ProductionPhase
+from workflow.services import WorkflowService
+
+
+class QuarantineFlowTests(TestCase):
+    """Quarantine entry, sample steps and release are guarded, set-based writes"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_admin()
+        cls.qa = create_user('qa', 'qa', 'QA001', 'QA')
+        cls.qc = create_user('qc', 'qc', 'QC001', 'QC')
+        product = Product.objects.create(product_name='Capsule', product_type='capsule')
+        cls.bmrs = [create_bmr(product, cls.admin, number) for number in range(1, 5)]
+        cls.drying = ProductionPhase.objects.get(product_type='capsule', phase_name='drying')
+
+    def test_entry_is_set_based(self):
+        with self.assertNumQueries(8):
+            QuarantineBatch.enter([(self.bmrs[0], self.drying)])
+        with self.assertNumQueries(8):
+            records = QuarantineBatch.enter([(bmr, self.drying) for bmr in self.bmrs[1:]])
+        self.assertEqual({record.bmr_id for record in records}, {bmr.pk for bmr in self.bmrs[1:]})
+        self.assertEqual(ChangeEvent.objects.filter(source='quarantine', action='quarantined').count(), 4)
+
+        # A released phase quarantined again (after a rework) reopens its record
+        batch = QuarantineBatch.objects.get(bmr=self.bmrs[0])
+        self.assertTrue(QuarantineBatch.release(self.bmrs[0], self.drying, self.admin))
+        QuarantineBatch.enter([(self.bmrs[0], self.drying)])
+        batch.refresh_from_db()
+        self.assertEqual((batch.status, batch.released_date, batch.released_by), ('quarantined', None, None))
+
+    def test_sample_steps_apply_once(self):
+        batch = QuarantineBatch.enter([(self.bmrs[0], self.drying)])[0]
+        stale = QuarantineBatch.objects.get(pk=batch.pk)
+        sample = batch.request_sample(self.admin)
+        with self.assertRaises(QuarantineConflict):
+            stale.request_sample(self.admin)
+        self.assertEqual(SampleRequest.objects.count(), 1)
+
+        self.client.force_login(self.qa)
+        url = reverse('quarantine:process_qa_sample', args=[sample.pk])
+        self.assertTrue(self.client.post(url, {'comments': 'Sampled'}).json()['success'])
+        response = self.client.post(url, {'comments': 'Again'}).json()
+        self.assertFalse(response['success'])
+        self.assertIn('already processed', response['error'])
+
+        self.client.force_login(self.qc)
+        self.assertTrue(self.client.post(reverse('quarantine:approve_qc_sample', args=[sample.pk])).json()['success'])
+        self.assertFalse(self.client.post(reverse('quarantine:approve_qc_sample', args=[sample.pk])).json()['success'])
+        sample.refresh_from_db()
+        batch.refresh_from_db()
+        self.assertEqual((sample.qc_status, sample.received_by, batch.status), ('approved', self.qc, 'sample_approved'))
+        self.assertEqual(
+            list(ChangeEvent.objects.filter(source='sample').values_list('action', flat=True)),
+            ['pending', 'pending', 'pending', 'approved'],
+        )
+
+    def test_release_applies_once(self):
+        batch = QuarantineBatch.enter([(self.bmrs[0], self.drying)])[0]
+        self.assertTrue(WorkflowService.proceed_from_quarantine(self.bmrs[0], self.drying, released_by=self.admin))
+        blending = BatchPhaseExecution.objects.get(bmr=self.bmrs[0], phase__phase_name='blending')
+        self.assertEqual(blending.status, 'pending')
+
+        # A second click changes nothing
+        self.assertFalse(WorkflowService.proceed_from_quarantine(self.bmrs[0], self.drying, released_by=self.admin))
+        blending.refresh_from_db()
+        self.assertEqual(blending.version, 1)
+        batch.refresh_from_db()
+        self.assertEqual((batch.status, batch.released_by), ('released', self.admin))
+        self.assertIsNotNone(batch.quarantine_seconds)
@@ -4,7 +4,10 @@ from django.contrib import messages
 from django.http import JsonResponse
 from django.utils import timezone
 from django.db.models import Q, Count, Avg
-from .models import QuarantineBatch, SampleRequest
+from kampala_pharma.db_writer import write_transaction
+from .models import QuarantineBatch, QuarantineConflict, SampleRequest
+from dashboards.fragment_cache import cached_section
+from dashboards.stats import Counter, count_stats
 from workflow.services import WorkflowService
 from workflow.models import BatchPhaseExecution
 
@@ -22,18 +25,24 @@ def quarantine_dashboard(request):
     ).filter(status__in=['quarantined', 'sample_requested', 'sample_in_qa', 'sample_in_qc', 'sample_approved', 'sample_failed'])
     
     # Get statistics
-    total_in_quarantine = quarantine_batches.count()
-    awaiting_decision = quarantine_batches.filter(status__in=['quarantined', 'sample_approved']).count()
-    samples_in_progress = quarantine_batches.filter(status__in=['sample_requested', 'sample_in_qa', 'sample_in_qc']).count()
-    failed_samples = quarantine_batches.filter(status='sample_failed').count()
-    
-    # Calculate average quarantine time using database fields
-    from django.db.models import F, ExpressionWrapper, DurationField
-    avg_quarantine_time = 0
-    released_batches = QuarantineBatch.objects.filter(released_date__isnull=False)
-    if released_batches.exists():
-        total_hours = sum(batch.quarantine_duration_hours for batch in released_batches)
-        avg_quarantine_time = total_hours / released_batches.count()
+    stats = cached_section(
+        'quarantine_counters',
+        lambda: count_stats(
+            total_in_quarantine=Counter(quarantine_batches),
+            awaiting_decision=Counter(quarantine_batches, status__in=['quarantined', 'sample_approved']),
+            samples_in_progress=Counter(quarantine_batches, status__in=['sample_requested', 'sample_in_qa', 'sample_in_qc']),
+            failed_samples=Counter(quarantine_batches, status='sample_failed'),
+        ),
+        sources=['quarantine', 'sample'], stale_for=60,
+    )
+    total_in_quarantine = stats['total_in_quarantine']
+    awaiting_decision = stats['awaiting_decision']
+    samples_in_progress = stats['samples_in_progress']
+    failed_samples = stats['failed_samples']
+    
+    # Average quarantine time of released batches, from the stored durations
+    avg_seconds = QuarantineBatch.objects.order_by().aggregate(avg=Avg('quarantine_seconds'))['avg']
+    avg_quarantine_time = avg_seconds / 3600 if avg_seconds is not None else 0
     
     # Recent sample requests for tracking
     recent_samples = SampleRequest.objects.select_related(
@@ -165,7 +174,7 @@ def request_sample(request, quarantine_id):
     if not (request.user.is_staff or request.user.role in ['admin', 'production_manager', 'quarantine']):
         return JsonResponse({'success': False, 'error': 'Permission denied'})
     
-    quarantine_batch = get_object_or_404(QuarantineBatch, id=quarantine_id)
+    quarantine_batch = get_object_or_404(QuarantineBatch.objects.select_related('bmr'), id=quarantine_id)
     
     if not quarantine_batch.can_request_sample:
         return JsonResponse({
@@ -173,20 +182,13 @@ def request_sample(request, quarantine_id):
             'error': 'Cannot request sample. Maximum 2 samples allowed per batch.'
         })
     
-    # Create new sample request
-    sample_number = quarantine_batch.sample_count + 1
-    sample_request = SampleRequest.objects.create(
-        quarantine_batch=quarantine_batch,
-        sample_number=sample_number,
-        requested_by=request.user
-    )
-    
-    # Update quarantine batch
-    quarantine_batch.sample_count = sample_number
-    quarantine_batch.status = 'sample_requested'
-    quarantine_batch.save()
+    # Create the sample request and mark the batch in one transaction
+    try:
+        sample_request = quarantine_batch.request_sample(request.user)
+    except QuarantineConflict as conflict:
+        return JsonResponse({'success': False, 'error': str(conflict)})
     
-    messages.success(request, f'Sample {sample_number} requested for {quarantine_batch.bmr.batch_number}')
+    messages.success(request, f'Sample {sample_request.sample_number} requested for {quarantine_batch.bmr.batch_number}')
     
     if request.headers.get('Content-Type') == 'application/json':
         return JsonResponse({'success': True, 'message': 'Sample requested successfully'})
@@ -212,7 +214,8 @@ def proceed_to_next_phase(request, quarantine_id):
         # Use workflow service to proceed from quarantine
         success = WorkflowService.proceed_from_quarantine(
             quarantine_batch.bmr, 
-            quarantine_batch.current_phase
+            quarantine_batch.current_phase,
+            released_by=request.user
         )
         
         if success:
@@ -254,11 +257,14 @@ def process_qa_sample(request, sample_id):
     if request.user.role != 'qa':
         return JsonResponse({'success': False, 'error': 'Permission denied'})
     
-    sample = get_object_or_404(SampleRequest, id=sample_id)
+    sample = get_object_or_404(SampleRequest.objects.select_related('quarantine_batch__bmr'), id=sample_id)
     
     if request.method == 'POST':
         comments = request.POST.get('comments', '')
-        sample.update_qa_stage(request.user, comments)
+        try:
+            sample.update_qa_stage(request.user, comments)
+        except QuarantineConflict as conflict:
+            return JsonResponse({'success': False, 'error': str(conflict)})
         
         messages.success(request, f'Sample processed and sent to QC for {sample.quarantine_batch.bmr.batch_number}')
         return JsonResponse({'success': True, 'message': 'Sample sent to QC'})
@@ -297,8 +303,11 @@ def receive_qc_sample(request, sample_id):
     if request.user.role != 'qc':
         return JsonResponse({'success': False, 'error': 'Permission denied'})
     
-    sample = get_object_or_404(SampleRequest, id=sample_id)
-    sample.update_qc_received(request.user)
+    sample = get_object_or_404(SampleRequest.objects.select_related('quarantine_batch__bmr'), id=sample_id)
+    try:
+        sample.update_qc_received(request.user)
+    except QuarantineConflict as conflict:
+        return JsonResponse({'success': False, 'error': str(conflict)})
     
     messages.success(request, f'Sample received for testing: {sample.quarantine_batch.bmr.batch_number}')
     return JsonResponse({'success': True, 'message': 'Sample received'})
@@ -309,7 +318,7 @@ def approve_reject_sample(request, sample_id):
     if request.user.role != 'qc':
         return JsonResponse({'success': False, 'error': 'Permission denied'})
     
-    sample = get_object_or_404(SampleRequest, id=sample_id)
+    sample = get_object_or_404(SampleRequest.objects.select_related('quarantine_batch__bmr'), id=sample_id)
     
     if request.method == 'POST':
         qc_status = request.POST.get('qc_status')  # 'approved' or 'failed'
@@ -318,7 +327,10 @@ def approve_reject_sample(request, sample_id):
         if qc_status not in ['approved', 'failed']:
             return JsonResponse({'success': False, 'error': 'Invalid status'})
         
-        sample.update_qc_decision(request.user, qc_status, comments)
+        try:
+            sample.update_qc_decision(request.user, qc_status, comments)
+        except QuarantineConflict as conflict:
+            return JsonResponse({'success': False, 'error': str(conflict)})
         
         status_text = 'approved' if qc_status == 'approved' else 'failed'
         messages.success(request, f'Sample {status_text} for {sample.quarantine_batch.bmr.batch_number}')
@@ -336,14 +348,15 @@ def approve_qc_sample(request, sample_id):
         return JsonResponse({'success': False, 'error': 'Invalid request method'})
     
     try:
-        sample = get_object_or_404(SampleRequest, id=sample_id)
-        
-        # Ensure sample is received by QC if not already
-        if not sample.received_date:
-            sample.update_qc_received(request.user)
+        sample = get_object_or_404(SampleRequest.objects.select_related('quarantine_batch__bmr'), id=sample_id)
         
-        # Update sample with QC approval
-        sample.update_qc_decision(request.user, 'approved', 'Sample approved by QC')
+        with write_transaction():
+            # Ensure sample is received by QC if not already
+            if not sample.received_date:
+                sample.update_qc_received(request.user)
+            
+            # Update sample with QC approval
+            sample.update_qc_decision(request.user, 'approved', 'Sample approved by QC')
         
         return JsonResponse({
             'success': True, 
@@ -364,18 +377,19 @@ def fail_qc_sample(request, sample_id):
     
     try:
         import json
-        sample = get_object_or_404(SampleRequest, id=sample_id)
-        
-        # Ensure sample is received by QC if not already
-        if not sample.received_date:
-            sample.update_qc_received(request.user)
+        sample = get_object_or_404(SampleRequest.objects.select_related('quarantine_batch__bmr'), id=sample_id)
         
         # Get failure reason from request body
         body = json.loads(request.body.decode('utf-8'))
         failure_reason = body.get('failure_reason', 'Sample failed QC testing')
         
-        # Update sample with QC failure
-        sample.update_qc_decision(request.user, 'failed', failure_reason)
+        with write_transaction():
+            # Ensure sample is received by QC if not already
+            if not sample.received_date:
+                sample.update_qc_received(request.user)
+            
+            # Update sample with QC failure
+            sample.update_qc_decision(request.user, 'failed', failure_reason)
         
         return JsonResponse({
             'success': True, 
@@ -1,14 +1,15 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.http import HttpResponse
-from django.db.models import Q
-from bmr.models import BMR
-from workflow.models import BatchPhaseExecution, ProductionPhase
+from django.utils import timezone
+from django.db.models import Q, Prefetch
+from bmr.models import BMR, BMRRequest
+from dashboards.export_jobs import queue_export
+from dashboards.exports import EXPORT_CHUNK_SIZE, streaming_csv_response
+from dashboards.spreadsheets import STYLES, Spreadsheet, solid_fill
+from workflow.models import BatchPhaseExecution, ProductionPhase, BMRProgress
 from workflow.services import WorkflowService
-import csv
-import io
-import openpyxl
-from openpyxl.styles import Font, PatternFill, Alignment
+from openpyxl.styles import Font
 
 @login_required
 def timeline_list_view(request):
@@ -17,22 +18,22 @@ def timeline_list_view(request):
     is_admin = request.user.is_staff or request.user.is_superuser or request.user.role == 'admin'
     
     if is_admin:
-        bmrs = BMR.objects.all().select_related('product', 'created_by').order_by('-created_date')
+        bmrs = BMR.objects.all().select_related('product', 'created_by', 'progress').order_by('-created_date')
     else:
         # Operators only see BMRs they were involved in
         bmrs = BMR.objects.filter(
             Q(created_by=request.user) | Q(approved_by=request.user)
-        ).select_related('product', 'created_by').order_by('-created_date')
+        ).select_related('product', 'created_by', 'progress').order_by('-created_date')
     
     # Add progress information to each BMR
     bmr_progress = []
     stats = {'completed': 0, 'in_progress': 0, 'partially_complete': 0, 'not_started': 0}
     
     for bmr in bmrs:
-        phases = BatchPhaseExecution.objects.filter(bmr=bmr)
-        total_phases = phases.count()
-        completed_phases = phases.filter(status='completed').count()
-        in_progress_phases = phases.filter(status='in_progress').count()
+        progress = BMRProgress.for_bmr(bmr)
+        total_phases = progress.total_phases
+        completed_phases = progress.completed_count
+        in_progress_phases = progress.in_progress_count
         
         progress_percentage = (completed_phases / total_phases * 100) if total_phases > 0 else 0
         
@@ -340,27 +341,10 @@ def enhanced_timeline_view(request, bmr_id):
     
     return render(request, 'reports/enhanced_timeline.html', context)
 
-@login_required
-def export_timeline_csv(request):
-    """Export BMR timeline data to CSV"""
-    # Check user permissions
-    is_admin = request.user.is_staff or request.user.is_superuser or request.user.role == 'admin'
-    
-    if is_admin:
-        bmrs = BMR.objects.all().select_related('product', 'created_by').order_by('-created_date')
-    else:
-        bmrs = BMR.objects.filter(
-            Q(created_by=request.user) | Q(approved_by=request.user)
-        ).select_related('product', 'created_by').order_by('-created_date')
-    
-    # Create CSV response
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="bmr_timeline_export.csv"'
-    
-    writer = csv.writer(response)
-    
+def _timeline_csv_rows(bmrs):
+    """Rows of the timeline CSV, read a chunk of BMRs at a time"""
     # Write header with BMR request fields
-    writer.writerow([
+    yield [
         'BMR Number',
         'Product Name', 
         'Product Type',
@@ -379,30 +363,29 @@ def export_timeline_csv(request):
         'Last Updated',
         'Time in Current Phase (hours)',
         'Total Time Since Request (hours)'
-    ])
+    ]
     
     # Write data for each BMR
-    for bmr in bmrs:
-        # Get BMR request information
-        from bmr.models import BMRRequest
-        bmr_request = BMRRequest.objects.filter(bmr=bmr).first()
+    for bmr in bmrs.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        # Latest BMR request (prefetched, newest first)
+        bmr_requests = bmr.bmr_requests.all()
+        bmr_request = bmr_requests[0] if bmr_requests else None
         
-        phases = BatchPhaseExecution.objects.filter(bmr=bmr).select_related('phase')
-        total_phases = phases.count()
-        completed_phases = phases.filter(status='completed').count()
-        in_progress_phases = phases.filter(status='in_progress').count()
+        progress = BMRProgress.for_bmr(bmr)
+        total_phases = progress.total_phases
+        completed_phases = progress.completed_count
+        in_progress_phases = progress.in_progress_count
         
         progress_percentage = (completed_phases / total_phases * 100) if total_phases > 0 else 0
         
-        # Find current phase (first pending or in_progress phase)
-        current_phase = phases.filter(status__in=['pending', 'in_progress']).order_by('phase__phase_order').first()
+        # Current phase is the first pending or in_progress phase
+        current_phase = progress.current_execution
         current_phase_name = current_phase.phase.phase_name if current_phase else 'Completed'
         current_phase_status = current_phase.status if current_phase else 'completed'
         
         # Calculate time in current phase
         time_in_phase = ''
         if current_phase and current_phase.started_date:
-            from django.utils import timezone
             time_diff = timezone.now() - current_phase.started_date
             hours = int(time_diff.total_seconds() / 3600)
             time_in_phase = f"{hours}"
@@ -410,16 +393,14 @@ def export_timeline_csv(request):
         # Calculate total time since request
         total_time_since_request = ''
         if bmr_request and bmr_request.request_date:
-            from django.utils import timezone
             time_diff = timezone.now() - bmr_request.request_date
             hours = int(time_diff.total_seconds() / 3600)
             total_time_since_request = f"{hours}"
         
         # Get last updated date (most recent phase activity)
-        last_phase = phases.exclude(started_date__isnull=True).order_by('-started_date').first()
-        last_updated = last_phase.started_date if last_phase else bmr.created_date
+        last_updated = progress.last_activity or bmr.created_date
         
-        writer.writerow([
+        yield [
             bmr.batch_number,
             bmr.product.product_name,
             bmr.product.product_type,
@@ -438,394 +419,271 @@ def export_timeline_csv(request):
             last_updated.strftime('%Y-%m-%d %H:%M') if last_updated else '',
             time_in_phase,
             total_time_since_request
-        ])
+        ]
+
+@login_required
+def export_timeline_csv(request):
+    """Export BMR timeline data to CSV"""
+    # Check user permissions
+    is_admin = request.user.is_staff or request.user.is_superuser or request.user.role == 'admin'
     
-    return response
+    if is_admin:
+        bmrs = BMR.objects.all()
+    else:
+        bmrs = BMR.objects.filter(
+            Q(created_by=request.user) | Q(approved_by=request.user)
+        )
+    bmrs = bmrs.select_related(
+        'product', 'created_by', 'progress__current_execution__phase'
+    ).prefetch_related(
+        Prefetch('bmr_requests', queryset=BMRRequest.objects.select_related('requested_by'))
+    ).order_by('-created_date')
+    
+    return streaming_csv_response(_timeline_csv_rows(bmrs), 'bmr_timeline_export.csv')
 
 @login_required
 def export_timeline_excel(request):
-    """Export comprehensive BMR timeline data to Excel matching the original format"""
-    from django.utils import timezone
-    from datetime import datetime
-    
+    """Export comprehensive BMR timeline data to Excel (built by the export worker)"""
+    return queue_export(request, 'timeline_excel')
+
+# Columns are sized for their usual content instead of measuring every cell
+SUMMARY_WIDTHS = [16, 28, 14, 18, 18, 16, 22, 22, 11, 22]
+DETAIL_WIDTHS = [26, 16, 18, 20, 18, 18, 16, 30, 16, 12, 12, 18, 18, 12, 14, 18, 18]
+
+# Status column fills
+PHASE_STATUS_STYLES = {
+    'completed': 'status_completed',
+    'in_progress': 'status_in_progress',
+    'pending': 'status_pending',
+}
+REQUEST_STATUS_STYLES = {
+    'completed': 'status_request',
+    'pending': 'status_pending',
+}
+
+# Status mapping
+PHASE_STATUS_LABELS = {
+    'completed': 'Completed',
+    'in_progress': 'Not Completed',
+    'pending': 'Not Ready',
+    'failed': 'Not Completed'
+}
+
+
+def _phase_hours(execution):
+    if execution.started_date and execution.completed_date:
+        return (execution.completed_date - execution.started_date).total_seconds() / 3600
+    return None
+
+
+def _duration_cell(duration_hours, suffix=''):
+    """Hours rounded to one decimal, or minutes below an hour"""
+    if duration_hours >= 1:
+        return f"{round(duration_hours, 1)}{suffix}" if suffix else round(duration_hours, 1)
+    return f"{round(duration_hours * 60, 1)}m{suffix}"
+
+
+def _production_time_display(executions):
+    completed = [execution for execution in executions if execution.status == 'completed']
+    total_hours = sum(_phase_hours(execution) or 0 for execution in completed)
+    if total_hours > 0:
+        days = int(total_hours // 24)
+        hours = int(total_hours % 24)
+        minutes = int((total_hours % 1) * 60)
+        if days > 0:
+            elapsed = f"{days}d {hours}h"
+        elif hours > 0:
+            elapsed = f"{hours}h {minutes}m"
+        else:
+            elapsed = f"{minutes}m"
+    if executions and len(completed) == len(executions):
+        # All phases completed
+        return f"Completed in {elapsed}" if total_hours > 0 else "Completed"
+    return f"In Progress ({elapsed} so far)" if total_hours > 0 else "In Progress"
+
+
+def _timeline_summary_row(bmr, bmr_request, executions):
+    total_duration = sum(_phase_hours(execution) or 0 for execution in executions)
+    current_phase = next(
+        (execution for execution in executions if execution.status in ('pending', 'in_progress')), None
+    )
+    completed_phases = sum(1 for execution in executions if execution.status == 'completed')
+    
+    # Find bottleneck (longest phase)
+    bottleneck_phase = "Bmr Creation"  # Default
+    max_duration = 0
+    for execution in executions:
+        phase_duration = _phase_hours(execution) or 0
+        if phase_duration > max_duration:
+            max_duration = phase_duration
+            bottleneck_phase = execution.phase.phase_name.replace('_', ' ').title()
+    
+    return [
+        bmr.batch_number,
+        bmr.product.product_name,
+        bmr.product.product_type.title(),
+        bmr_request.request_date if bmr_request and bmr_request.request_date else 'N/A',
+        bmr.created_date,
+        bmr.status.replace('_', ' ').title(),
+        current_phase.phase.phase_name.replace('_', ' ').title() if current_phase else 'Completed',
+        "In Progress" if total_duration == 0 else f"{total_duration:.1f}",
+        "Yes" if completed_phases == len(executions) else "No",
+        bottleneck_phase
+    ]
+
+
+def _timeline_request_row(bmr, bmr_request):
+    """The BMR request, shown as the first row of the detail sheet"""
+    # Time from request to BMR creation
+    request_duration = ''
+    if bmr_request.request_date and bmr.created_date:
+        request_duration = _duration_cell((bmr.created_date - bmr_request.request_date).total_seconds() / 3600)
+    completed = bmr_request.status == 'completed'
+    comments = f"Priority: {bmr_request.get_priority_display()}"
+    if bmr_request.reason:
+        comments += f", Reason: {bmr_request.reason}"
+    
+    return [
+        'BMR Request Submitted',  # Phase Name
+        bmr_request.get_status_display(),  # Status
+        bmr_request.request_date,  # Started Date
+        bmr_request.requested_by.get_full_name() if bmr_request.requested_by else '',  # Started By
+        bmr.created_date if completed else '',  # Completed Date
+        bmr.created_date if completed else 'Not Completed',  # Complete
+        request_duration,  # Duration (Hours)
+        comments,  # Comments
+        '',  # Machine Used
+        'No',  # Breakdown Occurred
+        '',  # Breakdown Duration
+        '',  # Breakdown Start
+        '',  # Breakdown End
+        'No',  # Changeover Occurred
+        '',  # Changeover Duration
+        '',  # Changeover Start
+        ''   # Changeover End
+    ]
+
+
+def _timeline_phase_row(execution, now):
+    duration_hours = _phase_hours(execution)
+    if duration_hours is not None:
+        duration = _duration_cell(duration_hours)
+    elif execution.started_date:
+        # Phase is in progress - time so far
+        duration = _duration_cell((now - execution.started_date).total_seconds() / 3600, ' (ongoing)')
+    else:
+        duration = "Not Started"
+    
+    breakdown_duration = ''
+    breakdown_occurred = 'No'
+    if execution.breakdown_start_time and execution.breakdown_end_time:
+        breakdown_occurred = 'Yes'
+        breakdown_diff = execution.breakdown_end_time - execution.breakdown_start_time
+        breakdown_duration = round(breakdown_diff.total_seconds() / 3600, 1)
+    
+    changeover_duration = ''
+    changeover_occurred = 'No'
+    if execution.changeover_start_time and execution.changeover_end_time:
+        changeover_occurred = 'Yes'
+        changeover_diff = execution.changeover_end_time - execution.changeover_start_time
+        changeover_duration = round(changeover_diff.total_seconds() / 60, 1)  # Minutes for changeover
+    
+    return [
+        execution.phase.phase_name.replace('_', ' ').title(),
+        PHASE_STATUS_LABELS.get(execution.status, execution.status),
+        execution.started_date or "Not Started",
+        execution.started_by.get_full_name() if execution.started_by else '',
+        execution.completed_date or "Not Completed",
+        execution.completed_date if execution.status == 'completed' else "Not Completed",
+        duration,  # Duration (Hours)
+        execution.operator_comments or '',  # Comments
+        execution.machine_used.name if execution.machine_used else '',  # Machine Used
+        breakdown_occurred,  # Breakdown Occurred
+        breakdown_duration,  # Breakdown Duration
+        execution.breakdown_start_time or '',  # Breakdown Start
+        execution.breakdown_end_time or '',  # Breakdown End
+        changeover_occurred,  # Changeover Occurred
+        changeover_duration,  # Changeover Duration (Min)
+        execution.changeover_start_time or '',  # Changeover Start
+        execution.changeover_end_time or ''  # Changeover End
+    ]
+
+
+def build_timeline_excel(request):
+    """Timeline workbook matching the original format"""
     # Check user permissions
     is_admin = request.user.is_staff or request.user.is_superuser or request.user.role == 'admin'
     
     if is_admin:
-        bmrs = BMR.objects.all().select_related('product', 'created_by').order_by('-created_date')
+        bmrs = BMR.objects.all()
     else:
         bmrs = BMR.objects.filter(
             Q(created_by=request.user) | Q(approved_by=request.user)
-        ).select_related('product', 'created_by').order_by('-created_date')
-    
-    # Create workbook
-    wb = openpyxl.Workbook()
-    
-    # Define styles
-    header_font = Font(bold=True, color="FFFFFF", size=10)
-    header_fill = PatternFill(start_color="4472C4", end_color="4472C4", fill_type="solid")
-    title_font = Font(bold=True, size=14)
-    center_alignment = Alignment(horizontal="center", vertical="center")
-    left_alignment = Alignment(horizontal="left", vertical="center")
-    
-    # Remove default sheet and create Production Summary
-    wb.remove(wb.active)
-    ws_summary = wb.create_sheet("Production Summary")
-    
-    # Add title and report info
-    ws_summary.merge_cells('A1:L1')
-    title_cell = ws_summary['A1']
-    title_cell.value = "Kampala Pharmaceutical Industries - BMR Production Timeline Summary"
-    title_cell.font = title_font
-    title_cell.alignment = center_alignment
-    
-    ws_summary.merge_cells('A2:L2') 
-    report_cell = ws_summary['A2']
-    report_cell.value = f"Report Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-    report_cell.alignment = center_alignment
-    
-    # Headers for summary (row 4)
-    summary_headers = [
+        )
+    # Executions and requests are loaded once per chunk of BMRs
+    bmrs = bmrs.select_related('product', 'created_by').prefetch_related(
+        Prefetch('phase_executions', queryset=BatchPhaseExecution.objects.select_related(
+            'phase', 'started_by', 'completed_by', 'machine_used'
+        ).order_by('phase__phase_order')),
+        Prefetch('bmr_requests', queryset=BMRRequest.objects.select_related('requested_by')),
+    ).order_by('-created_date')
+    
+    book = Spreadsheet(styles={
+        'timeline_header': {
+            **STYLES['header'],
+            'font': Font(bold=True, color="FFFFFF", size=10),
+            'fill': solid_fill("4472C4"),
+        },
+    })
+    
+    # Production Summary first, detail sheets follow as the BMRs are read
+    ws_summary = book.add_sheet("Production Summary", widths=SUMMARY_WIDTHS, merged=['A1:L1', 'A2:L2'])
+    ws_summary.append(["Kampala Pharmaceutical Industries - BMR Production Timeline Summary"], style='title')
+    ws_summary.append([f"Report Generated: {timezone.localtime().strftime('%Y-%m-%d %H:%M:%S')}"], style='centered')
+    ws_summary.append([])
+    ws_summary.append([
         'Batch Number', 'Product Name', 'Product Type', 'Request Date',
         'Created Date', 'Current Status', 'Current Phase', 
         'Total Duration (Hours)', 'Completed', 'Bottleneck Phase'
+    ], style='timeline_header')
+    
+    # Detailed headers (row 5) - matching the Excel format exactly
+    detail_headers = [
+        'Phase Name', 'Status', 'Started Date', 'Started By', 'Completed Date', 
+        'Complete', 'Duration (Hours)', 'Comments', 'Machine Used',
+        'Breakdown Occurred', 'Breakdown Duration', 'Breakdown down',
+        'Breakdown End', 'Changeover Occurred', 'Changeover Duration (Min)',
+        'Changeover Start', 'Changeover End'
     ]
     
-    for col, header in enumerate(summary_headers, 1):
-        cell = ws_summary.cell(row=4, column=col, value=header)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = center_alignment
-    
-    # Fill summary data
-    summary_row = 5
-    for bmr in bmrs:
-        # Get BMR request information
-        from bmr.models import BMRRequest
-        bmr_request = BMRRequest.objects.filter(bmr=bmr).first()
+    now = timezone.now()
+    for bmr in bmrs.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        executions = list(bmr.phase_executions.all())
+        bmr_requests = bmr.bmr_requests.all()
+        bmr_request = bmr_requests[0] if bmr_requests else None
         
-        phases = BatchPhaseExecution.objects.filter(bmr=bmr).select_related('phase')
+        ws_summary.append(_timeline_summary_row(bmr, bmr_request, executions))
         
-        # Calculate total duration
-        total_duration = 0
-        for phase in phases:
-            if phase.started_date and phase.completed_date:
-                duration = phase.completed_date - phase.started_date
-                total_duration += duration.total_seconds() / 3600
-        
-        # Find current phase
-        current_phase = phases.filter(status__in=['pending', 'in_progress']).order_by('phase__phase_order').first()
-        current_phase_name = current_phase.phase.phase_name.replace('_', ' ').title() if current_phase else 'Completed'
-        
-        # Determine completion status
-        completed_phases = phases.filter(status='completed').count()
-        total_phases = phases.count()
-        is_completed = "Yes" if completed_phases == total_phases else "No"
-        
-        # Find bottleneck (longest phase)
-        bottleneck_phase = "Bmr Creation"  # Default
-        max_duration = 0
-        for phase in phases:
-            if phase.started_date and phase.completed_date:
-                phase_duration = (phase.completed_date - phase.started_date).total_seconds() / 3600
-                if phase_duration > max_duration:
-                    max_duration = phase_duration
-                    bottleneck_phase = phase.phase.phase_name.replace('_', ' ').title()
-        
-        created_date_naive = bmr.created_date.replace(tzinfo=None) if bmr.created_date else None
-        request_date_naive = bmr_request.request_date.replace(tzinfo=None) if bmr_request and bmr_request.request_date else None
-        
-        row_data = [
-            bmr.batch_number,
-            bmr.product.product_name,
-            bmr.product.product_type.title(),
-            request_date_naive if request_date_naive else 'N/A',
-            created_date_naive,
-            bmr.status.replace('_', ' ').title(),
-            current_phase_name,
-            "In Progress" if total_duration == 0 else f"{total_duration:.1f}",
-            is_completed,
-            bottleneck_phase
-        ]
-        
-        for col, value in enumerate(row_data, 1):
-            ws_summary.cell(row=summary_row, column=col, value=value)
-        
-        summary_row += 1
-    
-    # Now create detailed timeline sheets for each BMR
-    for bmr in bmrs:
-        # Create sheet for each BMR
-        sheet_name = f"BMR-{bmr.batch_number}"
-        ws_detail = wb.create_sheet(sheet_name)
-        
-        # Title for detailed sheet
-        ws_detail.merge_cells('A1:Q1')
-        detail_title = ws_detail['A1']
-        detail_title.value = f"Detailed Timeline for BMR {bmr.batch_number} - {bmr.product.product_name}"
-        detail_title.font = title_font
-        detail_title.alignment = center_alignment
-        
-        # Product info (row 2)
-        ws_detail['A2'] = f"Product Type: {bmr.product.product_type} | Created: {bmr.created_date.strftime('%Y-%m-%d %H:%M:%S') if bmr.created_date else 'N/A'}"
-        
-        # Calculate total production time for this BMR
-        phases = BatchPhaseExecution.objects.filter(bmr=bmr).select_related('phase')
-        total_production_hours = 0
-        completed_phases_count = 0
-        total_phases_count = phases.count()
-        
-        # Debug: Check each phase status
-        completed_phases = phases.filter(status='completed')
-        completed_phases_count = completed_phases.count()
-        
-        for phase in completed_phases:
-            if phase.started_date and phase.completed_date:
-                phase_duration = phase.completed_date - phase.started_date
-                total_production_hours += phase_duration.total_seconds() / 3600
-        
-        # Format production time display
-        if completed_phases_count == total_phases_count and total_phases_count > 0:
-            # All phases completed
-            if total_production_hours > 0:
-                days = int(total_production_hours // 24)
-                hours = int(total_production_hours % 24)
-                minutes = int((total_production_hours % 1) * 60)
-                if days > 0:
-                    production_time_display = f"Completed in {days}d {hours}h"
-                elif hours > 0:
-                    production_time_display = f"Completed in {hours}h {minutes}m"
-                else:
-                    production_time_display = f"Completed in {minutes}m"
-            else:
-                production_time_display = "Completed"
-        else:
-            # In progress
-            if total_production_hours > 0:
-                days = int(total_production_hours // 24)
-                hours = int(total_production_hours % 24)
-                minutes = int((total_production_hours % 1) * 60)
-                if days > 0:
-                    production_time_display = f"In Progress ({days}d {hours}h so far)"
-                elif hours > 0:
-                    production_time_display = f"In Progress ({hours}h {minutes}m so far)"
-                else:
-                    production_time_display = f"In Progress ({minutes}m so far)"
-            else:
-                production_time_display = "In Progress"
-        
-        ws_detail['A3'] = f"Total Production Time: {production_time_display}"
-        
-        # Detailed headers (row 5) - matching the Excel format exactly
-        detail_headers = [
-            'Phase Name', 'Status', 'Started Date', 'Started By', 'Completed Date', 
-            'Complete', 'Duration (Hours)', 'Comments', 'Machine Used',
-            'Breakdown Occurred', 'Breakdown Duration', 'Breakdown down',
-            'Breakdown End', 'Changeover Occurred', 'Changeover Duration (Min)',
-            'Changeover Start', 'Changeover End'
-        ]
-        
-        for col, header in enumerate(detail_headers, 1):
-            cell = ws_detail.cell(row=5, column=col, value=header)
-            cell.font = header_font
-            cell.fill = header_fill
-            cell.alignment = center_alignment
-        
-        # Get phases for this BMR
-        phases = BatchPhaseExecution.objects.filter(bmr=bmr).select_related(
-            'phase', 'started_by', 'completed_by', 'machine_used'
-        ).order_by('phase__phase_order')
-        
-        # Get BMR request information
-        from bmr.models import BMRRequest
-        bmr_request = BMRRequest.objects.filter(bmr=bmr).first()
-        
-        detail_row = 6
+        ws_detail = book.add_sheet(f"BMR-{bmr.batch_number}", widths=DETAIL_WIDTHS, merged=['A1:Q1'])
+        ws_detail.append(
+            [f"Detailed Timeline for BMR {bmr.batch_number} - {bmr.product.product_name}"], style='title'
+        )
+        created = timezone.localtime(bmr.created_date).strftime('%Y-%m-%d %H:%M:%S') if bmr.created_date else 'N/A'
+        ws_detail.append([f"Product Type: {bmr.product.product_type} | Created: {created}"])
+        ws_detail.append([f"Total Production Time: {_production_time_display(executions)}"])
+        ws_detail.append([])
+        ws_detail.append(detail_headers, style='timeline_header')
         
-        # Add BMR Request as first row if it exists
         if bmr_request:
-            request_date_naive = bmr_request.request_date.replace(tzinfo=None) if bmr_request.request_date else None
-            # Calculate time from request to BMR creation
-            request_duration = ''
-            if bmr_request.request_date and bmr.created_date:
-                time_diff = bmr.created_date - bmr_request.request_date
-                duration_hours = time_diff.total_seconds() / 3600
-                if duration_hours >= 1:
-                    request_duration = round(duration_hours, 1)
-                else:
-                    minutes = round(duration_hours * 60, 1)
-                    request_duration = f"{minutes}m"
-            
-            bmr_created_date_naive = bmr.created_date.replace(tzinfo=None) if bmr.created_date else None
-            
-            request_data = [
-                'BMR Request Submitted',  # Phase Name
-                bmr_request.get_status_display(),  # Status
-                request_date_naive,  # Started Date
-                bmr_request.requested_by.get_full_name() if bmr_request.requested_by else '',  # Started By
-                bmr_created_date_naive if bmr_request.status == 'completed' else '',  # Completed Date
-                bmr_created_date_naive if bmr_request.status == 'completed' else 'Not Completed',  # Complete
-                request_duration,  # Duration (Hours)
-                f"Priority: {bmr_request.get_priority_display()}, Reason: {bmr_request.reason}" if bmr_request.reason else f"Priority: {bmr_request.get_priority_display()}",  # Comments
-                '',  # Machine Used
-                'No',  # Breakdown Occurred
-                '',  # Breakdown Duration
-                '',  # Breakdown Start
-                '',  # Breakdown End
-                'No',  # Changeover Occurred
-                '',  # Changeover Duration
-                '',  # Changeover Start
-                ''   # Changeover End
-            ]
-            
-            for col, value in enumerate(request_data, 1):
-                cell = ws_detail.cell(row=detail_row, column=col, value=value)
-                # Apply special formatting for BMR request row
-                if col == 2:  # Status column
-                    if bmr_request.status == 'completed':
-                        cell.fill = PatternFill(start_color="E7E6E6", end_color="E7E6E6", fill_type="solid")
-                    elif bmr_request.status == 'pending':
-                        cell.fill = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
-            
-            detail_row += 1
-        
-        for phase in phases:
-            # Calculate duration in hours
-            duration = ''
-            breakdown_duration = ''
-            changeover_duration = ''
-            breakdown_occurred = 'No'
-            changeover_occurred = 'No'
-            
-            # Main phase duration - FIXED to ensure it shows up
-            if phase.started_date and phase.completed_date:
-                time_diff = phase.completed_date - phase.started_date
-                duration_hours = time_diff.total_seconds() / 3600
-                # Ensure duration is always shown with proper formatting
-                if duration_hours >= 1:
-                    duration = round(duration_hours, 1)
-                else:
-                    # Show minutes if less than an hour
-                    minutes = round(duration_hours * 60, 1)
-                    duration = f"{minutes}m"
-            elif phase.started_date:
-                # Phase is in progress - calculate time so far
-                from django.utils import timezone
-                time_diff = timezone.now() - phase.started_date
-                duration_hours = time_diff.total_seconds() / 3600
-                if duration_hours >= 1:
-                    duration = f"{round(duration_hours, 1)} (ongoing)"
-                else:
-                    minutes = round(duration_hours * 60, 1)
-                    duration = f"{minutes}m (ongoing)"
-            else:
-                # Phase not started
-                duration = "Not Started"
-            
-            # Breakdown duration (if exists)
-            if hasattr(phase, 'breakdown_start_time') and hasattr(phase, 'breakdown_end_time'):
-                if phase.breakdown_start_time and phase.breakdown_end_time:
-                    breakdown_occurred = 'Yes'
-                    breakdown_diff = phase.breakdown_end_time - phase.breakdown_start_time
-                    breakdown_duration = round(breakdown_diff.total_seconds() / 3600, 1)
-            
-            # Changeover duration (if exists)
-            if hasattr(phase, 'changeover_start_time') and hasattr(phase, 'changeover_end_time'):
-                if phase.changeover_start_time and phase.changeover_end_time:
-                    changeover_occurred = 'Yes'
-                    changeover_diff = phase.changeover_end_time - phase.changeover_start_time
-                    changeover_duration = round(changeover_diff.total_seconds() / 60, 1)  # Minutes for changeover
-            
-            # Convert dates to naive
-            started_date_naive = phase.started_date.replace(tzinfo=None) if phase.started_date else None
-            completed_date_naive = phase.completed_date.replace(tzinfo=None) if phase.completed_date else None
-            breakdown_start_naive = phase.breakdown_start_time.replace(tzinfo=None) if hasattr(phase, 'breakdown_start_time') and phase.breakdown_start_time else None
-            breakdown_end_naive = phase.breakdown_end_time.replace(tzinfo=None) if hasattr(phase, 'breakdown_end_time') and phase.breakdown_end_time else None
-            changeover_start_naive = phase.changeover_start_time.replace(tzinfo=None) if hasattr(phase, 'changeover_start_time') and phase.changeover_start_time else None
-            changeover_end_naive = phase.changeover_end_time.replace(tzinfo=None) if hasattr(phase, 'changeover_end_time') and phase.changeover_end_time else None
-            
-            # Status mapping
-            status_map = {
-                'completed': 'Completed',
-                'in_progress': 'Not Completed',
-                'pending': 'Not Ready',
-                'failed': 'Not Completed'
-            }
-            
-            phase_data = [
-                phase.phase.phase_name.replace('_', ' ').title(),
-                status_map.get(phase.status, phase.status),
-                "Not Started" if not started_date_naive else started_date_naive,
-                phase.started_by.get_full_name() if phase.started_by else '',
-                "Not Completed" if not completed_date_naive else completed_date_naive,
-                "Not Completed" if phase.status != 'completed' else completed_date_naive,
-                duration if duration else '',  # Duration (Hours)
-                phase.operator_comments or '',  # Comments
-                phase.machine_used.name if phase.machine_used else '',  # Machine Used
-                breakdown_occurred,  # Breakdown Occurred
-                breakdown_duration if breakdown_duration else '',  # Breakdown Duration
-                breakdown_start_naive if breakdown_start_naive else '',  # Breakdown Start
-                breakdown_end_naive if breakdown_end_naive else '',  # Breakdown End
-                changeover_occurred,  # Changeover Occurred
-                changeover_duration if changeover_duration else '',  # Changeover Duration (Min)
-                changeover_start_naive if changeover_start_naive else '',  # Changeover Start
-                changeover_end_naive if changeover_end_naive else ''  # Changeover End
-            ]
-            
-            for col, value in enumerate(phase_data, 1):
-                cell = ws_detail.cell(row=detail_row, column=col, value=value)
-                # Apply conditional formatting based on status
-                if col == 2:  # Status column
-                    if phase.status == 'completed':
-                        cell.fill = PatternFill(start_color="C6EFCE", end_color="C6EFCE", fill_type="solid")
-                    elif phase.status == 'in_progress':
-                        cell.fill = PatternFill(start_color="FFEB9C", end_color="FFEB9C", fill_type="solid")
-                    elif phase.status == 'pending':
-                        cell.fill = PatternFill(start_color="FFC7CE", end_color="FFC7CE", fill_type="solid")
-            
-            detail_row += 1
-    
-    # Auto-adjust column widths for all sheets
-    for sheet in wb.worksheets:
-        for column_letter in sheet.column_dimensions:
-            max_length = 0
-            for row in sheet.iter_rows():
-                for cell in row:
-                    if cell.column_letter == column_letter and not hasattr(cell, '_merge_start'):
-                        try:
-                            if cell.value and len(str(cell.value)) > max_length:
-                                max_length = len(str(cell.value))
-                        except:
-                            pass
-            # Set minimum width and maximum width
-            adjusted_width = min(max(max_length + 2, 10), 30)
-            sheet.column_dimensions[column_letter].width = adjusted_width
-        
-        # Also adjust any columns that weren't in column_dimensions
-        from openpyxl.utils import get_column_letter
-        for col_num in range(1, sheet.max_column + 1):
-            column_letter = get_column_letter(col_num)
-            if column_letter not in sheet.column_dimensions:
-                max_length = 0
-                for row in sheet.iter_rows(min_col=col_num, max_col=col_num):
-                    for cell in row:
-                        if not hasattr(cell, '_merge_start'):
-                            try:
-                                if cell.value and len(str(cell.value)) > max_length:
-                                    max_length = len(str(cell.value))
-                            except:
-                                pass
-                adjusted_width = min(max(max_length + 2, 10), 30)
-                sheet.column_dimensions[column_letter].width = adjusted_width
-    
-    # Generate filename with timestamp
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"bmr_timeline_{timestamp}.xlsx"
-    
-    # Create response
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
-    
-    # Save workbook to response
-    wb.save(response)
-    return response
+            ws_detail.append(
+                _timeline_request_row(bmr, bmr_request),
+                styles={1: REQUEST_STATUS_STYLES.get(bmr_request.status)},
+            )
+        for execution in executions:
+            ws_detail.append(
+                _timeline_phase_row(execution, now),
+                styles={1: PHASE_STATUS_STYLES.get(execution.status)},
+            )
+        ws_detail.close()
+    
+    return book.response(f"bmr_timeline_{timezone.localtime().strftime('%Y%m%d_%H%M%S')}.xlsx")
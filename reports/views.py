@@ -1,177 +1,160 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.http import HttpResponse, JsonResponse
-from django.db.models import Q, Count
+from django.contrib.auth.models import Group
+from django.db.models import Q, Count, F, Prefetch
+from django.db.models.functions import Coalesce
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from datetime import datetime, timedelta
 from bmr.models import BMR, BMRSignature
+from dashboards.export_jobs import queue_export
+from dashboards.exports import EXPORT_CHUNK_SIZE, streaming_csv_response
+from dashboards.spreadsheets import Spreadsheet
 from workflow.models import BatchPhaseExecution
-import csv
+import heapq
+import importlib.util
+import itertools
 import json
 
-def get_filtered_comments_data(request):
-    """Helper function to get comments data with filters applied"""
+def _has_text(field):
+    return Q(**{f"{field}__isnull": False}) & ~Q(**{field: ''})
+
+def _bmr_comments(bmrs, field, comment_type, phase, user_field, date):
+    """One comment row per BMR with text in ``field``, newest first"""
+    bmrs = bmrs.filter(_has_text(field)).annotate(comment_date=date).order_by(
+        F('comment_date').desc(nulls_last=True), 'pk'
+    )
+    for bmr in bmrs.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        user = getattr(bmr, user_field)
+        yield {
+            'bmr_number': bmr.batch_number,
+            'product': bmr.product.product_name,
+            'comment_type': comment_type,
+            'phase': phase,
+            'user': user.get_full_name() if user else 'Unknown',
+            'user_role': user.role if user else 'Unknown',
+            'date': bmr.comment_date,
+            'comments': getattr(bmr, field),
+            'status': bmr.status,
+            'bmr_id': bmr.id
+        }
+
+def _phase_comments(phases, field, comment_type):
+    """One comment row per phase execution with text in ``field``, newest first"""
+    phases = phases.filter(_has_text(field)).annotate(
+        comment_date=Coalesce('completed_date', 'created_date')
+    ).order_by(F('comment_date').desc(nulls_last=True), 'pk')
+    for phase in phases.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield {
+            'bmr_number': phase.bmr.batch_number,
+            'product': phase.bmr.product.product_name,
+            'comment_type': comment_type,
+            'phase': phase.phase.get_phase_name_display(),
+            'user': phase.completed_by.get_full_name() if phase.completed_by else 'Unknown',
+            'user_role': phase.completed_by.role if phase.completed_by else 'Unknown',
+            'date': phase.comment_date,
+            'comments': getattr(phase, field),
+            'status': phase.status,
+            'bmr_id': phase.bmr.id,
+            'phase_id': phase.id
+        }
+
+def _signature_comments(signatures):
+    """One comment row per signature with comments, newest first"""
+    signatures = signatures.filter(_has_text('comments')).prefetch_related(
+        Prefetch('signed_by__groups', queryset=Group.objects.order_by('pk'))
+    ).order_by('-signed_date', 'pk')
+    for signature in signatures.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        # Get user role from user's groups
+        groups = signature.signed_by.groups.all()
+        user_role = groups[0].name if groups else 'Staff'
+        
+        yield {
+            'bmr_number': signature.bmr.batch_number,
+            'product': signature.bmr.product.product_name,
+            'comment_type': 'Electronic Signature',
+            'phase': f"Signature - {signature.get_signature_type_display()}",
+            'user': signature.signed_by.get_full_name() if signature.signed_by else 'Unknown',
+            'user_role': user_role,
+            'date': signature.signed_date,
+            'comments': signature.comments,
+            'status': 'Signed',
+            'bmr_id': signature.bmr.id,
+            'signature_id': signature.id
+        }
+
+def iter_filtered_comments(request):
+    """
+    Comments visible to the user with the request's filters applied, newest first.
+
+    Each comment source is read in date order in chunks and the sources are
+    merged as they stream, so exports never hold the whole report in memory.
+    """
     # Check if user is admin/staff - they see all comments
     is_admin = request.user.is_staff or request.user.is_superuser or request.user.role == 'admin'
     
-    # Collect all comments
-    comments_data = []
+    # Filters from the request
+    bmr_filter = request.GET.get('bmr')
+    comment_type_filter = request.GET.get('type')
+    user_role_filter = request.GET.get('role')
     
     # 1. BMR Level Comments
-    if is_admin:
-        # Admin sees all BMRs
-        bmrs = BMR.objects.all().select_related('product', 'created_by', 'approved_by')
-    else:
+    bmrs = BMR.objects.select_related('product', 'created_by', 'approved_by')
+    if not is_admin:
         # Operators only see BMRs they created or were involved in
-        bmrs = BMR.objects.filter(
-            Q(created_by=request.user) | 
-            Q(approved_by=request.user)
-        ).select_related('product', 'created_by', 'approved_by')
-    
-    for bmr in bmrs:
-        # QA Comments on BMR
-        if bmr.qa_comments:
-            comments_data.append({
-                'bmr_number': bmr.batch_number,
-                'product': bmr.product.product_name,
-                'comment_type': 'BMR QA Comments',
-                'phase': 'BMR Creation',
-                'user': bmr.created_by.get_full_name() if bmr.created_by else 'Unknown',
-                'user_role': bmr.created_by.role if bmr.created_by else 'Unknown',
-                'date': bmr.created_date,
-                'comments': bmr.qa_comments,
-                'status': bmr.status,
-                'bmr_id': bmr.id
-            })
-        
-        # Regulatory Comments on BMR
-        if bmr.regulatory_comments:
-            comments_data.append({
-                'bmr_number': bmr.batch_number,
-                'product': bmr.product.product_name,
-                'comment_type': 'BMR Regulatory Comments',
-                'phase': 'Regulatory Approval',
-                'user': bmr.approved_by.get_full_name() if bmr.approved_by else 'Unknown',
-                'user_role': bmr.approved_by.role if bmr.approved_by else 'Unknown',
-                'date': bmr.approved_date or bmr.modified_date,
-                'comments': bmr.regulatory_comments,
-                'status': bmr.status,
-                'bmr_id': bmr.id
-            })
+        bmrs = bmrs.filter(Q(created_by=request.user) | Q(approved_by=request.user))
     
     # 2. Phase Level Comments
-    if is_admin:
-        # Admin sees all phases
-        phases = BatchPhaseExecution.objects.all().select_related(
-            'bmr', 'bmr__product', 'phase', 'started_by', 'completed_by'
-        )
-    else:
+    phases = BatchPhaseExecution.objects.select_related(
+        'bmr', 'bmr__product', 'phase', 'started_by', 'completed_by'
+    )
+    if not is_admin:
         # Operators only see phases they were involved in
-        phases = BatchPhaseExecution.objects.filter(
+        phases = phases.filter(
             Q(started_by=request.user) | 
             Q(completed_by=request.user) |
             Q(bmr__created_by=request.user)
-        ).select_related(
-            'bmr', 'bmr__product', 'phase', 'started_by', 'completed_by'
         )
     
-    for phase in phases:
-        # Operator Comments
-        if phase.operator_comments:
-            comments_data.append({
-                'bmr_number': phase.bmr.batch_number,
-                'product': phase.bmr.product.product_name,
-                'comment_type': 'Operator Comments',
-                'phase': phase.phase.get_phase_name_display(),
-                'user': phase.completed_by.get_full_name() if phase.completed_by else 'Unknown',
-                'user_role': phase.completed_by.role if phase.completed_by else 'Unknown',
-                'date': phase.completed_date or phase.created_date,
-                'comments': phase.operator_comments,
-                'status': phase.status,
-                'bmr_id': phase.bmr.id,
-                'phase_id': phase.id
-            })
-        
-        # QA Comments
-        if phase.qa_comments:
-            comments_data.append({
-                'bmr_number': phase.bmr.batch_number,
-                'product': phase.bmr.product.product_name,
-                'comment_type': 'Phase QA Comments',
-                'phase': phase.phase.get_phase_name_display(),
-                'user': phase.completed_by.get_full_name() if phase.completed_by else 'Unknown',
-                'user_role': phase.completed_by.role if phase.completed_by else 'Unknown',
-                'date': phase.completed_date or phase.created_date,
-                'comments': phase.qa_comments,
-                'status': phase.status,
-                'bmr_id': phase.bmr.id,
-                'phase_id': phase.id
-            })
-        
-        # Rejection Reasons
-        if phase.rejection_reason:
-            comments_data.append({
-                'bmr_number': phase.bmr.batch_number,
-                'product': phase.bmr.product.product_name,
-                'comment_type': 'Rejection Reason',
-                'phase': phase.phase.get_phase_name_display(),
-                'user': phase.completed_by.get_full_name() if phase.completed_by else 'Unknown',
-                'user_role': phase.completed_by.role if phase.completed_by else 'Unknown',
-                'date': phase.completed_date or phase.created_date,
-                'comments': phase.rejection_reason,
-                'status': phase.status,
-                'bmr_id': phase.bmr.id,
-                'phase_id': phase.id
-            })
-    
     # 3. Signature Comments
-    if is_admin:
-        # Admin sees all signatures
-        signatures = BMRSignature.objects.all().select_related('bmr', 'bmr__product', 'signed_by')
-    else:
+    signatures = BMRSignature.objects.select_related('bmr', 'bmr__product', 'signed_by')
+    if not is_admin:
         # Operators only see signatures they made or on BMRs they created
-        signatures = BMRSignature.objects.filter(
-            Q(signed_by=request.user) |
-            Q(bmr__created_by=request.user)
-        ).select_related('bmr', 'bmr__product', 'signed_by')
-    
-    for signature in signatures:
-        if signature.comments:
-            # Get user role from user's groups
-            user_role = signature.signed_by.groups.first().name if signature.signed_by.groups.exists() else 'Staff'
-            
-            comments_data.append({
-                'bmr_number': signature.bmr.batch_number,
-                'product': signature.bmr.product.product_name,
-                'comment_type': 'Electronic Signature',
-                'phase': f"Signature - {signature.get_signature_type_display()}",
-                'user': signature.signed_by.get_full_name() if signature.signed_by else 'Unknown',
-                'user_role': user_role,
-                'date': signature.signed_date,
-                'comments': signature.comments,
-                'status': 'Signed',
-                'bmr_id': signature.bmr.id,
-                'signature_id': signature.id
-            })
-    
-    # Sort by date (newest first)
-    comments_data.sort(key=lambda x: x['date'] or datetime.min, reverse=True)
-    
-    # Apply filters from the request
-    bmr_filter = request.GET.get('bmr')
-    comment_type_filter = request.GET.get('type')
-    user_role_filter = request.GET.get('role')
+        signatures = signatures.filter(Q(signed_by=request.user) | Q(bmr__created_by=request.user))
     
     if bmr_filter:
-        comments_data = [c for c in comments_data if bmr_filter.lower() in c['bmr_number'].lower()]
-    
-    if comment_type_filter:
-        comments_data = [c for c in comments_data if c['comment_type'] == comment_type_filter]
-    
-    if user_role_filter:
-        comments_data = [c for c in comments_data if c['user_role'] == user_role_filter]
+        bmrs = bmrs.filter(batch_number__icontains=bmr_filter)
+        phases = phases.filter(bmr__batch_number__icontains=bmr_filter)
+        signatures = signatures.filter(bmr__batch_number__icontains=bmr_filter)
+    
+    # Each source yields its rows newest first; unapproved regulatory comments use the creation date
+    sources = {
+        'BMR QA Comments': lambda: _bmr_comments(
+            bmrs, 'qa_comments', 'BMR QA Comments', 'BMR Creation', 'created_by', F('created_date')
+        ),
+        'BMR Regulatory Comments': lambda: _bmr_comments(
+            bmrs, 'regulatory_comments', 'BMR Regulatory Comments', 'Regulatory Approval', 'approved_by',
+            Coalesce('approved_date', 'created_date'),
+        ),
+        'Operator Comments': lambda: _phase_comments(phases, 'operator_comments', 'Operator Comments'),
+        'Phase QA Comments': lambda: _phase_comments(phases, 'qa_comments', 'Phase QA Comments'),
+        'Rejection Reason': lambda: _phase_comments(phases, 'rejection_reason', 'Rejection Reason'),
+        'Electronic Signature': lambda: _signature_comments(signatures),
+    }
+    streams = [
+        source() for comment_type, source in sources.items()
+        if not comment_type_filter or comment_type == comment_type_filter
+    ]
     
-    return comments_data
+    # Sort by date (newest first)
+    for comment in heapq.merge(*streams, key=lambda c: c['date'], reverse=True):
+        if user_role_filter and comment['user_role'] != user_role_filter:
+            continue
+        yield comment
+
+def get_filtered_comments_data(request):
+    """Helper function to get comments data with filters applied"""
+    return list(iter_filtered_comments(request))
 
 @login_required
 def comments_report_view(request):
@@ -236,44 +219,45 @@ def comments_report_view(request):
     
     return render(request, 'reports/comments_report.html', context)
 
+def _comments_csv_rows(comments):
+    """Rows of the comments CSV: header, then one row per comment"""
+    comments = iter(comments)
+    first = next(comments, None)
+    if first is None:
+        yield ['No comments found in the system']
+        return
+    
+    yield ['BMR Number', 'Product', 'Comment Type', 'Phase', 'Date', 'Comments', 'Status']
+    for comment in itertools.chain([first], comments):
+        yield [
+            comment['bmr_number'],
+            comment['product'],
+            comment['comment_type'],
+            comment['phase'],
+            comment['date'].strftime('%Y-%m-%d %H:%M:%S') if comment['date'] else '',
+            comment['comments'],
+            comment['status'],
+        ]
+
 @login_required
 def export_comments_csv(request):
     """Export comments to CSV format with role-based filtering"""
-    
-    # Get filtered comments data
-    raw_comments = get_filtered_comments_data(request)
-    
-    # Format data for CSV
-    comments_data = []
-    for comment in raw_comments:
-        comments_data.append({
-            'BMR Number': comment['bmr_number'],
-            'Product': comment['product'],
-            'Comment Type': comment['comment_type'],
-            'Phase': comment['phase'],
-            'Date': comment['date'].strftime('%Y-%m-%d %H:%M:%S') if comment['date'] else '',
-            'Comments': comment['comments'],
-            'Status': comment['status']
-        })
-    
-    # Create CSV response
-    response = HttpResponse(content_type='text/csv')
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    response['Content-Disposition'] = f'attachment; filename="KPI_Comments_Report_{timestamp}.csv"'
-    
-    if comments_data:
-        writer = csv.DictWriter(response, fieldnames=comments_data[0].keys())
-        writer.writeheader()
-        writer.writerows(comments_data)
-    else:
-        writer = csv.writer(response)
-        writer.writerow(['No comments found in the system'])
-    
-    return response
+    return streaming_csv_response(
+        _comments_csv_rows(iter_filtered_comments(request)),
+        f'KPI_Comments_Report_{timestamp}.csv',
+    )
 
 @login_required
 def export_comments_word(request):
-    """Export comments to Word format with role-based filtering"""
+    """Export comments to Word format with role-based filtering (built by the export worker)"""
+    if importlib.util.find_spec('docx') is None:
+        return HttpResponse("python-docx library not installed. Please install it to use Word export.", 
+                          content_type="text/plain")
+    return queue_export(request, 'comments_word')
+
+def build_comments_word(request):
+    """Comments Word document, grouped by BMR"""
     try:
         from docx import Document
         from docx.shared import Inches, Pt, RGBColor
@@ -398,56 +382,33 @@ def export_comments_word(request):
     doc.save(response)
     return response
 
-@login_required
 @login_required
 def export_comments_excel(request):
-    """Export comments to Excel format with role-based filtering"""
-    try:
-        import pandas as pd
-        from io import BytesIO
-    except ImportError:
-        return HttpResponse("pandas library not installed. Please install it to use Excel export.", 
-                          content_type="text/plain")
-    
-    # Get filtered comments data
-    raw_comments = get_filtered_comments_data(request)
-    
-    # Format data for Excel
-    comments_data = []
-    for comment in raw_comments:
-        comments_data.append({
-            'BMR Number': comment['bmr_number'],
-            'Product': comment['product'],
-            'Comment Type': comment['comment_type'],
-            'Phase': comment['phase'],
-            'Date': comment['date'].strftime('%Y-%m-%d %H:%M:%S') if comment['date'] else '',
-            'Comments': comment['comments'],
-            'Status': comment['status']
-        })
-    
-    # Create Excel file
-    output = BytesIO()
-    if comments_data:
-        df = pd.DataFrame(comments_data)
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='Comments Report', index=False)
-    else:
-        # Create empty dataframe with headers
-        df = pd.DataFrame(columns=['BMR Number', 'Product', 'Comment Type', 'Phase', 'User', 'User Role', 'Date', 'Comments', 'Status'])
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='Comments Report', index=False)
-    
-    output.seek(0)
-    
-    # Prepare response
-    response = HttpResponse(
-        output.getvalue(),
-        content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    """Export comments to Excel format with role-based filtering (built by the export worker)"""
+    return queue_export(request, 'comments_excel')
+
+def build_comments_excel(request):
+    """Comments Excel workbook, written as the comments are read"""
+    book = Spreadsheet()
+    sheet = book.add_sheet(
+        'Comments Report', widths=[16, 28, 22, 22, 20, 60, 14], freeze='A2',
     )
-    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-    response['Content-Disposition'] = f'attachment; filename="KPI_Comments_Report_{timestamp}.xlsx"'
+    sheet.append(
+        ['BMR Number', 'Product', 'Comment Type', 'Phase', 'Date', 'Comments', 'Status'], style='header'
+    )
+    for comment in iter_filtered_comments(request):
+        sheet.append([
+            comment['bmr_number'],
+            comment['product'],
+            comment['comment_type'],
+            comment['phase'],
+            comment['date'] or '',
+            comment['comments'],
+            comment['status']
+        ], style='cell', styles={4: 'datetime', 5: 'wrapped'})
     
-    return response
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    return book.response(f'KPI_Comments_Report_{timestamp}.xlsx')
 
 @login_required
 def bmr_comments_detail(request, bmr_id):
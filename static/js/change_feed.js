@@ -0,0 +1,91 @@
+// Change feed client for live screens.
+//
+// Polls ?since=<seq> and hands each batch of changed rows to the page. Where
+// the server enables the server-sent events stream (streamUrl is set), it
+// subscribes to that instead, and falls back to polling when the browser has
+// no EventSource or the stream is refused or keeps failing.
+//
+//   ChangeFeed.subscribe({
+//       streamUrl: '/dashboards/changes/stream/',
+//       pollUrl: '/dashboards/changes/',
+//       since: 42,
+//       sources: ['phase', 'fgs'],
+//       onEvents: function(events) { ... },
+//   });
+(function(window) {
+    'use strict';
+
+    function buildUrl(base, params) {
+        var query = Object.keys(params)
+            .filter(function(key) { return params[key] !== null && params[key] !== undefined && params[key] !== ''; })
+            .map(function(key) { return encodeURIComponent(key) + '=' + encodeURIComponent(params[key]); })
+            .join('&');
+        return query ? base + (base.indexOf('?') === -1 ? '?' : '&') + query : base;
+    }
+
+    function subscribe(options) {
+        var since = options.since === undefined ? null : options.since;
+        var sources = (options.sources || []).join(',');
+        var pollInterval = options.pollInterval || 15000;
+        var maxStreamErrors = options.maxStreamErrors || 3;
+        var streamErrors = 0;
+        var source = null;
+        var timer = null;
+
+        function deliver(events) {
+            if (!events.length) return;
+            since = events[events.length - 1].seq;
+            options.onEvents(events);
+        }
+
+        function poll() {
+            fetch(buildUrl(options.pollUrl, {since: since, source: sources}), {
+                headers: {'Accept': 'application/json'},
+                credentials: 'same-origin'
+            })
+                .then(function(response) { return response.json(); })
+                .then(function(data) {
+                    if (since === null) {
+                        since = data.last_seq;
+                    } else {
+                        deliver(data.events);
+                    }
+                    timer = setTimeout(poll, data.has_more ? 0 : pollInterval);
+                })
+                .catch(function() { timer = setTimeout(poll, pollInterval); });
+        }
+
+        function stream() {
+            source = new EventSource(buildUrl(options.streamUrl, {since: since, source: sources}));
+            source.addEventListener('change', function(message) {
+                streamErrors = 0;
+                deliver([JSON.parse(message.data)]);
+            });
+            source.addEventListener('error', function() {
+                // EventSource reconnects by itself (sending Last-Event-ID);
+                // only give up on it when it keeps failing
+                streamErrors += 1;
+                if (source.readyState === EventSource.CLOSED || streamErrors >= maxStreamErrors) {
+                    source.close();
+                    source = null;
+                    poll();
+                }
+            });
+        }
+
+        if (window.EventSource && options.streamUrl) {
+            stream();
+        } else {
+            poll();
+        }
+
+        return {
+            close: function() {
+                if (source) source.close();
+                if (timer) clearTimeout(timer);
+            }
+        };
+    }
+
+    window.ChangeFeed = {subscribe: subscribe};
+})(window);
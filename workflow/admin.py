@@ -1,5 +1,8 @@
 from django.contrib import admin
-from .models import ProductionPhase, BatchPhaseExecution, Machine
+from .models import (
+    ProductionPhase, BatchPhaseExecution, Machine, BMRProgress, OperatorDailyStats, OperatorBatchDay, ChangeEvent, EventWatermark,
+    PhaseEvent, PhaseStats,
+)
 
 @admin.register(Machine)
 class MachineAdmin(admin.ModelAdmin):
@@ -60,3 +63,60 @@ class BatchPhaseExecutionAdmin(admin.ModelAdmin):
     
     def get_queryset(self, request):
         return super().get_queryset(request).select_related('bmr', 'phase', 'started_by', 'completed_by', 'machine_used')
+
+@admin.register(BMRProgress)
+class BMRProgressAdmin(admin.ModelAdmin):
+    list_display = ['bmr', 'percent_complete', 'completed_count', 'total_phases', 'current_execution', 'last_activity']
+    search_fields = ['bmr__batch_number']
+    ordering = ['-last_activity']
+    readonly_fields = [field.name for field in BMRProgress._meta.fields]
+
+@admin.register(OperatorDailyStats)
+class OperatorDailyStatsAdmin(admin.ModelAdmin):
+    list_display = ['operator', 'day', 'phase_name', 'completions', 'attempts', 'active_minutes']
+    list_filter = ['day', 'phase_name']
+    search_fields = ['operator__username', 'operator__first_name', 'operator__last_name']
+    date_hierarchy = 'day'
+    readonly_fields = [field.name for field in OperatorDailyStats._meta.fields]
+
+@admin.register(OperatorBatchDay)
+class OperatorBatchDayAdmin(admin.ModelAdmin):
+    list_display = ['operator', 'bmr', 'day', 'completions']
+    search_fields = ['operator__username', 'bmr__batch_number']
+    date_hierarchy = 'day'
+    readonly_fields = [field.name for field in OperatorBatchDay._meta.fields]
+
+@admin.register(ChangeEvent)
+class ChangeEventAdmin(admin.ModelAdmin):
+    list_display = ['sequence', 'source', 'object_id', 'bmr', 'action', 'created_at']
+    list_filter = ['source', 'action']
+    ordering = ['-sequence']
+    readonly_fields = [field.name for field in ChangeEvent._meta.fields]
+
+@admin.register(PhaseEvent)
+class PhaseEventAdmin(admin.ModelAdmin):
+    list_display = ['sequence', 'bmr', 'phase_name', 'action', 'user', 'created_at']
+    list_filter = ['action', 'phase_name']
+    search_fields = ['bmr__batch_number']
+    date_hierarchy = 'created_at'
+    ordering = ['-sequence']
+    readonly_fields = [field.name for field in PhaseEvent._meta.fields]
+
+    # The log is append-only
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+@admin.register(EventWatermark)
+class EventWatermarkAdmin(admin.ModelAdmin):
+    list_display = ['consumer', 'sequence', 'updated_at']
+    readonly_fields = [field.name for field in EventWatermark._meta.fields]
+
+@admin.register(PhaseStats)
+class PhaseStatsAdmin(admin.ModelAdmin):
+    list_display = ['product_type', 'phase_name', 'starts', 'completions', 'failures', 'rollbacks', 'updated_at']
+    list_filter = ['product_type']
+    search_fields = ['phase_name']
+    readonly_fields = [field.name for field in PhaseStats._meta.fields]
@@ -0,0 +1,284 @@
+"""
+Machine performance (availability, downtime, utilization) for the admin pages.
+
+Running time comes from the started/completed dates of phase executions that
+used a machine; downtime comes from the recorded breakdown and changeover
+intervals. Overlapping intervals are merged with a sweep-line so a machine is
+never counted as running or down twice for the same minute.
+
+Metrics are computed per local calendar day and cached per day bucket. Past
+days rarely change, so once history is cached only today's bucket (and any
+day invalidated by a phase save) is recomputed, and all missing days are
+filled from a single query.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from .models import BatchPhaseExecution, Machine
+
+
+# Shift windows within a local day as (name, start hour, end hour). The night
+# shift wraps midnight, so within one day bucket it covers both ends of the day.
+SHIFTS = (
+    ('night', 0, 6),
+    ('morning', 6, 14),
+    ('afternoon', 14, 22),
+    ('night', 22, 24),
+)
+SHIFT_NAMES = ('morning', 'afternoon', 'night')
+SHIFT_MINUTES = 8 * 60
+
+DAY_MINUTES = 24 * 60
+CACHE_PREFIX = 'machine_performance:day'
+PAST_DAY_TIMEOUT = 24 * 60 * 60
+TODAY_TIMEOUT = 5 * 60
+
+
+def _day_key(day):
+    return f"{CACHE_PREFIX}:{day.isoformat()}"
+
+
+def _day_window(day):
+    start = timezone.make_aware(datetime.combine(day, time.min))
+    return start, start + timedelta(days=1)
+
+
+def covered_minutes(intervals, window_start, window_end):
+    """Sweep-line: minutes within the window covered by at least one interval"""
+    events = []
+    for start, end in intervals:
+        start = max(start, window_start)
+        end = min(end, window_end)
+        if start < end:
+            events.append((start, 1))
+            events.append((end, -1))
+    events.sort()
+
+    covered = 0.0
+    depth = 0
+    previous = None
+    for moment, delta in events:
+        if depth > 0:
+            covered += (moment - previous).total_seconds()
+        depth += delta
+        previous = moment
+    return covered / 60
+
+
+def _reason(text):
+    text = (text or '').strip()
+    return text[:100] if text else 'Unspecified'
+
+
+def _collect_intervals(window_start, window_end, now):
+    """Load every machine interval overlapping the window in one query"""
+    overlaps_run = Q(started_date__lt=window_end) & (
+        Q(completed_date__gte=window_start) | Q(completed_date__isnull=True)
+    )
+    overlaps_breakdown = Q(breakdown_occurred=True, breakdown_start_time__lt=window_end) & (
+        Q(breakdown_end_time__gte=window_start) | Q(breakdown_end_time__isnull=True)
+    )
+    overlaps_changeover = Q(changeover_occurred=True, changeover_start_time__lt=window_end) & (
+        Q(changeover_end_time__gte=window_start) | Q(changeover_end_time__isnull=True)
+    )
+    rows = BatchPhaseExecution.objects.filter(
+        Q(machine_used__isnull=False) & (overlaps_run | overlaps_breakdown | overlaps_changeover)
+    ).order_by().values_list(
+        'machine_used_id', 'started_date', 'completed_date',
+        'breakdown_occurred', 'breakdown_start_time', 'breakdown_end_time', 'breakdown_reason',
+        'changeover_occurred', 'changeover_start_time', 'changeover_end_time', 'changeover_reason',
+    )
+
+    runs = defaultdict(list)
+    events = defaultdict(list)  # machine_id -> [(category, reason, start, end)]
+    for (machine_id, started, completed,
+         breakdown, breakdown_start, breakdown_end, breakdown_reason,
+         changeover, changeover_start, changeover_end, changeover_reason) in rows:
+        if started:
+            runs[machine_id].append((started, completed or now))
+        # Open-ended events run until the phase completes (or until now)
+        if breakdown and breakdown_start:
+            end = breakdown_end or completed or now
+            events[machine_id].append(('breakdown', _reason(breakdown_reason), breakdown_start, end))
+        if changeover and changeover_start:
+            end = changeover_end or completed or now
+            events[machine_id].append(('changeover', _reason(changeover_reason), changeover_start, end))
+    return runs, events
+
+
+def _compute_days(days, now):
+    """Build metric buckets for the given (contiguous or not) days from one query"""
+    window_start = _day_window(min(days))[0]
+    window_end = _day_window(max(days))[1]
+    runs, events = _collect_intervals(window_start, window_end, now)
+
+    buckets = {}
+    for day in days:
+        day_start, day_end = _day_window(day)
+        bucket = {}
+        for machine_id in set(runs) | set(events):
+            machine_runs = runs.get(machine_id, [])
+            machine_events = events.get(machine_id, [])
+            breakdowns = [(s, e) for category, _, s, e in machine_events if category == 'breakdown']
+            changeovers = [(s, e) for category, _, s, e in machine_events if category == 'changeover']
+
+            shift_minutes = dict.fromkeys(SHIFT_NAMES, 0.0)
+            for name, start_hour, end_hour in SHIFTS:
+                shift_minutes[name] += covered_minutes(
+                    machine_runs,
+                    day_start + timedelta(hours=start_hour),
+                    day_start + timedelta(hours=end_hour),
+                )
+
+            pareto = defaultdict(float)
+            for category, reason, start, end in machine_events:
+                minutes = covered_minutes([(start, end)], day_start, day_end)
+                if minutes:
+                    pareto[(category, reason)] += minutes
+
+            metrics = {
+                'run_minutes': sum(shift_minutes.values()),
+                'breakdown_minutes': covered_minutes(breakdowns, day_start, day_end),
+                'changeover_minutes': covered_minutes(changeovers, day_start, day_end),
+                'downtime_minutes': covered_minutes(breakdowns + changeovers, day_start, day_end),
+                'shift_run_minutes': shift_minutes,
+                'pareto': dict(pareto),
+            }
+            if metrics['run_minutes'] or metrics['downtime_minutes']:
+                bucket[machine_id] = metrics
+        buckets[day] = bucket
+    return buckets
+
+
+def get_day_buckets(start_day, end_day):
+    """Per-day machine metrics for start_day..end_day inclusive, served from cache where possible"""
+    now = timezone.now()
+    today = timezone.localdate(now)
+    days = [start_day + timedelta(days=offset) for offset in range((end_day - start_day).days + 1)]
+
+    cached = cache.get_many([_day_key(day) for day in days])
+    buckets = {day: cached[_day_key(day)] for day in days if _day_key(day) in cached}
+    missing = [day for day in days if day not in buckets]
+    if missing:
+        computed = _compute_days(missing, now)
+        buckets.update(computed)
+        past = {_day_key(day): bucket for day, bucket in computed.items() if day < today}
+        if past:
+            cache.set_many(past, PAST_DAY_TIMEOUT)
+        if today in computed:
+            cache.set(_day_key(today), computed[today], TODAY_TIMEOUT)
+    return buckets
+
+
+def invalidate_machine_days(activity, previous=None):
+    """
+    Drop cached day buckets touched by a phase execution's machine intervals,
+    as written (``activity``) and as loaded (``previous``), both from
+    ``_machine_activity()``. A rollback clears the dates the phase ran on, so
+    those days are only known from before the write.
+    """
+    keys = set()
+    for machine_id, moments in filter(None, (activity, previous)):
+        days = [timezone.localdate(moment) for moment in moments if moment] if machine_id else None
+        if not days:
+            continue
+        first, last = min(days), max(days)
+        keys.update(_day_key(first + timedelta(days=offset)) for offset in range((last - first).days + 1))
+    if keys:
+        cache.delete_many(list(keys))
+
+
+def machine_usage_counts():
+    """All-time usage, breakdown and changeover counts per machine in one grouped query"""
+    rows = BatchPhaseExecution.objects.filter(machine_used__isnull=False).order_by().values('machine_used_id').annotate(
+        usage_count=Count('id'),
+        breakdown_count=Count('id', filter=Q(breakdown_occurred=True)),
+        changeover_count=Count('id', filter=Q(changeover_occurred=True)),
+    )
+    return {row.pop('machine_used_id'): row for row in rows}
+
+
+def _percent(part, whole):
+    return round(part / whole * 100, 1) if whole else None
+
+
+def get_machine_performance(days=7, end_day=None, machines=None):
+    """
+    Availability, downtime and utilization per machine over the last ``days`` days.
+
+    Returns a dict with ``machines`` (one row per machine), ``daily`` (per-day
+    utilization per machine id), ``pareto`` (downtime by category and reason,
+    largest first, with cumulative percentages) and the window bounds.
+    """
+    end_day = end_day or timezone.localdate()
+    start_day = end_day - timedelta(days=days - 1)
+    buckets = get_day_buckets(start_day, end_day)
+    if machines is None:
+        machines = Machine.objects.all()
+
+    totals = defaultdict(lambda: {
+        'run_minutes': 0.0, 'breakdown_minutes': 0.0, 'changeover_minutes': 0.0,
+        'downtime_minutes': 0.0, 'shift_run_minutes': dict.fromkeys(SHIFT_NAMES, 0.0),
+    })
+    pareto = defaultdict(float)
+    daily = []
+    for day in sorted(buckets):
+        daily.append({
+            'day': day,
+            'utilization': {
+                machine_id: _percent(metrics['run_minutes'], DAY_MINUTES)
+                for machine_id, metrics in buckets[day].items()
+            },
+        })
+        for machine_id, metrics in buckets[day].items():
+            total = totals[machine_id]
+            for field in ('run_minutes', 'breakdown_minutes', 'changeover_minutes', 'downtime_minutes'):
+                total[field] += metrics[field]
+            for name, minutes in metrics['shift_run_minutes'].items():
+                total['shift_run_minutes'][name] += minutes
+            for key, minutes in metrics['pareto'].items():
+                pareto[key] += minutes
+
+    rows = []
+    for machine in machines:
+        total = totals[machine.id]
+        run = total['run_minutes']
+        rows.append({
+            'machine': machine,
+            'run_minutes': round(run, 1),
+            'breakdown_minutes': round(total['breakdown_minutes'], 1),
+            'changeover_minutes': round(total['changeover_minutes'], 1),
+            'downtime_minutes': round(total['downtime_minutes'], 1),
+            'availability': _percent(max(run - total['downtime_minutes'], 0), run),
+            'utilization': _percent(run, days * DAY_MINUTES),
+            'shift_utilization': {
+                name: _percent(minutes, days * SHIFT_MINUTES)
+                for name, minutes in total['shift_run_minutes'].items()
+            },
+        })
+
+    pareto_rows = []
+    total_downtime = sum(pareto.values())
+    cumulative = 0.0
+    for (category, reason), minutes in sorted(pareto.items(), key=lambda item: item[1], reverse=True):
+        cumulative += minutes
+        pareto_rows.append({
+            'category': category,
+            'reason': reason,
+            'minutes': round(minutes, 1),
+            'percent': _percent(minutes, total_downtime),
+            'cumulative_percent': _percent(cumulative, total_downtime),
+        })
+
+    return {
+        'start_day': start_day,
+        'end_day': end_day,
+        'days': days,
+        'machines': rows,
+        'daily': daily,
+        'pareto': pareto_rows,
+    }
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+
+from bmr.models import BMR
+from workflow.services import WorkflowService
+
+
+class Command(BaseCommand):
+    help = 'Create missing workflow phase executions in bulk, e.g. after importing BMRs'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--bmr',
+            type=int,
+            action='append',
+            dest='bmr_ids',
+            help='Only initialize the given BMR id (can be repeated); default is every BMR without phases',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of BMRs initialized per transaction',
+        )
+
+    def handle(self, *args, **options):
+        if options['bmr_ids']:
+            bmrs = BMR.objects.filter(pk__in=options['bmr_ids'])
+        else:
+            bmrs = BMR.objects.filter(phase_executions__isnull=True)
+        bmr_ids = list(bmrs.order_by('pk').values_list('pk', flat=True))
+        
+        batch_size = options['batch_size']
+        created = 0
+        for start in range(0, len(bmr_ids), batch_size):
+            chunk = BMR.objects.filter(pk__in=bmr_ids[start:start + batch_size])
+            created += WorkflowService.initialize_workflows(chunk, batch_size=batch_size)
+        self.stdout.write(
+            self.style.SUCCESS(f'Created {created} phase execution(s) for {len(bmr_ids)} BMR(s)')
+        )
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from workflow.models import PhaseStats
+
+
+class Command(BaseCommand):
+    help = 'Fold the phase events added since the last run into the phase statistics'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='Recompute the statistics by replaying the whole phase event log',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of events to read per query',
+        )
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            count = PhaseStats.rebuild(batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} phase statistics row(s)'))
+            return
+        count = PhaseStats.catch_up(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Processed {count} phase event(s)'))
@@ -0,0 +1,27 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from workflow.models import ChangeEvent
+
+
+class Command(BaseCommand):
+    help = 'Delete change feed events older than the retention period'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=7,
+            help='Keep events from the last N days (default 7)',
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        # Never delete the newest event, so the sequence keeps increasing
+        latest = ChangeEvent.latest_sequence()
+        deleted, _ = ChangeEvent.objects.filter(created_at__lt=cutoff, sequence__lt=latest).delete()
+        self.stdout.write(
+            self.style.SUCCESS(f'Deleted {deleted} change event(s) older than {options["days"]} day(s)')
+        )
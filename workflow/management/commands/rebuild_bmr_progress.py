@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from workflow.models import BMRProgress
+
+
+class Command(BaseCommand):
+    help = 'Regenerate the per-BMR progress summaries from phase executions'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--bmr',
+            type=int,
+            action='append',
+            dest='bmr_ids',
+            help='Only rebuild the given BMR id (can be repeated)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of summaries to insert per query',
+        )
+
+    def handle(self, *args, **options):
+        count = BMRProgress.rebuild(bmr_ids=options['bmr_ids'], batch_size=options['batch_size'])
+        self.stdout.write(
+            self.style.SUCCESS(f'Rebuilt progress summaries for {count} BMR(s)')
+        )
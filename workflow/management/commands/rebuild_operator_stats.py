@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from workflow.models import OperatorDailyStats
+
+
+class Command(BaseCommand):
+    help = 'Regenerate the per-operator daily productivity rollups from phase executions'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--operator',
+            type=int,
+            action='append',
+            dest='operator_ids',
+            help='Only rebuild the given user id (can be repeated)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of rollups to insert per query',
+        )
+
+    def handle(self, *args, **options):
+        count = OperatorDailyStats.rebuild(operator_ids=options['operator_ids'], batch_size=options['batch_size'])
+        self.stdout.write(
+            self.style.SUCCESS(f'Rebuilt {count} operator daily rollup(s)')
+        )
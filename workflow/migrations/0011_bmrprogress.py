@@ -0,0 +1,79 @@
+# Generated by Django 4.2.7 on 2026-10-17 03:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def populate_progress(apps, schema_editor):
+    """Build the initial summaries from existing phase executions"""
+    BMR = apps.get_model('bmr', 'BMR')
+    BatchPhaseExecution = apps.get_model('workflow', 'BatchPhaseExecution')
+    BMRProgress = apps.get_model('workflow', 'BMRProgress')
+    statuses = ['not_ready', 'pending', 'in_progress', 'completed', 'failed', 'skipped', 'rolled_back']
+
+    rows = BatchPhaseExecution.objects.order_by().values('bmr_id').annotate(
+        total_phases=models.Count('id'),
+        last_started=models.Max('started_date'),
+        last_completed=models.Max('completed_date'),
+        **{f"{status}_count": models.Count('id', filter=models.Q(status=status)) for status in statuses}
+    )
+    rows = {row.pop('bmr_id'): row for row in rows}
+
+    current = {}
+    active = BatchPhaseExecution.objects.filter(
+        status__in=['pending', 'in_progress']
+    ).order_by('bmr_id', 'phase__phase_order').values_list('bmr_id', 'pk')
+    for bmr_id, execution_id in active:
+        current.setdefault(bmr_id, execution_id)
+
+    now = django.utils.timezone.now()
+    summaries = []
+    for bmr_id in BMR.objects.values_list('pk', flat=True):
+        row = rows.get(bmr_id, {})
+        activity = [d for d in (row.pop('last_started', None), row.pop('last_completed', None)) if d]
+        total = row.get('total_phases', 0)
+        summaries.append(BMRProgress(
+            bmr_id=bmr_id,
+            current_execution_id=current.get(bmr_id),
+            percent_complete=int(row['completed_count'] * 100 / total) if total else 0,
+            last_activity=max(activity) if activity else None,
+            updated_at=now,
+            **row
+        ))
+    BMRProgress.objects.bulk_create(summaries, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bmr', '0005_bmr_manufacturing_date'),
+        ('workflow', '0010_batchphaseexecution_rework_count_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BMRProgress',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_phases', models.IntegerField(default=0)),
+                ('not_ready_count', models.IntegerField(default=0)),
+                ('pending_count', models.IntegerField(default=0)),
+                ('in_progress_count', models.IntegerField(default=0)),
+                ('completed_count', models.IntegerField(default=0)),
+                ('failed_count', models.IntegerField(default=0)),
+                ('skipped_count', models.IntegerField(default=0)),
+                ('rolled_back_count', models.IntegerField(default=0)),
+                ('percent_complete', models.IntegerField(default=0)),
+                ('last_activity', models.DateTimeField(blank=True, db_index=True, null=True)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('bmr', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='progress', to='bmr.bmr')),
+                ('current_execution', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='workflow.batchphaseexecution')),
+            ],
+            options={
+                'verbose_name': 'BMR Progress',
+                'verbose_name_plural': 'BMR Progress',
+            },
+        ),
+        migrations.RunPython(populate_progress, migrations.RunPython.noop),
+    ]
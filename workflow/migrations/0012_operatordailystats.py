@@ -0,0 +1,89 @@
+# Generated by Django 4.2.7 on 2026-10-17 04:02
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def populate_operator_stats(apps, schema_editor):
+    """Build the initial daily rollups from existing phase executions"""
+    BatchPhaseExecution = apps.get_model('workflow', 'BatchPhaseExecution')
+    OperatorDailyStats = apps.get_model('workflow', 'OperatorDailyStats')
+    localdate = django.utils.timezone.localdate
+    now = django.utils.timezone.now()
+
+    completions = list(BatchPhaseExecution.objects.filter(
+        completed_by__isnull=False, completed_date__isnull=False
+    ).order_by().values_list('completed_by_id', 'bmr_id', 'phase__phase_name', 'started_date', 'completed_date'))
+    first_completed = {}
+    for operator_id, bmr_id, _, _, completed in completions:
+        key = (operator_id, bmr_id)
+        if key not in first_completed or completed < first_completed[key]:
+            first_completed[key] = completed
+
+    rollups = {}
+
+    def rollup(operator_id, day):
+        if (operator_id, day) not in rollups:
+            rollups[(operator_id, day)] = OperatorDailyStats(
+                operator_id=operator_id, day=day, updated_at=now, phase_counts={}
+            )
+        return rollups[(operator_id, day)]
+
+    batches = {}
+    for operator_id, bmr_id, phase_name, started, completed in completions:
+        day = localdate(completed)
+        row = rollup(operator_id, day)
+        row.completions += 1
+        row.phase_counts[phase_name] = row.phase_counts.get(phase_name, 0) + 1
+        if started and started <= completed:
+            row.timed_completions += 1
+            row.active_minutes += (completed - started).total_seconds() / 60
+        batches.setdefault((operator_id, day), set()).add(bmr_id)
+        if first_completed[(operator_id, bmr_id)] == completed:
+            row.new_batches += 1
+    for key, bmr_ids in batches.items():
+        rollups[key].distinct_batches = len(bmr_ids)
+
+    attempts = BatchPhaseExecution.objects.filter(
+        started_by__isnull=False, started_date__isnull=False
+    ).order_by().values_list('started_by_id', 'started_date')
+    for operator_id, started in attempts:
+        rollup(operator_id, localdate(started)).attempts += 1
+
+    OperatorDailyStats.objects.bulk_create(rollups.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('workflow', '0011_bmrprogress'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OperatorDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(db_index=True)),
+                ('completions', models.IntegerField(default=0)),
+                ('attempts', models.IntegerField(default=0, help_text='Phases started on this day')),
+                ('distinct_batches', models.IntegerField(default=0)),
+                ('new_batches', models.IntegerField(default=0, help_text='Batches this operator completed a phase on for the first time on this day')),
+                ('timed_completions', models.IntegerField(default=0)),
+                ('active_minutes', models.FloatField(default=0)),
+                ('phase_counts', models.JSONField(blank=True, default=dict)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('operator', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Operator Daily Stats',
+                'verbose_name_plural': 'Operator Daily Stats',
+                'ordering': ['-day'],
+                'unique_together': {('operator', 'day')},
+            },
+        ),
+        migrations.RunPython(populate_operator_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.7 on 2026-10-17 04:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bmr', '0005_bmr_manufacturing_date'),
+        ('workflow', '0012_operatordailystats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(choices=[('phase', 'Phase Execution'), ('quarantine', 'Quarantine Batch'), ('sample', 'Sample Request'), ('fgs', 'FGS Inventory'), ('release', 'Product Release')], max_length=20)),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('action', models.CharField(max_length=30)),
+                ('data', models.JSONField(blank=True, default=dict)),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('bmr', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='bmr.bmr')),
+            ],
+            options={
+                'ordering': ['id'],
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-17 04:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workflow', '0013_changeevent'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='batchphaseexecution',
+            index=models.Index(fields=['status', 'phase'], name='workflow_exec_status_phase'),
+        ),
+    ]
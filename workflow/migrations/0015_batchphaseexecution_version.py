@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-17 04:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workflow', '0014_batchphaseexecution_status_phase_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='batchphaseexecution',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
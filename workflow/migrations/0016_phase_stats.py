@@ -0,0 +1,55 @@
+# Generated by Django 4.2.7 on 2026-10-17 04:51
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workflow', '0015_batchphaseexecution_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('consumer', models.CharField(max_length=50, unique=True)),
+                ('sequence', models.PositiveBigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PhaseStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('product_type', models.CharField(max_length=20)),
+                ('phase_name', models.CharField(max_length=50)),
+                ('starts', models.IntegerField(default=0)),
+                ('completions', models.IntegerField(default=0)),
+                ('timed_completions', models.IntegerField(default=0, help_text='Completions with a start and end time')),
+                ('total_hours', models.FloatField(default=0)),
+                ('failures', models.IntegerField(default=0)),
+                ('rollbacks', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'verbose_name': 'Phase Stats',
+                'verbose_name_plural': 'Phase Stats',
+                'ordering': ['product_type', 'phase_name'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='changeevent',
+            index=models.Index(fields=['source', 'id'], name='changeevent_source_seq'),
+        ),
+        migrations.AddIndex(
+            model_name='changeevent',
+            index=models.Index(fields=['bmr', 'id'], name='changeevent_bmr_seq'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='phasestats',
+            unique_together={('product_type', 'phase_name')},
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 4.2.7 on 2026-10-17 04:54
+
+from django.db import migrations, models
+from django.db.models import Q
+
+
+def seconds(start, end):
+    return round((end - start).total_seconds()) if start and end else None
+
+
+def populate_durations(apps, schema_editor):
+    """Store the durations of the executions written before the columns existed"""
+    BatchPhaseExecution = apps.get_model('workflow', 'BatchPhaseExecution')
+    executions = BatchPhaseExecution.objects.filter(
+        Q(started_date__isnull=False, completed_date__isnull=False)
+        | Q(breakdown_occurred=True) | Q(changeover_occurred=True)
+    ).order_by()
+    fields = ['duration_seconds', 'net_duration_seconds', 'breakdown_seconds', 'changeover_seconds']
+    batch = []
+    for execution in executions.iterator(chunk_size=500):
+        started, completed = execution.started_date, execution.completed_date
+        breakdown_start, breakdown_end = execution.breakdown_start_time, execution.breakdown_end_time
+        if not execution.breakdown_occurred:
+            breakdown_start = breakdown_end = None
+        execution.duration_seconds = execution.net_duration_seconds = seconds(started, completed)
+        if execution.duration_seconds is not None and breakdown_start and breakdown_end:
+            lost = seconds(max(started, breakdown_start), min(completed, breakdown_end))
+            execution.net_duration_seconds -= max(lost, 0)
+        execution.breakdown_seconds = seconds(breakdown_start, breakdown_end) or 0
+        if execution.changeover_occurred:
+            execution.changeover_seconds = seconds(execution.changeover_start_time, execution.changeover_end_time) or 0
+        batch.append(execution)
+        if len(batch) == 500:
+            BatchPhaseExecution.objects.bulk_update(batch, fields)
+            batch = []
+    BatchPhaseExecution.objects.bulk_update(batch, fields)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workflow', '0016_phase_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='batchphaseexecution',
+            name='breakdown_seconds',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='batchphaseexecution',
+            name='changeover_seconds',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='batchphaseexecution',
+            name='duration_seconds',
+            field=models.IntegerField(blank=True, help_text='Start to completion', null=True),
+        ),
+        migrations.AddField(
+            model_name='batchphaseexecution',
+            name='net_duration_seconds',
+            field=models.IntegerField(blank=True, help_text='Start to completion, less the breakdown time in between', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='batchphaseexecution',
+            index=models.Index(fields=['phase', 'net_duration_seconds'], name='workflow_exec_phase_duration'),
+        ),
+        migrations.RunPython(populate_durations, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-17 05:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('workflow', '0017_duration_columns'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='batchphaseexecution',
+            index=models.Index(fields=['phase', 'status'], name='workflow_exec_phase_status'),
+        ),
+        migrations.AddIndex(
+            model_name='batchphaseexecution',
+            index=models.Index(fields=['completed_date'], name='workflow_exec_completed'),
+        ),
+        migrations.AddIndex(
+            model_name='batchphaseexecution',
+            index=models.Index(fields=['completed_by', 'completed_date'], name='workflow_exec_completed_by'),
+        ),
+        migrations.AddIndex(
+            model_name='batchphaseexecution',
+            index=models.Index(condition=models.Q(('breakdown_occurred', True)), fields=['-breakdown_start_time'], name='workflow_exec_breakdowns'),
+        ),
+        migrations.AddIndex(
+            model_name='batchphaseexecution',
+            index=models.Index(condition=models.Q(('changeover_occurred', True)), fields=['-changeover_start_time'], name='workflow_exec_changeovers'),
+        ),
+    ]
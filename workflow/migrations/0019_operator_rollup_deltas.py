@@ -0,0 +1,111 @@
+# Generated by Django 4.2.7 on 2026-10-17 09:10
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def clear_operator_stats(apps, schema_editor):
+    """The per-day rows are replaced by per-phase rows, rebuilt below"""
+    apps.get_model('workflow', 'OperatorDailyStats').objects.all().delete()
+
+
+def populate_operator_stats(apps, schema_editor):
+    """Build the per-phase daily rollups and batch days from existing phase executions"""
+    BatchPhaseExecution = apps.get_model('workflow', 'BatchPhaseExecution')
+    OperatorDailyStats = apps.get_model('workflow', 'OperatorDailyStats')
+    OperatorBatchDay = apps.get_model('workflow', 'OperatorBatchDay')
+    localdate = django.utils.timezone.localdate
+    now = django.utils.timezone.now()
+
+    daily, batches = {}, {}
+
+    def rollup(operator_id, day, phase_name):
+        key = (operator_id, day, phase_name)
+        if key not in daily:
+            daily[key] = OperatorDailyStats(operator_id=operator_id, day=day, phase_name=phase_name, updated_at=now)
+        return daily[key]
+
+    attempts = BatchPhaseExecution.objects.filter(
+        started_by__isnull=False, started_date__isnull=False
+    ).order_by().values_list('started_by_id', 'started_date', 'phase__phase_name')
+    for operator_id, started, phase_name in attempts.iterator():
+        rollup(operator_id, localdate(started), phase_name).attempts += 1
+
+    completions = BatchPhaseExecution.objects.filter(
+        status='completed', completed_by__isnull=False, completed_date__isnull=False
+    ).order_by().values_list('completed_by_id', 'bmr_id', 'phase__phase_name', 'started_date', 'completed_date')
+    for operator_id, bmr_id, phase_name, started, completed in completions.iterator():
+        day = localdate(completed)
+        row = rollup(operator_id, day, phase_name)
+        row.completions += 1
+        if started and started <= completed:
+            row.timed_completions += 1
+            row.active_minutes += (completed - started).total_seconds() / 60
+        key = (operator_id, bmr_id, day)
+        if key not in batches:
+            batches[key] = OperatorBatchDay(operator_id=operator_id, bmr_id=bmr_id, day=day, updated_at=now)
+        batches[key].completions += 1
+
+    OperatorDailyStats.objects.bulk_create(daily.values(), batch_size=500)
+    OperatorBatchDay.objects.bulk_create(batches.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bmr', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('workflow', '0018_hot_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_operator_stats, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='operatordailystats',
+            unique_together=set(),
+        ),
+        migrations.RemoveField(
+            model_name='operatordailystats',
+            name='distinct_batches',
+        ),
+        migrations.RemoveField(
+            model_name='operatordailystats',
+            name='new_batches',
+        ),
+        migrations.RemoveField(
+            model_name='operatordailystats',
+            name='phase_counts',
+        ),
+        migrations.AddField(
+            model_name='operatordailystats',
+            name='phase_name',
+            field=models.CharField(default='', max_length=50),
+            preserve_default=False,
+        ),
+        migrations.AlterModelOptions(
+            name='operatordailystats',
+            options={'ordering': ['-day', 'phase_name'], 'verbose_name': 'Operator Daily Stats', 'verbose_name_plural': 'Operator Daily Stats'},
+        ),
+        migrations.AlterUniqueTogether(
+            name='operatordailystats',
+            unique_together={('operator', 'day', 'phase_name')},
+        ),
+        migrations.CreateModel(
+            name='OperatorBatchDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('completions', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('bmr', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='bmr.bmr')),
+                ('operator', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='batch_days', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['operator', 'day'], name='workflow_batchday_operator')],
+                'unique_together': {('operator', 'bmr', 'day')},
+            },
+        ),
+        migrations.RunPython(populate_operator_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,88 @@
+# Generated by Django 4.2.7 on 2026-10-17 11:20
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+# Execution statuses that are logged as an outcome
+OUTCOMES = ('completed', 'failed', 'skipped')
+
+
+def backfill_phase_events(apps, schema_editor):
+    """
+    Seed the log with what the executions still show (starts and outcomes),
+    in time order, and replay it into the phase statistics from the start
+    """
+    BatchPhaseExecution = apps.get_model('workflow', 'BatchPhaseExecution')
+    PhaseEvent = apps.get_model('workflow', 'PhaseEvent')
+    PhaseEventSequence = apps.get_model('workflow', 'PhaseEventSequence')
+    now = django.utils.timezone.now()
+
+    events = []
+    executions = BatchPhaseExecution.objects.filter(
+        models.Q(started_date__isnull=False) | models.Q(status__in=OUTCOMES)
+    ).order_by().values_list(
+        'pk', 'bmr_id', 'phase__phase_name', 'status', 'started_by_id', 'started_date',
+        'completed_by_id', 'completed_date', 'duration_seconds',
+    )
+    for pk, bmr_id, phase_name, status, started_by, started, completed_by, completed, duration in executions.iterator():
+        if started:
+            events.append(PhaseEvent(
+                action='started', execution_id=pk, bmr_id=bmr_id, phase_name=phase_name,
+                user_id=started_by, created_at=started,
+            ))
+        if status in OUTCOMES:
+            events.append(PhaseEvent(
+                action=status, execution_id=pk, bmr_id=bmr_id, phase_name=phase_name,
+                user_id=completed_by if status != 'skipped' else None, created_at=completed or started or now,
+                duration_seconds=duration if status == 'completed' else None,
+            ))
+    events.sort(key=lambda event: event.created_at)
+    for sequence, event in enumerate(events, 1):
+        event.sequence = sequence
+    PhaseEvent.objects.bulk_create(events, batch_size=500)
+    PhaseEventSequence.objects.create(pk=1, value=len(events))
+
+    # Watermarks counted change feed ids until now
+    apps.get_model('workflow', 'PhaseStats').objects.all().delete()
+    apps.get_model('workflow', 'EventWatermark').objects.update(sequence=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bmr', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('workflow', '0019_operator_rollup_deltas'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PhaseEventSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PhaseEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sequence', models.PositiveBigIntegerField(unique=True)),
+                ('action', models.CharField(choices=[('started', 'Started'), ('completed', 'Completed'), ('failed', 'Failed'), ('rolled_back', 'Rolled Back'), ('skipped', 'Skipped'), ('quarantined', 'Quarantined'), ('released', 'Released')], max_length=20)),
+                ('phase_name', models.CharField(max_length=50)),
+                ('duration_seconds', models.IntegerField(blank=True, help_text='Start to completion, for completions', null=True)),
+                ('created_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('bmr', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='phase_events', to='bmr.bmr')),
+                ('execution', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='events', to='workflow.batchphaseexecution')),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['sequence'],
+                'indexes': [models.Index(fields=['bmr', 'sequence'], name='phaseevent_bmr_seq')],
+            },
+        ),
+        migrations.RunPython(backfill_phase_events, migrations.RunPython.noop),
+    ]
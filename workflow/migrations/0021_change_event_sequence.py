@@ -0,0 +1,62 @@
+# Generated by Django 4.2.7 on 2026-10-17 14:05
+
+from django.db import migrations, models
+from django.db.models import F, Max
+
+
+def number_change_events(apps, schema_editor):
+    """Existing events keep their id as their sequence, so clients resume where they were"""
+    ChangeEvent = apps.get_model('workflow', 'ChangeEvent')
+    EventSequence = apps.get_model('workflow', 'EventSequence')
+    ChangeEvent.objects.update(sequence=F('id'))
+    latest = ChangeEvent.objects.aggregate(latest=Max('id'))['latest'] or 0
+    counter, _ = EventSequence.objects.get_or_create(pk=1)
+    if counter.value < latest:
+        counter.value = latest
+        counter.save(update_fields=['value'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bmr', '0001_initial'),
+        ('workflow', '0020_phase_event_log'),
+    ]
+
+    operations = [
+        migrations.RenameModel(
+            old_name='PhaseEventSequence',
+            new_name='EventSequence',
+        ),
+        migrations.AddField(
+            model_name='changeevent',
+            name='sequence',
+            field=models.PositiveBigIntegerField(null=True),
+        ),
+        migrations.RunPython(number_change_events, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='changeevent',
+            name='sequence',
+            field=models.PositiveBigIntegerField(unique=True),
+        ),
+        migrations.RemoveIndex(
+            model_name='changeevent',
+            name='changeevent_source_seq',
+        ),
+        migrations.RemoveIndex(
+            model_name='changeevent',
+            name='changeevent_bmr_seq',
+        ),
+        migrations.AddIndex(
+            model_name='changeevent',
+            index=models.Index(fields=['source', 'sequence'], name='changeevent_source_seq'),
+        ),
+        migrations.AddIndex(
+            model_name='changeevent',
+            index=models.Index(fields=['bmr', 'sequence'], name='changeevent_bmr_seq'),
+        ),
+        migrations.AlterModelOptions(
+            name='changeevent',
+            options={'ordering': ['sequence']},
+        ),
+    ]
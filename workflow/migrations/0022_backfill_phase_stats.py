@@ -0,0 +1,69 @@
+# Generated by Django 4.2.7 on 2026-10-17 16:40
+
+from django.db import migrations
+from django.utils import timezone
+
+
+CONSUMER = 'phase_stats'
+TOTALS = ['starts', 'completions', 'timed_completions', 'total_hours', 'failures', 'rollbacks']
+BATCH_SIZE = 500
+
+
+def counts(action, duration_seconds):
+    """What an event adds to its row; the same rules as PhaseStats._counts"""
+    if action == 'started':
+        return {'starts': 1}
+    if action == 'failed':
+        return {'failures': 1}
+    if action == 'rolled_back':
+        return {'rollbacks': 1}
+    if action == 'completed':
+        if duration_seconds is None:
+            return {'completions': 1}
+        return {'completions': 1, 'timed_completions': 1, 'total_hours': duration_seconds / 3600}
+    return None
+
+
+def replay_phase_events(apps, schema_editor):
+    """
+    Fill the phase statistics from the whole event log, which 0020 seeded
+    but left unread, and move the watermark past it, so the scheduled runs
+    only fold in new events
+    """
+    PhaseEvent = apps.get_model('workflow', 'PhaseEvent')
+    PhaseStats = apps.get_model('workflow', 'PhaseStats')
+    EventWatermark = apps.get_model('workflow', 'EventWatermark')
+    BMR = apps.get_model('bmr', 'BMR')
+
+    product_types = dict(BMR.objects.order_by().values_list('pk', 'product__product_type'))
+    totals, latest = {}, 0
+    events = PhaseEvent.objects.order_by('sequence').values_list('sequence', 'bmr_id', 'phase_name', 'action', 'duration_seconds')
+    for sequence, bmr_id, phase_name, action, duration_seconds in events.iterator(chunk_size=BATCH_SIZE):
+        latest = sequence
+        product_type = product_types.get(bmr_id)
+        added = counts(action, duration_seconds)
+        if not product_type or not added:
+            continue
+        row = totals.setdefault((product_type, phase_name), dict.fromkeys(TOTALS, 0))
+        for field, value in added.items():
+            row[field] += value
+
+    now = timezone.now()
+    PhaseStats.objects.all().delete()
+    PhaseStats.objects.bulk_create([
+        PhaseStats(product_type=product_type, phase_name=phase_name, updated_at=now, **row)
+        for (product_type, phase_name), row in totals.items()
+    ], batch_size=BATCH_SIZE)
+    EventWatermark.objects.update_or_create(consumer=CONSUMER, defaults={'sequence': latest, 'updated_at': now})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bmr', '0001_initial'),
+        ('workflow', '0021_change_event_sequence'),
+    ]
+
+    operations = [
+        migrations.RunPython(replay_phase_events, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,15 @@
-from django.db import models
+import uuid
+from functools import partial, reduce
+from operator import or_
+from datetime import datetime, time, timedelta
+
+from django.db import connections, models, router, transaction
+from django.db.models import Case, F, IntegerField, Max, Min, OuterRef, Q, Subquery, Value, When, Count
 from django.conf import settings
+from django.core.cache import cache, caches
+from django.utils import timezone
 from bmr.models import BMR
+from kampala_pharma.db_writer import write_transaction
 
 class Machine(models.Model):
     """Machine model for production phases"""
@@ -88,6 +97,28 @@ class ProductionPhase(models.Model):
     
     def __str__(self):
         return f"{self.get_product_type_display()} - {self.get_phase_name_display()}"
+    
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        from .transitions import invalidate
+        invalidate()
+    
+    def delete(self, *args, **kwargs):
+        result = super().delete(*args, **kwargs)
+        from .transitions import invalidate
+        invalidate()
+        return result
+
+class PhaseConflict(Exception):
+    """A guarded phase transition found the execution already changed by someone else"""
+    
+    def __init__(self, execution, expected_status):
+        self.execution = execution
+        self.expected_status = expected_status
+        super().__init__(
+            f"{execution.phase.get_phase_name_display()} for batch {execution.bmr.batch_number} "
+            f"was updated by someone else (expected it to be {expected_status.replace('_', ' ')})"
+        )
 
 class BatchPhaseExecution(models.Model):
     """Tracks the execution of phases for each batch"""
@@ -101,6 +132,13 @@ class BatchPhaseExecution(models.Model):
         ('skipped', 'Skipped'),
         ('rolled_back', 'Rolled Back'),
     ]
+    # The status a guarded transition to each of these statuses starts from
+    TRANSITION_SOURCES = {'in_progress': 'pending', 'completed': 'in_progress', 'failed': 'in_progress'}
+    # The timestamps the machine performance day buckets are built from
+    MACHINE_MOMENTS = (
+        'started_date', 'completed_date', 'breakdown_start_time', 'breakdown_end_time',
+        'changeover_start_time', 'changeover_end_time',
+    )
     
     bmr = models.ForeignKey(BMR, on_delete=models.CASCADE, related_name='phase_executions')
     phase = models.ForeignKey(ProductionPhase, on_delete=models.CASCADE)
@@ -158,14 +196,289 @@ class BatchPhaseExecution(models.Model):
     )
     qc_approval_date = models.DateTimeField(null=True, blank=True)
     rejection_reason = models.TextField(blank=True)
+
+    # Rework tracking (QC rollbacks)
+    rework_count = models.IntegerField(default=0)
+    rollback_from = models.ForeignKey(
+        'self',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='reworked_to'
+    )
+    rollback_reason = models.TextField(blank=True, null=True)
     
+    # Incremented on every write; guarded transitions only apply to the version they read
+    version = models.PositiveIntegerField(default=0)
+    
+    # Durations kept in step with the timestamps on every write, so reports can aggregate them in SQL
+    duration_seconds = models.IntegerField(null=True, blank=True, help_text="Start to completion")
+    net_duration_seconds = models.IntegerField(
+        null=True, blank=True, help_text="Start to completion, less the breakdown time in between"
+    )
+    breakdown_seconds = models.IntegerField(default=0)
+    changeover_seconds = models.IntegerField(default=0)
+
     class Meta:
         unique_together = ['bmr', 'phase']
         ordering = ['bmr', 'phase__phase_order']
+        indexes = [
+            # Work queues: open executions for a set of phases
+            models.Index(fields=['status', 'phase'], name='workflow_exec_status_phase'),
+            # Status counts and lookups for one phase (FGS, QC, approvals)
+            models.Index(fields=['phase', 'status'], name='workflow_exec_phase_status'),
+            # Duration averages and percentiles per phase
+            models.Index(fields=['phase', 'net_duration_seconds'], name='workflow_exec_phase_duration'),
+            # Completions in a date range, overall and per operator
+            models.Index(fields=['completed_date'], name='workflow_exec_completed'),
+            models.Index(fields=['completed_by', 'completed_date'], name='workflow_exec_completed_by'),
+            # Recent breakdowns and changeovers, for the few rows that had one
+            models.Index(
+                fields=['-breakdown_start_time'], name='workflow_exec_breakdowns',
+                condition=Q(breakdown_occurred=True),
+            ),
+            models.Index(
+                fields=['-changeover_start_time'], name='workflow_exec_changeovers',
+                condition=Q(changeover_occurred=True),
+            ),
+        ]
     
     def __str__(self):
         return f"{self.bmr.batch_number} - {self.phase.get_phase_name_display()} ({self.status})"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored status so save() can tell what changed
+        instance._loaded_status = instance.__dict__.get('status')
+        instance._loaded_activity = instance._activity()
+        instance._loaded_machine_activity = instance._machine_activity()
+        return instance
+    
+    def _activity(self):
+        """The status and who started/completed the phase when, as used by the operator rollups"""
+        values = self.__dict__
+        return (values.get('status'), values.get('started_by_id'), values.get('started_date'),
+                values.get('completed_by_id'), values.get('completed_date'))
+    
+    def _machine_activity(self):
+        """The machine and the moments of its run, breakdown and changeover, as cached in the machine day buckets"""
+        values = self.__dict__
+        return values.get('machine_used_id'), tuple(values.get(name) for name in self.MACHINE_MOMENTS)
+    
+    def _durations(self, **fields):
+        """The duration columns for the execution's timestamps, with ``fields`` written over them"""
+        def value(name):
+            value = fields[name] if name in fields else getattr(self, name)
+            if isinstance(value, datetime) and timezone.is_naive(value):
+                value = timezone.make_aware(value)
+            return value
+        
+        def seconds(start, end):
+            return round((end - start).total_seconds()) if start and end else None
+        
+        started, completed = value('started_date'), value('completed_date')
+        breakdown = (value('breakdown_start_time'), value('breakdown_end_time')) if value('breakdown_occurred') else (None, None)
+        changeover = seconds(value('changeover_start_time'), value('changeover_end_time')) if value('changeover_occurred') else None
+        
+        gross = net = seconds(started, completed)
+        if gross is not None and all(breakdown):
+            # Only the part of the breakdown within the phase counts against it
+            lost = seconds(max(started, breakdown[0]), min(completed, breakdown[1]))
+            net = gross - max(lost, 0)
+        return {
+            'duration_seconds': gross,
+            'net_duration_seconds': net,
+            'breakdown_seconds': seconds(*breakdown) or 0,
+            'changeover_seconds': changeover or 0,
+        }
+    
+    def save(self, *args, **kwargs):
+        """Save the execution, keep the progress, operator and machine summaries in step and publish status changes"""
+        is_new = self._state.adding
+        previous_status = getattr(self, '_loaded_status', None)
+        if not is_new:
+            self.version += 1
+        for name, value in self._durations().items():
+            setattr(self, name, value)
+        with write_transaction(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+            self._publish_change(previous_status, is_new=is_new)
+    
+    def _event_data(self, previous_status):
+        return {
+            'phase': self.phase.phase_name,
+            'previous_status': previous_status,
+            'started_date': self.started_date.isoformat() if self.started_date else None,
+            'completed_date': self.completed_date.isoformat() if self.completed_date else None,
+        }
+    
+    def _phase_event(self, previous_status):
+        """This write's entry in the phase event log, or None when the status change is not a logged action"""
+        action = PhaseEvent.action_for(previous_status, self.status)
+        if action is None:
+            return None
+        return PhaseEvent(
+            action=action, execution_id=self.pk, bmr_id=self.bmr_id, phase_name=self.phase.phase_name,
+            user_id={'started': self.started_by_id, 'completed': self.completed_by_id, 'failed': self.completed_by_id}.get(action),
+            duration_seconds=self.duration_seconds if action == 'completed' else None,
+        )
+    
+    def _publish_change(self, previous_status, is_new=False):
+        """
+        Keep the progress summary, change feed and event log in step with a
+        write of this execution; the derived rollups follow once it commits
+        """
+        if is_new or previous_status != self.status:
+            BMRProgress.record_transition(self, previous_status, is_new=is_new)
+            ChangeEvent.record('phase', self, self.status, bmr_id=self.bmr_id, **self._event_data(previous_status))
+            PhaseEvent.record_many([self._phase_event(previous_status)])
+        else:
+            ChangeEvent.touch('phase')
+        self._loaded_status = self.status
+        type(self)._refresh_rollups_on_commit([self])
+    
+    @classmethod
+    def _refresh_rollups_on_commit(cls, executions):
+        """
+        Once the write commits, apply what changed since the executions were
+        loaded to the operator rollups and drop the machine day buckets it
+        touched. The write does not need either, so they are not done while it
+        holds the writer lock; ``rebuild_operator_stats`` repairs the rollups
+        should a process die in between.
+        """
+        changes = []
+        for execution in executions:
+            changes.append((
+                execution.phase.phase_name, execution.bmr_id,
+                getattr(execution, '_loaded_activity', None), execution._activity(),
+                getattr(execution, '_loaded_machine_activity', None), execution._machine_activity(),
+            ))
+            execution._loaded_activity = execution._activity()
+            execution._loaded_machine_activity = execution._machine_activity()
+        transaction.on_commit(partial(cls._refresh_rollups, changes), robust=True)
+    
+    @staticmethod
+    def _refresh_rollups(changes):
+        from .machine_performance import invalidate_machine_days
+        OperatorDailyStats.record_changes([
+            (phase_name, bmr_id, previous, current) for phase_name, bmr_id, previous, current, _, _ in changes
+        ])
+        for *_, previous_machine, machine in changes:
+            invalidate_machine_days(machine, previous_machine)
+    
+    def transition(self, status, expected_version=None, from_status=None, **fields):
+        """
+        Move the execution to a new status with one guarded UPDATE.
+        
+        The row is only written while it is still in ``from_status`` - by
+        default the status the move requires (TRANSITION_SOURCES, e.g. only
+        an in-progress phase can be completed), else the one this instance
+        was loaded with - and at the version it was loaded with (or
+        ``expected_version``, e.g. the one a form was rendered with);
+        otherwise PhaseConflict is raised and nothing is changed. ``fields``
+        are written in the same statement.
+        """
+        expected_status = (
+            from_status or self.TRANSITION_SOURCES.get(status) or getattr(self, '_loaded_status', self.status)
+        )
+        if expected_version is None:
+            expected_version = self.version
+        fields.update(self._durations(**fields))
+        with write_transaction():
+            updated = type(self).objects.filter(
+                pk=self.pk, status=expected_status, version=expected_version
+            ).update(status=status, version=F('version') + 1, **fields)
+            if not updated:
+                raise PhaseConflict(self, expected_status)
+            self.status = status
+            self.version = expected_version + 1
+            for name, value in fields.items():
+                setattr(self, name, value)
+            self._publish_change(expected_status)
+        return self
+    
+    @classmethod
+    def bulk_transition(cls, changes, fields=None, values=None):
+        """
+        Move executions to new statuses with a single guarded UPDATE.
+        
+        ``changes`` maps executions (loaded with their phase) to their new
+        status; ``fields`` maps a status to extra field values written on the
+        rows moving to it, and ``values`` maps an execution to field values of
+        its own. Executions already in their new status are left alone. Each
+        row is only written at the version it was loaded with, otherwise
+        PhaseConflict is raised and nothing changes.
+        
+        The progress summary, change feed, phase event log and operator
+        rollups are updated once for the whole set rather than per row, so
+        the statement count does not grow with the number of executions.
+        Returns the executions that changed.
+        """
+        fields = fields or {}
+        values = values or {}
+        changed = [(execution, status) for execution, status in changes.items() if execution.status != status]
+        if not changed:
+            return []
+        written = {
+            execution: {**fields.get(status, {}), **values.get(execution, {})}
+            for execution, status in changed
+        }
+        for execution, row in written.items():
+            row.update(execution._durations(**row))
+        
+        updates = {
+            'status': Case(
+                *[When(pk=execution.pk, then=Value(status)) for execution, status in changed],
+                default=F('status')
+            ),
+            'version': F('version') + 1,
+        }
+        for name in {name for row in written.values() for name in row}:
+            updates[name] = Case(
+                *[When(pk=execution.pk, then=Value(row[name].pk if isinstance(row[name], models.Model) else row[name]))
+                  for execution, row in written.items() if name in row],
+                default=F(name),
+                output_field=cls._meta.get_field(name)
+            )
+        loaded = Q()
+        for execution, _ in changed:
+            loaded |= Q(pk=execution.pk, version=execution.version)
+        
+        with write_transaction():
+            conflict = cls.objects.filter(loaded).update(**updates) != len(changed)
+            if conflict:
+                transaction.set_rollback(True)
+            else:
+                cls._apply_changes(changed, written)
+        if conflict:
+            versions = dict(cls.objects.filter(pk__in=[execution.pk for execution, _ in changed]).values_list('pk', 'version'))
+            execution = next(execution for execution, _ in changed if versions.get(execution.pk) != execution.version)
+            raise PhaseConflict(execution, execution.status)
+        
+        for execution, _ in changed:
+            execution._loaded_status = execution.status
+        return [execution for execution, _ in changed]
+    
+    @classmethod
+    def _apply_changes(cls, changed, written):
+        """Update the instances after a bulk UPDATE and publish the changes as a set"""
+        previous = []
+        for execution, status in changed:
+            previous.append((execution, execution.status))
+            execution.status = status
+            execution.version += 1
+            for name, value in written[execution].items():
+                setattr(execution, name, value)
+        
+        BMRProgress.record_transitions(previous)
+        ChangeEvent.record_many('phase', [
+            (execution.pk, execution.bmr_id, execution.status, execution._event_data(status))
+            for execution, status in previous
+        ])
+        PhaseEvent.record_many([execution._phase_event(status) for execution, status in previous])
+        cls._refresh_rollups_on_commit([execution for execution, _ in previous])
+    
     def requires_machine_selection(self):
         """Check if this phase requires machine selection"""
         machine_required_phases = [
@@ -225,30 +538,8 @@ class BatchPhaseExecution(models.Model):
     
     def get_next_phase(self):
         """Get the next phase in the workflow"""
-        product_type = self.bmr.product.product_type
-        current_order = self.phase.phase_order
-        # Handle special cases for tablet coating
-        if (product_type in ['tablet_normal', 'tablet_2'] and 
-            self.phase.phase_name == 'sorting'):
-            if self.bmr.product.is_coated:
-                # Go to coating phase
-                next_phase = ProductionPhase.objects.filter(
-                    product_type=product_type,
-                    phase_name='coating'
-                ).first()
-            else:
-                # Skip coating, go to packaging
-                next_phase = ProductionPhase.objects.filter(
-                    product_type=product_type,
-                    phase_name='packaging_material_release'
-                ).first()
-        else:
-            # Normal sequential flow
-            next_phase = ProductionPhase.objects.filter(
-                product_type=product_type,
-                phase_order__gt=current_order
-            ).first()
-        return next_phase
+        from .services import WorkflowService
+        return WorkflowService.graph_for(self.bmr.product).next_phase(self.phase.phase_name)
     
     def trigger_next_phase(self):
         """Automatically trigger the next phase when current phase completes"""
@@ -261,6 +552,790 @@ class BatchPhaseExecution(models.Model):
                     defaults={'status': 'pending'}
                 )
 
+class BMRProgress(models.Model):
+    """Denormalized phase progress for a BMR, maintained on every phase status change"""
+    
+    ACTIVE_STATUSES = ['pending', 'in_progress']
+    
+    bmr = models.OneToOneField(BMR, on_delete=models.CASCADE, related_name='progress')
+    
+    # Phase counts by status
+    total_phases = models.IntegerField(default=0)
+    not_ready_count = models.IntegerField(default=0)
+    pending_count = models.IntegerField(default=0)
+    in_progress_count = models.IntegerField(default=0)
+    completed_count = models.IntegerField(default=0)
+    failed_count = models.IntegerField(default=0)
+    skipped_count = models.IntegerField(default=0)
+    rolled_back_count = models.IntegerField(default=0)
+    
+    # First pending/in-progress phase in workflow order
+    current_execution = models.ForeignKey(
+        BatchPhaseExecution,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+'
+    )
+    percent_complete = models.IntegerField(default=0)
+    last_activity = models.DateTimeField(null=True, blank=True, db_index=True)
+    updated_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        verbose_name = 'BMR Progress'
+        verbose_name_plural = 'BMR Progress'
+    
+    def __str__(self):
+        return f"{self.bmr.batch_number} - {self.percent_complete}% ({self.completed_count}/{self.total_phases})"
+    
+    @property
+    def current_phase(self):
+        return self.current_execution.phase if self.current_execution else None
+    
+    @property
+    def is_active(self):
+        return self.current_execution_id is not None
+    
+    @classmethod
+    def for_bmr(cls, bmr):
+        """Summary for a BMR, or an empty one if none has been recorded yet"""
+        try:
+            return bmr.progress
+        except cls.DoesNotExist:
+            return cls(bmr=bmr)
+    
+    @staticmethod
+    def _count_field(status):
+        return f"{status}_count"
+    
+    @classmethod
+    def _current_execution_subquery(cls):
+        return Subquery(
+            BatchPhaseExecution.objects.filter(
+                bmr_id=OuterRef('bmr_id'),
+                status__in=cls.ACTIVE_STATUSES
+            ).order_by('phase__phase_order').values('pk')[:1]
+        )
+    
+    @classmethod
+    def record_transition(cls, execution, previous_status, is_new=False):
+        """Apply a single phase status change to the summary with one UPDATE"""
+        cls.record_transitions([(execution, previous_status)], is_new=is_new)
+    
+    @classmethod
+    def record_transitions(cls, changes, is_new=False):
+        """Apply (execution, previous_status) changes to the summaries of their BMRs with one UPDATE"""
+        deltas_by_bmr = {}
+        for execution, previous_status in changes:
+            if previous_status is None and not is_new:
+                # Status before the change is unknown, recount this BMR
+                deltas_by_bmr[execution.bmr_id] = None
+                continue
+            deltas = deltas_by_bmr.setdefault(execution.bmr_id, {})
+            if deltas is None:
+                continue
+            if is_new:
+                deltas['total_phases'] = deltas.get('total_phases', 0) + 1
+            else:
+                field = cls._count_field(previous_status)
+                deltas[field] = deltas.get(field, 0) - 1
+            field = cls._count_field(execution.status)
+            deltas[field] = deltas.get(field, 0) + 1
+        
+        for bmr_id in [bmr_id for bmr_id, deltas in deltas_by_bmr.items() if deltas is None]:
+            cls.refresh(bmr_id)
+            del deltas_by_bmr[bmr_id]
+        if not deltas_by_bmr:
+            return
+        
+        def per_bmr(values):
+            return Case(
+                *[When(bmr_id=bmr_id, then=Value(value)) for bmr_id, value in values.items()],
+                default=Value(0), output_field=IntegerField()
+            )
+        
+        now = timezone.now()
+        updates = {
+            name: F(name) + per_bmr({bmr_id: deltas.get(name, 0) for bmr_id, deltas in deltas_by_bmr.items()})
+            for name in {name for deltas in deltas_by_bmr.values() for name in deltas}
+        }
+        # i.e. "new total > 0", expressed against the stored columns
+        updates['percent_complete'] = Case(
+            *[When(
+                bmr_id=bmr_id, total_phases__gt=-deltas.get('total_phases', 0),
+                then=(F('completed_count') + deltas.get('completed_count', 0)) * 100 / (F('total_phases') + deltas.get('total_phases', 0))
+            ) for bmr_id, deltas in deltas_by_bmr.items()],
+            default=Value(0),
+            output_field=IntegerField()
+        )
+        updates['current_execution'] = cls._current_execution_subquery()
+        updates['last_activity'] = now
+        updates['updated_at'] = now
+        
+        summaries = cls.objects.filter(bmr_id__in=list(deltas_by_bmr))
+        if summaries.update(**updates) < len(deltas_by_bmr):
+            # BMRs without a summary yet get one counted from scratch
+            existing = set(summaries.values_list('bmr_id', flat=True))
+            for bmr_id in deltas_by_bmr.keys() - existing:
+                cls.refresh(bmr_id)
+    
+    @classmethod
+    def _summaries(cls, executions):
+        """Build unsaved summaries for every BMR in the execution queryset"""
+        counts = {
+            cls._count_field(status): Count('id', filter=Q(status=status))
+            for status, _ in BatchPhaseExecution.STATUS_CHOICES
+        }
+        rows = executions.order_by().values('bmr_id').annotate(
+            total_phases=Count('id'),
+            last_started=Max('started_date'),
+            last_completed=Max('completed_date'),
+            **counts
+        )
+        current = {}
+        active = executions.filter(status__in=cls.ACTIVE_STATUSES).order_by('bmr_id', 'phase__phase_order')
+        for bmr_id, execution_id in active.values_list('bmr_id', 'pk'):
+            current.setdefault(bmr_id, execution_id)
+        
+        now = timezone.now()
+        summaries = {}
+        for row in rows:
+            bmr_id = row.pop('bmr_id')
+            activity = [d for d in (row.pop('last_started'), row.pop('last_completed')) if d]
+            total = row['total_phases']
+            summaries[bmr_id] = cls(
+                bmr_id=bmr_id,
+                current_execution_id=current.get(bmr_id),
+                percent_complete=int(row['completed_count'] * 100 / total) if total else 0,
+                last_activity=max(activity) if activity else None,
+                updated_at=now,
+                **row
+            )
+        return summaries
+    
+    @classmethod
+    def refresh(cls, bmr_id):
+        """Recount the summary for a single BMR"""
+        summary = cls._summaries(BatchPhaseExecution.objects.filter(bmr_id=bmr_id)).get(bmr_id)
+        if summary is None:
+            summary = cls(bmr_id=bmr_id)
+        values = {
+            field.attname: getattr(summary, field.attname)
+            for field in cls._meta.concrete_fields
+            if field.attname not in ('id', 'bmr_id')
+        }
+        return cls.objects.update_or_create(bmr_id=bmr_id, defaults=values)[0]
+    
+    @classmethod
+    def rebuild(cls, bmr_ids=None, batch_size=500):
+        """Regenerate summaries in bulk, for all BMRs or the given ids"""
+        executions = BatchPhaseExecution.objects.all()
+        bmrs = BMR.objects.all()
+        if bmr_ids is not None:
+            executions = executions.filter(bmr_id__in=bmr_ids)
+            bmrs = bmrs.filter(pk__in=bmr_ids)
+        
+        summaries = cls._summaries(executions)
+        now = timezone.now()
+        for bmr_id in bmrs.values_list('pk', flat=True):
+            summaries.setdefault(bmr_id, cls(bmr_id=bmr_id, updated_at=now))
+        
+        with transaction.atomic():
+            stale = cls.objects.all() if bmr_ids is None else cls.objects.filter(bmr_id__in=bmr_ids)
+            stale.delete()
+            cls.objects.bulk_create(summaries.values(), batch_size=batch_size)
+        return len(summaries)
+
+def _add_amounts(totals, amounts, sign):
+    for key, values in amounts.items():
+        row = totals.setdefault(key, {})
+        for field, value in values.items():
+            row[field] = row.get(field, 0) + sign * value
+
+
+def _apply_deltas(model, keys, deltas, empty):
+    """
+    Add ``{key: {field: amount}}`` to the rollup rows of ``model`` identified
+    by the ``keys`` fields, with one INSERT for the rows that do not exist yet
+    and one UPDATE adding every amount with F(). When something was taken
+    away, the rows left with nothing in the ``empty`` fields are deleted with
+    one more statement. The count does not depend on how many rows change.
+    """
+    deltas = {key: amounts for key, amounts in deltas.items() if any(amounts.values())}
+    if not deltas:
+        return
+    now = timezone.now()
+    matches = {key: Q(**dict(zip(keys, key))) for key in deltas}
+    model.objects.bulk_create(
+        [model(updated_at=now, **dict(zip(keys, key))) for key in deltas], ignore_conflicts=True
+    )
+    rows = model.objects.filter(reduce(or_, matches.values()))
+    updates = {
+        field: F(field) + Case(
+            *[When(matches[key], then=Value(amounts[field])) for key, amounts in deltas.items() if amounts.get(field)],
+            default=Value(0), output_field=model._meta.get_field(field)
+        )
+        for field in {field for amounts in deltas.values() for field in amounts}
+    }
+    rows.update(updated_at=now, **updates)
+    if any(amount < 0 for amounts in deltas.values() for amount in amounts.values()):
+        rows.filter(**dict.fromkeys(empty, 0)).delete()
+
+
+class OperatorDailyStats(models.Model):
+    """
+    Per-operator, per-day and per-phase productivity rollup, maintained as
+    phase executions are started and completed.
+
+    Only phases that ended ``completed`` count as completions; a phase failed
+    at QA/QC counts as an attempt. Batches an operator worked on are kept in
+    OperatorBatchDay.
+    """
+    
+    operator = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='daily_stats'
+    )
+    day = models.DateField(db_index=True)
+    phase_name = models.CharField(max_length=50)
+    
+    completions = models.IntegerField(default=0)
+    attempts = models.IntegerField(default=0, help_text="Phases started on this day")
+    timed_completions = models.IntegerField(default=0)
+    active_minutes = models.FloatField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        unique_together = ['operator', 'day', 'phase_name']
+        ordering = ['-day', 'phase_name']
+        verbose_name = 'Operator Daily Stats'
+        verbose_name_plural = 'Operator Daily Stats'
+    
+    def __str__(self):
+        return f"{self.operator.username} - {self.day} {self.phase_name} ({self.completions} completed)"
+    
+    @property
+    def average_active_minutes(self):
+        if not self.timed_completions:
+            return None
+        return round(self.active_minutes / self.timed_completions, 1)
+    
+    @staticmethod
+    def _day(moment):
+        return timezone.localdate(moment)
+    
+    @classmethod
+    def _contributions(cls, phase_name, bmr_id, activity):
+        """
+        What one execution in the given state adds to the rollups, as
+        ({(operator, day, phase): amounts}, {(operator, bmr, day): amounts})
+        """
+        daily, batches = {}, {}
+        if activity is None:
+            return daily, batches
+        status, started_by_id, started, completed_by_id, completed = activity
+        if started_by_id and started:
+            daily[(started_by_id, cls._day(started), phase_name)] = {'attempts': 1}
+        if status == 'completed' and completed_by_id and completed:
+            day = cls._day(completed)
+            amounts = daily.setdefault((completed_by_id, day, phase_name), {})
+            amounts['completions'] = 1
+            if started and started <= completed:
+                amounts['timed_completions'] = 1
+                amounts['active_minutes'] = (completed - started).total_seconds() / 60
+            batches[(completed_by_id, bmr_id, day)] = {'completions': 1}
+        return daily, batches
+    
+    @classmethod
+    def record_changes(cls, changes):
+        """
+        Apply (phase_name, bmr_id, previous, current) changes to executions'
+        starts and completions as deltas: what the executions add now less
+        what they added before, whatever the number of operators and days
+        involved. ``previous`` and ``current`` are the executions'
+        ``_activity()`` before and after the change, None for no row.
+        """
+        daily, batches = {}, {}
+        for phase_name, bmr_id, previous, current in changes:
+            if previous == current:
+                continue
+            for activity, sign in ((previous, -1), (current, 1)):
+                added_daily, added_batches = cls._contributions(phase_name, bmr_id, activity)
+                _add_amounts(daily, added_daily, sign)
+                _add_amounts(batches, added_batches, sign)
+        if not daily and not batches:
+            return
+        with write_transaction():
+            _apply_deltas(cls, ['operator_id', 'day', 'phase_name'], daily, empty=['completions', 'attempts'])
+            _apply_deltas(OperatorBatchDay, ['operator_id', 'bmr_id', 'day'], batches, empty=['completions'])
+    
+    @classmethod
+    def rebuild(cls, operator_ids=None, batch_size=500):
+        """Regenerate rollups in bulk, for all operators or the given ids"""
+        executions = BatchPhaseExecution.objects.filter(
+            Q(started_by__isnull=False, started_date__isnull=False)
+            | Q(status='completed', completed_by__isnull=False, completed_date__isnull=False)
+        )
+        if operator_ids is not None:
+            executions = executions.filter(Q(started_by_id__in=operator_ids) | Q(completed_by_id__in=operator_ids))
+        rows = executions.order_by().values_list(
+            'phase__phase_name', 'bmr_id', 'status', 'started_by_id', 'started_date', 'completed_by_id', 'completed_date'
+        )
+        daily, batches = {}, {}
+        for phase_name, bmr_id, *activity in rows.iterator():
+            added_daily, added_batches = cls._contributions(phase_name, bmr_id, tuple(activity))
+            _add_amounts(daily, added_daily, 1)
+            _add_amounts(batches, added_batches, 1)
+        if operator_ids is not None:
+            daily = {key: amounts for key, amounts in daily.items() if key[0] in operator_ids}
+            batches = {key: amounts for key, amounts in batches.items() if key[0] in operator_ids}
+        
+        now = timezone.now()
+        with transaction.atomic():
+            for model, keys, totals in (
+                (cls, ['operator_id', 'day', 'phase_name'], daily),
+                (OperatorBatchDay, ['operator_id', 'bmr_id', 'day'], batches),
+            ):
+                stale = model.objects.all() if operator_ids is None else model.objects.filter(operator_id__in=operator_ids)
+                stale.delete()
+                model.objects.bulk_create([
+                    model(updated_at=now, **dict(zip(keys, key)), **amounts) for key, amounts in totals.items()
+                ], batch_size=batch_size)
+        return len(daily)
+
+class OperatorBatchDay(models.Model):
+    """Phases an operator completed on a batch on one day, for counting the batches they handled"""
+    
+    operator = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='batch_days'
+    )
+    bmr = models.ForeignKey(BMR, on_delete=models.CASCADE, related_name='+')
+    day = models.DateField()
+    completions = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        unique_together = ['operator', 'bmr', 'day']
+        indexes = [
+            models.Index(fields=['operator', 'day'], name='workflow_batchday_operator'),
+        ]
+    
+    def __str__(self):
+        return f"{self.operator.username} - {self.bmr.batch_number} on {self.day}"
+    
+    @classmethod
+    def counts(cls, operator_id, day=None):
+        """
+        Batches the operator completed a phase on: ``handled`` in total and,
+        for ``day``, ``distinct`` that day and ``new`` first that day
+        """
+        rows = cls.objects.filter(operator_id=operator_id)
+        counts = {'handled': rows.values('bmr_id').distinct().count()}
+        if day is not None:
+            counts['distinct'] = rows.filter(day=day).count()
+            counts['new'] = rows.values('bmr_id').annotate(first=Min('day')).filter(first=day).count()
+        return counts
+
+class ChangeEvent(models.Model):
+    """
+    Append-only feed of phase, quarantine and FGS changes for live screens.
+
+    Clients remember the last ``sequence`` they saw and ask for everything
+    after it, so each change is read once per screen instead of every screen
+    re-running its page queries on a timer. Sequences come from EventSequence,
+    so a client can never move past an event that has not committed yet.
+    """
+    
+    SOURCE_CHOICES = [
+        ('phase', 'Phase Execution'),
+        ('quarantine', 'Quarantine Batch'),
+        ('sample', 'Sample Request'),
+        ('fgs', 'FGS Inventory'),
+        ('release', 'Product Release'),
+    ]
+    
+    # Latest committed sequence, so idle listeners can skip the database; a
+    # hint only, read again from the table when it is missing
+    LATEST_SEQUENCE_KEY = 'change_feed:latest'
+    # Per-source version token in the "versions" cache, replaced whenever that source changes
+    VERSION_KEY = 'change_feed:version:{source}'
+    
+    sequence = models.PositiveBigIntegerField(unique=True)
+    source = models.CharField(max_length=20, choices=SOURCE_CHOICES)
+    object_id = models.PositiveBigIntegerField()
+    bmr = models.ForeignKey(BMR, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    action = models.CharField(max_length=30)
+    data = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+    
+    class Meta:
+        ordering = ['sequence']
+        indexes = [
+            # Consumers that read one source, and a batch's history, in feed order
+            models.Index(fields=['source', 'sequence'], name='changeevent_source_seq'),
+            models.Index(fields=['bmr', 'sequence'], name='changeevent_bmr_seq'),
+        ]
+    
+    def __str__(self):
+        return f"#{self.sequence} {self.source} {self.object_id} {self.action}"
+    
+    @classmethod
+    def record(cls, source, instance, action, bmr_id=None, **data):
+        """Append an event for a saved instance; listeners are woken once the transaction commits"""
+        return cls.record_many(source, [(instance.pk, bmr_id, action, data)])[0]
+    
+    @classmethod
+    def record_many(cls, source, events, batch_size=None):
+        """Append several events with one INSERT; ``events`` are (object_id, bmr_id, action, data) tuples"""
+        events = [
+            cls(source=source, object_id=object_id, bmr_id=bmr_id, action=action, data=data)
+            for object_id, bmr_id, action, data in events
+        ]
+        if not events:
+            return []
+        # Numbered and inserted in one transaction, which holds the counter until it commits
+        with write_transaction(savepoint=False):
+            first = EventSequence.reserve(len(events))
+            for offset, event in enumerate(events):
+                event.sequence = first + offset
+            created = cls.objects.bulk_create(events, batch_size=batch_size)
+            latest = created[-1].sequence
+            transaction.on_commit(lambda: cache.set(cls.LATEST_SEQUENCE_KEY, latest, None))
+            cls.touch(source)
+        return created
+    
+    @classmethod
+    def touch(cls, source):
+        """Mark a source as changed (without a feed row) once the transaction commits"""
+        transaction.on_commit(partial(cls._replace_version, source), robust=True)
+    
+    @classmethod
+    def _replace_version(cls, source):
+        with write_transaction():
+            caches['versions'].set(cls.VERSION_KEY.format(source=source), uuid.uuid4().hex, None)
+    
+    @classmethod
+    def versions(cls, sources):
+        """Current version token of each source, for building cache keys"""
+        versions_cache = caches['versions']
+        keys = {source: cls.VERSION_KEY.format(source=source) for source in sources}
+        found = versions_cache.get_many(keys.values())
+        versions = {}
+        for source, key in keys.items():
+            if key not in found:
+                with write_transaction():
+                    versions_cache.add(key, uuid.uuid4().hex, None)
+                found[key] = versions_cache.get(key)
+            versions[source] = found[key]
+        return versions
+    
+    @classmethod
+    def latest_sequence(cls):
+        """Sequence number of the newest event (0 when the feed is empty)"""
+        return cls.objects.aggregate(latest=Max('sequence'))['latest'] or 0
+    
+    @classmethod
+    def since(cls, sequence, sources=None, limit=500):
+        """Events after the given sequence number, oldest first"""
+        events = cls.objects.filter(sequence__gt=sequence)
+        if sources:
+            events = events.filter(source__in=sources)
+        return events.order_by('sequence')[:limit]
+    
+    def as_dict(self):
+        return {
+            'seq': self.sequence,
+            'source': self.source,
+            'object_id': self.object_id,
+            'bmr_id': self.bmr_id,
+            'action': self.action,
+            'data': self.data,
+            'created_at': self.created_at.isoformat(),
+        }
+
+class EventSequence(models.Model):
+    """
+    Counter the change feed and the phase event log take their sequence numbers from.
+
+    Reserving numbers updates the single row, which then stays locked until
+    the writing transaction commits. Transactions that record events therefore
+    commit in the order of their numbers, and a reader that has seen up to
+    N can never later find a committed event below N. Auto-increment ids do
+    not promise that: on PostgreSQL a transaction can take id 10, commit
+    after the one that took id 11, and be skipped by a reader of ``id > 10``.
+    """
+    
+    value = models.PositiveBigIntegerField(default=0)
+    
+    # The one counter row
+    ROW = 1
+    
+    def __str__(self):
+        return f"Events @ {self.value}"
+    
+    @classmethod
+    def reserve(cls, count):
+        """Reserve ``count`` numbers inside the writing transaction, which must also insert the events; returns the first"""
+        connection = connections[router.db_for_write(cls)]
+        if connection.features.can_return_columns_from_insert:
+            # PostgreSQL and SQLite 3.35+: increment and read back in one statement
+            table = connection.ops.quote_name(cls._meta.db_table)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'UPDATE {table} SET "value" = "value" + %s WHERE "id" = %s RETURNING "value"', [count, cls.ROW]
+                )
+                row = cursor.fetchone()
+            if row is not None:
+                return row[0] - count + 1
+        elif cls.objects.filter(pk=cls.ROW).update(value=F('value') + count):
+            return cls.objects.values_list('value', flat=True).get(pk=cls.ROW) - count + 1
+        # The row is created by the migration; only a flushed table lacks it
+        latest = max(
+            model.objects.aggregate(latest=Max('sequence'))['latest'] or 0 for model in (ChangeEvent, PhaseEvent)
+        )
+        cls.objects.create(pk=cls.ROW, value=latest + count)
+        return latest + 1
+
+
+class PhaseEvent(models.Model):
+    """
+    Append-only history of the production workflow.
+
+    One row per phase start, completion, failure, rollback and skip, and per
+    quarantine entry and release, written in the transaction that made the
+    change. Unlike the change feed the log is never pruned and rows are never
+    updated, so rollups derived from it can always be rebuilt by replaying it.
+    Consumers read it in ``sequence`` order from their EventWatermark.
+    """
+    
+    ACTION_CHOICES = [
+        ('started', 'Started'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+        ('rolled_back', 'Rolled Back'),
+        ('skipped', 'Skipped'),
+        ('quarantined', 'Quarantined'),
+        ('released', 'Released'),
+    ]
+    # The execution statuses that are themselves logged actions
+    STATUS_ACTIONS = {'in_progress': 'started', 'completed': 'completed', 'failed': 'failed', 'skipped': 'skipped'}
+    # A phase going back to one of these from any other status is a rollback
+    ROLLBACK_STATUSES = ('not_ready', 'pending', 'rolled_back')
+    
+    sequence = models.PositiveBigIntegerField(unique=True)
+    action = models.CharField(max_length=20, choices=ACTION_CHOICES)
+    execution = models.ForeignKey(
+        BatchPhaseExecution, on_delete=models.SET_NULL, null=True, blank=True, related_name='events'
+    )
+    bmr = models.ForeignKey(BMR, on_delete=models.SET_NULL, null=True, blank=True, related_name='phase_events')
+    phase_name = models.CharField(max_length=50)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='+'
+    )
+    duration_seconds = models.IntegerField(null=True, blank=True, help_text="Start to completion, for completions")
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+    
+    class Meta:
+        ordering = ['sequence']
+        indexes = [
+            # A batch's history in log order
+            models.Index(fields=['bmr', 'sequence'], name='phaseevent_bmr_seq'),
+        ]
+    
+    def __str__(self):
+        return f"#{self.sequence} {self.phase_name} {self.action}"
+    
+    @classmethod
+    def action_for(cls, previous_status, status):
+        """The logged action for an execution moving between statuses, or None"""
+        if status == previous_status:
+            return None
+        if status in cls.STATUS_ACTIONS:
+            return cls.STATUS_ACTIONS[status]
+        if status in cls.ROLLBACK_STATUSES and previous_status and previous_status not in cls.ROLLBACK_STATUSES:
+            return 'rolled_back'
+        return None
+    
+    @classmethod
+    def record_many(cls, events, batch_size=None):
+        """Append unsaved events (None entries are skipped) with one INSERT, inside the writing transaction"""
+        events = [event for event in events if event is not None]
+        if not events:
+            return []
+        with write_transaction(savepoint=False):
+            first = EventSequence.reserve(len(events))
+            for offset, event in enumerate(events):
+                event.sequence = first + offset
+            return cls.objects.bulk_create(events, batch_size=batch_size)
+    
+    @classmethod
+    def since(cls, sequence, limit=500):
+        """Events after the given sequence number, oldest first"""
+        return cls.objects.filter(sequence__gt=sequence).order_by('sequence')[:limit]
+
+
+class EventWatermark(models.Model):
+    """
+    How far an incremental consumer has read the phase event log.
+
+    Rollups and exports that are derived from the log keep the sequence of
+    the last event they folded in, and on each run only read the events after
+    it instead of rescanning the tables the events describe.
+    """
+    
+    consumer = models.CharField(max_length=50, unique=True)
+    sequence = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+    
+    def __str__(self):
+        return f"{self.consumer} @ {self.sequence}"
+    
+    @classmethod
+    def consume(cls, consumer, handler, batch_size=500):
+        """
+        Pass the phase events after the consumer's watermark to ``handler`` in
+        batches, oldest first. Each batch is handled and the watermark moved
+        past it in one transaction, so an event is folded in exactly once even
+        when the handler fails halfway. Returns the number of events handled.
+        """
+        handled = 0
+        while True:
+            with write_transaction():
+                watermark, _ = cls.objects.select_for_update().get_or_create(consumer=consumer)
+                events = list(PhaseEvent.since(watermark.sequence, limit=batch_size))
+                if not events:
+                    break
+                handler(events)
+                watermark.sequence = events[-1].sequence
+                watermark.updated_at = timezone.now()
+                watermark.save(update_fields=['sequence', 'updated_at'])
+            handled += len(events)
+            if len(events) < batch_size:
+                break
+        return handled
+    
+    @classmethod
+    def advance(cls, consumer, sequence):
+        """Move the watermark to a sequence, e.g. back to 0 to replay the log"""
+        cls.objects.update_or_create(
+            consumer=consumer, defaults={'sequence': sequence, 'updated_at': timezone.now()}
+        )
+
+
+class PhaseStats(models.Model):
+    """
+    Running totals per product type and phase, folded in from the phase events.
+
+    Every start, completion, failure and rollback counts once, when it
+    happens, so a phase that failed QC and passed on the second attempt shows
+    both outcomes.
+    """
+    
+    CONSUMER = 'phase_stats'
+    TOTALS = ['starts', 'completions', 'timed_completions', 'total_hours', 'failures', 'rollbacks']
+    
+    product_type = models.CharField(max_length=20)
+    phase_name = models.CharField(max_length=50)
+    starts = models.IntegerField(default=0)
+    completions = models.IntegerField(default=0)
+    timed_completions = models.IntegerField(default=0, help_text="Completions with a start and end time")
+    total_hours = models.FloatField(default=0)
+    failures = models.IntegerField(default=0)
+    rollbacks = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        unique_together = ['product_type', 'phase_name']
+        ordering = ['product_type', 'phase_name']
+        verbose_name = 'Phase Stats'
+        verbose_name_plural = 'Phase Stats'
+    
+    def __str__(self):
+        return f"{self.product_type} - {self.phase_name} ({self.completions} completed)"
+    
+    @property
+    def average_hours(self):
+        if not self.timed_completions:
+            return None
+        return self.total_hours / self.timed_completions
+    
+    @classmethod
+    def catch_up(cls, batch_size=500):
+        """Fold in the phase events added since the last run; returns the number of events read"""
+        return EventWatermark.consume(cls.CONSUMER, cls.apply_events, batch_size=batch_size)
+    
+    @staticmethod
+    def _counts(event):
+        """What a phase event adds to its row, or None when it is not a start, outcome or rollback"""
+        if event.action == 'started':
+            return {'starts': 1}
+        if event.action == 'failed':
+            return {'failures': 1}
+        if event.action == 'rolled_back':
+            return {'rollbacks': 1}
+        if event.action == 'completed':
+            if event.duration_seconds is None:
+                return {'completions': 1}
+            return {'completions': 1, 'timed_completions': 1, 'total_hours': event.duration_seconds / 3600}
+        return None
+    
+    @classmethod
+    def _deltas(cls, product_types, events):
+        deltas = {}
+        for event in events:
+            product_type = product_types.get(event.bmr_id)
+            counts = cls._counts(event)
+            if not product_type or not counts:
+                continue
+            totals = deltas.setdefault((product_type, event.phase_name), dict.fromkeys(cls.TOTALS, 0))
+            for field, value in counts.items():
+                totals[field] += value
+        return deltas
+    
+    @classmethod
+    def apply_events(cls, events):
+        """Add a batch of phase events to the totals, with one read and one write per table"""
+        bmr_ids = {event.bmr_id for event in events if event.bmr_id}
+        product_types = dict(
+            BMR.objects.filter(pk__in=bmr_ids).order_by().values_list('pk', 'product__product_type')
+        )
+        deltas = cls._deltas(product_types, events)
+        if not deltas:
+            return
+        
+        now = timezone.now()
+        existing = {
+            (row.product_type, row.phase_name): row
+            for row in cls.objects.filter(
+                product_type__in={key[0] for key in deltas}, phase_name__in={key[1] for key in deltas},
+            )
+        }
+        created, updated = [], []
+        for (product_type, phase_name), totals in deltas.items():
+            row = existing.get((product_type, phase_name))
+            if row is None:
+                created.append(cls(product_type=product_type, phase_name=phase_name, updated_at=now, **totals))
+                continue
+            for field in cls.TOTALS:
+                setattr(row, field, getattr(row, field) + totals[field])
+            row.updated_at = now
+            updated.append(row)
+        cls.objects.bulk_create(created)
+        cls.objects.bulk_update(updated, cls.TOTALS + ['updated_at'])
+    
+    @classmethod
+    def rebuild(cls, batch_size=500):
+        """Recompute the totals by replaying the whole phase event log; returns the number of rows"""
+        with write_transaction():
+            cls.objects.all().delete()
+            EventWatermark.advance(cls.CONSUMER, 0)
+            cls.catch_up(batch_size=batch_size)
+            return cls.objects.count()
+
+
 class PhaseOperator(models.Model):
     """Maps operators to specific phases they can handle"""
     
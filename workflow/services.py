@@ -1,10 +1,42 @@
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.db.models.query import QuerySet
 from django.utils import timezone
 from bmr.models import BMR
-from .models import ProductionPhase, BatchPhaseExecution
+from kampala_pharma.db_writer import write_transaction
+from .models import ProductionPhase, BatchPhaseExecution, BMRProgress, ChangeEvent, PhaseConflict, PhaseEvent, PhaseOperator
+from .transitions import get_graph, invalidate as invalidate_graphs
 
 class WorkflowService:
     """Service to manage workflow progression and phase automation"""
     
+    # Bulk actions: the status an execution must have and the one it moves to
+    BULK_ACTIONS = {
+        'start': ('pending', 'in_progress'),
+        'complete': ('in_progress', 'completed'),
+    }
+    
+    # Map user roles to phases they can handle
+    ROLE_PHASES = {
+        'qa': ['bmr_creation', 'final_qa'],
+        'regulatory': ['regulatory_approval'],
+        'store_manager': ['raw_material_release'],  # Store Manager handles raw material release
+        'dispensing_operator': ['material_dispensing'],  # Dispensing Operator handles material dispensing
+        'packaging_store': ['packaging_material_release'],  # Packaging store handles packaging material release
+        'finished_goods_store': ['finished_goods_store'],  # Finished Goods Store only handles finished goods storage
+        'qc': ['post_compression_qc', 'post_mixing_qc', 'post_blending_qc'],
+        'mixing_operator': ['mixing'],
+        'granulation_operator': ['granulation'],
+        'blending_operator': ['blending'],
+        'compression_operator': ['compression'],
+        'coating_operator': ['coating'],
+        'drying_operator': ['drying'],
+        'filling_operator': ['filling'],
+        'tube_filling_operator': ['tube_filling'],
+        'packing_operator': ['blister_packing', 'bulk_packing', 'secondary_packaging'],
+        'sorting_operator': ['sorting'],
+    }
+    
     # Define the workflow sequences for each product type
     PRODUCT_WORKFLOWS = {
         'ointment': [
@@ -55,10 +87,17 @@ class WorkflowService:
         ]
     }
     
+    # Status of each new phase execution; phases not listed start as not_ready
+    # and are activated by the transition from the phase before them
+    INITIAL_STATUSES = {
+        'bmr_creation': 'completed',
+        'regulatory_approval': 'pending',
+    }
+    
     @classmethod
-    def initialize_workflow_for_bmr(cls, bmr):
-        """Initialize all workflow phases for a new BMR using the correct system workflow"""
-        product_type = bmr.product.product_type
+    def phase_sequence(cls, product):
+        """Phase names of a product's workflow, in order, for its coating and tablet type"""
+        product_type = product.product_type
         
         # Use the PRODUCT_WORKFLOWS dictionary which includes raw_material_release
         base_workflow = cls.PRODUCT_WORKFLOWS.get(product_type, [])
@@ -71,12 +110,12 @@ class WorkflowService:
         # Handle tablet-specific logic for coating and packing types
         if product_type == 'tablet':
             # Handle coating - skip if not coated
-            if not getattr(bmr.product, 'is_coated', False):
+            if not getattr(product, 'is_coated', False):
                 if 'coating' in workflow_phases:
                     workflow_phases.remove('coating')
             
             # Handle packing type for tablets
-            if getattr(bmr.product, 'tablet_type', None) == 'tablet_2':
+            if getattr(product, 'tablet_type', None) == 'tablet_2':
                 # TABLET_2 uses bulk_packing instead of blister_packing
                 if 'blister_packing' in workflow_phases:
                     index = workflow_phases.index('blister_packing')
@@ -84,60 +123,191 @@ class WorkflowService:
         
         # Remove any duplicate phases that might exist
         seen = set()
-        workflow_phases = [x for x in workflow_phases if not (x in seen or seen.add(x))]
-
-        # Remove any accidental duplicates
-        seen = set()
-        workflow_phases = [x for x in workflow_phases if not (x in seen or seen.add(x))]
+        return [x for x in workflow_phases if not (x in seen or seen.add(x))]
+    
+    @classmethod
+    def variant_key(cls, product):
+        """Key of the product's workflow variant; coating and tablet type only change the tablet workflow"""
+        if product.product_type != 'tablet':
+            return (product.product_type,)
+        return (product.product_type, bool(getattr(product, 'is_coated', False)), getattr(product, 'tablet_type', None) or '')
+    
+    @classmethod
+    def graph_for(cls, product):
+        """Compiled transition graph for the product's workflow variant"""
+        return get_graph(cls.variant_key(product), tuple(cls.phase_sequence(product)), product.product_type)
+    
+    @classmethod
+    def _apply_transition(cls, bmr, transition):
+        """Apply a compiled transition to the BMR's executions; False if the phase to activate is missing"""
+        return bmr.pk in cls._apply_transitions([(bmr, transition)])
+    
+    @classmethod
+    def _apply_transitions(cls, transitions):
+        """
+        Apply compiled transitions to several BMRs with one read and one UPDATE.
         
-        # Create phase executions for all phases in the workflow
-        for order, phase_name in enumerate(workflow_phases, 1):
-            try:
-                # Get or create the production phase definition with ENFORCED correct order
-                phase, created = ProductionPhase.objects.get_or_create(
-                    product_type=product_type,
-                    phase_name=phase_name,
-                    defaults={
-                        'phase_order': order,
-                        'is_mandatory': True,
-                        'requires_approval': phase_name in ['regulatory_approval', 'final_qa']
-                    }
-                )
-                
-                # CRITICAL: Always update phase order to ensure consistency
-                if phase.phase_order != order:
-                    phase.phase_order = order
-                    phase.save()
-                    print(f"Updated phase order for {phase_name} to {order}")
-                
-                # Create the batch phase execution with proper initial status
-                if phase_name == 'bmr_creation':
-                    initial_status = 'completed'
-                elif phase_name == 'regulatory_approval':
-                    initial_status = 'pending'
-                elif phase_name == 'raw_material_release':
-                    initial_status = 'not_ready'  # Will be activated when regulatory approval completes
-                elif phase_name == 'material_dispensing':
-                    initial_status = 'not_ready'  # Will be activated when raw material release completes
-                # ENHANCEMENT: Ensure secondary_packaging is properly initialized
-                elif phase_name == 'secondary_packaging':
-                    # Always initialize as not_ready, it will be activated at the right time
-                    initial_status = 'not_ready'
-                else:
-                    initial_status = 'not_ready'
-                
-                BatchPhaseExecution.objects.get_or_create(
-                    bmr=bmr,
-                    phase=phase,
-                    defaults={
-                        'status': initial_status
-                    }
+        ``transitions`` is a list of (bmr, transition) pairs, at most one per
+        BMR. Returns the ids of the BMRs whose transition was applied; a BMR
+        missing the phase to activate is left alone.
+        """
+        if not transitions:
+            return set()
+        executions = {}
+        for execution in BatchPhaseExecution.objects.filter(
+            bmr_id__in=[bmr.pk for bmr, _ in transitions],
+            phase__phase_name__in={name for _, transition in transitions for name in transition.phase_names}
+        ).select_related('phase').order_by():
+            executions[(execution.bmr_id, execution.phase.phase_name)] = execution
+        
+        applied = set()
+        changes = {}
+        for bmr, transition in transitions:
+            if transition.activate and (bmr.pk, transition.activate) not in executions:
+                print(f"WARNING: No {transition.activate} phase found for BMR {bmr.batch_number}")
+                continue
+            for phase_name in transition.reset:
+                execution = executions.get((bmr.pk, phase_name))
+                if execution and execution.status == 'pending':
+                    changes[execution] = 'not_ready'
+            for phase_name in transition.complete:
+                if (bmr.pk, phase_name) in executions:
+                    changes[executions[(bmr.pk, phase_name)]] = 'completed'
+            if transition.activate:
+                changes[executions[(bmr.pk, transition.activate)]] = 'pending'
+            applied.add(bmr.pk)
+        
+        BatchPhaseExecution.bulk_transition(changes, fields={'completed': {
+            'completed_date': timezone.now(),
+            'operator_comments': "QC completed via quarantine sample approval",
+        }})
+        return applied
+    
+    @classmethod
+    def _phase_definitions(cls, product):
+        """
+        The workflow's phase names and their ProductionPhase rows, created and ordered as needed.
+        
+        The rows come from the compiled graph, which every process rebuilds
+        when ProductionPhase rows are saved or deleted. Only when the graph
+        lacks a phase or has one out of order are the rows read again, the
+        missing ones created and the order corrected.
+        """
+        sequence = cls.phase_sequence(product)
+        phases = cls.graph_for(product).phases
+        if all(name in phases and phases[name].phase_order == order for order, name in enumerate(sequence, 1)):
+            return sequence, phases
+        
+        def phase_rows():
+            return {
+                phase.phase_name: phase
+                for phase in ProductionPhase.objects.filter(product_type=product.product_type, phase_name__in=sequence)
+            }
+        
+        # The graph may predate rows changed without the model, e.g. by a migration
+        invalidate_graphs()
+        phases = phase_rows()
+        missing = [name for name in sequence if name not in phases]
+        if missing:
+            ProductionPhase.objects.bulk_create([
+                ProductionPhase(
+                    product_type=product.product_type,
+                    phase_name=name,
+                    phase_order=sequence.index(name) + 1,
+                    is_mandatory=True,
+                    requires_approval=name in ['regulatory_approval', 'final_qa']
                 )
-                
-            except Exception as e:
-                print(f"Error creating phase {phase_name} for BMR {bmr.bmr_number}: {e}")
+                for name in missing
+            ], ignore_conflicts=True)
+            invalidate_graphs()
+            phases = phase_rows()
         
-        print(f"Initialized workflow for {bmr.batch_number} ({product_type}) with {len(workflow_phases)} phases")
+        # CRITICAL: Always update phase order to ensure consistency
+        reordered = []
+        for order, name in enumerate(sequence, 1):
+            if phases[name].phase_order != order:
+                phases[name].phase_order = order
+                reordered.append(phases[name])
+        if reordered:
+            ProductionPhase.objects.bulk_update(reordered, ['phase_order'])
+            invalidate_graphs()
+            print(f"Updated phase order for {', '.join(phase.phase_name for phase in reordered)}")
+        return sequence, phases
+    
+    @classmethod
+    def initialize_workflows(cls, bmrs, batch_size=500):
+        """
+        Create the phase executions of many BMRs in one transaction, for imports and backfills.
+        
+        Phase definitions come from the compiled graphs and all missing
+        executions are written with one bulk insert. Executions that already
+        exist are left as they are, so repeated calls are harmless. Returns
+        the number of executions created.
+        """
+        if isinstance(bmrs, QuerySet):
+            bmrs = bmrs.select_related('product')
+        bmrs = list(bmrs)
+        if not bmrs:
+            return 0
+        bmr_ids = [bmr.pk for bmr in bmrs]
+        
+        with write_transaction():
+            existing = set(
+                BatchPhaseExecution.objects.filter(bmr_id__in=bmr_ids).order_by().values_list('bmr_id', 'phase_id')
+            )
+            definitions = {}
+            phase_names = {}
+            new_executions = []
+            for bmr in bmrs:
+                key = cls.variant_key(bmr.product)
+                if key not in definitions:
+                    definitions[key] = cls._phase_definitions(bmr.product)
+                sequence, phases = definitions[key]
+                for phase_name in sequence:
+                    phase = phases[phase_name]
+                    phase_names[phase.pk] = phase_name
+                    if (bmr.pk, phase.pk) not in existing:
+                        new_executions.append(BatchPhaseExecution(
+                            bmr=bmr, phase=phase, status=cls.INITIAL_STATUSES.get(phase_name, 'not_ready')
+                        ))
+            if not new_executions:
+                return 0
+            
+            # Conflicts (a concurrent initialization) are skipped, as get_or_create did
+            BatchPhaseExecution.objects.bulk_create(new_executions, batch_size=batch_size, ignore_conflicts=True)
+            
+            # bulk_create skips save(): publish the new executions and recount progress
+            created = {(execution.bmr_id, execution.phase_id) for execution in new_executions}
+            rows = [
+                row for row in BatchPhaseExecution.objects.filter(
+                    bmr_id__in=bmr_ids
+                ).order_by('bmr_id', 'phase__phase_order').values_list('pk', 'bmr_id', 'phase_id', 'status')
+                if (row[1], row[2]) in created
+            ]
+            ChangeEvent.record_many('phase', [
+                (execution_id, bmr_id, status, {
+                    'phase': phase_names[phase_id],
+                    'previous_status': None,
+                    'started_date': None,
+                    'completed_date': None,
+                })
+                for execution_id, bmr_id, phase_id, status in rows
+            ], batch_size=batch_size)
+            # Executions that start out completed (BMR creation) are logged as such
+            PhaseEvent.record_many([
+                PhaseEvent(action=PhaseEvent.action_for(None, status), execution_id=execution_id,
+                           bmr_id=bmr_id, phase_name=phase_names[phase_id])
+                for execution_id, bmr_id, phase_id, status in rows
+                if PhaseEvent.action_for(None, status)
+            ], batch_size=batch_size)
+            BMRProgress.rebuild(bmr_ids=bmr_ids, batch_size=batch_size)
+        return len(new_executions)
+    
+    @classmethod
+    def initialize_workflow_for_bmr(cls, bmr):
+        """Initialize all workflow phases for a new BMR using the correct system workflow"""
+        cls.initialize_workflows([bmr])
+        print(f"Initialized workflow for {bmr.batch_number} ({bmr.product.product_type}) with {len(cls.phase_sequence(bmr.product))} phases")
     
     @classmethod
     def get_current_phase(cls, bmr):
@@ -167,109 +337,197 @@ class WorkflowService:
         return None
     
     @classmethod
-    def complete_phase(cls, bmr, phase_name, completed_by, comments=None):
-        """Mark a phase as completed and activate the next phase"""
+    @write_transaction
+    def complete_phase(cls, bmr, phase_name, completed_by, comments=None, expected_version=None):
+        """
+        Mark a phase as completed and activate the next phase.
+        
+        The completion is a guarded UPDATE: PhaseConflict is raised when the
+        execution is not in progress at the version read (or
+        ``expected_version``), e.g. because it was never started or another
+        operator completed it first.
+        """
         try:
-            execution = BatchPhaseExecution.objects.get(
+            execution = BatchPhaseExecution.objects.select_related('phase').get(
                 bmr=bmr,
                 phase__phase_name=phase_name
             )
-            
-            # Mark current phase as completed
-            execution.status = 'completed'
-            execution.completed_by = completed_by
-            execution.completed_date = timezone.now()
-            if comments:
-                execution.operator_comments = comments
-            execution.save()
-            
-            # Create QC checkpoints if this is a QC phase
-            if 'qc' in phase_name.lower():
-                cls._create_qc_checkpoints(execution, completed_by)
-            
-            # Activate next phase by finding the next 'not_ready' phase in sequence
-            next_phases = BatchPhaseExecution.objects.filter(
-                bmr=bmr,
-                phase__phase_order__gt=execution.phase.phase_order,
-                status='not_ready'
-            ).order_by('phase__phase_order')
-            
-            if next_phases.exists():
-                next_phase = next_phases.first()
-                next_phase.status = 'pending'  # Make it available for operators
-                next_phase.save()
-                
-                # Store notification data in session if available
-                from django.contrib import messages
-                if hasattr(completed_by, 'request') and hasattr(completed_by.request, 'session'):
-                    completed_by.request.session['completed_phase'] = phase_name
-                    completed_by.request.session['completed_bmr'] = bmr.id
-                    if next_phase:
-                        next_phase_name = next_phase.phase.get_phase_name_display()
-                        if bmr.product.product_type == 'tablet' and getattr(bmr.product, 'tablet_type', None) == 'tablet_2' and phase_name == 'packaging_material_release':
-                            next_phase_name = 'Bulk Packing'  # Force correct next phase name
-                return next_phase
-                
         except BatchPhaseExecution.DoesNotExist:
             print(f"Phase execution not found: {phase_name} for BMR {bmr.bmr_number}")
+            return None
         
-        return None
+        # Mark current phase as completed
+        fields = {'completed_by': completed_by, 'completed_date': timezone.now()}
+        if comments:
+            fields['operator_comments'] = comments
+        execution.transition('completed', expected_version=expected_version, **fields)
+        
+        # Create QC checkpoints if this is a QC phase
+        if 'qc' in phase_name.lower():
+            cls._create_qc_checkpoints(execution, completed_by)
+        
+        # Activate next phase by finding the next 'not_ready' phase in sequence
+        next_phase = BatchPhaseExecution.objects.filter(
+            bmr=bmr,
+            phase__phase_order__gt=execution.phase.phase_order,
+            status='not_ready'
+        ).select_related('phase').order_by('phase__phase_order').first()
+        
+        if next_phase:
+            # Make it available for operators
+            BatchPhaseExecution.bulk_transition({next_phase: 'pending'})
+            
+            # Store notification data in session if available
+            if hasattr(completed_by, 'request') and hasattr(completed_by.request, 'session'):
+                completed_by.request.session['completed_phase'] = phase_name
+                completed_by.request.session['completed_bmr'] = bmr.id
+        return next_phase
     
     @classmethod
-    def start_phase(cls, bmr, phase_name, started_by):
-        """Start a phase execution - with prerequisite validation"""
+    def start_phase(cls, bmr, phase_name, started_by, expected_version=None):
+        """
+        Start a phase execution - with prerequisite validation.
+        
+        Starting is a single guarded UPDATE from pending; PhaseConflict is
+        raised when another operator changed the execution first.
+        """
         try:
-            execution = BatchPhaseExecution.objects.get(
+            execution = BatchPhaseExecution.objects.select_related('phase').get(
                 bmr=bmr,
                 phase__phase_name=phase_name,
                 status='pending'
             )
-            
-            # Validate that all prerequisite phases are completed
-            if not cls.can_start_phase(bmr, phase_name):
-                print(f"Cannot start phase {phase_name} for BMR {bmr.bmr_number} - prerequisites not met")
-                return None
-            
-            execution.status = 'in_progress'
-            execution.started_by = started_by
-            execution.started_date = timezone.now()
-            execution.save()
-            
-            return execution
-            
         except BatchPhaseExecution.DoesNotExist:
             print(f"Cannot start phase {phase_name} for BMR {bmr.bmr_number} - not pending")
+            return None
         
-        return None
+        # Validate that all prerequisite phases are completed
+        if not cls.can_start_phase(bmr, phase_name):
+            print(f"Cannot start phase {phase_name} for BMR {bmr.bmr_number} - prerequisites not met")
+            return None
+        
+        return execution.transition(
+            'in_progress', expected_version=expected_version,
+            started_by=started_by, started_date=timezone.now()
+        )
     
     @classmethod
-    def can_start_phase(cls, bmr, phase_name):
-        """Check if a phase can be started (all prerequisites completed)"""
-        try:
-            current_execution = BatchPhaseExecution.objects.get(
-                bmr=bmr,
-                phase__phase_name=phase_name
-            )
-            
-            # Cannot start phases that are not pending
-            if current_execution.status != 'pending':
-                return False
-            
-            # Get all phases with lower order (prerequisites)
-            prerequisite_phases = BatchPhaseExecution.objects.filter(
-                bmr=bmr,
-                phase__phase_order__lt=current_execution.phase.phase_order
-            )
-            
-            # Check if all prerequisite phases are completed or skipped
-            for prereq in prerequisite_phases:
-                if prereq.status not in ['completed', 'skipped']:
-                    return False
-            
-            return True
+    @write_transaction
+    def bulk_phase_action(cls, user, action, versions, comments='', machine=None):
+        """
+        Start or complete several phase executions for one user in one transaction.
+        
+        ``action`` is a key of BULK_ACTIONS and ``versions`` maps execution ids
+        to the version the user last saw (None to accept the current one).
+        The executions are checked together - in the user's work queue, in
+        the right status, at the expected version, prerequisites done and a
+        machine given where one is needed - and the valid ones are moved with
+        one UPDATE. Completed phases are routed on like trigger_next_phase,
+        with the next phases of all batches activated together.
+        
+        Returns one result dict per id, in the order given.
+        """
+        from_status, to_status = cls.BULK_ACTIONS[action]
+        unfinished_prerequisites = BatchPhaseExecution.objects.filter(
+            bmr=OuterRef('bmr'),
+            phase__phase_order__lt=OuterRef('phase__phase_order')
+        ).exclude(status__in=['completed', 'skipped'])
+        executions = {
+            execution.pk: execution
+            for execution in cls.get_work_queue(
+                user, statuses=[status for status, _ in BatchPhaseExecution.STATUS_CHOICES]
+            ).filter(pk__in=list(versions)).annotate(blocked=Exists(unfinished_prerequisites))
+        }
+        
+        results = {}
+        
+        def reject(pk, message):
+            results[pk] = {'id': pk, 'ok': False, 'message': message}
+        
+        valid = []
+        for pk, version in versions.items():
+            execution = executions.get(pk)
+            if execution is None:
+                reject(pk, 'Phase not found or not assigned to you.')
+            elif execution.status != from_status:
+                reject(pk, f"{execution.phase.get_phase_name_display()} for batch {execution.bmr.batch_number} "
+                           f"is {execution.get_status_display().lower()}.")
+            elif version is not None and version != execution.version:
+                reject(pk, f"{execution.phase.get_phase_name_display()} for batch {execution.bmr.batch_number} "
+                           f"was updated by someone else.")
+            elif action == 'start' and execution.blocked:
+                reject(pk, f"Cannot start {execution.phase.get_phase_name_display()} for batch "
+                           f"{execution.bmr.batch_number} - prerequisites not met.")
+            elif action == 'start' and machine is None and execution.requires_machine_selection():
+                reject(pk, f"Machine selection is required for {execution.phase.get_phase_name_display()}.")
+            else:
+                valid.append(execution)
+        
+        now = timezone.now()
+        if action == 'start':
+            fields = {'started_by': user, 'started_date': now,
+                      'operator_comments': f"Started by {user.get_full_name()}. Notes: {comments}"}
+            if machine is not None:
+                fields['machine_used'] = machine
+        else:
+            fields = {'completed_by': user, 'completed_date': now,
+                      'operator_comments': f"Completed by {user.get_full_name()}. Notes: {comments}"}
+        
+        # A row changed since it was read drops out; the rest are retried
+        while valid:
+            try:
+                BatchPhaseExecution.bulk_transition(
+                    {execution: to_status for execution in valid}, fields={to_status: fields}
+                )
+                break
+            except PhaseConflict as conflict:
+                reject(conflict.execution.pk, str(conflict))
+                valid.remove(conflict.execution)
+        
+        next_phases = {}
+        if action == 'complete':
+            from quarantine.models import QuarantineBatch
             
-        except BatchPhaseExecution.DoesNotExist:
-            return False
+            activations, quarantined = [], []
+            for execution in valid:
+                transition = cls.graph_for(execution.bmr.product).after(execution.phase.phase_name)
+                if transition is None:
+                    continue
+                if transition.quarantine:
+                    quarantined.append(execution)
+                    next_phases[execution.pk] = 'quarantine'
+                elif transition.activate:
+                    activations.append((execution, transition))
+            QuarantineBatch.enter([(execution.bmr, execution.phase) for execution in quarantined])
+            applied = cls._apply_transitions([(execution.bmr, transition) for execution, transition in activations])
+            for execution, transition in activations:
+                if execution.bmr_id in applied:
+                    next_phases[execution.pk] = transition.activate
+        
+        for execution in valid:
+            results[execution.pk] = {
+                'id': execution.pk,
+                'ok': True,
+                'message': f"{execution.phase.get_phase_name_display()} for batch {execution.bmr.batch_number} "
+                           f"is now {execution.get_status_display().lower()}.",
+                'status': execution.status,
+                'version': execution.version,
+                'next_phase': next_phases.get(execution.pk),
+            }
+        return [results[pk] for pk in versions]
+    
+    @classmethod
+    def can_start_phase(cls, bmr, phase_name):
+        """Check if a phase can be started (pending, and all prerequisites completed or skipped)"""
+        unfinished_prerequisites = BatchPhaseExecution.objects.filter(
+            bmr=OuterRef('bmr'),
+            phase__phase_order__lt=OuterRef('phase__phase_order')
+        ).exclude(status__in=['completed', 'skipped'])
+        return BatchPhaseExecution.objects.filter(
+            bmr=bmr,
+            phase__phase_name=phase_name,
+            status='pending'
+        ).exclude(Exists(unfinished_prerequisites)).exists()
     
     @classmethod
     def get_workflow_status(cls, bmr):
@@ -320,56 +578,53 @@ class WorkflowService:
         )
     
     @classmethod
+    @write_transaction
     def handle_qc_failure_rollback(cls, bmr, failed_phase_name, rollback_to_phase):
-        """Handle QC failure and rollback to a previous phase"""
+        """
+        Handle QC failure and rollback to a previous phase.
+        
+        Every phase from the rollback point onward (including the failed QC
+        phase, which must be retested) is reset in one UPDATE, with only the
+        rollback phase left pending so work can resume there.
+        """
         try:
-            # Find the failed QC phase
-            failed_execution = BatchPhaseExecution.objects.get(
-                bmr=bmr,
-                phase__phase_name=failed_phase_name
-            )
+            executions = {
+                execution.phase.phase_name: execution
+                for execution in BatchPhaseExecution.objects.filter(bmr=bmr).select_related('phase').order_by()
+            }
+            failed_execution = executions[failed_phase_name]
+            rollback_phase = executions[rollback_to_phase]
             
             # Mark the QC phase as failed for audit trail
             if failed_execution.status != 'failed':
-                failed_execution.status = 'failed'
-                failed_execution.completed_date = timezone.now()
-                failed_execution.save()
-            
-            # Find the rollback phase 
-            rollback_phase = BatchPhaseExecution.objects.get(
-                bmr=bmr,
-                phase__phase_name=rollback_to_phase
-            )
+                BatchPhaseExecution.bulk_transition(
+                    {failed_execution: 'failed'}, fields={'failed': {'completed_date': timezone.now()}}
+                )
             
             # CRITICAL: Reset ALL phases from rollback point onward to ensure proper sequence
-            # This includes the failed QC phase which must be reset for retesting
-            phases_to_reset = BatchPhaseExecution.objects.filter(
-                bmr=bmr,
-                phase__phase_order__gte=rollback_phase.phase.phase_order
-            )
-            
-            for phase_execution in phases_to_reset:
-                # Reset to not_ready - they will be activated in proper sequence
-                phase_execution.status = 'not_ready'
-                phase_execution.started_by = None
-                phase_execution.started_date = None
-                phase_execution.completed_by = None
-                phase_execution.completed_date = None
-                
-                if phase_execution.id == failed_execution.id:
-                    phase_execution.operator_comments = f'QC RESET: Ready for retesting after {rollback_to_phase} rework.'
-                elif phase_execution.id == rollback_phase.id:
-                    phase_execution.operator_comments = f'REWORK REQUIRED: Rolled back from {failed_phase_name} failure. Must restart from this phase.'
+            changes = {}
+            comments = {}
+            for execution in executions.values():
+                if execution.phase.phase_order < rollback_phase.phase.phase_order:
+                    continue
+                if execution is failed_execution:
+                    comment = f'QC RESET: Ready for retesting after {rollback_to_phase} rework.'
+                elif execution is rollback_phase:
+                    comment = f'REWORK REQUIRED: Rolled back from {failed_phase_name} failure. Must restart from this phase.'
                 else:
-                    phase_execution.operator_comments = 'RESET: Waiting for workflow sequence after rollback.'
-                
-                phase_execution.save()
-            
-            # Set ONLY the rollback phase to pending so work can resume
-            rollback_phase.status = 'pending'
-            rollback_phase.operator_comments = f'REWORK REQUIRED: Rolled back from {failed_phase_name} failure. Must restart from this phase.'
-            rollback_phase.save()
-            
+                    comment = 'RESET: Waiting for workflow sequence after rollback.'
+                # Reset to not_ready - they will be activated in proper sequence,
+                # except the rollback phase which is set pending so work can resume
+                changes[execution] = 'pending' if execution is rollback_phase else 'not_ready'
+                comments[execution] = {'operator_comments': comment}
+            
+            cleared = {
+                'started_by': None, 'started_date': None,
+                'completed_by': None, 'completed_date': None,
+            }
+            BatchPhaseExecution.bulk_transition(
+                changes, fields={'not_ready': cleared, 'pending': cleared}, values=comments
+            )
             return True
             
         except Exception as e:
@@ -377,263 +632,34 @@ class WorkflowService:
             return False
     
     @classmethod
+    @write_transaction
     def trigger_next_phase(cls, bmr, current_phase):
         """Trigger the next phase in the workflow after completing current phase"""
         try:
-            current_execution = BatchPhaseExecution.objects.get(
-                bmr=bmr,
-                phase=current_phase
-            )
-            
-            # QUARANTINE LOGIC: Check if this phase should go to quarantine
-            phases_that_bypass_quarantine = [
-                'bmr_creation', 'regulatory_approval',  # Administrative phases
-                'raw_material_release', 'material_dispensing', 'packaging_material_release',  # Material handling
-                'blister_packing', 'bulk_packing', 'secondary_packaging',  # All packing phases bypass quarantine
-                'final_qa', 'finished_goods_store'  # Final phases
-            ]
-            
-            if current_execution.phase.phase_name not in phases_that_bypass_quarantine:
-                print(f"Phase {current_execution.phase.phase_name} completed for BMR {bmr.batch_number}, sending to quarantine...")
-                return cls._send_to_quarantine(bmr, current_execution)
-            
-            # EXISTING SPECIAL HANDLING (no quarantine)
-            # NEW: Handle raw material release -> material dispensing transition
-            if current_execution.phase.phase_name == 'raw_material_release':
-                print(f"Completed raw material release for BMR {bmr.batch_number}, activating material dispensing...")
-                material_dispensing_phase = BatchPhaseExecution.objects.filter(
-                    bmr=bmr,
-                    phase__phase_name='material_dispensing'
-                ).first()
-                
-                if material_dispensing_phase:
-                    material_dispensing_phase.status = 'pending'
-                    material_dispensing_phase.save()
-                    print(f"Activated material_dispensing phase for BMR {bmr.batch_number}")
-                    return True
-                else:
-                    print(f"WARNING: No material_dispensing phase found for BMR {bmr.batch_number}")
-                    return False
-            
-            # NEW: Handle regulatory approval -> raw material release transition
-            if current_execution.phase.phase_name == 'regulatory_approval':
-                print(f"Completed regulatory approval for BMR {bmr.batch_number}, activating raw material release...")
-                raw_material_release_phase = BatchPhaseExecution.objects.filter(
-                    bmr=bmr,
-                    phase__phase_name='raw_material_release'
-                ).first()
-                
-                if raw_material_release_phase:
-                    raw_material_release_phase.status = 'pending'
-                    raw_material_release_phase.save()
-                    print(f"Activated raw_material_release phase for BMR {bmr.batch_number}")
-                    return True
-                else:
-                    print(f"WARNING: No raw_material_release phase found for BMR {bmr.batch_number}")
-                    return False
-            
-            # Special handling for sorting -> coating for tablets
-            if current_execution.phase.phase_name == 'sorting' and bmr.product.product_type == 'tablet':
-                print(f"Completed sorting for tablet BMR {bmr.batch_number}, handling workflow...")
-                is_coated = bmr.product.is_coated
-                print(f"Is product coated: {is_coated}")
-                
-                # Get coating and packaging phases
-                coating_phase = BatchPhaseExecution.objects.filter(
-                    bmr=bmr, 
-                    phase__phase_name='coating'
-                ).first()
-                
-                packaging_phase = BatchPhaseExecution.objects.filter(
-                    bmr=bmr,
-                    phase__phase_name='packaging_material_release'
-                ).first()
-                
-                if coating_phase and packaging_phase:
-                    print(f"Found coating phase (status: {coating_phase.status}) and packaging phase (status: {packaging_phase.status})")
-                    # For coated tablets: always go to coating first
-                    if is_coated:
-                        coating_phase.status = 'pending'
-                        coating_phase.save()
-                        print(f"Activated coating phase for coated product: {bmr.batch_number}")
-                        return True
-                    else:
-                        # For uncoated tablets: skip coating, go to packaging
-                        coating_phase.status = 'skipped'
-                        coating_phase.completed_date = timezone.now()
-                        coating_phase.operator_comments = "Phase skipped - product does not require coating"
-                        coating_phase.save()
-                        packaging_phase.status = 'pending'
-                        packaging_phase.save()
-                        print(f"Skipped coating, activated packaging for uncoated product: {bmr.batch_number}")
-                        return True
-            
-            # Special handling for coating -> packaging for coated tablets
-            if current_execution.phase.phase_name == 'coating' and bmr.product.product_type == 'tablet':
-                print(f"Completed coating for tablet BMR {bmr.batch_number}, activating packaging...")
-                packaging_phase = BatchPhaseExecution.objects.filter(
-                    bmr=bmr,
-                    phase__phase_name='packaging_material_release'
-                ).first()
-                
-                if packaging_phase:
-                    packaging_phase.status = 'pending'
-                    packaging_phase.save()
-                    print(f"Activated packaging phase after coating: {bmr.batch_number}")
-                    return True
-            
-            # Special handling for packaging_material_release -> bulk_packing for tablet_2
-            if current_execution.phase.phase_name == 'packaging_material_release' and bmr.product.product_type == 'tablet':
-                tablet_type = getattr(bmr.product, 'tablet_type', None)
-                print(f"Completed packaging material release for tablet BMR {bmr.batch_number}, tablet_type: {tablet_type}")
-                
-                if tablet_type == 'tablet_2':
-                    # For tablet_2, activate bulk_packing first
-                    bulk_packing_phase = BatchPhaseExecution.objects.filter(
-                        bmr=bmr,
-                        phase__phase_name='bulk_packing'
-                    ).first()
-                    
-                    if bulk_packing_phase:
-                        # Ensure secondary packaging is NOT activated yet
-                        secondary_phase = BatchPhaseExecution.objects.filter(
-                            bmr=bmr,
-                            phase__phase_name='secondary_packaging'
-                        ).first()
-                        if secondary_phase and secondary_phase.status == 'pending':
-                            secondary_phase.status = 'not_ready'
-                            secondary_phase.save()
-                            print(f"Reset secondary_packaging to not_ready for tablet_2: {bmr.batch_number}")
-                        
-                        bulk_packing_phase.status = 'pending'
-                        bulk_packing_phase.save()
-                        print(f"Activated bulk_packing phase for tablet_2: {bmr.batch_number}")
-                        return True  # CRITICAL: Exit here to prevent standard logic from running
-                else:
-                    # For normal tablets, activate blister_packing
-                    blister_packing_phase = BatchPhaseExecution.objects.filter(
-                        bmr=bmr,
-                        phase__phase_name='blister_packing'
-                    ).first()
-                    
-                    if blister_packing_phase:
-                        # Ensure secondary packaging is NOT activated yet for normal tablets too
-                        secondary_phase = BatchPhaseExecution.objects.filter(
-                            bmr=bmr,
-                            phase__phase_name='secondary_packaging'
-                        ).first()
-                        if secondary_phase and secondary_phase.status == 'pending':
-                            secondary_phase.status = 'not_ready'
-                            secondary_phase.save()
-                            print(f"Reset secondary_packaging to not_ready for normal tablet: {bmr.batch_number}")
-                        
-                        blister_packing_phase.status = 'pending'
-                        blister_packing_phase.save()
-                        print(f"Activated blister_packing phase for normal tablet: {bmr.batch_number}")
-                        return True  # CRITICAL: Exit here to prevent standard logic from running
-                
-                # If we reach here, something went wrong with tablet handling
-                print(f"WARNING: Failed to handle tablet packaging transition for BMR {bmr.batch_number}")
+            transition = cls.graph_for(bmr.product).after(current_phase.phase_name)
+            if transition is None:
+                print(f"Phase {current_phase.phase_name} is not part of the workflow for BMR {bmr.batch_number}")
                 return False
             
-            # Special handling for bulk_packing -> secondary_packaging for tablet_2
-            if current_execution.phase.phase_name == 'bulk_packing' and bmr.product.product_type == 'tablet':
-                tablet_type = getattr(bmr.product, 'tablet_type', None)
-                if tablet_type == 'tablet_2':
-                    # After bulk packing is complete, activate secondary packaging
-                    secondary_phase = BatchPhaseExecution.objects.filter(
-                        bmr=bmr,
-                        phase__phase_name='secondary_packaging'
-                    ).first()
-                    
-                    if secondary_phase:
-                        secondary_phase.status = 'pending'
-                        secondary_phase.save()
-                        print(f"Activated secondary_packaging phase after bulk_packing for tablet_2: {bmr.batch_number}")
-                        return True  # CRITICAL: Exit here to prevent standard logic
-                    else:
-                        print(f"WARNING: No secondary_packaging phase found for tablet_2 BMR {bmr.batch_number}")
-                        return False
-                        
-            # Special handling for blister_packing -> secondary_packaging for normal tablets
-            if current_execution.phase.phase_name == 'blister_packing' and bmr.product.product_type == 'tablet':
-                tablet_type = getattr(bmr.product, 'tablet_type', None)
-                if tablet_type == 'normal' or tablet_type is None:  # Default to normal if not specified
-                    # After blister packing is complete, activate secondary packaging
-                    secondary_phase = BatchPhaseExecution.objects.filter(
-                        bmr=bmr,
-                        phase__phase_name='secondary_packaging'
-                    ).first()
-                    
-                    if secondary_phase:
-                        secondary_phase.status = 'pending'
-                        secondary_phase.save()
-                        print(f"Activated secondary_packaging phase after blister_packing for normal tablet: {bmr.batch_number}")
-                        return True  # CRITICAL: Exit here to prevent standard logic
-                    else:
-                        print(f"WARNING: No secondary_packaging phase found for normal tablet BMR {bmr.batch_number}")
-                        return False
+            # QUARANTINE LOGIC: production phases go to quarantine before the next phase
+            if transition.quarantine:
+                print(f"Phase {current_phase.phase_name} completed for BMR {bmr.batch_number}, sending to quarantine...")
+                return cls._send_to_quarantine(bmr, current_phase)
             
-            # Standard next phase logic for ALL other cases
-            # This will only run if none of the special cases above returned True
-            all_next = BatchPhaseExecution.objects.filter(
-                bmr=bmr,
-                phase__phase_order__gt=current_execution.phase.phase_order
-            ).order_by('phase__phase_order')
+            if not transition.activate:
+                print(f"No more phases to trigger for BMR {bmr.batch_number}")
+                return False
             
-            # Important: Get the very next phase by phase_order, regardless of status
-            next_phase = all_next.first()
-            if next_phase:
-                # Special protection for secondary_packaging to ensure correct workflow
-                if next_phase.phase.phase_name == 'secondary_packaging' and bmr.product.product_type == 'tablet':
-                    tablet_type = getattr(bmr.product, 'tablet_type', None)
-                    
-                    # For tablet_2, ensure bulk_packing is completed
-                    if tablet_type == 'tablet_2':
-                        bulk_packing = BatchPhaseExecution.objects.filter(
-                            bmr=bmr, 
-                            phase__phase_name='bulk_packing'
-                        ).first()
-                        
-                        if bulk_packing and bulk_packing.status != 'completed':
-                            print(f"WARNING: Cannot activate secondary_packaging for tablet_2 BMR {bmr.batch_number} - bulk_packing not completed")
-                            return False
-                    
-                    # For normal tablets, ensure blister_packing is completed
-                    elif tablet_type == 'normal' or tablet_type is None:
-                        blister_packing = BatchPhaseExecution.objects.filter(
-                            bmr=bmr, 
-                            phase__phase_name='blister_packing'
-                        ).first()
-                        
-                        if blister_packing and blister_packing.status != 'completed':
-                            print(f"WARNING: Cannot activate secondary_packaging for normal tablet BMR {bmr.batch_number} - blister_packing not completed")
-                            return False
-                
-                # Update the status to pending to activate it
-                next_phase.status = 'pending'
-                next_phase.save()
-                print(f"Triggered next phase: {next_phase.phase.phase_name} for BMR {bmr.batch_number}")
+            if cls._apply_transition(bmr, transition):
+                print(f"Triggered next phase: {transition.activate} for BMR {bmr.batch_number}")
                 return True
-            
-            print(f"No more phases to trigger for BMR {bmr.batch_number}")
-            # Debug: print all phase statuses for this BMR
-            all_phases = BatchPhaseExecution.objects.filter(bmr=bmr).select_related('phase').order_by('phase__phase_order')
-            print("Phase order and statuses:")
-            for p in all_phases:
-                print(f"  {p.phase.phase_order:2d}. {p.phase.phase_name:25} {p.status}")
-            return False
-        except BatchPhaseExecution.DoesNotExist:
-            print(f"Current phase execution not found for BMR {bmr.batch_number}")
-            return False
-        except Exception as e:
-            print(f"Error triggering next phase for BMR {bmr.batch_number}: {e}")
             return False
         except Exception as e:
             print(f"Error triggering next phase for BMR {bmr.batch_number}: {e}")
             return False
     
     @classmethod
+    @write_transaction
     def rollback_to_previous_phase(cls, bmr, failed_phase):
         """Rollback to previous phase when QC fails"""
         try:
@@ -686,28 +712,7 @@ class WorkflowService:
     @classmethod
     def get_phases_for_user_role(cls, bmr, user_role):
         """Get phases that a specific user role can work on"""
-        # Map user roles to phases they can handle
-        role_phase_mapping = {
-            'qa': ['bmr_creation', 'final_qa'],
-            'regulatory': ['regulatory_approval'],
-            'store_manager': ['raw_material_release'],  # Store Manager handles raw material release
-            'dispensing_operator': ['material_dispensing'],  # Dispensing Operator handles material dispensing
-            'packaging_store': ['packaging_material_release'],  # Packaging store handles packaging material release
-            'finished_goods_store': ['finished_goods_store'],  # Finished Goods Store only handles finished goods storage
-            'qc': ['post_compression_qc', 'post_mixing_qc', 'post_blending_qc'],
-            'mixing_operator': ['mixing'],
-            'granulation_operator': ['granulation'],
-            'blending_operator': ['blending'],
-            'compression_operator': ['compression'],
-            'coating_operator': ['coating'],
-            'drying_operator': ['drying'],
-            'filling_operator': ['filling'],
-            'tube_filling_operator': ['tube_filling'],
-            'packing_operator': ['blister_packing', 'bulk_packing', 'secondary_packaging'],
-            'sorting_operator': ['sorting'],
-        }
-        
-        allowed_phases = role_phase_mapping.get(user_role, [])
+        allowed_phases = cls.ROLE_PHASES.get(user_role, [])
         
         return BatchPhaseExecution.objects.filter(
             bmr=bmr,
@@ -716,33 +721,33 @@ class WorkflowService:
         ).select_related('phase').order_by('phase__phase_order')
     
     @classmethod
-    def _send_to_quarantine(cls, bmr, current_execution):
+    def get_work_queue(cls, user, statuses=('pending', 'in_progress'), phase_names=None):
+        """
+        All open phase executions a user can work on, across every BMR, in one query.
+        
+        The user's role phases are combined with any phases assigned to them
+        through PhaseOperator. Rows come with BMR, product and phase loaded,
+        newest BMR first and in workflow order within a BMR, matching the
+        per-BMR get_phases_for_user_role() listing.
+        """
+        allowed = Q(phase__phase_name__in=cls.ROLE_PHASES.get(user.role, []))
+        allowed |= Q(phase_id__in=PhaseOperator.objects.filter(user=user).values('phase_id'))
+        
+        queue = BatchPhaseExecution.objects.filter(allowed, status__in=statuses)
+        if phase_names is not None:
+            queue = queue.filter(phase__phase_name__in=phase_names)
+        return queue.select_related(
+            'bmr__product', 'bmr__created_by', 'phase', 'machine_used', 'started_by'
+        ).order_by('-bmr__created_date', 'bmr_id', 'phase__phase_order')
+    
+    @classmethod
+    def _send_to_quarantine(cls, bmr, current_phase):
         """Send completed phase to quarantine"""
         try:
             from quarantine.models import QuarantineBatch
             
-            # Check if batch is already in quarantine
-            existing_quarantine = QuarantineBatch.objects.filter(
-                bmr=bmr,
-                status__in=['quarantined', 'sample_requested', 'sample_in_qa', 'sample_in_qc', 'sample_approved', 'sample_failed']
-            ).first()
-            
-            if existing_quarantine:
-                # Update existing quarantine record
-                existing_quarantine.current_phase = current_execution.phase
-                existing_quarantine.status = 'quarantined'
-                existing_quarantine.save()
-                print(f"Updated existing quarantine record for BMR {bmr.batch_number} at phase {current_execution.phase.phase_name}")
-            else:
-                # Create new quarantine record
-                QuarantineBatch.objects.create(
-                    bmr=bmr,
-                    current_phase=current_execution.phase,
-                    status='quarantined',
-                    quarantine_date=timezone.now()
-                )
-                print(f"Created quarantine record for BMR {bmr.batch_number} at phase {current_execution.phase.phase_name}")
-            
+            QuarantineBatch.enter([(bmr, current_phase)])
+            print(f"Quarantined BMR {bmr.batch_number} at phase {current_phase.phase_name}")
             return True
             
         except Exception as e:
@@ -750,50 +755,32 @@ class WorkflowService:
             return False
     
     @classmethod
-    def proceed_from_quarantine(cls, bmr, quarantine_phase):
+    @write_transaction
+    def proceed_from_quarantine(cls, bmr, quarantine_phase, released_by=None):
         """Proceed from quarantine to next phase after sample approval - skip QC phases since sample was already approved"""
         try:
-            # Get all phases after the quarantine phase
-            all_next = BatchPhaseExecution.objects.filter(
-                bmr=bmr,
-                phase__phase_order__gt=quarantine_phase.phase_order
-            ).order_by('phase__phase_order')
+            from quarantine.models import QuarantineBatch
             
-            # QC phases that should be skipped since quarantine sample was approved
-            qc_phases = ['post_mixing_qc', 'post_compression_qc', 'post_blending_qc']
+            # QC phases after the quarantine phase are completed by the approved
+            # sample, and the next production phase is activated
+            transition = cls.graph_for(bmr.product).after_quarantine(quarantine_phase.phase_name)
+            next_phase = transition.activate if transition else None
+            if not next_phase:
+                print(f"No next production phase found after quarantine for BMR {bmr.batch_number}")
+                return False
             
-            # Find the next non-QC phase (since QC was already done via quarantine sample)
-            next_phase = None
-            for phase_execution in all_next:
-                if phase_execution.phase.phase_name not in qc_phases:
-                    next_phase = phase_execution
-                    break
-                else:
-                    # Mark QC phases as completed since quarantine sample was approved
-                    phase_execution.status = 'completed'
-                    phase_execution.completed_date = timezone.now()
-                    phase_execution.operator_comments = "QC completed via quarantine sample approval"
-                    phase_execution.save()
-                    print(f"Skipped QC phase {phase_execution.phase.phase_name} for BMR {bmr.batch_number} (quarantine sample approved)")
+            # Release first: a second click finds the record released and changes nothing
+            if not QuarantineBatch.release(bmr, quarantine_phase, user=released_by):
+                print(f"Quarantine for BMR {bmr.batch_number} at {quarantine_phase.phase_name} is not releasable")
+                return False
             
-            if next_phase:
-                next_phase.status = 'pending'
-                next_phase.save()
-                print(f"Proceeded from quarantine: activated {next_phase.phase.phase_name} for BMR {bmr.batch_number}")
-                
-                # Update quarantine record
-                from quarantine.models import QuarantineBatch
-                quarantine_batch = QuarantineBatch.objects.filter(bmr=bmr).first()
-                if quarantine_batch:
-                    quarantine_batch.status = 'released'
-                    quarantine_batch.released_date = timezone.now()
-                    quarantine_batch.save()
-                
+            if cls._apply_transition(bmr, transition):
+                print(f"Proceeded from quarantine: activated {next_phase} for BMR {bmr.batch_number}")
                 return True
-            else:
-                print(f"No next production phase found after quarantine for BMR {bmr.batch_number}")
-                return False
+            transaction.set_rollback(True)
+            return False
                 
         except Exception as e:
+            transaction.set_rollback(True)
             print(f"Error proceeding from quarantine for BMR {bmr.batch_number}: {e}")
             return False
@@ -0,0 +1,1041 @@
+import json
+from datetime import datetime, time, timedelta
+from importlib import import_module
+from io import StringIO
+from unittest import mock
+
+from django.apps import apps
+from django.contrib.messages import get_messages
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from bmr.models import BMR
+from dashboards import fragment_cache
+from dashboards.analytics import get_phase_bottleneck_analysis, get_quality_metrics
+from products.models import Product
+from quarantine.models import QuarantineBatch, SampleRequest
+from workflow import transitions
+from workflow.machine_performance import covered_minutes, get_machine_performance, machine_usage_counts
+from workflow.models import (
+    BatchPhaseExecution, BMRProgress, ChangeEvent, EventWatermark, Machine, OperatorBatchDay, OperatorDailyStats,
+    PhaseConflict, PhaseEvent, PhaseStats, ProductionPhase,
+)
+from workflow.services import WorkflowService
+from kampala_pharma.testing import create_admin, create_bmr, create_operator, create_user
+
+
+class BMRProgressTests(TestCase):
+    """The progress summary follows every phase change and matches a count from scratch"""
+
+    COUNTED = [
+        'total_phases', 'not_ready_count', 'pending_count', 'in_progress_count', 'completed_count',
+        'failed_count', 'skipped_count', 'rolled_back_count', 'current_execution_id', 'percent_complete',
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_admin()
+        cls.operator = create_operator()
+        cls.product = Product.objects.create(product_name='Capsule', product_type='capsule')
+        cls.bmr = create_bmr(cls.product, cls.admin)
+
+    def execution(self, phase_name):
+        return BatchPhaseExecution.objects.get(bmr=self.bmr, phase__phase_name=phase_name)
+
+    def summary(self):
+        return BMRProgress.objects.filter(bmr=self.bmr).values(*self.COUNTED).get()
+
+    def assertCounted(self, **expected):
+        """The stored summary has the expected values and is what a recount gives"""
+        summary = self.summary()
+        self.assertEqual({field: summary[field] for field in expected}, expected)
+        recounted = BMRProgress._summaries(BatchPhaseExecution.objects.filter(bmr=self.bmr))[self.bmr.pk]
+        self.assertEqual(summary, {field: getattr(recounted, field) for field in self.COUNTED})
+
+    def test_counts_follow_start_complete_and_rollback(self):
+        total = BatchPhaseExecution.objects.filter(bmr=self.bmr).count()
+        approval = self.execution('regulatory_approval')
+        self.assertCounted(total_phases=total, completed_count=1, pending_count=1, current_execution_id=approval.pk)
+
+        WorkflowService.start_phase(self.bmr, 'regulatory_approval', self.operator)
+        self.assertCounted(completed_count=1, pending_count=0, in_progress_count=1, current_execution_id=approval.pk)
+
+        WorkflowService.complete_phase(self.bmr, 'regulatory_approval', self.operator)
+        self.assertCounted(
+            completed_count=2, pending_count=1, in_progress_count=0,
+            current_execution_id=self.execution('raw_material_release').pk,
+            percent_complete=int(2 * 100 / total),
+        )
+
+        # Straight to the QC phase, without routing the phases in between
+        qc = self.execution('post_blending_qc')
+        qc.transition('in_progress', from_status=qc.status, started_by=self.operator, started_date=timezone.now())
+        self.assertCounted(pending_count=1, in_progress_count=1)
+        self.assertTrue(WorkflowService.handle_qc_failure_rollback(self.bmr, 'post_blending_qc', 'blending'))
+        blending = self.execution('blending')
+        self.assertCounted(completed_count=2, pending_count=2, in_progress_count=0, failed_count=0)
+        self.assertEqual(self.execution('post_blending_qc').status, 'not_ready')
+        self.assertEqual(blending.status, 'pending')
+
+    def test_refresh_and_rebuild_recount(self):
+        WorkflowService.start_phase(self.bmr, 'regulatory_approval', self.operator)
+        expected = self.summary()
+        # Writes that bypass save() leave the summary behind
+        BatchPhaseExecution.objects.filter(bmr=self.bmr, phase__phase_name='regulatory_approval').update(status='completed')
+        self.assertEqual(self.summary(), expected)
+
+        BMRProgress.refresh(self.bmr.pk)
+        self.assertCounted(completed_count=2, in_progress_count=0, pending_count=0, current_execution_id=None)
+        refreshed = self.summary()
+        BMRProgress.objects.all().delete()
+        self.assertEqual(BMRProgress.rebuild(), 1)
+        self.assertEqual(self.summary(), refreshed)
+
+    def test_migration_backfill(self):
+        WorkflowService.start_phase(self.bmr, 'regulatory_approval', self.operator)
+        other = create_bmr(self.product, self.admin, 2)
+        expected = sorted(BMRProgress.objects.values_list('bmr_id', *self.COUNTED))
+        self.assertEqual(len(expected), 2)
+
+        BMRProgress.objects.all().delete()
+        migration = import_module('workflow.migrations.0011_bmrprogress')
+        migration.populate_progress(apps, None)
+        self.assertEqual(sorted(BMRProgress.objects.values_list('bmr_id', *self.COUNTED)), expected)
+        self.assertEqual(BMRProgress.objects.get(bmr=other).completed_count, 1)
+
+
+class MachinePerformanceTests(TestCase):
+    """Machine availability and downtime come from merged intervals, cached per day"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_admin()
+        cls.machine = Machine.objects.create(name='Granulator 1', machine_type='granulation')
+        cls.product = Product.objects.create(product_name='Test Tablet', product_type='tablet')
+        cls.bmr = create_bmr(cls.product, cls.admin)
+        cls.day = timezone.localdate() - timedelta(days=1)
+
+    def setUp(self):
+        cache.clear()
+        at = lambda hour, minute=0: timezone.make_aware(datetime.combine(self.day, time(hour, minute)))
+        self.at = at
+        self.execution = BatchPhaseExecution.objects.filter(bmr=self.bmr, phase__phase_name='granulation')
+        self.execution.update(
+            machine_used=self.machine, status='completed',
+            started_date=at(8), completed_date=at(12),
+            breakdown_occurred=True, breakdown_start_time=at(9), breakdown_end_time=at(10),
+            breakdown_reason='Motor fault',
+            changeover_occurred=True, changeover_start_time=at(9, 30), changeover_end_time=at(10, 30),
+        )
+
+    def test_covered_minutes_merges_overlaps(self):
+        intervals = [(self.at(1), self.at(3)), (self.at(2), self.at(4)), (self.at(6), self.at(7))]
+        self.assertEqual(covered_minutes(intervals, self.at(0), self.at(23)), 240)
+        self.assertEqual(covered_minutes(intervals, self.at(3), self.at(23)), 120)
+
+    def test_machine_metrics(self):
+        performance = get_machine_performance(days=1, end_day=self.day, machines=[self.machine])
+        row = performance['machines'][0]
+        self.assertEqual(row['run_minutes'], 240)
+        self.assertEqual(row['breakdown_minutes'], 60)
+        self.assertEqual(row['changeover_minutes'], 60)
+        self.assertEqual(row['downtime_minutes'], 90)
+        self.assertEqual(row['availability'], 62.5)
+        self.assertEqual(row['shift_utilization']['morning'], 50)
+        self.assertEqual(
+            [(cause['category'], cause['reason']) for cause in performance['pareto']],
+            [('breakdown', 'Motor fault'), ('changeover', 'Unspecified')],
+        )
+        self.assertEqual(performance['pareto'][-1]['cumulative_percent'], 100)
+
+    def test_day_buckets_are_cached_and_invalidated_on_save(self):
+        get_machine_performance(days=7, end_day=self.day, machines=[self.machine])
+        with self.assertNumQueries(0):
+            get_machine_performance(days=7, end_day=self.day, machines=[self.machine])
+
+        execution = self.execution.get()
+        execution.completed_date = self.at(14)
+        with self.captureOnCommitCallbacks(execute=True):
+            execution.save()
+        row = get_machine_performance(days=1, end_day=self.day, machines=[self.machine])['machines'][0]
+        self.assertEqual(row['run_minutes'], 360)
+
+    def test_rollback_invalidates_the_days_the_phase_ran_on(self):
+        self.execution.update(
+            breakdown_occurred=False, breakdown_start_time=None, breakdown_end_time=None,
+            changeover_occurred=False, changeover_start_time=None, changeover_end_time=None,
+        )
+        row = get_machine_performance(days=1, end_day=self.day, machines=[self.machine])['machines'][0]
+        self.assertEqual(row['run_minutes'], 240)
+
+        # The rollback clears the dates but keeps the machine
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(WorkflowService.handle_qc_failure_rollback(self.bmr, 'post_compression_qc', 'granulation'))
+        self.assertEqual(self.execution.get().machine_used, self.machine)
+        row = get_machine_performance(days=1, end_day=self.day, machines=[self.machine])['machines'][0]
+        self.assertEqual(row['run_minutes'], 0)
+
+    def test_usage_counts_single_query(self):
+        with self.assertNumQueries(1):
+            counts = machine_usage_counts()
+        self.assertEqual(counts[self.machine.id], {'usage_count': 1, 'breakdown_count': 1, 'changeover_count': 1})
+
+    def test_machine_pages_render(self):
+        self.client.force_login(self.admin)
+        for name in ['dashboards:admin_dashboard', 'dashboards:machine_management']:
+            with self.subTest(name=name):
+                self.assertEqual(self.client.get(reverse(name)).status_code, 200)
+
+
+# Saves now replace the dashboard versions on commit; refresh stale sections
+# in the request so no thread outlives the test
+@mock.patch.object(fragment_cache, 'REVALIDATE_IN_BACKGROUND', False)
+class OperatorDailyStatsTests(TestCase):
+    """Operator rollups follow phase starts/completions and match a full rebuild"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_admin()
+        cls.operators = [create_operator(f'operator{number}', employee_id=f'OP00{number}') for number in range(1, 4)]
+        cls.product = Product.objects.create(product_name='Test Ointment', product_type='ointment')
+        cls.bmrs = [create_bmr(cls.product, cls.admin, number) for number in (1, 2, 3)]
+
+    def save(self, execution):
+        # The rollups are applied once the write commits
+        with self.captureOnCommitCallbacks(execute=True):
+            execution.save()
+
+    def work(self, bmr, phase_name, operator, started, completed=None):
+        execution = BatchPhaseExecution.objects.get(bmr=bmr, phase__phase_name=phase_name)
+        execution.status = 'in_progress'
+        execution.started_by = operator
+        execution.started_date = started
+        self.save(execution)
+        if completed:
+            execution.status = 'completed'
+            execution.completed_by = operator
+            execution.completed_date = completed
+            self.save(execution)
+        return execution
+
+    def snapshot(self):
+        return sorted(OperatorDailyStats.objects.values_list(
+            'operator_id', 'day', 'phase_name', 'completions', 'attempts', 'timed_completions', 'active_minutes',
+        )), sorted(OperatorBatchDay.objects.values_list('operator_id', 'bmr_id', 'day', 'completions'))
+
+    def test_incremental_matches_rebuild(self):
+        operator = self.operators[0]
+        now = timezone.now()
+        today = timezone.localdate(now)
+        yesterday = now - timedelta(days=1)
+        self.work(self.bmrs[0], 'mixing', operator, yesterday, yesterday + timedelta(minutes=30))
+        self.work(self.bmrs[0], 'tube_filling', operator, now - timedelta(minutes=20), now)
+        self.work(self.bmrs[1], 'mixing', operator, now - timedelta(minutes=10))
+
+        rows = operator.daily_stats.filter(day=today)
+        self.assertEqual(
+            sorted(rows.values_list('phase_name', 'completions', 'attempts')), [('mixing', 0, 1), ('tube_filling', 1, 1)]
+        )
+        self.assertEqual(rows.get(phase_name='tube_filling').average_active_minutes, 20)
+        self.assertEqual(OperatorBatchDay.counts(operator.pk, today), {'handled': 1, 'distinct': 1, 'new': 0})
+
+        incremental = self.snapshot()
+        OperatorDailyStats.rebuild()
+        self.assertEqual(self.snapshot(), incremental)
+
+        # Resetting the earlier completion moves the batch's first completion to today
+        execution = BatchPhaseExecution.objects.get(bmr=self.bmrs[0], phase__phase_name='mixing')
+        execution.status = 'not_ready'
+        execution.started_by = execution.completed_by = None
+        execution.started_date = execution.completed_date = None
+        self.save(execution)
+        self.assertEqual(OperatorBatchDay.counts(operator.pk, today), {'handled': 1, 'distinct': 1, 'new': 1})
+        self.assertFalse(operator.daily_stats.filter(day=timezone.localdate(yesterday)).exists())
+        incremental = self.snapshot()
+        OperatorDailyStats.rebuild()
+        self.assertEqual(self.snapshot(), incremental)
+
+    def test_failed_phase_is_not_a_completion(self):
+        operator = self.operators[0]
+        now = timezone.now()
+        execution = self.work(self.bmrs[0], 'mixing', operator, now - timedelta(minutes=10))
+        execution.status = 'failed'
+        execution.completed_by = operator
+        execution.completed_date = now
+        self.save(execution)
+        row = operator.daily_stats.get()
+        self.assertEqual((row.completions, row.attempts, row.timed_completions), (0, 1, 0))
+        self.assertEqual(OperatorBatchDay.counts(operator.pk)['handled'], 0)
+        incremental = self.snapshot()
+        OperatorDailyStats.rebuild()
+        self.assertEqual(self.snapshot(), incremental)
+
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('dashboards:admin_dashboard'))
+        self.assertEqual(response.context['productivity_metrics']['top_operators'], [])
+
+        # Passing on the second attempt counts once
+        execution.status = 'completed'
+        self.save(execution)
+        self.assertEqual(operator.daily_stats.get().completions, 1)
+        response = self.client.get(reverse('dashboards:admin_dashboard'))
+        self.assertEqual(response.context['productivity_metrics']['total_completions'], 1)
+
+    def test_dashboards_read_rollups(self):
+        now = timezone.now()
+        for bmr, operator in zip(self.bmrs, self.operators):
+            self.work(bmr, 'mixing', operator, now - timedelta(minutes=5), now)
+
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('dashboards:admin_dashboard'))
+        top = response.context['productivity_metrics']['top_operators']
+        self.assertEqual(len(top), 3)
+        self.assertEqual(response.context['productivity_metrics']['total_completions'], 3)
+
+        self.client.force_login(self.operators[0])
+        response = self.client.get(reverse('dashboards:operator_dashboard'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['stats']['completed_today'], 1)
+        self.assertEqual(response.context['operator_stats']['batches_handled'], 1)
+        self.assertEqual(response.context['operator_stats']['avg_completion_time'], '5.0 min')
+
+
+class WorkflowGraphTests(TestCase):
+    """Phase transitions come from the compiled graph in a fixed number of queries"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_admin()
+        cls.products = {
+            'ointment': Product.objects.create(product_name='Ointment', product_type='ointment'),
+            'capsule': Product.objects.create(product_name='Capsule', product_type='capsule'),
+            'coated': Product.objects.create(
+                product_name='Coated Tablet', product_type='tablet', coating_type='coated', tablet_type='normal',
+            ),
+            'tablet_2': Product.objects.create(
+                product_name='Bulk Tablet', product_type='tablet', coating_type='uncoated', tablet_type='tablet_2',
+            ),
+        }
+        cls.bmrs = {
+            name: create_bmr(product, cls.admin, number)
+            for number, (name, product) in enumerate(cls.products.items(), 1)
+        }
+
+    def setUp(self):
+        cache.clear()
+
+    def statuses(self, bmr):
+        return dict(BatchPhaseExecution.objects.filter(bmr=bmr).values_list('phase__phase_name', 'status'))
+
+    def complete(self, bmr, phase_name):
+        execution = BatchPhaseExecution.objects.select_related('phase').get(bmr=bmr, phase__phase_name=phase_name)
+        execution.status = 'completed'
+        execution.completed_date = timezone.now()
+        execution.save()
+        return WorkflowService.trigger_next_phase(bmr, execution.phase)
+
+    def test_variants(self):
+        coated = WorkflowService.graph_for(self.products['coated'])
+        self.assertIn('coating', coated.sequence)
+        self.assertEqual(coated.after('sorting').quarantine, True)
+        bulk = WorkflowService.graph_for(self.products['tablet_2'])
+        self.assertNotIn('coating', bulk.sequence)
+        self.assertEqual(bulk.after('packaging_material_release').activate, 'bulk_packing')
+        self.assertEqual(bulk.after('packaging_material_release').reset, ('secondary_packaging',))
+        self.assertEqual(bulk.after_quarantine('compression').activate, 'sorting')
+        self.assertEqual(bulk.after_quarantine('compression').complete, ('post_compression_qc',))
+        self.assertIsNone(bulk.after('finished_goods_store').activate)
+
+        # Compiled once, reused until a ProductionPhase changes
+        with self.assertNumQueries(0):
+            self.assertIs(WorkflowService.graph_for(self.products['tablet_2']), bulk)
+        execution = BatchPhaseExecution.objects.select_related('phase').get(
+            bmr=self.bmrs['tablet_2'], phase__phase_name='sorting',
+        )
+        self.assertEqual(execution.get_next_phase().phase_name, 'packaging_material_release')
+        execution.phase.save()
+        self.assertIsNot(WorkflowService.graph_for(self.products['tablet_2']), bulk)
+
+    def test_transitions_cost_the_same_for_every_product_type(self):
+        for name, bmr in self.bmrs.items():
+            WorkflowService.graph_for(bmr.product)
+            phase = ProductionPhase.objects.get(product_type=bmr.product.product_type, phase_name='regulatory_approval')
+            # Read, status UPDATE, progress UPDATE, feed sequence and INSERT and two savepoint pairs
+            with self.subTest(name), self.assertNumQueries(9):
+                self.assertTrue(WorkflowService.trigger_next_phase(bmr, phase))
+            self.assertEqual(self.statuses(bmr)['raw_material_release'], 'pending')
+            self.assertEqual(BMRProgress.objects.get(bmr=bmr).pending_count, 2)
+
+    def test_packing_and_quarantine_release(self):
+        bmr = self.bmrs['tablet_2']
+        BatchPhaseExecution.objects.filter(bmr=bmr, phase__phase_name='secondary_packaging').update(status='pending')
+        self.assertTrue(self.complete(bmr, 'packaging_material_release'))
+        statuses = self.statuses(bmr)
+        self.assertEqual(statuses['bulk_packing'], 'pending')
+        self.assertEqual(statuses['secondary_packaging'], 'not_ready')
+        self.assertTrue(self.complete(bmr, 'bulk_packing'))
+        self.assertEqual(self.statuses(bmr)['secondary_packaging'], 'pending')
+
+        # Production phases go to quarantine; release skips the QC phase
+        bmr = self.bmrs['ointment']
+        self.assertTrue(self.complete(bmr, 'mixing'))
+        self.assertEqual(self.statuses(bmr)['post_mixing_qc'], 'not_ready')
+        mixing = ProductionPhase.objects.get(product_type='ointment', phase_name='mixing')
+        self.assertTrue(WorkflowService.proceed_from_quarantine(bmr, mixing))
+        statuses = self.statuses(bmr)
+        self.assertEqual(statuses['post_mixing_qc'], 'completed')
+        self.assertEqual(statuses['tube_filling'], 'pending')
+        self.assertEqual(
+            ChangeEvent.objects.filter(bmr=bmr, data__phase='post_mixing_qc').values_list('action', flat=True).last(),
+            'completed',
+        )
+        progress = BMRProgress.objects.get(bmr=bmr)
+        BMRProgress.refresh(bmr.pk)
+        refreshed = BMRProgress.objects.get(bmr=bmr)
+        self.assertEqual(
+            (progress.completed_count, progress.pending_count, progress.current_execution_id),
+            (refreshed.completed_count, refreshed.pending_count, refreshed.current_execution_id),
+        )
+
+
+class WorkflowInitializationTests(TestCase):
+    """New BMRs get their phase executions from one bulk insert"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_admin()
+        cls.ointment = Product.objects.create(product_name='Ointment', product_type='ointment')
+        cls.tablet = Product.objects.create(
+            product_name='Bulk Tablet', product_type='tablet', coating_type='uncoated', tablet_type='tablet_2',
+        )
+        # Phase definitions exist, as they do once the first BMR of a type was created
+        create_bmr(cls.ointment, cls.admin, 0)
+
+    def imported(self, count, product):
+        """BMRs inserted without save(), as an import would"""
+        return BMR.objects.bulk_create(
+            BMR(bmr_number=f"IMP{number:04d}", batch_number=f"{number:03d}2026", product=product, created_by=self.admin)
+            for number in range(count)
+        )
+
+    def test_graph_compiled_before_a_rollback_is_not_reused(self):
+        order = WorkflowService.graph_for(self.ointment).phases['mixing'].phase_order
+        with transaction.atomic():
+            phase = ProductionPhase.objects.get(product_type='ointment', phase_name='mixing')
+            phase.phase_order = 99
+            phase.save()
+            self.assertEqual(WorkflowService.graph_for(self.ointment).phases['mixing'].phase_order, 99)
+            self.assertIsNotNone(transitions._pending_invalidation())
+            transaction.set_rollback(True)
+        self.assertIsNone(transitions._pending_invalidation())
+        self.assertEqual(WorkflowService.graph_for(self.ointment).phases['mixing'].phase_order, order)
+
+        # Once a change commits, the graphs follow the shared version again
+        phase.phase_order = order
+        with self.captureOnCommitCallbacks(execute=True):
+            phase.save()
+        self.assertIsNone(transitions._pending_invalidation())
+        graph = WorkflowService.graph_for(self.ointment)
+        self.assertEqual(graph.version, caches['versions'].get(transitions.GRAPH_VERSION_KEY))
+        self.assertIs(WorkflowService.graph_for(self.ointment), graph)
+
+    def test_single_bmr_is_initialized_in_bounded_queries(self):
+        bmr = self.imported(1, self.ointment)[0]
+        WorkflowService.graph_for(self.ointment)
+        # Existing rows, one execution insert, one feed insert, the event log
+        # entry for BMR creation, the progress rebuild and savepoints; not a
+        # round trip per phase. The phase rows come from the compiled graph,
+        # checked against its version token.
+        with CaptureQueriesContext(connection) as queries:
+            WorkflowService.initialize_workflow_for_bmr(bmr)
+        self.assertEqual(len(queries), 17)
+        self.assertFalse([query for query in queries if 'FROM "workflow_productionphase"' in query['sql']])
+        statuses = dict(BatchPhaseExecution.objects.filter(bmr=bmr).values_list('phase__phase_name', 'status'))
+        self.assertEqual(len(statuses), 11)
+        self.assertEqual(statuses['bmr_creation'], 'completed')
+        self.assertEqual(statuses['regulatory_approval'], 'pending')
+        self.assertEqual(statuses['mixing'], 'not_ready')
+        progress = BMRProgress.objects.get(bmr=bmr)
+        self.assertEqual((progress.total_phases, progress.completed_count), (11, 1))
+        self.assertEqual(ChangeEvent.objects.filter(source='phase', bmr=bmr).count(), 11)
+
+        # Repeated calls change nothing
+        self.assertEqual(WorkflowService.initialize_workflows([bmr]), 0)
+        self.assertEqual(BatchPhaseExecution.objects.filter(bmr=bmr).count(), 11)
+
+    def test_bulk_initialization(self):
+        bmrs = self.imported(5, self.ointment) + self.imported(0, self.tablet)
+        tablet = BMR.objects.create(batch_number='0992026', product=self.tablet, created_by=self.admin)
+        BatchPhaseExecution.objects.filter(bmr=tablet).exclude(phase__phase_name='bmr_creation').delete()
+
+        with CaptureQueriesContext(connection) as small:
+            created = WorkflowService.initialize_workflows(BMR.objects.filter(pk__in=[bmr.pk for bmr in bmrs[:2]]))
+        self.assertEqual(created, 22)
+        with CaptureQueriesContext(connection) as large:
+            created = WorkflowService.initialize_workflows(BMR.objects.filter(pk__in=[bmr.pk for bmr in bmrs] + [tablet.pk]))
+        self.assertEqual(created, 3 * 11 + 13)
+        # One more variant costs its phase lookups, not a query per BMR
+        self.assertLessEqual(len(large), len(small) + 2)
+
+        self.assertEqual(
+            BatchPhaseExecution.objects.filter(bmr=tablet, phase__phase_name='bulk_packing').count(), 1,
+        )
+        BMRProgress.rebuild()
+        self.assertEqual(BMRProgress.objects.get(bmr=tablet).total_phases, 14)
+
+    def test_command_backfills_bmrs_without_phases(self):
+        self.imported(3, self.ointment)
+        out = StringIO()
+        call_command('initialize_workflows', stdout=out)
+        self.assertIn('Created 33 phase execution(s) for 3 BMR(s)', out.getvalue())
+        self.assertFalse(BMR.objects.filter(phase_executions__isnull=True).exists())
+
+
+class PhaseConcurrencyTests(TestCase):
+    """Phase transitions only apply to the version they were read at"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_admin()
+        cls.qa = create_user('qa', 'qa', 'QA001', 'QA')
+        cls.product = Product.objects.create(product_name='Ointment', product_type='ointment')
+        cls.bmr = create_bmr(cls.product, cls.admin)
+
+    def execution(self, phase_name):
+        return BatchPhaseExecution.objects.select_related('phase', 'bmr').get(bmr=self.bmr, phase__phase_name=phase_name)
+
+    def messages(self, response):
+        return [str(message) for message in get_messages(response.wsgi_request)]
+
+    def test_stale_transition_conflicts(self):
+        first = self.execution('regulatory_approval')
+        second = self.execution('regulatory_approval')
+        with CaptureQueriesContext(connection) as queries:
+            first.transition('in_progress', started_by=self.admin, started_date=timezone.now())
+        self.assertEqual(first.version, 1)
+        update = next(query['sql'] for query in queries if query['sql'].startswith('UPDATE "workflow_batchphaseexecution"'))
+        self.assertIn('"version" = 0', update)
+
+        with self.assertRaises(PhaseConflict):
+            second.transition('in_progress', started_by=self.qa, started_date=timezone.now())
+        current = self.execution('regulatory_approval')
+        self.assertEqual((current.status, current.started_by, current.version), ('in_progress', self.admin, 1))
+        self.assertEqual(BMRProgress.objects.get(bmr=self.bmr).in_progress_count, 1)
+
+        # save() moves the version on as well
+        current.operator_comments = 'Checked'
+        current.save()
+        self.assertEqual(self.execution('regulatory_approval').version, 2)
+
+    def test_stale_bulk_transition_changes_nothing(self):
+        raw_material, dispensing = (self.execution('raw_material_release'), self.execution('material_dispensing'))
+        other = self.execution('material_dispensing')
+        other.operator_comments = 'Edited'
+        other.save()
+
+        with self.assertRaises(PhaseConflict) as raised:
+            BatchPhaseExecution.bulk_transition({raw_material: 'pending', dispensing: 'pending'})
+        self.assertEqual(raised.exception.execution, dispensing)
+        self.assertEqual(self.execution('raw_material_release').status, 'not_ready')
+        self.assertEqual(BMRProgress.objects.get(bmr=self.bmr).pending_count, 1)
+
+    def test_complete_phase_with_stale_version(self):
+        WorkflowService.start_phase(self.bmr, 'regulatory_approval', self.admin)
+        with self.assertRaises(PhaseConflict):
+            WorkflowService.complete_phase(self.bmr, 'regulatory_approval', self.admin, expected_version=0)
+        self.assertEqual(self.execution('regulatory_approval').status, 'in_progress')
+        self.assertEqual(self.execution('raw_material_release').status, 'not_ready')
+
+        next_phase = WorkflowService.complete_phase(self.bmr, 'regulatory_approval', self.admin, expected_version=1)
+        self.assertEqual(next_phase.phase.phase_name, 'raw_material_release')
+        self.assertEqual(self.execution('raw_material_release').status, 'pending')
+        self.assertEqual(self.execution('regulatory_approval').version, 2)
+
+    def test_only_a_phase_in_progress_can_be_completed(self):
+        # Never started: no version posted, and still refused
+        with self.assertRaises(PhaseConflict):
+            WorkflowService.complete_phase(self.bmr, 'regulatory_approval', self.admin)
+        self.assertEqual(
+            (self.execution('regulatory_approval').status, self.execution('regulatory_approval').version), ('pending', 0)
+        )
+        self.assertEqual(self.execution('raw_material_release').status, 'not_ready')
+
+        WorkflowService.start_phase(self.bmr, 'regulatory_approval', self.admin)
+        WorkflowService.complete_phase(self.bmr, 'regulatory_approval', self.admin)
+        events = PhaseEvent.objects.count()
+        # Already completed: refused, nothing logged and the next phase left alone
+        with self.assertRaises(PhaseConflict):
+            WorkflowService.complete_phase(self.bmr, 'regulatory_approval', self.admin)
+        self.assertEqual(self.execution('regulatory_approval').version, 2)
+        self.assertEqual(PhaseEvent.objects.count(), events)
+        self.assertEqual(self.execution('raw_material_release').status, 'pending')
+
+    def test_dashboard_refuses_to_complete_a_pending_phase(self):
+        mixing = self.execution('mixing')
+        BatchPhaseExecution.objects.filter(pk=mixing.pk).update(status='pending')
+        self.client.force_login(self.admin)
+        response = self.client.post(reverse('dashboards:operator_dashboard'), {'action': 'complete', 'phase_id': mixing.pk})
+        self.assertIn('expected it to be in progress', self.messages(response)[0])
+        self.assertEqual(self.execution('mixing').status, 'pending')
+        self.assertFalse(PhaseEvent.objects.filter(execution=mixing, action='completed').exists())
+
+    def test_dashboards_report_conflicts(self):
+        mixing = self.execution('mixing')
+        mixing.status = 'in_progress'
+        mixing.save()
+
+        self.client.force_login(self.admin)
+        response = self.client.post(reverse('dashboards:operator_dashboard'), {
+            'action': 'complete', 'phase_id': mixing.pk, 'version': 0,
+        })
+        self.assertIn('was updated by someone else', self.messages(response)[0])
+        self.assertEqual(self.execution('mixing').status, 'in_progress')
+
+        final_qa = self.execution('final_qa')
+        final_qa.status = 'in_progress'
+        final_qa.save()
+        self.client.force_login(self.qa)
+        response = self.client.post(reverse('dashboards:qa_dashboard'), {
+            'action': 'approve', 'phase_id': final_qa.pk, 'version': 0, 'comments': 'OK',
+        })
+        self.assertIn('was updated by someone else', self.messages(response)[0])
+        self.assertEqual(self.execution('final_qa').status, 'in_progress')
+
+        response = self.client.post(reverse('dashboards:qa_dashboard'), {
+            'action': 'approve', 'phase_id': final_qa.pk, 'version': 1, 'comments': 'OK',
+        })
+        self.assertEqual(self.execution('final_qa').status, 'completed')
+        self.assertEqual(self.execution('finished_goods_store').status, 'pending')
+
+
+class BoundedTransitionTests(TestCase):
+    """Completing, failing and rolling back a phase costs the same statements for every product type"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_admin()
+        cls.operator = create_operator()
+        cls.qc = create_user('qc', 'qc', 'QC001', 'QC')
+        products = {
+            'ointment': Product.objects.create(product_name='Ointment', product_type='ointment'),
+            'capsule': Product.objects.create(product_name='Capsule', product_type='capsule'),
+            'coated': Product.objects.create(
+                product_name='Coated Tablet', product_type='tablet', coating_type='coated', tablet_type='normal',
+            ),
+            'tablet_2': Product.objects.create(
+                product_name='Bulk Tablet', product_type='tablet', coating_type='uncoated', tablet_type='tablet_2',
+            ),
+        }
+        cls.bmrs = {
+            name: create_bmr(product, cls.admin, number)
+            for number, (name, product) in enumerate(products.items(), 1)
+        }
+
+    def setUp(self):
+        cache.clear()
+
+    def advance(self, bmr, phase_name):
+        """Complete every phase before ``phase_name`` and put it in progress"""
+        executions = BatchPhaseExecution.objects.filter(bmr=bmr)
+        order = executions.get(phase__phase_name=phase_name).phase.phase_order
+        now = timezone.now()
+        executions.filter(phase__phase_order__lt=order).update(
+            status='completed', started_by=self.operator, started_date=now - timedelta(hours=1),
+            completed_by=self.operator, completed_date=now,
+        )
+        executions.filter(phase__phase_name=phase_name).update(
+            status='in_progress', started_by=self.operator, started_date=now,
+        )
+        executions.filter(phase__phase_order__gt=order).update(status='not_ready')
+        BMRProgress.rebuild([bmr.pk])
+        OperatorDailyStats.rebuild()
+        return executions.get(phase__phase_name=phase_name)
+
+    def statuses(self, bmr):
+        return dict(BatchPhaseExecution.objects.filter(bmr=bmr).values_list('phase__phase_name', 'status'))
+
+    def post(self, url, execution, action, queries, after_commit):
+        """Pin the request's statements, then those of the work that follows its commit"""
+        with self.captureOnCommitCallbacks() as callbacks, self.assertNumQueries(queries):
+            self.client.post(url, {'action': action, 'phase_id': execution.pk, 'version': execution.version})
+        with self.assertNumQueries(after_commit):
+            for callback in callbacks:
+                callback()
+
+    def test_completion_is_bounded(self):
+        self.client.force_login(self.operator)
+        url = reverse('dashboards:operator_dashboard')
+        first_production = {'ointment': 'mixing', 'capsule': 'drying', 'coated': 'granulation', 'tablet_2': 'granulation'}
+        for name, bmr in self.bmrs.items():
+            WorkflowService.graph_for(bmr.product)
+            with self.subTest(product=name):
+                # Session and user and the execution, then in the write: its
+                # guarded UPDATE with the summary, feed row and event log entry
+                # (a sequence UPDATE and an INSERT each), and the next phase's
+                # UPDATE with its summary and feed row; savepoints make up the
+                # rest. The rollup deltas (an INSERT and an UPDATE per rollup
+                # table) follow the commit, and each feed write replaces the
+                # source's version token in its own queued write (7 statements).
+                self.post(url, self.advance(bmr, 'material_dispensing'), 'complete', 25, 20)
+                self.assertEqual(self.statuses(bmr)[first_production[name]], 'pending')
+
+                # Production phases go to quarantine instead, in their own savepoint
+                self.post(url, self.advance(bmr, first_production[name]), 'complete', 26, 20)
+                self.assertEqual(bmr.quarantine_batches.get().current_phase.phase_name, first_production[name])
+
+                self.post(url, self.advance(bmr, 'packaging_material_release'), 'complete', 25, 20)
+                self.assertEqual(self.statuses(bmr)['secondary_packaging'] == 'pending', name == 'ointment')
+
+    def test_qc_rollback_is_bounded(self):
+        self.client.force_login(self.qc)
+        url = reverse('dashboards:qc_dashboard')
+        qc_phases = {
+            'ointment': ('post_mixing_qc', 'mixing'),
+            'capsule': ('post_blending_qc', 'blending'),
+            'coated': ('post_compression_qc', 'granulation'),
+            'tablet_2': ('post_compression_qc', 'granulation'),
+        }
+        for name, bmr in self.bmrs.items():
+            qc_phase, rollback_phase = qc_phases[name]
+            with self.subTest(product=name):
+                # The failed QC phase's guarded UPDATE and its event log entry,
+                # then one UPDATE resetting every phase from the rollback point,
+                # one summary UPDATE, one feed entry and one event log entry
+                # for all the rolled back phases; after the commit the rollup
+                # deltas (INSERT, UPDATE and DELETE of emptied rows per rollup
+                # table) and the two version token writes. The same whether
+                # two or four phases are reset.
+                self.post(url, self.advance(bmr, qc_phase), 'fail', 29, 24)
+                statuses = self.statuses(bmr)
+                self.assertEqual(statuses[rollback_phase], 'pending')
+                self.assertEqual(statuses[qc_phase], 'not_ready')
+                self.assertEqual(statuses['material_dispensing'], 'completed')
+                execution = BatchPhaseExecution.objects.get(bmr=bmr, phase__phase_name=rollback_phase)
+                self.assertIsNone(execution.completed_by)
+                self.assertTrue(execution.operator_comments.startswith('REWORK REQUIRED'))
+
+                progress = BMRProgress.objects.get(bmr=bmr)
+                BMRProgress.rebuild([bmr.pk])
+                rebuilt = BMRProgress.objects.get(bmr=bmr)
+                self.assertEqual(
+                    (progress.pending_count, progress.completed_count, progress.not_ready_count),
+                    (rebuilt.pending_count, rebuilt.completed_count, rebuilt.not_ready_count),
+                )
+        self.assertEqual(
+            ChangeEvent.objects.filter(
+                source='phase', action='not_ready', data__phase='post_compression_qc', data__previous_status='failed',
+            ).count(), 2,
+        )
+
+    def test_qc_rollback_cost_does_not_grow_with_operators(self):
+        product = self.bmrs['coated'].product
+        operators = [
+            create_operator(f'granulator{number}', 'granulation_operator', f'GR00{number}') for number in range(1, 9)
+        ]
+        queries = []
+        for number, crew in enumerate(([self.operator], operators), 5):
+            bmr = create_bmr(product, self.admin, number)
+            self.advance(bmr, 'post_compression_qc')
+            done = BatchPhaseExecution.objects.filter(bmr=bmr, status='completed').order_by('phase__phase_order')
+            for index, execution in enumerate(done):
+                worker = crew[index % len(crew)]
+                BatchPhaseExecution.objects.filter(pk=execution.pk).update(started_by=worker, completed_by=worker)
+            OperatorDailyStats.rebuild()
+            with CaptureQueriesContext(connection) as captured, self.captureOnCommitCallbacks(execute=True):
+                self.assertTrue(WorkflowService.handle_qc_failure_rollback(bmr, 'post_compression_qc', 'granulation'))
+            queries.append(len(captured))
+            self.assertFalse(OperatorDailyStats.objects.filter(phase_name='granulation', completions__gt=0).exists())
+            incremental = sorted(OperatorDailyStats.objects.values_list('operator_id', 'day', 'phase_name', 'completions', 'attempts'))
+            OperatorDailyStats.rebuild()
+            self.assertEqual(
+                sorted(OperatorDailyStats.objects.values_list('operator_id', 'day', 'phase_name', 'completions', 'attempts')),
+                incremental,
+            )
+        # Phases reset by one operator or by eight cost the same statements
+        self.assertEqual(queries[0], queries[1])
+
+
+class BulkPhaseActionTests(TestCase):
+    """Several batches are started or completed with one request"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_admin()
+        cls.packer = create_operator('packer', 'packing_operator', 'PK001', 'Packing')
+        cls.machine = Machine.objects.create(name='Blister 1', machine_type='blister_packing')
+        product = Product.objects.create(product_name='Capsule', product_type='capsule')
+        cls.bmrs = [create_bmr(product, cls.admin, number) for number in range(1, 5)]
+        for bmr in cls.bmrs:
+            executions = BatchPhaseExecution.objects.filter(bmr=bmr)
+            executions.filter(phase__phase_order__lt=11).update(status='completed', completed_date=timezone.now())
+            executions.filter(phase__phase_name='blister_packing').update(status='pending')
+        BMRProgress.rebuild()
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.packer)
+
+    def execution(self, bmr, phase_name='blister_packing'):
+        return BatchPhaseExecution.objects.get(bmr=bmr, phase__phase_name=phase_name)
+
+    def post(self, action, executions, **data):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('dashboards:bulk_phase_action'),
+                json.dumps({'action': action, 'executions': executions, **data}),
+                content_type='application/json',
+            )
+        return response.status_code, response.json()
+
+    def test_start_and_complete(self):
+        ids = [self.execution(bmr).pk for bmr in self.bmrs[:3]]
+        foreign = self.execution(self.bmrs[3], 'drying').pk
+
+        # Blister packing needs a machine
+        status, data = self.post('start', ids[:1])
+        self.assertEqual(status, 200)
+        self.assertFalse(data['results'][0]['ok'])
+        self.assertIn('Machine selection is required', data['results'][0]['message'])
+
+        status, data = self.post('start', ids + [foreign], machine_id=self.machine.pk)
+        self.assertEqual((data['applied'], data['failed']), (3, 1))
+        self.assertEqual([result['id'] for result in data['results']], ids + [foreign])
+        self.assertEqual(data['results'][-1]['message'], 'Phase not found or not assigned to you.')
+        for pk in ids:
+            execution = BatchPhaseExecution.objects.get(pk=pk)
+            self.assertEqual((execution.status, execution.started_by, execution.machine_used), ('in_progress', self.packer, self.machine))
+        self.assertEqual(OperatorDailyStats.objects.get(operator=self.packer).attempts, 3)
+
+        # Completing routes every batch on; the statements do not grow with the batch count
+        WorkflowService.graph_for(self.bmrs[0].product)
+        with CaptureQueriesContext(connection) as one:
+            self.post('complete', [{'id': ids[0], 'version': 1}])
+        with CaptureQueriesContext(connection) as two:
+            status, data = self.post('complete', [{'id': pk, 'version': 1} for pk in ids[1:]])
+        self.assertEqual(len(one), len(two))
+        self.assertEqual(data['applied'], 2)
+        self.assertEqual(data['results'][0]['next_phase'], 'secondary_packaging')
+        for bmr in self.bmrs[:3]:
+            self.assertEqual(self.execution(bmr).status, 'completed')
+            self.assertEqual(self.execution(bmr, 'secondary_packaging').status, 'pending')
+            self.assertEqual(BMRProgress.objects.get(bmr=bmr).pending_count, 1)
+
+        # Already completed
+        status, data = self.post('complete', ids[:1])
+        self.assertIn('is completed', data['results'][0]['message'])
+
+    def test_stale_and_invalid_requests(self):
+        pk = self.execution(self.bmrs[0]).pk
+        status, data = self.post('start', [{'id': pk, 'version': 5}], machine_id=self.machine.pk)
+        self.assertIn('was updated by someone else', data['results'][0]['message'])
+        self.assertEqual(self.execution(self.bmrs[0]).status, 'pending')
+
+        self.assertEqual(self.post('finish', [pk])[0], 400)
+        self.assertEqual(self.post('start', [])[0], 400)
+        self.assertEqual(self.post('start', [pk], machine_id=999)[0], 400)
+        self.assertEqual(self.post('start', [pk], machine_id='drum')[0], 400)
+        self.assertEqual(self.post('start', str(pk))[0], 400)
+        self.assertEqual(self.post('start', [[pk]])[0], 400)
+
+        # A body that is not a JSON object
+        for body in ([{'id': pk}], 42, 'start', None):
+            with self.subTest(body=body):
+                response = self.client.post(
+                    reverse('dashboards:bulk_phase_action'), json.dumps(body), content_type='application/json',
+                )
+                self.assertEqual(response.status_code, 400)
+
+        # Plain form posts work too
+        response = self.client.post(reverse('dashboards:bulk_phase_action'), {
+            'action': 'start', 'execution_id': [pk], 'machine_id': self.machine.pk,
+        })
+        self.assertEqual(response.json()['applied'], 1)
+
+
+class PhaseStatsTests(TestCase):
+    """Phase analytics read the events since their watermark instead of rescanning the executions"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_admin()
+        cls.operator = create_operator()
+        product = Product.objects.create(product_name='Capsule', product_type='capsule')
+        cls.bmr = create_bmr(product, cls.admin)
+
+    def execution(self, phase_name):
+        return BatchPhaseExecution.objects.get(bmr=self.bmr, phase__phase_name=phase_name)
+
+    def run_phase(self, phase_name, outcome='completed', hours=2):
+        now = timezone.now()
+        execution = self.execution(phase_name)
+        # Straight from not_ready, without routing the phases in between
+        execution.transition(
+            'in_progress', from_status=execution.status, started_by=self.operator, started_date=now - timedelta(hours=hours)
+        )
+        execution.transition(outcome, completed_by=self.operator, completed_date=now)
+        return execution
+
+    def test_catch_up_reads_only_new_events(self):
+        PhaseStats.catch_up()
+        # BMR creation is completed when the workflow is initialized, without timings
+        row = PhaseStats.objects.get()
+        self.assertEqual((row.phase_name, row.starts, row.completions, row.timed_completions), ('bmr_creation', 0, 1, 0))
+
+        self.run_phase('raw_material_release', hours=2)
+        self.run_phase('material_dispensing', hours=4)
+        self.assertEqual(PhaseStats.catch_up(), 4)
+        row = PhaseStats.objects.get(product_type='capsule', phase_name='material_dispensing')
+        self.assertEqual((row.starts, row.completions, row.timed_completions), (1, 1, 1))
+        self.assertAlmostEqual(row.average_hours, 4)
+        self.assertEqual(
+            EventWatermark.objects.get(consumer=PhaseStats.CONSUMER).sequence,
+            PhaseEvent.objects.latest('sequence').sequence,
+        )
+
+        # Nothing new: the watermark and log reads, inside their savepoint
+        with self.assertNumQueries(4):
+            self.assertEqual(PhaseStats.catch_up(), 0)
+
+        self.run_phase('raw_material_release', hours=6)
+        self.assertEqual(PhaseStats.catch_up(batch_size=1), 2)
+        row = PhaseStats.objects.get(product_type='capsule', phase_name='raw_material_release')
+        self.assertEqual((row.completions, row.timed_completions), (2, 2))
+        self.assertAlmostEqual(row.average_hours, 4)
+        bottlenecks = {row['phase_name']: row for row in get_phase_bottleneck_analysis()}
+        self.assertEqual(
+            (bottlenecks['Raw Material Release']['avg_hours'], bottlenecks['Raw Material Release']['count']), (4.0, 2)
+        )
+        # The percentile comes from the stored duration of the current execution
+        self.assertEqual(bottlenecks['Raw Material Release']['p90_hours'], 6.0)
+
+    def test_failures_and_rollbacks(self):
+        self.run_phase('post_blending_qc', outcome='failed')
+        WorkflowService.handle_qc_failure_rollback(self.bmr, 'post_blending_qc', 'blending')
+        self.run_phase('post_blending_qc')
+
+        # Reading the analytics leaves the events to the scheduled run
+        with self.assertNumQueries(1):
+            self.assertEqual(get_quality_metrics()['labels'], [])
+        self.assertEqual(PhaseStats.catch_up(), 6)
+        metrics = get_quality_metrics()
+        self.assertEqual(metrics['labels'], ['Capsule'])
+        self.assertEqual((metrics['pass_rates'], metrics['fail_rates']), ([50.0], [50.0]))
+        qc = PhaseStats.objects.get(phase_name='post_blending_qc')
+        self.assertEqual((qc.starts, qc.completions, qc.failures, qc.rollbacks), (2, 1, 1, 1))
+        self.assertEqual(
+            list(PhaseEvent.objects.filter(phase_name='post_blending_qc').values_list('action', flat=True)),
+            ['started', 'failed', 'rolled_back', 'started', 'completed'],
+        )
+
+        # A rebuild replays the log, so the first attempt still counts
+        PhaseStats.rebuild()
+        qc = PhaseStats.objects.get(phase_name='post_blending_qc')
+        self.assertEqual((qc.starts, qc.completions, qc.failures, qc.rollbacks), (2, 1, 1, 1))
+        self.assertEqual(PhaseStats.catch_up(), 0)
+
+    def test_late_commit_below_the_watermark_is_read(self):
+        PhaseStats.catch_up()
+        # On PostgreSQL a transaction can take a lower id than one that
+        # commits before it. Numbers are reserved on a row that stays locked
+        # until commit, so the late event's sequence is still above the
+        # watermark even though its id is below the events already read.
+        early = PhaseEvent.record_many([PhaseEvent(id=1000, action='started', bmr=self.bmr, phase_name='blending')])
+        self.assertEqual(PhaseStats.catch_up(), 1)
+        late = PhaseEvent.record_many([PhaseEvent(id=900, action='failed', bmr=self.bmr, phase_name='blending')])
+        self.assertGreater(late[0].sequence, early[0].sequence)
+        self.assertEqual(PhaseStats.catch_up(), 1)
+        row = PhaseStats.objects.get(phase_name='blending')
+        self.assertEqual((row.starts, row.failures), (1, 1))
+
+    def test_pruning_the_change_feed_keeps_the_log(self):
+        self.run_phase('raw_material_release')
+        ChangeEvent.objects.update(created_at=timezone.now() - timedelta(days=30))
+        call_command('prune_change_events', stdout=StringIO())
+        self.assertEqual(ChangeEvent.objects.count(), 1)
+
+        # Quarantine entries and releases are logged with the phase actions
+        QuarantineBatch.enter([(self.bmr, self.execution('raw_material_release').phase)])
+        QuarantineBatch.release(self.bmr, self.execution('raw_material_release').phase, self.admin)
+        self.assertEqual(
+            list(PhaseEvent.objects.filter(bmr=self.bmr).values_list('phase_name', 'action')),
+            [('bmr_creation', 'completed'), ('raw_material_release', 'started'), ('raw_material_release', 'completed'),
+             ('raw_material_release', 'quarantined'), ('raw_material_release', 'released')],
+        )
+        call_command('process_events', stdout=StringIO())
+        self.assertEqual(PhaseStats.objects.get(phase_name='raw_material_release').completions, 1)
+
+    def test_migration_replays_the_log(self):
+        self.run_phase('post_blending_qc', outcome='failed')
+        WorkflowService.handle_qc_failure_rollback(self.bmr, 'post_blending_qc', 'blending')
+        self.run_phase('post_blending_qc')
+        PhaseStats.rebuild()
+        rebuilt = list(PhaseStats.objects.values_list('product_type', 'phase_name', *PhaseStats.TOTALS))
+
+        PhaseStats.objects.all().delete()
+        EventWatermark.objects.all().delete()
+        migration = import_module('workflow.migrations.0022_backfill_phase_stats')
+        migration.replay_phase_events(apps, None)
+        self.assertEqual(list(PhaseStats.objects.values_list('product_type', 'phase_name', *PhaseStats.TOTALS)), rebuilt)
+        self.assertEqual(PhaseStats.catch_up(), 0)
+
+
+class DurationColumnTests(TestCase):
+    """Durations are stored as the timestamps are written, so reports can average them in SQL"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = create_admin()
+        product = Product.objects.create(product_name='Capsule', product_type='capsule')
+        cls.bmr = create_bmr(product, cls.admin)
+
+    def test_phase_durations(self):
+        execution = BatchPhaseExecution.objects.get(bmr=self.bmr, phase__phase_name='drying')
+        start = timezone.now() - timedelta(hours=3)
+        execution.transition('in_progress', from_status='not_ready', started_by=self.admin, started_date=start)
+        self.assertIsNone(execution.duration_seconds)
+
+        # A breakdown running past the end only counts while the phase ran; form times are naive local times
+        breakdown_start = timezone.localtime(start + timedelta(hours=2)).replace(tzinfo=None)
+        execution.transition(
+            'completed', completed_by=self.admin, completed_date=start + timedelta(hours=3),
+            breakdown_occurred=True, breakdown_start_time=breakdown_start,
+            breakdown_end_time=breakdown_start + timedelta(hours=2),
+        )
+        execution.refresh_from_db()
+        self.assertEqual(
+            (execution.duration_seconds, execution.net_duration_seconds, execution.breakdown_seconds),
+            (3 * 3600, 2 * 3600, 2 * 3600),
+        )
+
+        # Clearing the timestamps on a rollback clears the durations
+        BatchPhaseExecution.bulk_transition(
+            {execution: 'pending'}, fields={'pending': {'started_date': None, 'completed_date': None}},
+        )
+        execution.refresh_from_db()
+        self.assertEqual((execution.duration_seconds, execution.net_duration_seconds), (None, None))
+
+    def test_sample_processing_times(self):
+        phase = ProductionPhase.objects.get(product_type='capsule', phase_name='blending')
+        batch = QuarantineBatch.objects.create(bmr=self.bmr, current_phase=phase)
+        sample = SampleRequest.objects.create(quarantine_batch=batch, sample_number=1, requested_by=self.admin)
+        SampleRequest.objects.filter(pk=sample.pk).update(request_date=timezone.now() - timedelta(hours=5))
+        sample.refresh_from_db()
+        self.assertEqual(SampleRequest.processing_times(), {'avg_qa_processing_time': None, 'avg_qc_processing_time': None})
+
+        sample.update_qa_stage(self.admin)
+        sample.update_qc_received(self.admin)
+        sample.update_qc_decision(self.admin, 'approved')
+        times = SampleRequest.processing_times()
+        self.assertAlmostEqual(times['avg_qa_processing_time'], 5, places=2)
+        self.assertAlmostEqual(times['avg_qc_processing_time'], 0, places=2)
+        self.assertEqual(SampleRequest.objects.get().turnaround_seconds, sample.qa_seconds)
+
+        batch.status = 'released'
+        batch.released_date = batch.quarantine_date + timedelta(hours=8)
+        batch.save()
+        self.assertEqual(QuarantineBatch.objects.get().quarantine_seconds, 8 * 3600)
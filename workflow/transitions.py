@@ -0,0 +1,164 @@
+"""
+Compiled workflow graphs for phase transitions.
+
+The phase sequence of a product variant (product type, plus coating and
+tablet type for tablets) is turned once into a table of what happens when
+each phase completes: which phase becomes pending, whether the batch goes to
+quarantine first, and which phases are completed or reset on the way. A
+transition is then a dictionary lookup followed by one status UPDATE for the
+affected executions, whatever the product type.
+
+Graphs are kept per process and rebuilt when ProductionPhase rows change;
+the shared "versions" cache (CACHES in settings) holds a version token so
+every process notices the change. A graph compiled while such a change is
+still uncommitted is dropped again if the transaction rolls back.
+"""
+import threading
+import uuid
+import weakref
+
+from django.core.cache import caches
+from django.db import transaction
+
+from kampala_pharma.db_writer import write_transaction
+
+
+GRAPH_VERSION_KEY = 'workflow_graph:version'
+
+# Phases whose completion activates the next phase directly; every other
+# (production) phase sends the batch to quarantine for sampling first
+QUARANTINE_BYPASS = frozenset([
+    'bmr_creation', 'regulatory_approval',  # Administrative phases
+    'raw_material_release', 'material_dispensing', 'packaging_material_release',  # Material handling
+    'blister_packing', 'bulk_packing', 'secondary_packaging',  # All packing phases bypass quarantine
+    'final_qa', 'finished_goods_store'  # Final phases
+])
+
+# QC phases, completed by an approved quarantine sample
+QC_PHASES = frozenset(['post_mixing_qc', 'post_compression_qc', 'post_blending_qc'])
+
+# Phases sent back to not_ready (if already pending) when a phase completes,
+# so secondary packaging waits for the packing phase in between
+RESET_ON_COMPLETION = {
+    'packaging_material_release': ('secondary_packaging',),
+}
+
+_graphs = {}
+# This thread's newest invalidation that has not committed yet
+_local = threading.local()
+
+
+class Transition:
+    """Status changes applied to a BMR's executions when a phase completes"""
+
+    def __init__(self, activate=None, quarantine=False, complete=(), reset=()):
+        self.activate = activate
+        self.quarantine = quarantine
+        self.complete = tuple(complete)
+        self.reset = tuple(reset)
+
+    @property
+    def phase_names(self):
+        """Every phase whose execution the transition may change"""
+        names = list(self.complete) + list(self.reset)
+        if self.activate:
+            names.append(self.activate)
+        return names
+
+
+class WorkflowGraph:
+    """Transitions of one product variant, compiled from its phase sequence"""
+
+    def __init__(self, sequence, phases, version=None):
+        self.sequence = tuple(sequence)
+        self.phases = phases
+        self.version = version
+        self.position = {name: index for index, name in enumerate(self.sequence)}
+        self.completions = {}
+        self.releases = {}
+        for index, name in enumerate(self.sequence):
+            following = self.sequence[index + 1:]
+            if name in QUARANTINE_BYPASS:
+                self.completions[name] = Transition(
+                    activate=following[0] if following else None,
+                    reset=[phase for phase in RESET_ON_COMPLETION.get(name, ()) if phase in self.position],
+                )
+            else:
+                self.completions[name] = Transition(quarantine=True)
+
+            # After an approved quarantine sample the QC phases that follow are done
+            skipped = []
+            for phase in following:
+                if phase not in QC_PHASES:
+                    self.releases[name] = Transition(activate=phase, complete=skipped)
+                    break
+                skipped.append(phase)
+            else:
+                self.releases[name] = Transition(complete=skipped)
+
+    def after(self, phase_name):
+        """Transition when the phase completes, or None if it is not in this workflow"""
+        return self.completions.get(phase_name)
+
+    def after_quarantine(self, phase_name):
+        """Transition when a batch quarantined after the phase is released"""
+        return self.releases.get(phase_name)
+
+    def next_phase(self, phase_name):
+        """ProductionPhase that follows the phase in this workflow"""
+        index = self.position.get(phase_name)
+        if index is None or index + 1 >= len(self.sequence):
+            return None
+        return self.phases.get(self.sequence[index + 1])
+
+
+def _version():
+    versions_cache = caches['versions']
+    version = versions_cache.get(GRAPH_VERSION_KEY)
+    if version is None:
+        with write_transaction():
+            versions_cache.add(GRAPH_VERSION_KEY, uuid.uuid4().hex, None)
+        version = versions_cache.get(GRAPH_VERSION_KEY)
+    return version
+
+
+def _pending_invalidation():
+    """
+    The token of this thread's newest invalidation that has not committed
+    yet, or None. Graphs compiled after it may hold uncommitted rows, so they
+    are only reused until it commits (its callback clears it) or is rolled
+    back: only the transaction holds the callback, so dropping it on rollback
+    ends the weak reference.
+    """
+    pending = getattr(_local, 'pending', None)
+    publish = pending() if pending is not None else None
+    return publish.token if publish is not None else None
+
+
+def get_graph(key, sequence, product_type):
+    """The compiled graph for a variant key, compiling it on first use"""
+    version = _pending_invalidation() or _version()
+    graph = _graphs.get(key)
+    if graph is None or graph.version != version:
+        from .models import ProductionPhase
+
+        phases = {
+            phase.phase_name: phase
+            for phase in ProductionPhase.objects.filter(product_type=product_type, phase_name__in=sequence)
+        }
+        graph = _graphs[key] = WorkflowGraph(sequence, phases, version)
+    return graph
+
+
+def invalidate():
+    """Drop the compiled graphs here now, and in every process once the change commits"""
+    _graphs.clear()
+
+    def publish():
+        _local.pending = None
+        with write_transaction():
+            caches['versions'].set(GRAPH_VERSION_KEY, uuid.uuid4().hex, None)
+
+    publish.token = uuid.uuid4().hex
+    _local.pending = weakref.ref(publish)
+    transaction.on_commit(publish)